@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+#
+# Measures deriving many child pubkeys of an xpub: one at a time through
+# the xpub string (as derive_pubkey used to), in bulk from the parsed branch
+# node, and in bulk with a process pool. Also measures synchronizing a
+# wallet with a large gap limit, which creates its addresses in one batch.
+#
+# usage: ./contrib/benchmarks/bench_address_derivation.py [--num N] [--gap-limit N] [--workers N]
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from electrum import keystore
+from electrum.bip32 import BIP32Node
+from electrum.simple_config import SimpleConfig
+from electrum.wallet import Standard_Wallet
+from electrum.wallet_db import WalletDB
+
+
+XPUB = 'xpub661MyMwAqRbcGH3yTb2kMQGnsLziRTJZ8vNthsVSCGbdBr8CGDWKxnGAFYgyKTzBtwvPPmfVAWJuFmxRXjSbUTg87wDkWQ5GmzpfUcN9t8Z'
+
+
+def timed(f):
+    t0 = time.perf_counter()
+    result = f()
+    return time.perf_counter() - t0, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num', type=int, default=100_000)
+    parser.add_argument('--gap-limit', type=int, default=10_000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+    n = args.num
+
+    branch_xpub = BIP32Node.from_xkey(XPUB).subkey_at_public_derivation((0,)).to_xpub()
+    dt_old, old = timed(lambda: [keystore.Xpub.get_pubkey_from_xpub(branch_xpub, (i,)) for i in range(n)])
+    print(f"{n} pubkeys, one at a time from the xpub string: {dt_old:7.2f} s")
+
+    dt_bulk, bulk = timed(lambda: keystore.from_xpub(XPUB).derive_pubkeys(0, 0, n))
+    assert bulk == old
+    print(f"{n} pubkeys, bulk from the branch node:          {dt_bulk:7.2f} s  ({dt_old / dt_bulk:.1f}x)")
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        dt_pool, pooled = timed(lambda: keystore.from_xpub(XPUB).derive_pubkeys(0, 0, n, executor=executor))
+    assert pooled == old
+    print(f"{n} pubkeys, bulk with {args.workers} processes:             {dt_pool:7.2f} s  ({dt_old / dt_pool:.1f}x)")
+
+    config = SimpleConfig({'electrum_path': '/tmp/bench_address_derivation'})
+    db = WalletDB('', manual_upgrades=False)
+    db.put('keystore', keystore.from_xpub(XPUB).dump())
+    db.put('gap_limit', args.gap_limit)
+    dt_sync, w = timed(lambda: Standard_Wallet(db, None, config=config))
+    assert len(w.get_receiving_addresses()) == args.gap_limit
+    print(f"synchronize with gap limit {args.gap_limit}:                {dt_sync:7.2f} s")
+
+
+if __name__ == '__main__':
+    main()
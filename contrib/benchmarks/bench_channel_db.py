@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+#
+# Memory use and lookup speed of the in-memory channel graph of ChannelDB,
+# on a synthetic graph. Compares ChannelGraph to the dict based layout
+# ChannelDB used before: dicts of ChannelInfo and Policy tuples, and a set
+# of channels per node. Node ids and short channel ids are created up front
+# and are not counted for either of them.
+#
+# usage: ./contrib/benchmarks/bench_channel_db.py [--nodes N] [--channels N] [--lookups N]
+
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from electrum.channel_db import ChannelGraph, ChannelInfo, Policy
+from electrum.lnutil import ShortChannelID
+
+
+class DictGraph:
+    """The dict based layout ChannelDB used before ChannelGraph."""
+
+    def __init__(self):
+        self._channels = {}
+        self._policies = {}
+        self._channels_for_node = defaultdict(set)
+
+    def add_channel(self, channel_info):
+        self._channels[channel_info.short_channel_id] = channel_info
+        self._channels_for_node[channel_info.node1_id].add(channel_info.short_channel_id)
+        self._channels_for_node[channel_info.node2_id].add(channel_info.short_channel_id)
+
+    def set_policy(self, policy):
+        self._policies[(policy.start_node, policy.short_channel_id)] = policy
+
+    def get_channel_info(self, short_channel_id):
+        return self._channels.get(short_channel_id)
+
+    def get_policy(self, short_channel_id, node_id):
+        return self._policies.get((node_id, short_channel_id))
+
+    def get_channels_for_node(self, node_id):
+        return set(self._channels_for_node.get(node_id) or set())
+
+
+def make_graph(num_nodes, num_channels, seed=0):
+    rnd = random.Random(seed)
+    node_ids = [bytes([2]) + rnd.getrandbits(256).to_bytes(32, 'big') for _ in range(num_nodes)]
+    channels = []
+    for i in range(num_channels):
+        scid = ShortChannelID.from_components(500_000 + i // 1000, i % 1000, 0)
+        # preferential attachment, like the real graph: a few nodes have many channels
+        n1, n2 = sorted({node_ids[int(num_nodes * rnd.random() ** 2)] for _ in range(2)} | {node_ids[i % num_nodes]})[:2]
+        channels.append((scid, n1, n2))
+    return node_ids, channels
+
+
+def fill(graph, channels, seed=0):
+    rnd = random.Random(seed)
+    for scid, n1, n2 in channels:
+        graph.add_channel(ChannelInfo(short_channel_id=scid, node1_id=n1, node2_id=n2,
+                                      capacity_sat=rnd.randrange(20_000, 16_777_216)))
+        for node_id in (n1, n2):
+            graph.set_policy(Policy(key=scid + node_id,
+                                    cltv_expiry_delta=rnd.choice([40, 144]),
+                                    htlc_minimum_msat=1000,
+                                    htlc_maximum_msat=rnd.randrange(10 ** 6, 10 ** 10),
+                                    fee_base_msat=rnd.choice([0, 1000]),
+                                    fee_proportional_millionths=rnd.randrange(1, 5000),
+                                    channel_flags=0 if node_id == n1 else 1,
+                                    message_flags=1,
+                                    timestamp=1_600_000_000 + rnd.randrange(10 ** 6)))
+    if isinstance(graph, ChannelGraph):
+        graph.compact()
+
+
+def measure_memory(make):
+    tracemalloc.start()
+    graph = make()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return graph, size
+
+
+def time_lookups(graph, node_ids, scid_nodes, n):
+    rnd = random.Random(1)
+    nodes = [rnd.choice(node_ids) for _ in range(n)]
+    chans = [rnd.choice(scid_nodes) for _ in range(n)]
+    results = {}
+    t0 = time.perf_counter()
+    for node_id in nodes:
+        graph.get_channels_for_node(node_id)
+    results['get_channels_for_node'] = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for scid, node_id in chans:
+        graph.get_channel_info(scid)
+    results['get_channel_info'] = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for scid, node_id in chans:
+        graph.get_policy(scid, node_id)
+    results['get_policy_for_node'] = time.perf_counter() - t0
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', type=int, default=50_000)
+    parser.add_argument('--channels', type=int, default=100_000)
+    parser.add_argument('--lookups', type=int, default=100_000)
+    args = parser.parse_args()
+
+    node_ids, channels = make_graph(args.nodes, args.channels)
+    scid_nodes = [(scid, n1) for scid, n1, n2 in channels]
+    print(f"{args.nodes} nodes, {args.channels} channels with two policies each")
+    print(f"{'':<12} {'memory':>10} {'build':>8}   "
+          + "   ".join(f"{name} (us)" for name in ('get_channels_for_node', 'get_channel_info', 'get_policy_for_node')))
+    for name, cls in (('dicts', DictGraph), ('ChannelGraph', ChannelGraph)):
+        def make():
+            graph = cls()
+            fill(graph, channels)
+            return graph
+        t0 = time.perf_counter()
+        make()
+        dt = time.perf_counter() - t0
+        graph, size = measure_memory(make)
+        lookups = time_lookups(graph, node_ids, scid_nodes, args.lookups)
+        print(f"{name:<12} {size / 2 ** 20:7.1f} MB {dt:7.2f}s   "
+              + "   ".join(f"{1e6 * lookups[k] / args.lookups:{len(k) + 5}.2f}" for k in lookups))
+        del graph
+
+
+if __name__ == '__main__':
+    main()
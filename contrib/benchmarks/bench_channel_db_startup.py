@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+#
+# Startup time of ChannelDB.load_data on a synthetic gossip_db, when the
+# graph is parsed from the raw gossip messages in the tables, and when it is
+# loaded from the snapshot written on shutdown.
+#
+# usage: ./contrib/benchmarks/bench_channel_db_startup.py [--nodes N] [--channels N]
+
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from electrum import constants, util
+from electrum.channel_db import (ChannelDB, create_channel_info, create_policy, create_node_info,
+                                 create_address)
+from electrum.lnmsg import encode_msg
+from electrum.lnutil import ShortChannelID
+from electrum.simple_config import SimpleConfig
+from electrum.util import get_headers_dir
+
+
+def write_gossip_db(path, num_nodes, num_channels, seed=0):
+    rnd = random.Random(seed)
+    chain_hash = constants.net.rev_genesis_bytes()
+    node_ids = [bytes([2]) + rnd.getrandbits(256).to_bytes(32, 'big') for _ in range(num_nodes)]
+    conn = sqlite3.connect(path)
+    for create in (create_channel_info, create_policy, create_node_info, create_address):
+        conn.execute(create)
+    for i in range(num_channels):
+        scid = ShortChannelID.from_components(500_000 + i // 1000, i % 1000, 0)
+        n1, n2 = sorted({node_ids[i % num_nodes], node_ids[int(num_nodes * rnd.random() ** 2)]} | set(rnd.sample(node_ids, 2)))[:2]
+        msg = encode_msg('channel_announcement', node_signature_1=bytes(64), node_signature_2=bytes(64),
+                         bitcoin_signature_1=bytes(64), bitcoin_signature_2=bytes(64), len=0, features=b'',
+                         chain_hash=chain_hash, short_channel_id=scid, node_id_1=n1, node_id_2=n2,
+                         bitcoin_key_1=n1, bitcoin_key_2=n2)
+        conn.execute("INSERT INTO channel_info (short_channel_id, msg) VALUES (?,?)", (scid, msg))
+        for direction, node_id in enumerate((n1, n2)):
+            msg = encode_msg('channel_update', signature=bytes(64), chain_hash=chain_hash, short_channel_id=scid,
+                             timestamp=1_600_000_000 + rnd.randrange(10 ** 6), message_flags=b'\x01',
+                             channel_flags=bytes([direction]), cltv_expiry_delta=rnd.choice([40, 144]),
+                             htlc_minimum_msat=1000, fee_base_msat=rnd.choice([0, 1000]),
+                             fee_proportional_millionths=rnd.randrange(1, 5000),
+                             htlc_maximum_msat=rnd.randrange(10 ** 6, 10 ** 10))
+            conn.execute("INSERT INTO policy (key, msg) VALUES (?,?)", (scid + node_id, msg))
+    for i, node_id in enumerate(node_ids):
+        msg = encode_msg('node_announcement', signature=bytes(64), flen=2, features=b'\x02\x02',
+                         timestamp=1_600_000_000, node_id=node_id, rgb_color=bytes(3),
+                         alias=f'node{i}'.encode().ljust(32, b'\x00'), addrlen=0, addresses=b'')
+        conn.execute("INSERT INTO node_info (node_id, msg) VALUES (?,?)", (node_id, msg))
+    conn.commit()
+    conn.close()
+
+
+def time_load_data(config):
+    loop, stop_loop, loop_thread = util.create_and_start_event_loop()
+    util.callback_mgr.asyncio_loop = loop
+    class FakeNetwork:
+        asyncio_loop = loop
+        interface = None
+    FakeNetwork.config = config
+    channel_db = ChannelDB(FakeNetwork())
+    async def load_data():
+        t0 = time.perf_counter()
+        await channel_db.load_data()
+        return time.perf_counter() - t0
+    dt = asyncio.run_coroutine_threadsafe(load_data(), loop).result()
+    num_channels, num_policies = channel_db.num_channels, channel_db.num_policies
+    loop.call_soon_threadsafe(stop_loop.set_result, 1)
+    loop_thread.join()
+    channel_db.sql_thread.join()
+    return dt, num_channels, num_policies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', type=int, default=20_000)
+    parser.add_argument('--channels', type=int, default=50_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as electrum_path:
+        config = SimpleConfig({'electrum_path': electrum_path})
+        path = os.path.join(get_headers_dir(config), 'gossip_db')
+        t0 = time.perf_counter()
+        write_gossip_db(path, args.nodes, args.channels)
+        print(f"gossip_db with {args.nodes} nodes, {args.channels} channels: "
+              f"{os.path.getsize(path) / 2 ** 20:.1f} MB, written in {time.perf_counter() - t0:.1f}s")
+        dt, num_channels, num_policies = time_load_data(config)
+        print(f"load_data from the tables:   {dt:6.2f}s  ({num_channels} channels, {num_policies} policies, "
+              f"includes writing the snapshot)")
+        print(f"snapshot: {os.path.getsize(path + '.snapshot') / 2 ** 20:.1f} MB")
+        dt, num_channels, num_policies = time_load_data(config)
+        print(f"load_data from the snapshot: {dt:6.2f}s  ({num_channels} channels, {num_policies} policies)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+#
+# Measures the import time of a command line client invocation, i.e. a
+# command sent to a running daemon, with 'python -X importtime'. No daemon
+# needs to be running: the client imports the same modules either way.
+# Prints the slowest imports, and exits with an error if the total import
+# time is over the budget.
+#
+# usage: ./contrib/benchmarks/bench_cli_startup.py [--runs N] [--budget-ms MS] [--top N] [command ...]
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+
+
+def import_times(command):
+    """Returns {module: (self_us, cumulative_us)} for one invocation of run_electrum."""
+    with tempfile.TemporaryDirectory() as electrum_path:
+        args = [sys.executable, '-X', 'importtime', os.path.join(ROOT, 'run_electrum'),
+                '-D', electrum_path] + command
+        stderr = subprocess.run(args, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                universal_newlines=True).stderr
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=450)
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('command', nargs='*', default=['getbalance'])
+    args = parser.parse_args()
+
+    runs = [import_times(args.command) for _ in range(args.runs)]
+    best = min(runs, key=lambda times: sum(s for s, c in times.values()))
+    total_ms = sum(s for s, c in best.values()) / 1000
+    electrum_modules = sorted(name for name in best if name.split('.')[0] == 'electrum')
+
+    print(f"'electrum {' '.join(args.command)}', best of {args.runs}: {len(best)} modules, "
+          f"{total_ms:.1f} ms of imports")
+    print(f"electrum modules: {' '.join(electrum_modules)}")
+    print("slowest (cumulative):")
+    for name, (self_us, cumulative_us) in sorted(best.items(), key=lambda kv: -kv[1][1])[:args.top]:
+        print(f"  {cumulative_us / 1000:7.1f} ms  {name}")
+    if total_ms > args.budget_ms:
+        print(f"over budget: {total_ms:.1f} ms > {args.budget_ms} ms")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+#
+# Compares the Privacy and BranchAndBound coin choosers on synthetic
+# wallets of p2wpkh coins, paying random amounts at 10 sat/vbyte.
+# Reports the selection time, how often change was created, the mean fee,
+# and the mean waste: fee paid above what the tx strictly needs, plus, when
+# change was created, the fee of the change output and of spending it later.
+#
+# usage: ./contrib/benchmarks/bench_coinchooser.py [--utxos N [N ...]] [--payments N]
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from electrum import bitcoin
+from electrum.coinchooser import CoinChooserPrivacy, CoinChooserBranchAndBound
+from electrum.transaction import PartialTxOutput, Transaction
+from electrum.tests.test_coinchooser import make_coins, fee_estimator_vb
+
+
+DUST_THRESHOLD = 546
+P2WPKH_INPUT_VSIZE = 68
+
+
+def bench(chooser_class, coins, amounts, change_addr, dest_addr):
+    dt, num_change, fees, waste = 0, 0, 0, 0
+    for amount in amounts:
+        coin_chooser = chooser_class(enable_output_value_rounding=False)
+        outputs = [PartialTxOutput.from_address_and_value(dest_addr, amount)]
+        t0 = time.perf_counter()
+        tx = coin_chooser.make_tx(coins=coins, inputs=[], outputs=outputs, change_addrs=[change_addr],
+                                  fee_estimator_vb=fee_estimator_vb, dust_threshold=DUST_THRESHOLD)
+        dt += time.perf_counter() - t0
+        fee = tx.get_fee()
+        fees += fee
+        waste += fee - fee_estimator_vb(tx.estimated_size())
+        if len(tx.outputs()) > 1:
+            num_change += 1
+            waste += fee_estimator_vb(Transaction.estimated_output_size(change_addr) + P2WPKH_INPUT_VSIZE)
+    n = len(amounts)
+    return dt / n, num_change / n, fees / n, waste / n
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--utxos', type=int, nargs='+', default=[1_000, 10_000, 20_000])
+    parser.add_argument('--payments', type=int, default=20)
+    args = parser.parse_args()
+
+    rnd = random.Random(0)
+    dest_addr = bitcoin.hash_to_segwit_addr(bytes(20), witver=0)
+    change_addr = bitcoin.hash_to_segwit_addr(b'\x01' * 20, witver=0)
+    for num_utxos in args.utxos:
+        # log-uniform coin values, from 10k sat to 1 BTC
+        coins = make_coins([int(10 ** rnd.uniform(4, 8)) for i in range(num_utxos)])
+        amounts = [int(10 ** rnd.uniform(5, 7.5)) for i in range(args.payments)]
+        for name, klass in (('Privacy', CoinChooserPrivacy), ('BranchAndBound', CoinChooserBranchAndBound)):
+            dt, change, fee, waste = bench(klass, coins, amounts, change_addr, dest_addr)
+            print(f"{num_utxos:>6} utxos {name:>15}: {dt * 1000:8.1f} ms/payment, change in {change:4.0%},"
+                  f" mean fee {fee:7.0f} sat, mean waste {waste:6.0f} sat")
+
+
+if __name__ == '__main__':
+    main()
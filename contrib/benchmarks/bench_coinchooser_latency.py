@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+#
+# Measures how long the Privacy coin chooser takes to select coins on
+# synthetic wallets of p2wpkh coins, for UTXO counts from 100 to 100k.
+# Reports the time spent grouping the coins into buckets, and the total
+# time of make_tx. Each payment gets freshly created coins, as the wallet
+# does, so that no per-coin caches carry over.
+#
+# usage: ./contrib/benchmarks/bench_coinchooser_latency.py [--utxos N [N ...]] [--payments N]
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from electrum import bitcoin
+from electrum.coinchooser import CoinChooserPrivacy
+from electrum.transaction import PartialTxOutput
+from electrum.tests.test_coinchooser import make_coins, fee_estimator_vb
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--utxos', type=int, nargs='+', default=[100, 1_000, 10_000, 100_000])
+    parser.add_argument('--payments', type=int, default=3)
+    args = parser.parse_args()
+
+    rnd = random.Random(0)
+    dest_addr = bitcoin.hash_to_segwit_addr(bytes(20), witver=0)
+    change_addr = bitcoin.hash_to_segwit_addr(b'\x01' * 20, witver=0)
+    for num_utxos in args.utxos:
+        # log-uniform coin values, from 10k sat to 1 BTC
+        values = [int(10 ** rnd.uniform(4, 8)) for i in range(num_utxos)]
+        dt_bucketize, dt_total = 0, 0
+        for i in range(args.payments):
+            amount = int(10 ** rnd.uniform(5, 7.5))
+            coin_chooser = CoinChooserPrivacy(enable_output_value_rounding=False)
+            coins = make_coins(values)
+            t0 = time.perf_counter()
+            coin_chooser.bucketize_coins(coins, fee_estimator_vb=fee_estimator_vb)
+            dt_bucketize += time.perf_counter() - t0
+            coins = make_coins(values)
+            outputs = [PartialTxOutput.from_address_and_value(dest_addr, amount)]
+            t0 = time.perf_counter()
+            coin_chooser.make_tx(coins=coins, inputs=[], outputs=outputs, change_addrs=[change_addr],
+                                 fee_estimator_vb=fee_estimator_vb, dust_threshold=546)
+            dt_total += time.perf_counter() - t0
+        n = args.payments
+        print(f"{num_utxos:>7} utxos: make_tx {dt_total / n * 1000:9.1f} ms,"
+              f" of which bucketize_coins {dt_bucketize / n * 1000:9.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
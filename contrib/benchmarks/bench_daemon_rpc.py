@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+#
+# Load test for the JSON-RPC server of the daemon. Concurrent clients send
+# a mix of cheap calls (version) and expensive ones (getbalance on a wallet
+# with many addresses), and the latency of the cheap calls is reported:
+# with the command executor, expensive commands no longer block the event
+# loop. Also compares sending the calls one by one and as a JSON-RPC batch.
+#
+# usage: ./contrib/benchmarks/bench_daemon_rpc.py [--clients N] [--calls N] [--gap-limit N] [--workers N]
+
+import argparse
+import asyncio
+import contextlib
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+import aiohttp
+from aiohttp import web
+
+from electrum import keystore
+from electrum.commands import Commands, CommandExecutor, known_commands
+from electrum.daemon import AuthenticatedServer
+from electrum.simple_config import SimpleConfig
+from electrum.wallet import Standard_Wallet
+from electrum.wallet_db import WalletDB
+
+
+XPUB = 'xpub661MyMwAqRbcGH3yTb2kMQGnsLziRTJZ8vNthsVSCGbdBr8CGDWKxnGAFYgyKTzBtwvPPmfVAWJuFmxRXjSbUTg87wDkWQ5GmzpfUcN9t8Z'
+WALLET_PATH = 'bench_wallet'
+HOST, PORT = '127.0.0.1', 18765
+AUTH = aiohttp.BasicAuth('user', 'pass')
+
+
+class BenchDaemon:
+    """The parts of the Daemon used by the commands, with a single loaded wallet."""
+
+    def __init__(self, config, wallet):
+        self.config = config
+        self.wallet = wallet
+
+    def get_wallet(self, path):
+        return self.wallet
+
+    def wallet_in_use(self, wallet):
+        return contextlib.nullcontext()
+
+
+async def start_server(daemon, executor):
+    server = AuthenticatedServer('user', 'pass')
+    cmd_runner = Commands(config=daemon.config, daemon=daemon, executor=executor)
+    for cmdname in known_commands:
+        server.register_method(getattr(cmd_runner, cmdname))
+    app = web.Application()
+    app.router.add_post("/", server.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, HOST, PORT).start()
+    return runner
+
+
+def make_call(i, method):
+    params = {'wallet': WALLET_PATH} if known_commands[method].requires_wallet else {}
+    return {'id': i, 'jsonrpc': '2.0', 'method': method, 'params': params}
+
+
+async def client(session, calls, latencies, *, batch):
+    url = f'http://{HOST}:{PORT}/'
+    if batch:
+        async with session.post(url, json=calls) as resp:
+            for r in await resp.json():
+                assert 'result' in r, r
+        return
+    for call in calls:
+        t0 = time.perf_counter()
+        async with session.post(url, json=call) as resp:
+            r = await resp.json()
+            assert 'result' in r, r
+        if call['method'] == 'version':
+            latencies.append(time.perf_counter() - t0)
+
+
+async def run_load(daemon, executor, args, *, batch):
+    runner = await start_server(daemon, executor)
+    latencies = []
+    try:
+        async with aiohttp.ClientSession(auth=AUTH) as session:
+            clients = []
+            for c in range(args.clients):
+                # every fifth call is expensive
+                methods = ['getbalance' if (c + i) % 5 == 0 else 'version' for i in range(args.calls)]
+                calls = [make_call(i, method) for i, method in enumerate(methods)]
+                clients.append(client(session, calls, latencies, batch=batch))
+            t0 = time.perf_counter()
+            await asyncio.gather(*clients)
+            dt = time.perf_counter() - t0
+    finally:
+        await runner.cleanup()
+    return dt, latencies
+
+
+def report(name, n, dt, latencies):
+    line = f"{name:<34} {n / dt:8.1f} calls/s"
+    if latencies:
+        latencies = sorted(latencies)
+        p99 = latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))]
+        line += f"   version p50 {1000 * statistics.median(latencies):7.1f} ms, p99 {1000 * p99:7.1f} ms"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--calls', type=int, default=20, help='calls per client')
+    parser.add_argument('--gap-limit', type=int, default=5_000)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    config = SimpleConfig({'electrum_path': '/tmp/bench_daemon_rpc'})
+    db = WalletDB('', manual_upgrades=False)
+    db.put('keystore', keystore.from_xpub(XPUB).dump())
+    db.put('gap_limit', args.gap_limit)
+    daemon = BenchDaemon(config, Standard_Wallet(db, None, config=config))
+    n = args.clients * args.calls
+    print(f"{args.clients} clients x {args.calls} calls, every fifth one is getbalance "
+          f"({args.gap_limit} addresses)")
+
+    dt, latencies = asyncio.run(run_load(daemon, None, args, batch=False))
+    report("on the event loop", n, dt, latencies)
+    with CommandExecutor(args.workers) as executor:
+        dt, latencies = asyncio.run(run_load(daemon, executor, args, batch=False))
+        report(f"executor with {args.workers} threads", n, dt, latencies)
+        dt, latencies = asyncio.run(run_load(daemon, executor, args, batch=True))
+        report("executor, one batch per client", n, dt, latencies)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+#
+# Compares header lookups through the memory-mapped HeaderStore
+# with the previous open/seek/read path.
+#
+# usage: ./contrib/benchmarks/bench_header_store.py [--headers N] [--lookups N]
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from electrum.blockchain import HEADER_SIZE, HeaderStore, deserialize_header
+
+
+def read_header_seek(path: str, height: int) -> dict:
+    with open(path, 'rb') as f:
+        f.seek(height * HEADER_SIZE)
+        h = f.read(HEADER_SIZE)
+    return deserialize_header(h, height)
+
+
+def read_header_mmap(store: HeaderStore, path: str, height: int) -> dict:
+    h = store.read(path, height * HEADER_SIZE, HEADER_SIZE)
+    return deserialize_header(h, height)
+
+
+def timed(func, heights) -> float:
+    t0 = time.perf_counter()
+    for height in heights:
+        func(height)
+    return time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--headers', type=int, default=200_000)
+    parser.add_argument('--lookups', type=int, default=200_000)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'blockchain_headers')
+        with open(path, 'wb') as f:
+            f.write(os.urandom(args.headers * HEADER_SIZE))
+        store = HeaderStore()
+        patterns = {
+            'sequential': [i % args.headers for i in range(args.lookups)],
+            'random': [random.randrange(args.headers) for i in range(args.lookups)],
+        }
+        print(f"{args.headers} headers, {args.lookups} lookups per run")
+        for name, heights in patterns.items():
+            t_seek = timed(lambda height: read_header_seek(path, height), heights)
+            t_mmap = timed(lambda height: read_header_mmap(store, path, height), heights)
+            print(f"{name:>10}: open/seek/read {t_seek:.3f}s, mmap {t_mmap:.3f}s, "
+                  f"speedup x{t_seek / t_mmap:.1f}")
+        store.close()
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
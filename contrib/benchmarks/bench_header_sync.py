@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+#
+# Cold-start header catch-up against local fake Electrum servers that
+# add a fixed latency to every request, for several pipeline depths.
+#
+# usage: ./contrib/benchmarks/bench_header_sync.py [--chunks N] [--latency MS] [--servers N]
+
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+import aiorpcx
+from aiorpcx import RPCSession
+
+from electrum import constants, blockchain
+from electrum.blockchain import Blockchain, serialize_header, hash_raw_header
+from electrum.interface import Interface, NotificationSession, ServerAddr
+from electrum.logging import Logger
+from electrum.simple_config import SimpleConfig
+from electrum.util import make_dir
+
+
+def make_headers(num: int) -> bytes:
+    headers = []
+    prev_hash = '00' * 32
+    for height in range(num):
+        header = {'version': 1, 'prev_block_hash': prev_hash, 'merkle_root': '%064x' % height,
+                  'timestamp': 1600000000 + 600 * height, 'bits': 0x207fffff, 'nonce': 0}
+        raw = serialize_header(header)
+        headers.append(bytes.fromhex(raw))
+        prev_hash = hash_raw_header(raw)
+    return b''.join(headers)
+
+
+class FakeServerSession(RPCSession):
+
+    headers = b''
+    latency = 0.0
+
+    async def handle_request(self, request):
+        assert request.method == 'blockchain.block.headers', request.method
+        start_height, count = request.args
+        await asyncio.sleep(self.latency)
+        data = self.headers[start_height * 80:(start_height + count) * 80]
+        return {'hex': data.hex(), 'count': len(data) // 80, 'max': 2016}
+
+
+class BenchNetwork:
+
+    def __init__(self, config):
+        self.config = config
+        self.debug = False
+        self.interfaces = {}
+        self.interfaces_lock = threading.Lock()
+
+
+class BenchInterface(Interface):
+
+    def __init__(self, *, network, server, tip):
+        self.server = server
+        Logger.__init__(self)
+        self.network = network
+        self.ready = asyncio.Future()
+        self.ready.set_result(1)
+        self.tip = tip
+        self.debug = False
+        self._requested_chunks = set()
+        self.blockchain = None
+        self.session = None
+
+    async def connect(self):
+        factory = lambda *args, **kwargs: NotificationSession(*args, **kwargs, interface=self)
+        self.session = await aiorpcx.connect_rs(self.host, self.port, session_factory=factory).__aenter__()
+
+
+async def catch_up(iface: Interface, tip: int) -> None:
+    height = 0
+    while height <= tip:
+        could_connect, num_headers = await iface.request_chunks(height, tip)
+        assert could_connect
+        height = height // 2016 * 2016 + num_headers
+
+
+async def run(args) -> None:
+    headers = make_headers(args.chunks * 2016)
+    tip = args.chunks * 2016 - 1
+
+    class BenchNet(constants.BitcoinRegtest):
+        GENESIS = hash_raw_header(headers[:80].hex())
+    constants.net = BenchNet
+
+    FakeServerSession.headers = headers
+    FakeServerSession.latency = args.latency / 1000
+    servers = []
+    for i in range(args.servers):
+        server = await aiorpcx.serve_rs(FakeServerSession, '127.0.0.1', 0)
+        servers.append(server)
+    ports = [server.sockets[0].getsockname()[1] for server in servers]
+
+    print(f"{args.chunks} chunks, {args.latency} ms latency, {args.servers} server(s)")
+    for depth in (1, 2, 4, 8, 16):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            make_dir(os.path.join(tmpdir, 'forks'))
+            config = SimpleConfig({'electrum_path': tmpdir, 'header_sync_pipeline_depth': depth})
+            network = BenchNetwork(config)
+            interfaces = [BenchInterface(network=network, server=ServerAddr('127.0.0.1', port, protocol='t'), tip=tip)
+                          for port in ports]
+            for iface in interfaces:
+                await iface.connect()
+                network.interfaces[iface.server] = iface
+            chain = Blockchain(config=config, forkpoint=0, parent=None,
+                               forkpoint_hash=constants.net.GENESIS, prev_hash=None)
+            open(chain.path(), 'w+').close()
+            blockchain.blockchains = {constants.net.GENESIS: chain}
+            interfaces[0].blockchain = chain
+            t0 = time.perf_counter()
+            await catch_up(interfaces[0], tip)
+            elapsed = time.perf_counter() - t0
+            assert chain.height() == tip, chain.height()
+            print(f"depth {depth:>2}: {elapsed:.2f}s ({args.chunks * 2016 / elapsed:.0f} headers/s)")
+            for iface in interfaces:
+                await iface.session.close()
+        finally:
+            shutil.rmtree(tmpdir)
+    for server in servers:
+        server.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chunks', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=100, help='per-request latency in ms')
+    parser.add_argument('--servers', type=int, default=1)
+    args = parser.parse_args()
+    asyncio.get_event_loop().run_until_complete(run(args))
+
+
+if __name__ == '__main__':
+    main()
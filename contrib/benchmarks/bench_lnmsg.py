@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+#
+# Throughput of lnmsg.decode_msg and encode_msg on gossip messages
+# (channel_announcement, node_announcement, channel_update), for the
+# compiled codec and for the interpreter of the schemes it replaced.
+#
+# usage: ./contrib/benchmarks/bench_lnmsg.py [--messages N] [--repeat N]
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from electrum.lnmsg import LNSerializer
+
+
+def random_gossip(rnd, n):
+    def b(size):
+        return bytes(rnd.randrange(256) for i in range(size))
+    chain_hash = b(32)
+    msgs = []
+    for i in range(n):
+        kind = rnd.choice(('channel_announcement', 'node_announcement', 'channel_update', 'channel_update'))
+        if kind == 'channel_announcement':
+            fields = dict(node_signature_1=b(64), node_signature_2=b(64), bitcoin_signature_1=b(64),
+                          bitcoin_signature_2=b(64), len=2, features=b(2), chain_hash=chain_hash,
+                          short_channel_id=b(8), node_id_1=b(33), node_id_2=b(33),
+                          bitcoin_key_1=b(33), bitcoin_key_2=b(33))
+        elif kind == 'node_announcement':
+            fields = dict(signature=b(64), flen=3, features=b(3), timestamp=rnd.randrange(2 ** 32),
+                          node_id=b(33), rgb_color=b(3), alias=b(32), addrlen=7, addresses=b(7))
+        else:
+            fields = dict(signature=b(64), chain_hash=chain_hash, short_channel_id=b(8),
+                          timestamp=rnd.randrange(2 ** 32), message_flags=b'\x01', channel_flags=b(1),
+                          cltv_expiry_delta=144, htlc_minimum_msat=1000, fee_base_msat=1000,
+                          fee_proportional_millionths=1, htlc_maximum_msat=rnd.randrange(2 ** 40))
+        msgs.append((kind, fields))
+    return msgs
+
+
+def measure(func, items, repeat):
+    best = None
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        for item in items:
+            func(item)
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return len(items) / best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=20_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    lnser = LNSerializer()
+    msgs = random_gossip(random.Random(0), args.messages)
+    raw_msgs = [lnser.encode_msg(kind, **fields) for kind, fields in msgs]
+    assert all(lnser.decode_msg(raw) == lnser._interpreted_decode_msg(raw) for raw in raw_msgs[:1000])
+
+    print(f"{args.messages} gossip messages, best of {args.repeat}")
+    rates = {}
+    for name, decode, encode in (
+            ('interpreted', lnser._interpreted_decode_msg, lnser._interpreted_encode_msg),
+            ('compiled', lnser.decode_msg, lnser.encode_msg)):
+        rates[name] = (measure(decode, raw_msgs, args.repeat),
+                       measure(lambda msg: encode(msg[0], **msg[1]), msgs, args.repeat))
+        print(f"{name:<12} decode {rates[name][0]:10.0f} msg/s   encode {rates[name][1]:10.0f} msg/s")
+    print(f"{'speedup':<12} decode {rates['compiled'][0] / rates['interpreted'][0]:10.1f}x      "
+          f"encode {rates['compiled'][1] / rates['interpreted'][1]:10.1f}x")
+
+
+if __name__ == '__main__':
+    main()
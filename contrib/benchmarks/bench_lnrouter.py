@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+#
+# Route finding latency of LNPathFinder.find_path_for_payment on synthetic
+# graphs of increasing size. The first search includes building the per-edge
+# costs, the searches after it reuse them. Also measures a search after some
+# policies changed, or channels were added and removed, as they do with
+# incoming gossip (with the longest time another thread waited for the
+# ChannelDB lock during that search), and payments with
+# failed attempts, with a new search for each attempt (find_path_for_payment)
+# and with the cached candidate paths (find_path_from_candidates).
+#
+# usage: ./contrib/benchmarks/bench_lnrouter.py [--sizes N,N,...] [--searches N] [--payments N]
+
+import argparse
+from collections import defaultdict
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from electrum import util
+from electrum.channel_db import ChannelDB, ChannelInfo, Policy
+from electrum.lnrouter import LNPathFinder
+from electrum.lnutil import ShortChannelID
+from electrum.simple_config import SimpleConfig
+
+
+def fill_graph(channel_db, num_nodes, num_channels, seed=0, first_block=500_000):
+    """Adds channels with policies in both directions, between random
+    nodes, some of which have many more channels than others."""
+    rnd = random.Random(seed)
+    node_ids = [bytes([2]) + rnd.getrandbits(256).to_bytes(32, 'big') for _ in range(num_nodes)]
+    graph = channel_db._graph
+    for i in range(num_channels):
+        scid = ShortChannelID.from_components(first_block + i // 1000, i % 1000, 0)
+        n1, n2 = node_ids[i % num_nodes], node_ids[int(num_nodes * rnd.random() ** 2)]
+        if n1 == n2:
+            continue
+        n1, n2 = sorted((n1, n2))
+        graph.add_channel(ChannelInfo(short_channel_id=scid, node1_id=n1, node2_id=n2,
+                                      capacity_sat=rnd.randrange(10 ** 5, 10 ** 7)))
+        for direction, node_id in enumerate((n1, n2)):
+            graph.set_policy(Policy(key=scid + node_id, cltv_expiry_delta=rnd.choice([40, 144]),
+                                    htlc_minimum_msat=1000, htlc_maximum_msat=rnd.randrange(10 ** 6, 10 ** 10),
+                                    fee_base_msat=rnd.choice([0, 1000]),
+                                    fee_proportional_millionths=rnd.randrange(1, 5000),
+                                    channel_flags=direction, message_flags=1, timestamp=1_600_000_000))
+    return node_ids
+
+
+def bench_payments(path_finder, node_ids, rnd, num_payments, num_attempts=3):
+    """Each payment fails num_attempts times, which blacklists a channel of
+    the path. Then a second payment is made to the same destination."""
+    times = defaultdict(float)
+    for _ in range(num_payments):
+        nodeA, nodeB = rnd.sample(node_ids, 2)
+        for name in ('find_path_for_payment', 'find_path_from_candidates'):
+            find_path = getattr(path_finder, name)
+            path_finder.clear_blacklist()
+            t0 = time.perf_counter()
+            for _ in range(num_attempts):
+                path = find_path(nodeA, nodeB, 100_000_000)
+                if path is None:
+                    break
+                path_finder.add_to_blacklist(path[len(path) // 2].short_channel_id)
+            t1 = time.perf_counter()
+            path_finder.blacklist.clear()
+            find_path(nodeA, nodeB, 100_000_000)
+            t2 = time.perf_counter()
+            times[name, 'attempts'] += (t1 - t0) / num_payments
+            times[name, 'again'] += (t2 - t1) / num_payments
+    for name in ('find_path_for_payment', 'find_path_from_candidates'):
+        print(f"    {name:<26} {num_attempts} attempts {1000 * times[name, 'attempts']:7.1f} ms, "
+              f"paying the same node again {1000 * times[name, 'again']:7.1f} ms")
+
+
+def lock_wait_during(channel_db, f):
+    """Runs f, and returns the longest time another thread had to wait for
+    the lock of channel_db meanwhile, as the gossip handlers would."""
+    waits = []
+    done = threading.Event()
+    def acquire_lock():
+        while not done.is_set():
+            t0 = time.perf_counter()
+            with channel_db.lock:
+                waits.append(time.perf_counter() - t0)
+            time.sleep(0.001)
+    thread = threading.Thread(target=acquire_lock)
+    thread.start()
+    try:
+        f()
+    finally:
+        done.set()
+        thread.join()
+    return max(waits)
+
+
+def bench(config, num_nodes, num_searches, num_updates, num_payments):
+    loop, stop_loop, loop_thread = util.create_and_start_event_loop()
+    class FakeNetwork:
+        asyncio_loop = loop
+        interface = None
+    FakeNetwork.config = config
+    channel_db = ChannelDB(FakeNetwork())
+    channel_db.data_loaded.set()
+    try:
+        node_ids = fill_graph(channel_db, num_nodes, 4 * num_nodes)
+        path_finder = LNPathFinder(channel_db)
+        rnd = random.Random(1)
+        times = []
+        num_found = 0
+        def search():
+            nodeA, nodeB = rnd.sample(node_ids, 2)
+            t0 = time.perf_counter()
+            path = path_finder.find_path_for_payment(nodeA, nodeB, 100_000_000)
+            times.append(time.perf_counter() - t0)
+            return path is not None
+        for _ in range(num_searches):
+            num_found += search()
+        policies = rnd.sample(list(channel_db._graph.get_policies()), num_updates)
+        for policy in policies:
+            channel_db._graph.set_policy(policy._replace(fee_base_msat=policy.fee_base_msat + 1))
+        search()
+        print(f"{num_nodes:7} nodes {len(channel_db._graph):7} channels: "
+              f"first search {1000 * times[0]:8.1f} ms, then mean {1000 * statistics.mean(times[1:-1]):7.1f} ms "
+              f"(median {1000 * statistics.median(times[1:-1]):7.1f} ms, {num_found}/{num_searches} paths found), "
+              f"after {num_updates} policy updates {1000 * times[-1]:7.1f} ms")
+        for removed_scid in rnd.sample(sorted(channel_db._graph.get_channel_ids()), num_updates // 2):
+            channel_db._graph.remove_channel(removed_scid)
+        fill_graph(channel_db, num_nodes // 10, num_updates // 2, seed=2, first_block=600_000)
+        max_wait = lock_wait_during(channel_db, search)
+        print(f"    after adding and removing {num_updates // 2} channels each {1000 * times[-1]:7.1f} ms, "
+              f"longest wait for the ChannelDB lock {1000 * max_wait:7.1f} ms")
+        bench_payments(path_finder, node_ids, rnd, num_payments)
+    finally:
+        loop.call_soon_threadsafe(stop_loop.set_result, 1)
+        loop_thread.join()
+        channel_db.sql_thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1000,5000,20000,50000', help='number of nodes; 4 channels per node')
+    parser.add_argument('--searches', type=int, default=50)
+    parser.add_argument('--updates', type=int, default=100, help='policy updates before the last search')
+    parser.add_argument('--payments', type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as electrum_path:
+        config = SimpleConfig({'electrum_path': electrum_path})
+        for num_nodes in map(int, args.sizes.split(',')):
+            bench(config, num_nodes, args.searches, args.updates, args.payments)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+#
+# Fetches histories and transactions from a local stub ElectrumX server,
+# which adds a fixed latency to every request, for several batch sizes.
+#
+# usage: ./contrib/benchmarks/bench_rpc_batching.py [--addresses N] [--latency MS]
+
+import argparse
+import asyncio
+import hashlib
+import os
+import sys
+import tempfile
+import shutil
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+import aiorpcx
+from aiorpcx import RPCSession
+
+from electrum.interface import Interface, NotificationSession, ServerAddr
+from electrum.logging import Logger
+from electrum.simple_config import SimpleConfig
+from electrum.transaction import Transaction
+
+
+# a small signed transaction; variants are made by changing the locktime
+TX_TEMPLATE = '01000000012a5c9a94fcde98f5581cd00162c60a13936ceb75389ea65bf38633b424eb4031000000006c493046022100a82bbc57a0136751e5433f41cf000b3f1a99c6744775e76ec764fb78c54ee100022100f9e80b7de89de861dc6fb0c1429d5da72c2b6b2ee2406bc9bfb1beedd729d985012102e61d176da16edd1d258a200ad9759ef63adf8e14cd97f53227bae35cdb84d2f6ffffffff0140420f00000000001976a914230ac37834073a42146f11ef8414ae929feaafc388ac'
+
+
+def make_tx(i: int) -> str:
+    return TX_TEMPLATE + i.to_bytes(4, byteorder='little').hex()
+
+
+class StubElectrumXSession(RPCSession):
+
+    initial_concurrent = 10_000  # the latency models round-trip time, not server load
+    latency = 0.0
+    histories = {}  # scripthash -> history
+    txs = {}  # txid -> raw tx
+
+    async def handle_request(self, request):
+        await asyncio.sleep(self.latency)
+        if request.method == 'blockchain.scripthash.get_history':
+            return self.histories[request.args[0]]
+        elif request.method == 'blockchain.transaction.get':
+            return self.txs[request.args[0]]
+        raise aiorpcx.RPCError(aiorpcx.JSONRPC.METHOD_NOT_FOUND, request.method)
+
+
+class BenchNetwork:
+
+    def __init__(self, config):
+        self.config = config
+        self.debug = False
+        self.interfaces = {}
+        self.interfaces_lock = threading.Lock()
+
+
+class BenchInterface(Interface):
+
+    def __init__(self, *, network, server):
+        self.server = server
+        Logger.__init__(self)
+        self.network = network
+        self.debug = False
+        self._batch_semaphore = None
+        self.session = None
+
+    async def connect(self):
+        factory = lambda *args, **kwargs: NotificationSession(*args, **kwargs, interface=self)
+        self.session = await aiorpcx.connect_rs(self.host, self.port, session_factory=factory).__aenter__()
+
+
+async def run(args) -> None:
+    txs = {}
+    histories = {}
+    tx_index = 0
+    for i in range(args.addresses):
+        sh = hashlib.sha256(b'address %d' % i).hexdigest()
+        history = []
+        for j in range(args.txs_per_address):
+            raw = make_tx(tx_index)
+            tx_index += 1
+            txid = Transaction(raw).txid()
+            txs[txid] = raw
+            history.append({'tx_hash': txid, 'height': 100 + j})
+        histories[sh] = history
+    StubElectrumXSession.latency = args.latency / 1000
+    StubElectrumXSession.histories = histories
+    StubElectrumXSession.txs = txs
+    server = await aiorpcx.serve_rs(StubElectrumXSession, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+
+    print(f"{len(histories)} histories, {len(txs)} txs, {args.latency} ms latency per request")
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for batch_size in (1, 5, 20, 50):
+            config = SimpleConfig({'electrum_path': tmpdir,
+                                   'network_batch_size': batch_size,
+                                   'network_batch_concurrency': args.concurrency})
+            iface = BenchInterface(network=BenchNetwork(config), server=ServerAddr('127.0.0.1', port, protocol='t'))
+            await iface.connect()
+            t0 = time.perf_counter()
+            results = await iface.get_history_for_scripthashes(list(histories))
+            t1 = time.perf_counter()
+            raw_txs = await iface.get_transactions([item['tx_hash'] for res in results for item in res])
+            t2 = time.perf_counter()
+            assert len(raw_txs) == len(txs)
+            print(f"batch size {batch_size:>2}: histories {t1 - t0:.2f}s, txs {t2 - t1:.2f}s")
+            await iface.session.close()
+    finally:
+        shutil.rmtree(tmpdir)
+        server.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--addresses', type=int, default=1000)
+    parser.add_argument('--txs-per-address', type=int, default=2)
+    parser.add_argument('--latency', type=float, default=20, help='per-request latency in ms')
+    parser.add_argument('--concurrency', type=int, default=4, help='max batches in flight')
+    args = parser.parse_args()
+    asyncio.get_event_loop().run_until_complete(run(args))
+
+
+if __name__ == '__main__':
+    main()
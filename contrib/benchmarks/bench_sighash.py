@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+#
+# Measures computing the signature hashes of all inputs of a tx, with the
+# hex-string based preimage serialization PartialTransaction used to have,
+# and with SighashCache; for legacy (p2pkh) and segwit (p2wpkh) inputs.
+# Also measures PartialTransaction.sign for the whole tx, sequentially and
+# with a thread pool, and PartialTransaction.update_signatures (used by the
+# Trezor, KeepKey and Safe-T plugins) with the signatures of the signed tx.
+#
+# usage: ./contrib/benchmarks/bench_sighash.py [--inputs N [N ...]] [--workers N]
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from electrum.crypto import sha256d
+from electrum.ecc import ECPrivkey
+from electrum.transaction import SighashCache
+from electrum.util import bfh
+from electrum.tests.test_transaction import make_unsigned_tx, serialize_preimage_with_hex_strings
+
+
+def timed(f):
+    t0 = time.perf_counter()
+    result = f()
+    return time.perf_counter() - t0, result
+
+
+def sighashes_with_hex_strings(tx):
+    return [sha256d(bfh(serialize_preimage_with_hex_strings(tx, i))) for i in range(len(tx.inputs()))]
+
+
+def sighashes_with_cache(tx):
+    cache = SighashCache(tx)
+    return [cache.get_sighash(i, txin, bfh(tx.get_preimage_script(txin)))
+            for i, txin in enumerate(tx.inputs())]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--inputs', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    privkey = bytes(31) + b'\x01'
+    keypairs = {ECPrivkey(privkey).get_public_key_hex(compressed=True): (privkey, True)}
+    for script_type in ('p2pkh', 'p2wpkh'):
+        for num_inputs in args.inputs:
+            tx = make_unsigned_tx([script_type] * num_inputs)
+            dt_old, old = timed(lambda: sighashes_with_hex_strings(tx))
+            dt_new, new = timed(lambda: sighashes_with_cache(tx))
+            assert old == new
+            dt_sign, _ = timed(lambda: tx.sign(keypairs))
+            assert tx.is_complete()
+            sigs = [list(txin.part_sigs.values())[0].hex() for txin in tx.inputs()]
+            tx_pool = make_unsigned_tx([script_type] * num_inputs)
+            with ThreadPoolExecutor(max_workers=args.workers) as executor:
+                dt_pool, _ = timed(lambda: tx_pool.sign(keypairs, executor=executor))
+            assert tx_pool.serialize() == tx.serialize()
+            tx_update = make_unsigned_tx([script_type] * num_inputs)
+            dt_update, _ = timed(lambda: tx_update.update_signatures(sigs))
+            assert tx_update.serialize() == tx.serialize()
+            print(f"{script_type:>6} {num_inputs:>5} inputs  sighashes: hex strings {dt_old * 1000:9.1f} ms,"
+                  f" SighashCache {dt_new * 1000:7.1f} ms ({dt_old / dt_new:5.1f}x)"
+                  f"  sign: {dt_sign * 1000:8.1f} ms, {args.workers} threads: {dt_pool * 1000:8.1f} ms"
+                  f"  update_signatures: {dt_update * 1000:8.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
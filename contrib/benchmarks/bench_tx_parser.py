@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+#
+# Measures the throughput of Transaction.deserialize over the raw txs in
+# electrum/tests/test_transaction.py, and compares it with the previous,
+# BCDataStream-based parser. Also parses one large consolidation tx.
+#
+# usage: ./contrib/benchmarks/bench_tx_parser.py [--rounds N]
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from electrum.transaction import Transaction, parse_network_tx
+from electrum.util import bfh
+from electrum.tests.test_transaction import (parse_network_tx_with_bcdatastream,
+                                             raw_txs_from_test_vectors, signed_segwit_blob)
+
+
+def make_consolidation_tx(num_inputs: int) -> bytes:
+    # replicate the (segwit) input and its witness of a test vector
+    tx = Transaction(signed_segwit_blob)
+    txin = tx.inputs()[0]
+    outputs = tx.outputs()
+    raw = bytes.fromhex('01000000') + b'\x00\x01' + b'\xfd' + num_inputs.to_bytes(2, 'little')
+    for i in range(num_inputs):
+        raw += i.to_bytes(32, 'little') + (0).to_bytes(4, 'little') + b'\x00' + txin.nsequence.to_bytes(4, 'little')
+    raw += bytes([len(outputs)])
+    for txout in outputs:
+        raw += txout.serialize_to_network()
+    raw += txin.witness * num_inputs
+    raw += (0).to_bytes(4, 'little')
+    return raw
+
+
+def bench(parse, raw_txs, rounds: int) -> float:
+    t0 = time.perf_counter()
+    for i in range(rounds):
+        for raw in raw_txs:
+            parse(raw)
+    return time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rounds', type=int, default=200)
+    args = parser.parse_args()
+
+    raw_txs = [bfh(raw_tx) for raw_tx in raw_txs_from_test_vectors()]
+    num_bytes = sum(len(raw) for raw in raw_txs) * args.rounds
+    num_txs = len(raw_txs) * args.rounds
+    big_tx = [make_consolidation_tx(5000)]
+    print(f"{len(raw_txs)} test vectors, {args.rounds} rounds; consolidation tx: {len(big_tx[0])} bytes")
+    for name, parse in (('BCDataStream', parse_network_tx_with_bcdatastream),
+                        ('parse_network_tx', parse_network_tx)):
+        dt = bench(parse, raw_txs, args.rounds)
+        dt_big = bench(parse, big_tx, 10) / 10
+        print(f"{name:>16}: {num_txs / dt:9.0f} tx/s {num_bytes / dt / 1e6:6.1f} MB/s"
+              f"  consolidation tx: {dt_big * 1000:7.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
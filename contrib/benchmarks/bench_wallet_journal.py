@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+#
+# Measures the cost of saving a large wallet after small changes:
+# full JSON snapshots (consolidate=True) versus journal appends.
+# Reports bytes written per save (write amplification) and time per save.
+#
+# usage: ./contrib/benchmarks/bench_wallet_journal.py [--txs N] [--saves N]
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from electrum.storage import WalletStorage, StorageEncryptionVersion
+from electrum.util import TxMinedInfo
+from electrum.wallet_db import WalletDB, FINAL_SEED_VERSION
+
+
+def fake_txid(i: int) -> str:
+    return '%064x' % i
+
+
+def make_wallet_json(num_txs: int) -> str:
+    txi, txo, history, verified = {}, {}, {}, {}
+    for i in range(num_txs):
+        txid = fake_txid(i)
+        addr = 'bc1qaddress%030d' % (i % 1000)
+        txo[txid] = {addr: {'0': [100_000 + i, False]}}
+        if i:
+            txi[txid] = {addr: {fake_txid(i - 1) + ':0': 100_000 + i - 1}}
+        history.setdefault(addr, []).append([txid, 600_000 + i])
+        verified[txid] = [600_000 + i, 1_600_000_000 + i, 1, '00' * 32]
+    return json.dumps({
+        'seed_version': FINAL_SEED_VERSION,
+        'txi': txi,
+        'txo': txo,
+        'addr_history': history,
+        'verified_tx3': verified,
+    })
+
+
+def run(path: str, wallet_json: str, num_saves: int, consolidate: bool, password=None):
+    if os.path.exists(path):
+        os.unlink(path)
+    storage = WalletStorage(path)
+    if password:
+        storage.set_password(password, StorageEncryptionVersion.USER_PASSWORD)
+    db = WalletDB(wallet_json, manual_upgrades=False)
+    db.write(storage)
+    num_txs = len(db.list_verified_tx())
+    bytes_written = 0
+    t0 = time.perf_counter()
+    for i in range(num_saves):
+        # what a sync batch typically does: a new tx gets mined
+        txid = fake_txid(num_txs + i)
+        db.add_txo_addr(txid, 'bc1qnewaddress', 0, 50_000, False)
+        db.add_verified_tx(txid, TxMinedInfo(height=700_000 + i, timestamp=1_700_000_000,
+                                             txpos=1, header_hash='00' * 32))
+        journal_before = storage.journal_size()
+        db.write(storage, consolidate=consolidate)
+        if storage.journal_size() == 0:
+            # a snapshot rewrites the whole file
+            bytes_written += storage.snapshot_size()
+        else:
+            bytes_written += storage.journal_size() - journal_before
+    dt = time.perf_counter() - t0
+    return bytes_written / num_saves, dt / num_saves
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--txs', type=int, nargs='+', default=[10_000, 100_000])
+    parser.add_argument('--saves', type=int, default=20)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'wallet')
+        for num_txs in args.txs:
+            wallet_json = make_wallet_json(num_txs)
+            for password in (None, 'secret'):
+                label = 'encrypted' if password else 'plaintext'
+                full_bytes, full_time = run(path, wallet_json, args.saves, True, password)
+                jrnl_bytes, jrnl_time = run(path, wallet_json, args.saves, False, password)
+                print(f"{num_txs:>8} txs, {label:>9}: "
+                      f"snapshot {full_bytes / 1024:9.1f} KiB {full_time * 1000:8.1f} ms/save | "
+                      f"journal {jrnl_bytes / 1024:9.1f} KiB {jrnl_time * 1000:8.1f} ms/save | "
+                      f"x{full_bytes / jrnl_bytes:.0f} fewer bytes, x{full_time / jrnl_time:.1f} faster")
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
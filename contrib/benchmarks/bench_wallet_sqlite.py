@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+#
+# Compares opening a large wallet with the json WalletDB and with the
+# sqlite-backed SqliteWalletDB. Each load runs in a fresh process, and
+# reports the load time and the peak resident memory of that process. A load
+# that fails, e.g. because it ran out of memory, is reported as such.
+#
+# usage: ./contrib/benchmarks/bench_wallet_sqlite.py [--txs N [N ...]]
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from electrum.storage import WalletStorage
+from electrum.wallet_db import WalletDB, FINAL_SEED_VERSION
+from electrum.wallet_sqlite_db import SqliteWalletDB, get_sqlite_path
+
+
+RAW_TX = '02000000000101a5883f3de780d260e6f26cf85144403c7744a65a44cd38f9ff45aecadf010c540100000000fdffffff0220a10700000000001600145f4cfb0e1d2a7055634074bfbc9f546ac019e47f08de3c000000000016001424b32aadb42a89016c4de8f11741c3b29b15f21c02473044022045cc6c1cc875cbb0c0d8fe323dc1de9716e49ed5659741b0fb3dd9a196894066022077c242640071d12ec5763c5870f482a4823d8713e4bd14353dd621ed29a7f96d012102aea8d439a0f79d8b58e8d7bda83009f587e1f3da350adaa484329bf47cd03465fef61c00'
+
+
+def fake_txid(i: int) -> str:
+    return '%064x' % i
+
+
+def make_wallet_json(num_txs: int) -> str:
+    transactions, txi, txo, history, verified, spent = {}, {}, {}, {}, {}, {}
+    for i in range(num_txs):
+        txid = fake_txid(i)
+        addr = 'bc1qaddress%030d' % (i % 1000)
+        # the txid does not match, but is never checked on load
+        transactions[txid] = RAW_TX
+        txo[txid] = {addr: {'0': [100_000 + i, False]}}
+        if i:
+            txi[txid] = {addr: {fake_txid(i - 1) + ':0': 100_000 + i - 1}}
+            spent[fake_txid(i - 1)] = {'0': txid}
+        history.setdefault(addr, []).append([txid, 600_000 + i])
+        verified[txid] = [600_000 + i, 1_600_000_000 + i, 1, '00' * 32]
+    return json.dumps({
+        'seed_version': FINAL_SEED_VERSION,
+        'transactions': transactions,
+        'txi': txi,
+        'txo': txo,
+        'spent_outpoints': spent,
+        'addr_history': history,
+        'verified_tx3': verified,
+    })
+
+
+def peak_rss_kb() -> int:
+    # ru_maxrss survives fork+exec on linux, so it would include the parent
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def load(path: str, backend: str):
+    t0 = time.perf_counter()
+    storage = WalletStorage(path)
+    if backend == 'sqlite':
+        db = SqliteWalletDB(storage.read(), manual_upgrades=False, path=get_sqlite_path(path))
+    else:
+        db = WalletDB(storage.read(), manual_upgrades=False)
+    # what opening a wallet typically touches first
+    txid = db.list_verified_tx()[-1]
+    db.get_transaction(txid)
+    dt = time.perf_counter() - t0
+    print(json.dumps({'time': dt, 'maxrss_kb': peak_rss_kb()}))
+
+
+def migrate(path: str):
+    storage = WalletStorage(path)
+    db = SqliteWalletDB(storage.read(), manual_upgrades=False, path=get_sqlite_path(path))
+    db.write(storage)
+    db.close()
+
+
+def run(*args: str) -> Optional[str]:
+    """Runs this script with args in a new process. Returns its output,
+    or None if it failed."""
+    p = subprocess.run([sys.executable, os.path.abspath(__file__), *args],
+                       stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    if p.returncode != 0:
+        return None
+    return p.stdout.decode()
+
+
+def format_result(out: Optional[str]) -> str:
+    if out is None:
+        return '         failed'
+    r = json.loads(out.strip().splitlines()[-1])
+    return f"{r['time']:7.3f} s {r['maxrss_kb'] // 1024:6d} MB"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--txs', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--load', help=argparse.SUPPRESS)
+    parser.add_argument('--backend', help=argparse.SUPPRESS)
+    parser.add_argument('--migrate', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.load:
+        load(args.load, args.backend)
+        return
+    if args.migrate:
+        migrate(args.migrate)
+        return
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for num_txs in args.txs:
+            json_path = os.path.join(tmpdir, 'wallet_json_%d' % num_txs)
+            sqlite_path = os.path.join(tmpdir, 'wallet_sqlite_%d' % num_txs)
+            wallet_json = make_wallet_json(num_txs)
+            for path in (json_path, sqlite_path):
+                with open(path, 'w') as f:
+                    f.write(wallet_json)
+            del wallet_json
+            # migrate once, outside of the measurement
+            if run('--migrate', sqlite_path) is None:
+                print(f"{num_txs:>8} txs  migration to sqlite failed")
+                continue
+            r_json = run('--load', json_path, '--backend', 'json')
+            r_sqlite = run('--load', sqlite_path, '--backend', 'sqlite')
+            print(f"{num_txs:>8} txs  json: {format_result(r_json)}  sqlite: {format_result(r_sqlite)}")
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -12,19 +12,46 @@ if is_local and os.name == 'nt':
 
 
 from .version import ELECTRUM_VERSION
-from .util import format_satoshis
-from .wallet import Wallet
-from .storage import WalletStorage
-from .coinchooser import COIN_CHOOSERS
-from .network import Network, pick_random_server
-from .interface import Interface
-from .simple_config import SimpleConfig
-from . import bitcoin
-from . import transaction
-from . import daemon
-from .transaction import Transaction
-from .plugin import BasePlugin
-from .commands import Commands, known_commands
+
+
+# The submodules below are imported on first access, so that e.g. the
+# command line client, which only talks to the daemon, starts quickly.
+_lazy_attributes = {
+    'format_satoshis': ('util', 'format_satoshis'),
+    'Wallet': ('wallet', 'Wallet'),
+    'WalletStorage': ('storage', 'WalletStorage'),
+    'COIN_CHOOSERS': ('coinchooser', 'COIN_CHOOSERS'),
+    'Network': ('network', 'Network'),
+    'pick_random_server': ('network', 'pick_random_server'),
+    'Interface': ('interface', 'Interface'),
+    'SimpleConfig': ('simple_config', 'SimpleConfig'),
+    'bitcoin': ('bitcoin', None),
+    'transaction': ('transaction', None),
+    'daemon': ('daemon', None),
+    'Transaction': ('transaction', 'Transaction'),
+    'BasePlugin': ('plugin', 'BasePlugin'),
+    'Commands': ('commands', 'Commands'),
+    'known_commands': ('commands', 'known_commands'),
+}
+
+
+def __getattr__(name):
+    try:
+        module_name, attr_name = _lazy_attributes[name]
+    except KeyError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
+    module_name = f"{__name__}.{module_name}"
+    __import__(module_name)
+    module = sys.modules[module_name]
+    value = module if attr_name is None else getattr(module, attr_name)
+    globals()[name] = value
+    return value
+
+
+if sys.version_info < (3, 7):
+    # module-level __getattr__ (PEP 562) is not available
+    for _name in _lazy_attributes:
+        __getattr__(_name)
 
 
 __version__ = ELECTRUM_VERSION
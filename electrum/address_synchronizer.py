@@ -25,6 +25,7 @@ import asyncio
 import threading
 import asyncio
 import itertools
+from bisect import bisect_left
 from collections import defaultdict
 from typing import TYPE_CHECKING, Dict, Optional, Set, Tuple, NamedTuple, Sequence, List
 
@@ -57,6 +58,30 @@ class HistoryItem(NamedTuple):
     balance: int
 
 
+class HistoryCache:
+    """Sorted whole-wallet history with running balances.
+
+    Mutations only mark the affected txids dirty; get_history re-evaluates
+    those and recomputes balances from the earliest position that changed.
+    """
+
+    def __init__(self):
+        self.valid = False
+        self.dirty = set()  # type: Set[str]
+        self.keys = []  # type: List[Tuple[Tuple, str]]  # sorted (txpos, txid)
+        self.entries = {}  # type: Dict[str, Tuple[Tuple, int, Optional[int]]]  # txid -> (txpos, delta, fee)
+        self.items = []  # type: List[HistoryItem]
+        self.local_height = None  # type: Optional[int]
+
+    def invalidate(self) -> None:
+        self.valid = False
+        self.dirty.clear()
+
+    def mark_dirty(self, txid: str) -> None:
+        if self.valid:
+            self.dirty.add(txid)
+
+
 class TxWalletDelta(NamedTuple):
     is_relevant: bool  # "related to wallet?"
     is_any_input_ismine: bool
@@ -210,7 +235,7 @@ class AddressSynchronizer(Logger):
 
     def add_address(self, address):
         if not self.db.get_addr_history(address):
-            self.db.history[address] = []
+            self.db.set_addr_history(address, [])
             self.set_up_to_date(False)
         if self.synchronizer:
             self.synchronizer.add(address)
@@ -399,6 +424,7 @@ class AddressSynchronizer(Logger):
                     # make tx local
                     self.unverified_tx.pop(tx_hash, None)
                     self.db.remove_verified_tx(tx_hash)
+                    self._history_cache.mark_dirty(tx_hash)
                     if self.verifier:
                         self.verifier.remove_spv_proof_for_tx(tx_hash)
             self.db.set_addr_history(addr, hist)
@@ -415,10 +441,12 @@ class AddressSynchronizer(Logger):
         # Store fees
         for tx_hash, fee_sat in tx_fees.items():
             self.db.add_tx_fee_from_server(tx_hash, fee_sat)
+            self._history_cache.mark_dirty(tx_hash)
 
     @profiler
     def load_local_history(self):
         self._history_local = {}  # type: Dict[str, Set[str]]  # address -> set(txid)
+        self._history_cache = HistoryCache()
         self._address_history_changed_events = defaultdict(asyncio.Event)  # address -> Event
         for txid in itertools.chain(self.db.list_txi(), self.db.list_txo()):
             self._add_tx_to_local_history(txid)
@@ -449,6 +477,7 @@ class AddressSynchronizer(Logger):
             with self.transaction_lock:
                 self.db.clear_history()
                 self._history_local.clear()
+                self._history_cache.invalidate()
 
     def get_txpos(self, tx_hash):
         """Returns (height, txpos) tuple, even if the tx is unverified."""
@@ -478,9 +507,8 @@ class AddressSynchronizer(Logger):
     @with_transaction_lock
     @with_local_height_cached
     def get_history(self, *, domain=None) -> Sequence[HistoryItem]:
-        # get domain
         if domain is None:
-            domain = self.get_addresses()
+            return self._get_wallet_history()
         domain = set(domain)
         # 1. Get the history of each address in the domain, maintain the
         #    delta of a tx as the sum of its deltas on domain addresses
@@ -515,8 +543,65 @@ class AddressSynchronizer(Logger):
 
         return h2
 
+    def _get_wallet_history(self) -> Sequence[HistoryItem]:
+        """History of the whole wallet, served from self._history_cache.
+        Caller must hold self.lock and self.transaction_lock.
+        """
+        cache = self._history_cache
+        if not cache.valid:
+            cache.keys.clear()
+            cache.entries.clear()
+            cache.items.clear()
+            cache.dirty = set(itertools.chain(self.db.list_txi(), self.db.list_txo()))
+            cache.valid = True
+        # 1. re-evaluate dirty txs. Positions below 'lowest' are untouched.
+        lowest = len(cache.keys)
+        for txid in cache.dirty:
+            old_entry = cache.entries.pop(txid, None)
+            if old_entry is not None:
+                idx = bisect_left(cache.keys, (old_entry[0], txid))
+                del cache.keys[idx]
+                lowest = min(lowest, idx)
+            new_entry = self._get_history_entry(txid)
+            if new_entry is not None:
+                cache.entries[txid] = new_entry
+                key = (new_entry[0], txid)
+                idx = bisect_left(cache.keys, key)
+                cache.keys.insert(idx, key)
+                lowest = min(lowest, idx)
+        cache.dirty.clear()
+        # 2. confirmation counts depend on the local height
+        local_height = self.get_local_height()
+        if local_height != cache.local_height:
+            cache.local_height = local_height
+            lowest = 0
+        # 3. rebuild items and running balances from 'lowest' onwards
+        del cache.items[lowest:]
+        balance = cache.items[-1].balance if cache.items else 0
+        for txpos, txid in cache.keys[lowest:]:
+            _, delta, fee = cache.entries[txid]
+            balance += delta
+            cache.items.append(HistoryItem(txid=txid,
+                                           tx_mined_status=self.get_tx_height(txid),
+                                           delta=delta,
+                                           fee=fee,
+                                           balance=balance))
+        return list(cache.items)
+
+    def _get_history_entry(self, txid: str) -> Optional[Tuple[Tuple, int, Optional[int]]]:
+        """Returns (txpos, delta, fee) of txid in the wallet history,
+        or None if the tx is not related to any of our addresses.
+        """
+        addrs = set(itertools.chain(self.db.get_txi_addresses(txid), self.db.get_txo_addresses(txid)))
+        addrs = [addr for addr in addrs if self.is_mine(addr)]
+        if not addrs:
+            return None
+        delta = sum(self.get_tx_delta(txid, addr) for addr in addrs)
+        return self.get_txpos(txid), delta, self.get_tx_fee(txid)
+
     def _add_tx_to_local_history(self, txid):
         with self.transaction_lock:
+            self._history_cache.mark_dirty(txid)
             for addr in itertools.chain(self.db.get_txi_addresses(txid), self.db.get_txo_addresses(txid)):
                 cur_hist = self._history_local.get(addr, set())
                 cur_hist.add(txid)
@@ -525,6 +610,7 @@ class AddressSynchronizer(Logger):
 
     def _remove_tx_from_local_history(self, txid):
         with self.transaction_lock:
+            self._history_cache.mark_dirty(txid)
             for addr in itertools.chain(self.db.get_txi_addresses(txid), self.db.get_txo_addresses(txid)):
                 cur_hist = self._history_local.get(addr, set())
                 try:
@@ -554,24 +640,28 @@ class AddressSynchronizer(Logger):
             if tx_height in (TX_HEIGHT_UNCONFIRMED, TX_HEIGHT_UNCONF_PARENT):
                 with self.lock:
                     self.db.remove_verified_tx(tx_hash)
+                    self._history_cache.mark_dirty(tx_hash)
                 if self.verifier:
                     self.verifier.remove_spv_proof_for_tx(tx_hash)
         else:
             with self.lock:
                 # tx will be verified only if height > 0
                 self.unverified_tx[tx_hash] = tx_height
+                self._history_cache.mark_dirty(tx_hash)
 
     def remove_unverified_tx(self, tx_hash, tx_height):
         with self.lock:
             new_height = self.unverified_tx.get(tx_hash)
             if new_height == tx_height:
                 self.unverified_tx.pop(tx_hash, None)
+                self._history_cache.mark_dirty(tx_hash)
 
     def add_verified_tx(self, tx_hash: str, info: TxMinedInfo):
         # Remove from the unverified map and add to the verified map
         with self.lock:
             self.unverified_tx.pop(tx_hash, None)
             self.db.add_verified_tx(tx_hash, info)
+            self._history_cache.mark_dirty(tx_hash)
         tx_mined_status = self.get_tx_height(tx_hash)
         util.trigger_callback('verified', self, tx_hash, tx_mined_status)
 
@@ -601,6 +691,7 @@ class AddressSynchronizer(Logger):
                         # into unverified_tx with the old height, and if we get
                         # a status update, that will overwrite it.
                         self.unverified_tx[tx_hash] = tx_height
+                        self._history_cache.mark_dirty(tx_hash)
                         txs.add(tx_hash)
         return txs
 
@@ -617,6 +708,7 @@ class AddressSynchronizer(Logger):
             tx_was_added = self.add_transaction(tx)
             if tx_was_added:
                 self.future_tx[tx.txid()] = num_blocks
+                self._history_cache.mark_dirty(tx.txid())
             return tx_was_added
 
     def get_tx_height(self, tx_hash: str) -> TxMinedInfo:
@@ -96,6 +96,22 @@ def _CKD_pub(parent_pubkey: bytes, parent_chaincode: bytes, child_index: bytes)
     return child_pubkey, child_chaincode
 
 
+def derive_child_pubkeys(parent_pubkey: bytes, parent_chaincode: bytes,
+                         start: int, stop: int) -> List[bytes]:
+    """Returns the compressed pubkeys of the non-hardened children
+    with index in range(start, stop).
+    Module-level, so that it can be run in a process pool.
+    """
+    if start < 0: raise ValueError('the bip32 index needs to be non-negative')
+    if stop - 1 >= BIP32_PRIME: raise Exception('not possible to derive hardened child from parent pubkey')
+    # same as CKD_pub, but adds the tweak directly to the parent point
+    child_pubkeys = []
+    for child_index in range(start, stop):
+        I = hmac_oneshot(parent_chaincode, parent_pubkey + child_index.to_bytes(4, 'big'), hashlib.sha512)
+        child_pubkeys.append(ecc.add_tweak_to_pubkey(parent_pubkey, I[0:32]))
+    return child_pubkeys
+
+
 def xprv_header(xtype: str, *, net=None) -> bytes:
     if net is None:
         net = constants.net
@@ -269,6 +285,13 @@ class BIP32Node(NamedTuple):
                          fingerprint=fingerprint,
                          child_number=child_number)
 
+    def child_pubkeys(self, start: int, stop: int) -> List[bytes]:
+        """Returns the compressed pubkeys of the non-hardened children
+        with index in range(start, stop).
+        """
+        pubkey = self.eckey.get_public_key_bytes(compressed=True)
+        return derive_child_pubkeys(pubkey, self.chaincode, start, stop)
+
     def calc_fingerprint_of_this_node(self) -> bytes:
         """Returns the fingerprint of this node.
         Note that self.fingerprint is of the *parent*.
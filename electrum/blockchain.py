@@ -21,9 +21,11 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 import os
+import mmap
+import hashlib
 import threading
 import time
-from typing import Optional, Dict, Mapping, Sequence
+from typing import Optional, Dict, Mapping, Sequence, List, NamedTuple
 
 from . import util
 from .bitcoin import hash_encode, int_to_hex, rev_hex
@@ -83,6 +85,139 @@ def hash_raw_header(header: str) -> str:
     return hash_encode(sha256d(bfh(header)))
 
 
+def hash_raw_headers(data: bytes) -> List[bytes]:
+    """Returns the double-SHA256 of each consecutive 80-byte header in data,
+    in internal byte order (i.e. not reversed for display).
+    Trailing bytes that do not make up a full header are ignored.
+    """
+    sha256 = hashlib.sha256
+    view = memoryview(data)
+    end = len(data) // HEADER_SIZE * HEADER_SIZE
+    return [sha256(sha256(view[i:i+HEADER_SIZE]).digest()).digest()
+            for i in range(0, end, HEADER_SIZE)]
+
+
+class HeaderStore:
+    """Read-only view of a headers file, backed by a memory map.
+
+    Reading a header is a slice of the mapping instead of an
+    open/seek/read roundtrip. The mapping is created lazily on first
+    read, and must be dropped with close() before the file is written to,
+    truncated, renamed or deleted; it gets recreated on the next read.
+    """
+
+    def __init__(self):
+        self._path = None  # type: Optional[str]
+        self._mmap = None  # type: Optional[mmap.mmap]
+
+    def close(self) -> None:
+        if self._mmap is not None:
+            self._mmap.close()
+        self._mmap = None
+        self._path = None
+
+    def _get_mmap(self, path: str) -> Optional[mmap.mmap]:
+        if self._mmap is not None and self._path == path:
+            return self._mmap
+        self.close()
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return None  # empty files cannot be mapped
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._path = path
+        return self._mmap
+
+    def read(self, path: str, offset: int, length: int) -> bytes:
+        """Returns up to 'length' bytes starting at 'offset'.
+        Like file.read(), the result is short if the file ends early.
+        """
+        mm = self._get_mmap(path)
+        if mm is None:
+            return b''
+        return mm[offset:offset+length]
+
+
+class ChainworkRecord(NamedTuple):
+    """Summary of the retarget period ending at height 2016*(period+1)-1."""
+    header_hash: bytes  # hash of the last header of the period, in internal byte order
+    target: int  # target computed from the period, used in the next one
+    chainwork: int  # cumulative chainwork up to and including the last header of the period
+
+
+class ChainworkIndex:
+    """Sidecar file next to a headers file, holding one ChainworkRecord
+    per complete retarget period, starting at 'first_period'.
+
+    It is a cache: records can always be recomputed from the headers.
+    On load, the last record is checked against the headers file and
+    the whole index is discarded if it does not match.
+    """
+
+    SUFFIX = '.chainwork'
+    RECORD_SIZE = 96
+
+    def __init__(self, path: str, first_period: int):
+        self.path = path
+        self.first_period = first_period
+        self.records = []  # type: List[ChainworkRecord]
+
+    @classmethod
+    def _serialize_record(cls, record: ChainworkRecord) -> bytes:
+        return (record.header_hash
+                + record.target.to_bytes(32, byteorder='big')
+                + record.chainwork.to_bytes(32, byteorder='big'))
+
+    @classmethod
+    def _deserialize_record(cls, data: bytes) -> ChainworkRecord:
+        return ChainworkRecord(header_hash=data[0:32],
+                               target=int.from_bytes(data[32:64], byteorder='big'),
+                               chainwork=int.from_bytes(data[64:96], byteorder='big'))
+
+    def load(self) -> None:
+        self.records = []
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        if len(data) % self.RECORD_SIZE != 0:
+            return
+        self.records = [self._deserialize_record(data[i:i+self.RECORD_SIZE])
+                        for i in range(0, len(data), self.RECORD_SIZE)]
+
+    def get(self, period: int) -> Optional[ChainworkRecord]:
+        idx = period - self.first_period
+        if 0 <= idx < len(self.records):
+            return self.records[idx]
+        return None
+
+    def next_period(self) -> int:
+        return self.first_period + len(self.records)
+
+    def truncate(self, period: int) -> None:
+        """Drops records for 'period' and above."""
+        idx = max(0, period - self.first_period)
+        if idx >= len(self.records):
+            return
+        del self.records[idx:]
+        if os.path.exists(self.path):
+            with open(self.path, 'rb+') as f:
+                f.truncate(idx * self.RECORD_SIZE)
+
+    def append(self, records: Sequence[ChainworkRecord]) -> None:
+        if not records:
+            return
+        with open(self.path, 'ab') as f:
+            f.seek(len(self.records) * self.RECORD_SIZE)
+            f.truncate()
+            f.write(b''.join(map(self._serialize_record, records)))
+        self.records.extend(records)
+
+    def delete(self) -> None:
+        self.records = []
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
 # key: blockhash hex at forkpoint
 # the chain at some key is the best chain that includes the given hash
 blockchains = {}  # type: Dict[str, Blockchain]
@@ -101,8 +236,10 @@ def read_blockchains(config: 'SimpleConfig'):
         header_after_cp = best_chain.read_header(constants.net.max_checkpoint()+1)
         if not header_after_cp or not best_chain.can_connect(header_after_cp, check_height=False):
             _logger.info("[blockchain] deleting best chain. cannot connect header after last cp to last cp.")
+            best_chain.header_store.close()
             os.unlink(best_chain.path())
             best_chain.update_size()
+            best_chain.chainwork_index.delete()
     # forks
     fdir = os.path.join(util.get_headers_dir(config), 'forks')
     util.make_dir(fdir)
@@ -113,6 +250,9 @@ def read_blockchains(config: 'SimpleConfig'):
     def delete_chain(filename, reason):
         _logger.info(f"[blockchain] deleting chain {filename}: {reason}")
         os.unlink(os.path.join(fdir, filename))
+        index_path = os.path.join(fdir, filename + ChainworkIndex.SUFFIX)
+        if os.path.exists(index_path):
+            os.unlink(index_path)
 
     def instantiate_chain(filename):
         __, forkpoint, prev_hash, first_hash = filename.split('_')
@@ -138,9 +278,11 @@ def read_blockchains(config: 'SimpleConfig'):
         # consistency checks
         h = b.read_header(b.forkpoint)
         if first_hash != hash_header(h):
+            b.header_store.close()
             delete_chain(filename, "incorrect first hash for chain")
             return
         if not b.parent.can_connect(h, check_height=False):
+            b.header_store.close()
             delete_chain(filename, "cannot connect chain to parent")
             return
         chain_id = b.get_id()
@@ -154,22 +296,19 @@ def read_blockchains(config: 'SimpleConfig'):
 def get_best_chain() -> 'Blockchain':
     return blockchains[constants.net.GENESIS]
 
-# block hash -> chain work; up to and including that block
-_CHAINWORK_CACHE = {
-    "0000000000000000000000000000000000000000000000000000000000000000": 0,  # virtual block at height -1
-}  # type: Dict[str, int]
-
-
 def init_headers_file_for_best_chain():
     b = get_best_chain()
     filename = b.path()
     length = HEADER_SIZE * len(constants.net.CHECKPOINTS) * 2016
     if not os.path.exists(filename) or os.path.getsize(filename) < length:
+        b.header_store.close()
         with open(filename, 'wb') as f:
             if length > 0:
                 f.seek(length - 1)
                 f.write(b'\x00')
         util.ensure_sparse_file(filename)
+        with b.lock:
+            b.chainwork_index.truncate(len(constants.net.CHECKPOINTS))
     with b.lock:
         b.update_size()
 
@@ -193,7 +332,10 @@ class Blockchain(Logger):
         self._forkpoint_hash = forkpoint_hash  # blockhash at forkpoint. "first hash"
         self._prev_hash = prev_hash  # blockhash immediately before forkpoint
         self.lock = threading.RLock()
+        self.header_store = HeaderStore()
         self.update_size()
+        self.chainwork_index = None  # type: Optional[ChainworkIndex]
+        self._load_chainwork_index()
 
     def with_lock(func):
         def func_wrapper(self, *args, **kwargs):
@@ -296,6 +438,66 @@ class Blockchain(Logger):
         p = self.path()
         self._size = os.path.getsize(p)//HEADER_SIZE if os.path.exists(p) else 0
 
+    @with_lock
+    def _load_chainwork_index(self) -> None:
+        self.chainwork_index = ChainworkIndex(self.path() + ChainworkIndex.SUFFIX,
+                                              first_period=self.forkpoint // 2016)
+        if constants.net.TESTNET:
+            return
+        index = self.chainwork_index
+        index.load()
+        # drop records for periods we do not have (complete) headers for
+        index.truncate((self.height() + 1) // 2016)
+        if not index.records:
+            return
+        # the index is only valid if it describes our headers file
+        last_period = index.next_period() - 1
+        try:
+            header_hash = self.get_hash(last_period * 2016 + 2015)
+        except MissingHeader:
+            header_hash = None
+        if header_hash != hash_encode(index.records[-1].header_hash):
+            self.logger.info("chainwork index does not match headers file. discarding it.")
+            index.delete()
+
+    def _get_chainwork_record(self, period: int) -> Optional[ChainworkRecord]:
+        if period < self.chainwork_index.first_period and self.parent is not None:
+            return self.parent._get_chainwork_record(period)
+        return self.chainwork_index.get(period)
+
+    @with_lock
+    def _update_chainwork_index(self) -> None:
+        """Appends records for the retarget periods that
+        were completed since the last update."""
+        if constants.net.TESTNET:
+            return
+        index = self.chainwork_index
+        period = index.next_period()
+        if period > 0:
+            prev_record = self._get_chainwork_record(period - 1)
+            if prev_record is None and self.parent is not None:
+                self.parent._update_chainwork_index()
+                prev_record = self._get_chainwork_record(period - 1)
+            if prev_record is None:
+                return
+            running_total, prev_target = prev_record.chainwork, prev_record.target
+        else:
+            running_total, prev_target = 0, self.get_target(-1)
+        new_records = []
+        while period * 2016 + 2015 <= self.height():
+            try:
+                header_hash = bfh(self.get_hash(period * 2016 + 2015))[::-1]
+                target = self.get_target(period)
+            except MissingHeader:
+                break
+            running_total += 2016 * self.target_to_work(prev_target)
+            new_records.append(ChainworkRecord(header_hash=header_hash,
+                                               target=target,
+                                               chainwork=running_total))
+            prev_target = target
+            period += 1
+        index.append(new_records)
+
     @classmethod
     def verify_header(cls, header: dict, prev_hash: str, target: int, expected_header_hash: str=None) -> None:
         _hash = hash_header(header)
@@ -305,20 +507,39 @@ class Blockchain(Logger):
             raise Exception("prev hash mismatch: %s vs %s" % (prev_hash, header.get('prev_block_hash')))
 
     def verify_chunk(self, index: int, data: bytes) -> None:
+        """Verifies a chunk of raw headers starting at height index*2016.
+        Works directly on the raw bytes: all headers are hashed in one pass,
+        and each prev_block_hash field is compared against the digest of
+        the previous header, without deserializing headers into dicts.
+        """
         num = len(data) // HEADER_SIZE
         start_height = index * 2016
         prev_hash = self.get_hash(start_height - 1)
         target = self.get_target(index-1)
+        view = memoryview(data)
+        digests = hash_raw_headers(data)
+        prev_digest = bfh(prev_hash)[::-1]
         for i in range(num):
             height = start_height + i
+            offset = i * HEADER_SIZE
+            self._verify_raw_header_matches_local(height, view[offset:offset+HEADER_SIZE], digests[i])
+            if view[offset+4:offset+36] != prev_digest:
+                raise Exception("prev hash mismatch: %s vs %s"
+                                % (hash_encode(prev_digest), hash_encode(bytes(view[offset+4:offset+36]))))
+            prev_digest = digests[i]
+
+    def _verify_raw_header_matches_local(self, height: int, raw_header: memoryview, digest: bytes) -> None:
+        """Raises if we already know the header at given height
+        (from checkpoints or from our headers file), and it differs.
+        """
+        if height <= self.height() or height <= constants.net.max_checkpoint():
             try:
                 expected_header_hash = self.get_hash(height)
             except MissingHeader:
-                expected_header_hash = None
-            raw_header = data[i*HEADER_SIZE : (i+1)*HEADER_SIZE]
-            header = deserialize_header(raw_header, index*2016 + i)
-            self.verify_header(header, prev_hash, target, expected_header_hash)
-            prev_hash = hash_header(header)
+                return
+            _hash = hash_encode(digest)
+            if expected_header_hash != _hash:
+                raise Exception("hash mismatches with expected: {} vs {}".format(expected_header_hash, _hash))
 
     @with_lock
     def path(self):
@@ -352,6 +573,7 @@ class Blockchain(Logger):
             delta_bytes = 0
         truncate = not chunk_within_checkpoint_region
         self.write(chunk, delta_bytes, truncate)
+        self._update_chainwork_index()
         self.swap_with_parent()
 
     def swap_with_parent(self) -> None:
@@ -391,14 +613,13 @@ class Blockchain(Logger):
         # parent's new name will be something new (not child's old name)
         self.assert_headers_file_available(self.path())
         child_old_name = self.path()
-        with open(self.path(), 'rb') as f:
-            my_data = f.read()
+        my_data = self.header_store.read(self.path(), 0, self.size()*HEADER_SIZE)
         self.assert_headers_file_available(parent.path())
         assert forkpoint > parent.forkpoint, (f"forkpoint of parent chain ({parent.forkpoint}) "
                                               f"should be at lower height than children's ({forkpoint})")
-        with open(parent.path(), 'rb') as f:
-            f.seek((forkpoint - parent.forkpoint)*HEADER_SIZE)
-            parent_data = f.read(parent_branch_size*HEADER_SIZE)
+        parent_data = parent.header_store.read(parent.path(),
+                                               (forkpoint - parent.forkpoint)*HEADER_SIZE,
+                                               parent_branch_size*HEADER_SIZE)
         self.write(parent_data, 0)
         parent.write(my_data, (forkpoint - parent.forkpoint)*HEADER_SIZE)
         # swap parameters
@@ -407,9 +628,18 @@ class Blockchain(Logger):
         self._forkpoint_hash, parent._forkpoint_hash = parent._forkpoint_hash, hash_raw_header(bh2u(parent_data[:HEADER_SIZE]))
         self._prev_hash, parent._prev_hash = parent._prev_hash, self._prev_hash
         # parent's new name
+        self.header_store.close()
+        parent.header_store.close()
+        self.chainwork_index.delete()
+        parent.chainwork_index.delete()
         os.replace(child_old_name, parent.path())
         self.update_size()
         parent.update_size()
+        # chainwork indexes are rebuilt from scratch, under the new names
+        self._load_chainwork_index()
+        parent._load_chainwork_index()
+        self._update_chainwork_index()
+        parent._update_chainwork_index()
         # update pointers
         blockchains.pop(child_old_id, None)
         blockchains.pop(parent_old_id, None)
@@ -432,6 +662,7 @@ class Blockchain(Logger):
     def write(self, data: bytes, offset: int, truncate: bool=True) -> None:
         filename = self.path()
         self.assert_headers_file_available(filename)
+        self.header_store.close()
         with open(filename, 'rb+') as f:
             if truncate and offset != self._size * HEADER_SIZE:
                 f.seek(offset)
@@ -441,6 +672,10 @@ class Blockchain(Logger):
             f.flush()
             os.fsync(f.fileno())
         self.update_size()
+        # drop index records that depend on the headers we overwrote.
+        # records for checkpointed periods do not depend on the headers file.
+        first_written_height = self.forkpoint + offset // HEADER_SIZE
+        self.chainwork_index.truncate(max(first_written_height // 2016, len(self.checkpoints)))
 
     @with_lock
     def save_header(self, header: dict) -> None:
@@ -450,26 +685,31 @@ class Blockchain(Logger):
         assert delta == self.size(), (delta, self.size())
         assert len(data) == HEADER_SIZE
         self.write(data, delta*HEADER_SIZE)
+        self._update_chainwork_index()
         self.swap_with_parent()
 
     @with_lock
-    def read_header(self, height: int) -> Optional[dict]:
+    def read_raw_header(self, height: int) -> Optional[bytes]:
         if height < 0:
             return
         if height < self.forkpoint:
-            return self.parent.read_header(height)
+            return self.parent.read_raw_header(height)
         if height > self.height():
             return
         delta = height - self.forkpoint
         name = self.path()
         self.assert_headers_file_available(name)
-        with open(name, 'rb') as f:
-            f.seek(delta * HEADER_SIZE)
-            h = f.read(HEADER_SIZE)
-            if len(h) < HEADER_SIZE:
-                raise Exception('Expected to read a full header. This was only {} bytes'.format(len(h)))
+        h = self.header_store.read(name, delta * HEADER_SIZE, HEADER_SIZE)
+        if len(h) < HEADER_SIZE:
+            raise Exception('Expected to read a full header. This was only {} bytes'.format(len(h)))
         if h == bytes([0])*HEADER_SIZE:
             return None
+        return h
+
+    def read_header(self, height: int) -> Optional[dict]:
+        h = self.read_raw_header(height)
+        if h is None:
+            return None
         return deserialize_header(h, height)
 
     def header_at_tip(self) -> Optional[dict]:
@@ -506,10 +746,10 @@ class Blockchain(Logger):
             h, t = self.checkpoints[index]
             return h
         else:
-            header = self.read_header(height)
-            if header is None:
+            raw_header = self.read_raw_header(height)
+            if raw_header is None:
                 raise MissingHeader(height)
-            return hash_header(header)
+            return hash_encode(sha256d(raw_header))
 
     def get_target(self, index: int) -> int:
         # compute target from chunk x, used in chunk x+1
@@ -520,6 +760,9 @@ class Blockchain(Logger):
         if index < len(self.checkpoints):
             h, t = self.checkpoints[index]
             return t
+        record = self._get_chainwork_record(index)
+        if record is not None:
+            return record.target
         # new target
         first = self.read_header(index * 2016)
         last = self.read_header(index * 2016 + 2015)
@@ -557,12 +800,16 @@ class Blockchain(Logger):
             bitsBase >>= 8
         return bitsN << 24 | bitsBase
 
+    @classmethod
+    def target_to_work(cls, target: int) -> int:
+        """work done by single header with given target"""
+        return ((2 ** 256 - target - 1) // (target + 1)) + 1
+
     def chainwork_of_header_at_height(self, height: int) -> int:
         """work done by single header at given height"""
         chunk_idx = height // 2016 - 1
         target = self.get_target(chunk_idx)
-        work = ((2 ** 256 - target - 1) // (target + 1)) + 1
-        return work
+        return self.target_to_work(target)
 
     @with_lock
     def get_chainwork(self, height=None) -> int:
@@ -572,22 +819,18 @@ class Blockchain(Logger):
             # On testnet/regtest, difficulty works somewhat different.
             # It's out of scope to properly implement that.
             return height
-        last_retarget = height // 2016 * 2016 - 1
-        cached_height = last_retarget
-        while _CHAINWORK_CACHE.get(self.get_hash(cached_height)) is None:
-            if cached_height <= -1:
-                break
-            cached_height -= 2016
-        assert cached_height >= -1, cached_height
-        running_total = _CHAINWORK_CACHE[self.get_hash(cached_height)]
-        while cached_height < last_retarget:
-            cached_height += 2016
-            work_in_single_header = self.chainwork_of_header_at_height(cached_height)
-            work_in_chunk = 2016 * work_in_single_header
-            running_total += work_in_chunk
-            _CHAINWORK_CACHE[self.get_hash(cached_height)] = running_total
-        cached_height += 2016
-        work_in_single_header = self.chainwork_of_header_at_height(cached_height)
+        last_period = height // 2016 - 1
+        if last_period == -1:
+            running_total = 0
+        else:
+            record = self._get_chainwork_record(last_period)
+            if record is None:
+                self._update_chainwork_index()
+                record = self._get_chainwork_record(last_period)
+            if record is None:
+                raise MissingHeader(last_period * 2016 + 2015)
+            running_total = record.chainwork
+        work_in_single_header = self.chainwork_of_header_at_height(height)
         work_in_last_partial_chunk = (height % 2016 + 1) * work_in_single_header
         return running_total + work_in_last_partial_chunk
 
@@ -26,13 +26,19 @@
 import time
 import random
 import os
+import sys
+import json
+import mmap
+import itertools
+import bisect
 from collections import defaultdict
-from typing import Sequence, List, Tuple, Optional, Dict, NamedTuple, TYPE_CHECKING, Set
+from typing import Sequence, List, Tuple, Optional, Dict, NamedTuple, TYPE_CHECKING, Set, Iterator, Union, Any
 import binascii
 import base64
 import asyncio
 import threading
 from enum import IntEnum
+from array import array
 
 
 from .sql_db import SqlDB, sql
@@ -246,6 +252,639 @@ def get_mychannel_policy(short_channel_id: bytes, node_id: bytes,
         return Policy.from_msg(local_update_decoded)
 
 
+_graph_versions = itertools.count(1)
+NO_HTLC_MAXIMUM_MSAT = 2 ** 64 - 1
+
+
+class DirectedEdges(NamedTuple):
+    """The two directions of the channels of a ChannelGraph, grouped by the
+    node they end at: the edges ending at node n are at offsets[n]:offsets[n+1]
+    in the per-edge columns, followed by added_edges[n]. Node indexes refer
+    to node_ids. The policy columns of an edge are only meaningful if
+    has_policy is set.
+
+    Channels added since the edges were built have their edges appended to
+    the columns, and listed in added_edges. Removed channels keep their
+    edges, without policies, until the edges are built again."""
+    version: int
+    topology_version: int
+    node_ids: List[bytes]
+    node_index: Dict[bytes, int]
+    offsets: array
+    added_edges: Dict[int, List[int]]  # node -> edges ending there, beyond offsets
+    edge_index: array  # policy index in the graph -> edge, -1 for self-loops and removed channels
+    # per edge
+    short_channel_ids: List[ShortChannelID]
+    start_node: array
+    reverse_edge: array  # the other direction of the channel
+    capacity_sat: array  # -1 if unknown
+    has_policy: bytearray
+    has_reverse_policy: bytearray  # whether the end node published a policy too
+    cltv_expiry_delta: array
+    htlc_minimum_msat: array
+    htlc_maximum_msat: array  # NO_HTLC_MAXIMUM_MSAT if not set
+    fee_base_msat: array
+    fee_proportional_millionths: array
+    channel_flags: bytearray
+
+    # the columns set from the policies, and from the capacity of the channel
+    POLICY_COLUMNS = ('capacity_sat', 'has_policy', 'has_reverse_policy', 'cltv_expiry_delta', 'htlc_minimum_msat',
+                      'htlc_maximum_msat', 'fee_base_msat', 'fee_proportional_millionths', 'channel_flags')
+
+    def get_edges_ending_at(self, n: int) -> Sequence[int]:
+        edges = range(self.offsets[n], self.offsets[n + 1])
+        added = self.added_edges.get(n)
+        return edges if added is None else [*edges, *added]
+
+
+def _take(column, indexes: Sequence[int]):
+    """Returns a new column (array or bytearray) with the items of column at indexes."""
+    if isinstance(column, bytearray):
+        return bytearray(column[i] for i in indexes)
+    return array(column.typecode, [column[i] for i in indexes])
+
+
+def _extend(column, n: int):
+    """Returns a copy of column (array or bytearray) with n zeros appended."""
+    if isinstance(column, bytearray):
+        return column + bytes(n)
+    return column + array(column.typecode, bytes(n * column.itemsize))
+
+
+class ChannelGraph:
+    """Compact in-memory store of the public channel graph.
+
+    Nodes and channels are numbered. The endpoints and capacity of channel i
+    are in typed arrays at index i, and the fields of its two policies at
+    2*i (direction 0, i.e. starting at node1) and 2*i+1. The channels of
+    node n are _adj_channels[_adj_offsets[n]:_adj_offsets[n+1]] (CSR layout).
+    Channels added since the last compaction are kept in _pending_adjacency,
+    and removed channels leave a hole (None in _scids) until the next one.
+    ChannelInfo and Policy tuples are only created when looked up.
+
+    Not thread-safe; ChannelDB accesses it while holding its lock.
+    """
+
+    MIN_CHANGES_BEFORE_COMPACTION = 1000
+
+    # _policy_flags
+    POLICY_PRESENT = 1 << 0
+    POLICY_HAS_HTLC_MAXIMUM = 1 << 1
+
+    def __init__(self):
+        self._node_ids = []  # type: List[bytes]  # node index -> node_id
+        self._node_index = {}  # type: Dict[bytes, int]
+        self._scids = []  # type: List[Optional[ShortChannelID]]  # channel index -> scid, None if removed
+        self._channel_index = {}  # type: Dict[ShortChannelID, int]
+        # per channel
+        self._node1 = array('I')
+        self._node2 = array('I')
+        self._capacity_sat = array('q')  # -1 if unknown
+        # per channel direction
+        self._policy_flags = bytearray()
+        self._cltv_expiry_delta = array('H')
+        self._htlc_minimum_msat = array('Q')
+        self._htlc_maximum_msat = array('Q')
+        self._fee_base_msat = array('I')
+        self._fee_proportional_millionths = array('I')
+        self._channel_flags = bytearray()
+        self._message_flags = bytearray()
+        self._timestamp = array('I')
+        # adjacency
+        self._adj_offsets = array('I', [0])
+        self._adj_channels = array('I')
+        self._pending_adjacency = defaultdict(list)  # type: Dict[int, List[int]]
+        self._num_changes = 0  # channels added or removed since the last compaction
+        self.num_policies = 0
+        # changes when channels are added or removed, or when a policy changes
+        # other than by its timestamp
+        self.version = next(_graph_versions)
+        # changes when the channels and nodes are renumbered, or when there
+        # were too many changes to replay them
+        self._topology_version = self.version
+        self._policy_changes = []  # type: List[Tuple[int, int]]  # (version, policy index) since then
+
+    def _on_change(self, *policy_indexes: int) -> None:
+        """Bumps the version, after a change to the given policies, or to
+        their channel. Without policy indexes, after renumbering."""
+        self.version = next(_graph_versions)
+        if policy_indexes \
+                and len(self._policy_changes) < max(self.MIN_CHANGES_BEFORE_COMPACTION, len(self._channel_index) // 4):
+            self._policy_changes.extend((self.version, i) for i in policy_indexes)
+        else:
+            # too many changes to replay: DirectedEdges are rebuilt
+            self._topology_version = self.version
+            self._policy_changes.clear()
+
+    def __len__(self):
+        return len(self._channel_index)
+
+    def __contains__(self, short_channel_id: bytes) -> bool:
+        return short_channel_id in self._channel_index
+
+    def get_channel_ids(self) -> Set[ShortChannelID]:
+        return set(self._channel_index)
+
+    def _get_or_add_node(self, node_id: bytes) -> int:
+        n = self._node_index.get(node_id)
+        if n is None:
+            n = self._node_index[node_id] = len(self._node_ids)
+            self._node_ids.append(node_id)
+        return n
+
+    def add_channel(self, channel_info: ChannelInfo) -> None:
+        """Adds or replaces a channel. The policies of a replaced channel
+        are kept if its endpoints did not change."""
+        capacity_sat = channel_info.capacity_sat if channel_info.capacity_sat is not None else -1
+        c = self._channel_index.get(channel_info.short_channel_id)
+        if c is not None:
+            if (self._node_ids[self._node1[c]], self._node_ids[self._node2[c]]) \
+                    == (channel_info.node1_id, channel_info.node2_id):
+                self._capacity_sat[c] = capacity_sat
+                self._on_change(2 * c, 2 * c + 1)
+                return
+            self.remove_channel(channel_info.short_channel_id)
+        n1 = self._get_or_add_node(channel_info.node1_id)
+        n2 = self._get_or_add_node(channel_info.node2_id)
+        c = len(self._scids)
+        self._scids.append(channel_info.short_channel_id)
+        self._channel_index[channel_info.short_channel_id] = c
+        self._node1.append(n1)
+        self._node2.append(n2)
+        self._capacity_sat.append(capacity_sat)
+        for column in (self._policy_flags, self._cltv_expiry_delta, self._htlc_minimum_msat,
+                       self._htlc_maximum_msat, self._fee_base_msat, self._fee_proportional_millionths,
+                       self._channel_flags, self._message_flags, self._timestamp):
+            column.extend((0, 0))
+        self._pending_adjacency[n1].append(c)
+        if n2 != n1:
+            self._pending_adjacency[n2].append(c)
+        self._num_changes += 1
+        self._on_change(2 * c, 2 * c + 1)
+        self._maybe_compact()
+
+    def remove_channel(self, short_channel_id: bytes) -> Optional[ChannelInfo]:
+        """Removes a channel and its policies. Returns the removed channel."""
+        channel_info = self.get_channel_info(short_channel_id)
+        if channel_info is None:
+            return None
+        c = self._channel_index.pop(short_channel_id)
+        self._scids[c] = None
+        for i in (2 * c, 2 * c + 1):
+            if self._policy_flags[i] & self.POLICY_PRESENT:
+                self.num_policies -= 1
+            self._policy_flags[i] = 0
+        self._num_changes += 1
+        self._on_change(2 * c, 2 * c + 1)
+        self._maybe_compact()
+        return channel_info
+
+    def get_channel_info(self, short_channel_id: bytes) -> Optional[ChannelInfo]:
+        c = self._channel_index.get(short_channel_id)
+        if c is None:
+            return None
+        capacity_sat = self._capacity_sat[c]
+        node_ids = self._node_ids
+        return ChannelInfo(self._scids[c], node_ids[self._node1[c]], node_ids[self._node2[c]],
+                           capacity_sat if capacity_sat >= 0 else None)
+
+    def _get_policy_index(self, short_channel_id: bytes, node_id: bytes) -> Optional[int]:
+        c = self._channel_index.get(short_channel_id)
+        if c is None:
+            return None
+        if self._node_ids[self._node1[c]] == node_id:
+            return 2 * c
+        if self._node_ids[self._node2[c]] == node_id:
+            return 2 * c + 1
+        return None
+
+    def set_policy(self, policy: Policy) -> bool:
+        """Stores the policy of a known channel. Returns False if the channel
+        is not known, or if the start node of the policy is not one of its endpoints."""
+        i = self._get_policy_index(policy.key[:8], policy.key[8:])
+        if i is None:
+            return False
+        flags = self._policy_flags[i]
+        old_policy = self._get_policy_at(i) if flags & self.POLICY_PRESENT else None
+        if old_policy is None:
+            self.num_policies += 1
+        # fields other than the key and the timestamp
+        if old_policy is None or old_policy[1:8] != policy[1:8]:
+            self._on_change(i)
+        flags = self.POLICY_PRESENT
+        if policy.htlc_maximum_msat is not None:
+            flags |= self.POLICY_HAS_HTLC_MAXIMUM
+            self._htlc_maximum_msat[i] = policy.htlc_maximum_msat
+        self._policy_flags[i] = flags
+        self._cltv_expiry_delta[i] = policy.cltv_expiry_delta
+        self._htlc_minimum_msat[i] = policy.htlc_minimum_msat
+        self._fee_base_msat[i] = policy.fee_base_msat
+        self._fee_proportional_millionths[i] = policy.fee_proportional_millionths
+        self._channel_flags[i] = policy.channel_flags
+        self._message_flags[i] = policy.message_flags
+        self._timestamp[i] = policy.timestamp
+        return True
+
+    def _get_policy_at(self, i: int) -> Policy:
+        c = i // 2
+        start_node = self._node1[c] if i % 2 == 0 else self._node2[c]
+        has_htlc_maximum = self._policy_flags[i] & self.POLICY_HAS_HTLC_MAXIMUM
+        # same field order as Policy
+        return Policy(
+            self._scids[c] + self._node_ids[start_node],
+            self._cltv_expiry_delta[i],
+            self._htlc_minimum_msat[i],
+            self._htlc_maximum_msat[i] if has_htlc_maximum else None,
+            self._fee_base_msat[i],
+            self._fee_proportional_millionths[i],
+            self._channel_flags[i],
+            self._message_flags[i],
+            self._timestamp[i])
+
+    def get_policy(self, short_channel_id: bytes, node_id: bytes) -> Optional[Policy]:
+        i = self._get_policy_index(short_channel_id, node_id)
+        if i is None or not self._policy_flags[i] & self.POLICY_PRESENT:
+            return None
+        return self._get_policy_at(i)
+
+    def remove_policy(self, short_channel_id: bytes, node_id: bytes) -> None:
+        i = self._get_policy_index(short_channel_id, node_id)
+        if i is None or not self._policy_flags[i] & self.POLICY_PRESENT:
+            return
+        self._policy_flags[i] = 0
+        self.num_policies -= 1
+        self._on_change(i)
+
+    def get_policies(self) -> Iterator[Policy]:
+        flags = self._policy_flags
+        for i in range(len(flags)):
+            if flags[i] & self.POLICY_PRESENT:
+                yield self._get_policy_at(i)
+
+    def get_channel_infos(self) -> Iterator[ChannelInfo]:
+        for short_channel_id in self._channel_index:
+            yield self.get_channel_info(short_channel_id)
+
+    def _get_channel_indexes_for_node(self, n: int) -> List[int]:
+        offsets = self._adj_offsets
+        channels = self._adj_channels[offsets[n]:offsets[n + 1]].tolist() if n + 1 < len(offsets) else []
+        pending = self._pending_adjacency.get(n)
+        if pending:
+            channels += pending
+        return channels
+
+    def get_channel_ids_by_policy_count(self) -> Tuple[Set[ShortChannelID], ...]:
+        """Returns the channels with 0, 1 and 2 policies."""
+        ret = (set(), set(), set())
+        flags = self._policy_flags
+        for short_channel_id, c in self._channel_index.items():
+            num_policies = bool(flags[2 * c] & self.POLICY_PRESENT) + bool(flags[2 * c + 1] & self.POLICY_PRESENT)
+            ret[num_policies].add(short_channel_id)
+        return ret
+
+    def get_channels_for_node(self, node_id: bytes) -> Set[ShortChannelID]:
+        n = self._node_index.get(node_id)
+        if n is None:
+            return set()
+        scids = self._scids
+        ret = set(map(scids.__getitem__, self._get_channel_indexes_for_node(n)))
+        ret.discard(None)  # removed channels
+        return ret
+
+    def has_channels(self, node_id: bytes) -> bool:
+        n = self._node_index.get(node_id)
+        if n is None:
+            return False
+        return any(self._scids[c] is not None for c in self._get_channel_indexes_for_node(n))
+
+    def get_directed_edges(self, previous: DirectedEdges = None) -> Tuple[DirectedEdges, Optional[List[int]]]:
+        """Returns copies of the policies of the graph, as DirectedEdges, and
+        the edges that changed since previous. If previous is None, or if
+        it cannot be updated, the edges are built from scratch, and None is
+        returned instead of the changed edges."""
+        if self.can_update_directed_edges(previous):
+            return self.update_directed_edges(previous)
+        return build_directed_edges(self.get_edge_columns()), None
+
+    def can_update_directed_edges(self, previous: Optional[DirectedEdges]) -> bool:
+        return previous is not None and previous.topology_version == self._topology_version
+
+    def get_edge_columns(self) -> Dict[str, Any]:
+        """Returns copies of what build_directed_edges needs. Unlike building
+        the edges, this is fast enough to be done while holding a lock."""
+        return {
+            'version': self.version,
+            'topology_version': self._topology_version,
+            'node_ids': self._node_ids[:],
+            'short_channel_ids': self._scids[:],
+            **{name[1:]: getattr(self, name)[:] for name in self._EDGE_COLUMNS},
+        }
+
+    def update_directed_edges(self, previous: DirectedEdges) -> Tuple[DirectedEdges, List[int]]:
+        """Returns the edges of previous, with the policies that changed
+        since, and with the edges of the channels added since appended."""
+        assert self.can_update_directed_edges(previous)
+        changes = self._policy_changes
+        first = bisect.bisect_right(changes, (previous.version, sys.maxsize))
+        edges = previous._replace(
+            version=self.version,
+            **{name: getattr(previous, name)[:] for name in DirectedEdges.POLICY_COLUMNS})
+        policy_indexes = {}  # type: Dict[int, int]  # changed edge -> policy index
+        if len(self._policy_flags) > len(previous.edge_index):
+            edges = self._add_directed_edges(edges, policy_indexes)
+        edge_index = edges.edge_index
+        for version, i in changes[first:]:
+            # the reverse edge has a policy of its own, and has_reverse_policy
+            for j in (i, i ^ 1):
+                if edge_index[j] >= 0:
+                    policy_indexes[edge_index[j]] = j
+        flags = self._policy_flags
+        for e, i in policy_indexes.items():
+            edges.capacity_sat[e] = self._capacity_sat[i >> 1]
+            edges.has_policy[e] = flags[i] & self.POLICY_PRESENT
+            edges.has_reverse_policy[e] = flags[i ^ 1] & self.POLICY_PRESENT
+            edges.cltv_expiry_delta[e] = self._cltv_expiry_delta[i]
+            edges.htlc_minimum_msat[e] = self._htlc_minimum_msat[i]
+            edges.htlc_maximum_msat[e] = self._htlc_maximum_msat[i] \
+                if flags[i] & self.POLICY_HAS_HTLC_MAXIMUM else NO_HTLC_MAXIMUM_MSAT
+            edges.fee_base_msat[e] = self._fee_base_msat[i]
+            edges.fee_proportional_millionths[e] = self._fee_proportional_millionths[i]
+            edges.channel_flags[e] = self._channel_flags[i]
+        return edges, sorted(policy_indexes)
+
+    def _add_directed_edges(self, edges: DirectedEdges, policy_indexes: Dict[int, int]) -> DirectedEdges:
+        """Appends the edges of the channels added since edges were built.
+        Their policies are filled in through policy_indexes."""
+        num_previous_nodes = len(edges.node_ids)
+        if len(self._node_ids) > num_previous_nodes:
+            new_node_ids = self._node_ids[num_previous_nodes:]
+            node_index = dict(edges.node_index)
+            node_index.update((node_id, n) for n, node_id in enumerate(new_node_ids, num_previous_nodes))
+            edges = edges._replace(
+                node_ids=edges.node_ids + new_node_ids,
+                node_index=node_index,
+                offsets=edges.offsets + array('I', [edges.offsets[-1]]) * len(new_node_ids))
+        first_channel = len(edges.edge_index) // 2
+        edge_index = edges.edge_index + array('i', [-1]) * (len(self._policy_flags) - len(edges.edge_index))
+        short_channel_ids = edges.short_channel_ids[:]
+        start_node = edges.start_node[:]
+        reverse_edge = edges.reverse_edge[:]
+        added_edges = dict(edges.added_edges)
+        for c in range(first_channel, len(self._scids)):
+            n1, n2 = self._node1[c], self._node2[c]
+            if self._scids[c] is None or n1 == n2:
+                continue
+            short_channel_id = ShortChannelID.normalize(self._scids[c])
+            e = len(short_channel_ids)  # direction 0 starts at node1, so it ends at node2
+            edge_index[2 * c], edge_index[2 * c + 1] = e, e + 1
+            policy_indexes[e], policy_indexes[e + 1] = 2 * c, 2 * c + 1
+            short_channel_ids += (short_channel_id, short_channel_id)
+            start_node.extend((n1, n2))
+            reverse_edge.extend((e + 1, e))
+            added_edges[n2] = added_edges.get(n2, []) + [e]
+            added_edges[n1] = added_edges.get(n1, []) + [e + 1]
+        num_new_edges = len(short_channel_ids) - len(edges.short_channel_ids)
+        return edges._replace(
+            edge_index=edge_index,
+            added_edges=added_edges,
+            short_channel_ids=short_channel_ids,
+            start_node=start_node,
+            reverse_edge=reverse_edge,
+            **{name: _extend(getattr(edges, name), num_new_edges) for name in DirectedEdges.POLICY_COLUMNS})
+
+    def _maybe_compact(self) -> None:
+        if self._num_changes > max(self.MIN_CHANGES_BEFORE_COMPACTION, len(self._channel_index) // 4):
+            self.compact()
+
+    def compact(self) -> None:
+        """Drops removed channels and nodes without channels,
+        and moves all adjacency lists into the CSR arrays."""
+        if not self._num_changes:
+            return
+        if len(self._channel_index) != len(self._scids):
+            live = [c for c, scid in enumerate(self._scids) if scid is not None]
+            live_directions = [i for c in live for i in (2 * c, 2 * c + 1)]
+            node_indexes = sorted(set(self._node1[c] for c in live) | set(self._node2[c] for c in live))
+            new_node_index = {n: i for i, n in enumerate(node_indexes)}
+            self._node_ids = [self._node_ids[n] for n in node_indexes]
+            self._node_index = {node_id: i for i, node_id in enumerate(self._node_ids)}
+            self._scids = [self._scids[c] for c in live]
+            self._channel_index = {scid: c for c, scid in enumerate(self._scids)}
+            self._node1 = array('I', [new_node_index[self._node1[c]] for c in live])
+            self._node2 = array('I', [new_node_index[self._node2[c]] for c in live])
+            self._capacity_sat = _take(self._capacity_sat, live)
+            for name in ('_policy_flags', '_cltv_expiry_delta', '_htlc_minimum_msat', '_htlc_maximum_msat',
+                         '_fee_base_msat', '_fee_proportional_millionths', '_channel_flags',
+                         '_message_flags', '_timestamp'):
+                setattr(self, name, _take(getattr(self, name), live_directions))
+            self._on_change()  # the logged policy indexes are stale
+        # counting sort of the (node, channel) pairs by node
+        num_nodes = len(self._node_ids)
+        counts = [0] * (num_nodes + 1)
+        for c in range(len(self._scids)):
+            n1, n2 = self._node1[c], self._node2[c]
+            counts[n1 + 1] += 1
+            if n2 != n1:
+                counts[n2 + 1] += 1
+        for n in range(num_nodes):
+            counts[n + 1] += counts[n]
+        offsets = array('I', counts)
+        adj_channels = array('I', bytes(4 * counts[-1]))
+        fill = counts[:-1]
+        for c in range(len(self._scids)):
+            n1, n2 = self._node1[c], self._node2[c]
+            adj_channels[fill[n1]] = c
+            fill[n1] += 1
+            if n2 != n1:
+                adj_channels[fill[n2]] = c
+                fill[n2] += 1
+        self._adj_offsets = offsets
+        self._adj_channels = adj_channels
+        self._pending_adjacency.clear()
+        self._num_changes = 0
+
+    # what build_directed_edges needs, besides the node ids and short channel ids
+    _EDGE_COLUMNS = ('_node1', '_node2', '_capacity_sat', '_policy_flags', '_cltv_expiry_delta',
+                     '_htlc_minimum_msat', '_htlc_maximum_msat', '_fee_base_msat',
+                     '_fee_proportional_millionths', '_channel_flags')
+
+    _COLUMNS = ('_node1', '_node2', '_capacity_sat', '_policy_flags', '_cltv_expiry_delta',
+                '_htlc_minimum_msat', '_htlc_maximum_msat', '_fee_base_msat', '_fee_proportional_millionths',
+                '_channel_flags', '_message_flags', '_timestamp', '_adj_offsets', '_adj_channels')
+
+    def get_columns(self) -> Dict[str, 'SnapshotColumn']:
+        """Compacts the graph, and returns copies of the arrays it is made of."""
+        self.compact()
+        columns = {name[1:]: getattr(self, name)[:] for name in self._COLUMNS}
+        columns['node_id_offsets'], columns['node_ids'] = _pack_blobs(self._node_ids)
+        columns['short_channel_ids'] = bytearray(b''.join(self._scids))
+        return columns
+
+    @classmethod
+    def from_columns(cls, columns: Dict[str, 'SnapshotColumn']) -> 'ChannelGraph':
+        graph = cls()
+        for name in cls._COLUMNS:
+            column, empty = columns[name[1:]], getattr(graph, name)
+            if type(column) is not type(empty) or getattr(column, 'typecode', '') != getattr(empty, 'typecode', ''):
+                raise ValueError(f'unexpected type for column {name}')
+            setattr(graph, name, column)
+        graph._node_ids = _unpack_blobs(columns['node_id_offsets'], columns['node_ids'])
+        graph._node_index = {node_id: n for n, node_id in enumerate(graph._node_ids)}
+        scids = columns['short_channel_ids']
+        graph._scids = [ShortChannelID(scids[i:i + 8]) for i in range(0, len(scids), 8)]
+        graph._channel_index = {scid: c for c, scid in enumerate(graph._scids)}
+        num_channels = len(graph._scids)
+        if not (len(graph._node1) == len(graph._node2) == len(graph._capacity_sat) == num_channels
+                and all(len(getattr(graph, name)) == 2 * num_channels for name in cls._COLUMNS[3:12])
+                and len(graph._adj_offsets) == len(graph._node_ids) + 1
+                and len(graph._adj_channels) == graph._adj_offsets[-1]):
+            raise ValueError('inconsistent column lengths')
+        graph.num_policies = len(graph._policy_flags) - graph._policy_flags.count(0)
+        return graph
+
+
+def build_directed_edges(columns: Dict[str, Any]) -> DirectedEdges:
+    """Builds the DirectedEdges of a graph from ChannelGraph.get_edge_columns.
+    Does not need the lock of the graph."""
+    node_ids, scids = columns['node_ids'], columns['short_channel_ids']
+    node1, node2, flags = columns['node1'], columns['node2'], columns['policy_flags']
+    live = [c for c, scid in enumerate(scids) if scid is not None and node1[c] != node2[c]]
+    # counting sort of the directions by end node, in channel order.
+    # direction 0 starts at node1, so it ends at node2
+    counts = [0] * (len(node_ids) + 1)
+    for c in live:
+        counts[node1[c] + 1] += 1
+        counts[node2[c] + 1] += 1
+    for n in range(len(node_ids)):
+        counts[n + 1] += counts[n]
+    offsets = array('I', counts)
+    directions = [0] * counts[-1]  # type: List[int]  # policy index of each edge
+    fill = counts[:-1]
+    for c in live:
+        n1, n2 = node1[c], node2[c]
+        directions[fill[n2]] = 2 * c
+        fill[n2] += 1
+        directions[fill[n1]] = 2 * c + 1
+        fill[n1] += 1
+    edge_index = array('i', [-1]) * len(flags)
+    for e, i in enumerate(directions):
+        edge_index[i] = e
+    htlc_maximum_msat = columns['htlc_maximum_msat']
+    present, has_htlc_maximum = ChannelGraph.POLICY_PRESENT, ChannelGraph.POLICY_HAS_HTLC_MAXIMUM
+    return DirectedEdges(
+        version=columns['version'],
+        topology_version=columns['topology_version'],
+        node_ids=node_ids,
+        node_index={node_id: n for n, node_id in enumerate(node_ids)},
+        offsets=offsets,
+        added_edges={},
+        edge_index=edge_index,
+        short_channel_ids=[ShortChannelID.normalize(scids[i >> 1]) for i in directions],
+        start_node=array('I', [node2[i >> 1] if i & 1 else node1[i >> 1] for i in directions]),
+        reverse_edge=array('I', [edge_index[i ^ 1] for i in directions]),
+        capacity_sat=_take(columns['capacity_sat'], [i >> 1 for i in directions]),
+        has_policy=bytearray(flags[i] & present for i in directions),
+        has_reverse_policy=bytearray(flags[i ^ 1] & present for i in directions),
+        cltv_expiry_delta=_take(columns['cltv_expiry_delta'], directions),
+        htlc_minimum_msat=_take(columns['htlc_minimum_msat'], directions),
+        htlc_maximum_msat=array('Q', [htlc_maximum_msat[i] if flags[i] & has_htlc_maximum
+                                      else NO_HTLC_MAXIMUM_MSAT for i in directions]),
+        fee_base_msat=_take(columns['fee_base_msat'], directions),
+        fee_proportional_millionths=_take(columns['fee_proportional_millionths'], directions),
+        channel_flags=_take(columns['channel_flags'], directions))
+
+
+SnapshotColumn = Union[array, bytearray]
+
+SNAPSHOT_VERSION = 1
+SNAPSHOT_MAGIC = b'ELGRAPH\x00'
+
+
+def _pack_blobs(blobs: Sequence[bytes]) -> Tuple[array, bytearray]:
+    offsets = array('I', [0])
+    for blob in blobs:
+        offsets.append(offsets[-1] + len(blob))
+    return offsets, bytearray(b''.join(blobs))
+
+
+def _unpack_blobs(offsets: array, data: bytearray) -> List[bytes]:
+    if len(offsets) == 0 or offsets[-1] != len(data):
+        raise ValueError('inconsistent blob offsets')
+    return [bytes(data[offsets[i]:offsets[i + 1]]) for i in range(len(offsets) - 1)]
+
+
+def _pad8(n: int) -> int:
+    return -n % 8
+
+
+def write_snapshot(path: str, token: bytes, columns: Dict[str, SnapshotColumn]) -> None:
+    """Writes the columns (typed arrays or bytearrays) to path, atomically.
+
+    The file starts with SNAPSHOT_MAGIC, and the length and content of a
+    json header that describes the columns. The content of the columns
+    follows, in native byte order, each one aligned to 8 bytes.
+    """
+    layout = []
+    offset = 0
+    for name, column in columns.items():
+        typecode, itemsize = (column.typecode, column.itemsize) if isinstance(column, array) else ('', 1)
+        nbytes = len(column) * itemsize
+        layout.append((name, typecode, itemsize, offset, nbytes))
+        offset += nbytes + _pad8(nbytes)
+    header = json.dumps({
+        'version': SNAPSHOT_VERSION,
+        'token': token.hex(),
+        'byteorder': sys.byteorder,
+        'columns': layout,
+    }).encode('utf8')
+    data_start = len(SNAPSHOT_MAGIC) + 4 + len(header)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(SNAPSHOT_MAGIC)
+        f.write(len(header).to_bytes(4, 'little'))
+        f.write(header)
+        f.write(bytes(_pad8(data_start)))
+        for column in columns.values():
+            nbytes = f.write(column)
+            f.write(bytes(_pad8(nbytes)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_snapshot(path: str, token: bytes) -> Dict[str, SnapshotColumn]:
+    """Reads a file written by write_snapshot, by memory-mapping it.
+    Raises an exception if the file is not a snapshot with this token."""
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        if m[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            raise ValueError('not a snapshot')
+        pos = len(SNAPSHOT_MAGIC)
+        header_len = int.from_bytes(m[pos:pos + 4], 'little')
+        header = json.loads(m[pos + 4:pos + 4 + header_len].decode('utf8'))
+        if header['version'] != SNAPSHOT_VERSION:
+            raise ValueError(f"unsupported snapshot version {header['version']}")
+        if header['token'] != token.hex():
+            raise ValueError('snapshot does not match the database')
+        if header['byteorder'] != sys.byteorder:
+            raise ValueError('snapshot written with a different byte order')
+        data_start = pos + 4 + header_len
+        data_start += _pad8(data_start)
+        columns = {}
+        for name, typecode, itemsize, offset, nbytes in header['columns']:
+            start = data_start + offset
+            if start + nbytes > len(m):
+                raise ValueError('truncated snapshot')
+            if not typecode:
+                columns[name] = bytearray(m[start:start + nbytes])
+                continue
+            column = array(typecode)
+            if column.itemsize != itemsize:
+                raise ValueError(f'snapshot written with a different size for {typecode!r}')
+            column.frombytes(m[start:start + nbytes])
+            columns[name] = column
+    return columns
+
+
 create_channel_info = """
 CREATE TABLE IF NOT EXISTS channel_info (
 short_channel_id BLOB(8),
@@ -276,10 +915,18 @@ msg BLOB,
 PRIMARY KEY(node_id)
 )"""
 
+# token of the snapshot file that matches the other tables, if any
+create_snapshot = """
+CREATE TABLE IF NOT EXISTS snapshot (
+token BLOB(16),
+PRIMARY KEY(token)
+)"""
+
 
 class ChannelDB(SqlDB):
 
     NUM_MAX_RECENT_PEERS = 20
+    SNAPSHOT_INTERVAL = 600  # seconds
 
     def __init__(self, network: 'Network'):
         path = os.path.join(get_headers_dir(network.config), 'gossip_db')
@@ -292,30 +939,34 @@ class ChannelDB(SqlDB):
 
         # initialized in load_data
         # note: modify/iterate needs self.lock
-        self._channels = {}  # type: Dict[ShortChannelID, ChannelInfo]
-        self._policies = {}  # type: Dict[Tuple[bytes, ShortChannelID], Policy]  # (node_id, scid) -> Policy
+        self._graph = ChannelGraph()
         self._nodes = {}  # type: Dict[bytes, NodeInfo]  # node_id -> NodeInfo
         # node_id -> (host, port, ts)
         self._addresses = defaultdict(set)  # type: Dict[bytes, Set[NodeAddress]]
-        self._channels_for_node = defaultdict(set)  # type: Dict[bytes, Set[ShortChannelID]]
         self._recent_peers = []  # type: List[bytes]  # list of node_ids
         self._chans_with_0_policies = set()  # type: Set[ShortChannelID]
         self._chans_with_1_policies = set()  # type: Set[ShortChannelID]
         self._chans_with_2_policies = set()  # type: Set[ShortChannelID]
 
+        self._last_snapshot_time = time.time()
+
         self.data_loaded = asyncio.Event()
         self.network = network # only for callback
 
+    @property
+    def snapshot_path(self) -> str:
+        return self.path + '.snapshot'
+
     def update_counts(self):
         self.num_nodes = len(self._nodes)
-        self.num_channels = len(self._channels)
-        self.num_policies = len(self._policies)
+        self.num_channels = len(self._graph)
+        self.num_policies = self._graph.num_policies
         util.trigger_callback('channel_db', self.num_nodes, self.num_channels, self.num_policies)
         util.trigger_callback('ln_gossip_sync_progress')
 
     def get_channel_ids(self):
         with self.lock:
-            return set(self._channels.keys())
+            return self._graph.get_channel_ids()
 
     def add_recent_peer(self, peer: LNPeerAddr):
         now = int(time.time())
@@ -364,7 +1015,7 @@ class ChannelDB(SqlDB):
         added = 0
         for msg in msg_payloads:
             short_channel_id = ShortChannelID(msg['short_channel_id'])
-            if short_channel_id in self._channels:
+            if short_channel_id in self._graph:
                 continue
             if constants.net.rev_genesis_bytes() != msg['chain_hash']:
                 self.logger.info("ChanAnn has unexpected chain_hash {}".format(bh2u(msg['chain_hash'])))
@@ -390,12 +1041,10 @@ class ChannelDB(SqlDB):
             return
         channel_info = channel_info._replace(capacity_sat=capacity_sat)
         with self.lock:
-            self._channels[channel_info.short_channel_id] = channel_info
-            self._channels_for_node[channel_info.node1_id].add(channel_info.short_channel_id)
-            self._channels_for_node[channel_info.node2_id].add(channel_info.short_channel_id)
+            self._graph.add_channel(channel_info)
+            if 'raw' in msg:
+                self._db_save_channel(channel_info.short_channel_id, msg['raw'])
         self._update_num_policies_for_chan(channel_info.short_channel_id)
-        if 'raw' in msg:
-            self._db_save_channel(channel_info.short_channel_id, msg['raw'])
 
     def policy_changed(self, old_policy: Policy, new_policy: Policy, verbose: bool) -> bool:
         changed = False
@@ -439,7 +1088,7 @@ class ChannelDB(SqlDB):
             return UpdateStatus.EXPIRED
         if timestamp - now > 60:
             return UpdateStatus.DEPRECATED
-        channel_info = self._channels.get(short_channel_id)
+        channel_info = self.get_channel_info(short_channel_id)
         if not channel_info:
             return UpdateStatus.ORPHANED
         flags = int.from_bytes(payload['channel_flags'], 'big')
@@ -450,18 +1099,18 @@ class ChannelDB(SqlDB):
         timestamp = payload['timestamp']
         start_node = payload['start_node']
         short_channel_id = ShortChannelID(payload['short_channel_id'])
-        key = (start_node, short_channel_id)
-        old_policy = self._policies.get(key)
+        with self.lock:
+            old_policy = self._graph.get_policy(short_channel_id, start_node)
         if old_policy and timestamp <= old_policy.timestamp + 60:
             return UpdateStatus.DEPRECATED
         if verify:
             self.verify_channel_update(payload)
         policy = Policy.from_msg(payload)
         with self.lock:
-            self._policies[key] = policy
+            self._graph.set_policy(policy)
+            if 'raw' in payload:
+                self._db_save_policy(policy.key, payload['raw'])
         self._update_num_policies_for_chan(short_channel_id)
-        if 'raw' in payload:
-            self._db_save_policy(policy.key, payload['raw'])
         if old_policy and not self.policy_changed(old_policy, policy, verbose):
             return UpdateStatus.UNCHANGED
         else:
@@ -500,34 +1149,106 @@ class ChannelDB(SqlDB):
         c.execute(create_address)
         c.execute(create_policy)
         c.execute(create_channel_info)
+        c.execute(create_snapshot)
         self.conn.commit()
+        c.execute("SELECT COUNT(*) FROM snapshot")
+        self._snapshot_token_in_db = c.fetchone()[0] > 0
+
+    def _invalidate_snapshot(self):
+        # to be called in the sql thread, before modifying a table the snapshot is made from
+        if self._snapshot_token_in_db:
+            self.conn.execute("DELETE FROM snapshot")
+            self._snapshot_token_in_db = False
+
+    def _write_snapshot(self):
+        # called in the sql thread. Changes to the in-memory graph are queued for writing
+        # while holding the lock, so once the queue is drained the tables match the graph.
+        with self.lock:
+            self.run_queued_requests()
+            if self._snapshot_token_in_db:
+                return  # still valid
+            columns = self._graph.get_columns()
+            node_infos = list(self._nodes.values())
+        columns['node_info_id_offsets'], columns['node_info_ids'] = _pack_blobs(
+            [n.node_id for n in node_infos])
+        columns['node_info_feature_offsets'], columns['node_info_features'] = _pack_blobs(
+            [n.features.to_bytes((n.features.bit_length() + 7) // 8, 'big') for n in node_infos])
+        columns['node_info_timestamps'] = array('I', [n.timestamp for n in node_infos])
+        columns['node_info_alias_offsets'], columns['node_info_aliases'] = _pack_blobs(
+            [n.alias.encode('utf8') for n in node_infos])
+        token = os.urandom(16)
+        try:
+            write_snapshot(self.snapshot_path, token, columns)
+        except OSError as e:
+            self.logger.info(f'could not write gossip snapshot: {e!r}')
+            return
+        self.conn.execute("INSERT INTO snapshot (token) VALUES (?)", (token,))
+        self.conn.commit()
+        self._snapshot_token_in_db = True
+
+    def _read_snapshot(self, token: bytes) -> Tuple[ChannelGraph, Dict[bytes, NodeInfo]]:
+        columns = read_snapshot(self.snapshot_path, token)
+        graph = ChannelGraph.from_columns(columns)
+        node_ids = _unpack_blobs(columns['node_info_id_offsets'], columns['node_info_ids'])
+        features = _unpack_blobs(columns['node_info_feature_offsets'], columns['node_info_features'])
+        aliases = _unpack_blobs(columns['node_info_alias_offsets'], columns['node_info_aliases'])
+        timestamps = columns['node_info_timestamps']
+        if not len(node_ids) == len(features) == len(aliases) == len(timestamps):
+            raise ValueError('inconsistent node info columns')
+        nodes = {}
+        for node_id, f, ts, alias in zip(node_ids, features, timestamps, aliases):
+            nodes[node_id] = NodeInfo(node_id=node_id, features=int.from_bytes(f, 'big'),
+                                      timestamp=ts, alias=alias.decode('utf8'))
+        return graph, nodes
+
+    @sql
+    def _db_write_snapshot(self):
+        self._write_snapshot()
+
+    def maybe_save_snapshot(self):
+        """Writes a snapshot of the graph, if the last one is older than SNAPSHOT_INTERVAL."""
+        now = time.time()
+        if now - self._last_snapshot_time < self.SNAPSHOT_INTERVAL:
+            return
+        self._last_snapshot_time = now
+        self._db_write_snapshot()
+
+    def before_close(self):
+        if not self.data_loaded.is_set():
+            return
+        self._write_snapshot()
 
     @sql
     def _db_save_policy(self, key: bytes, msg: bytes):
         # 'msg' is a 'channel_update' message
+        self._invalidate_snapshot()
         c = self.conn.cursor()
         c.execute("""REPLACE INTO policy (key, msg) VALUES (?,?)""", [key, msg])
 
     @sql
     def _db_delete_policy(self, node_id: bytes, short_channel_id: ShortChannelID):
         key = short_channel_id + node_id
+        self._invalidate_snapshot()
         c = self.conn.cursor()
         c.execute("""DELETE FROM policy WHERE key=?""", (key,))
 
     @sql
     def _db_save_channel(self, short_channel_id: ShortChannelID, msg: bytes):
         # 'msg' is a 'channel_announcement' message
+        self._invalidate_snapshot()
         c = self.conn.cursor()
         c.execute("REPLACE INTO channel_info (short_channel_id, msg) VALUES (?,?)", [short_channel_id, msg])
 
     @sql
     def _db_delete_channel(self, short_channel_id: ShortChannelID):
+        self._invalidate_snapshot()
         c = self.conn.cursor()
         c.execute("""DELETE FROM channel_info WHERE short_channel_id=?""", (short_channel_id,))
 
     @sql
     def _db_save_node_info(self, node_id: bytes, msg: bytes):
         # 'msg' is a 'node_announcement' message
+        self._invalidate_snapshot()
         c = self.conn.cursor()
         c.execute("REPLACE INTO node_info (node_id, msg) VALUES (?,?)", [node_id, msg])
 
@@ -566,7 +1287,9 @@ class ChannelDB(SqlDB):
                 continue
             node_id = node_info.node_id
             # Ignore node if it has no associated channel (DoS protection)
-            if node_id not in self._channels_for_node:
+            with self.lock:
+                has_channels = self._graph.has_channels(node_id)
+            if not has_channels:
                 #self.logger.info('ignoring orphan node_announcement')
                 continue
             node = self._nodes.get(node_id)
@@ -578,8 +1301,8 @@ class ChannelDB(SqlDB):
             # save
             with self.lock:
                 self._nodes[node_id] = node_info
-            if 'raw' in msg_payload:
-                self._db_save_node_info(node_id, msg_payload['raw'])
+                if 'raw' in msg_payload:
+                    self._db_save_node_info(node_id, msg_payload['raw'])
             with self.lock:
                 for addr in node_addresses:
                     self._addresses[node_id].add(NodeAddress(addr.host, addr.port, 0))
@@ -589,10 +1312,10 @@ class ChannelDB(SqlDB):
         self.update_counts()
 
     def get_old_policies(self, delta) -> Sequence[Tuple[bytes, ShortChannelID]]:
-        with self.lock:
-            _policies = self._policies.copy()
         now = int(time.time())
-        return list(k for k, v in _policies.items() if v.timestamp <= now - delta)
+        with self.lock:
+            return [(p.start_node, p.short_channel_id) for p in self._graph.get_policies()
+                    if p.timestamp <= now - delta]
 
     def prune_old_policies(self, delta):
         old_policies = self.get_old_policies(delta)
@@ -600,8 +1323,8 @@ class ChannelDB(SqlDB):
             for key in old_policies:
                 node_id, scid = key
                 with self.lock:
-                    self._policies.pop(key)
-                self._db_delete_policy(*key)
+                    self._graph.remove_policy(scid, node_id)
+                    self._db_delete_policy(*key)
                 self._update_num_policies_for_chan(scid)
             self.update_counts()
             self.logger.info(f'Deleting {len(old_policies)} old policies')
@@ -623,15 +1346,13 @@ class ChannelDB(SqlDB):
         self._channel_updates_for_private_channels[(start_node_id, short_channel_id)] = msg_payload
 
     def remove_channel(self, short_channel_id: ShortChannelID):
-        # FIXME what about rm-ing policies?
+        # note: this also forgets the policies in memory
+        # FIXME what about rm-ing policies from the database?
         with self.lock:
-            channel_info = self._channels.pop(short_channel_id, None)
-            if channel_info:
-                self._channels_for_node[channel_info.node1_id].remove(channel_info.short_channel_id)
-                self._channels_for_node[channel_info.node2_id].remove(channel_info.short_channel_id)
+            self._graph.remove_channel(short_channel_id)
+            # delete from database
+            self._db_delete_channel(short_channel_id)
         self._update_num_policies_for_chan(short_channel_id)
-        # delete from database
-        self._db_delete_channel(short_channel_id)
 
     def get_node_addresses(self, node_id):
         return self._addresses.get(node_id)
@@ -641,9 +1362,6 @@ class ChannelDB(SqlDB):
     def load_data(self):
         if self.data_loaded.is_set():
             return
-        # Note: this method takes several seconds... mostly due to lnmsg.decode_msg being slow.
-        #       I believe lnmsg (and lightning.json) will need a rewrite anyway, so instead of tweaking
-        #       load_data() here, that should be done. see #6006
         c = self.conn.cursor()
         c.execute("""SELECT * FROM address""")
         for x in c:
@@ -656,13 +1374,45 @@ class ChannelDB(SqlDB):
             return newest_ts
         sorted_node_ids = sorted(self._addresses.keys(), key=newest_ts_for_node_id, reverse=True)
         self._recent_peers = sorted_node_ids[:self.NUM_MAX_RECENT_PEERS]
+        c.execute("""SELECT token FROM snapshot""")
+        row = c.fetchone()
+        snapshot = None
+        if row is not None:
+            try:
+                snapshot = self._read_snapshot(row[0])
+            except Exception as e:
+                self.logger.info(f'not using gossip snapshot: {e!r}')
+        if snapshot is not None:
+            with self.lock:
+                self._graph, self._nodes = snapshot
+        else:
+            self._invalidate_snapshot()
+            self._load_graph_from_tables(c)
+            self._write_snapshot()
+        with self.lock:
+            (self._chans_with_0_policies,
+             self._chans_with_1_policies,
+             self._chans_with_2_policies) = self._graph.get_channel_ids_by_policy_count()
+        source = 'snapshot' if snapshot is not None else 'tables'
+        self.logger.info(f'load data from {source}: {len(self._graph)} {self._graph.num_policies} {len(self._nodes)}')
+        self.update_counts()
+        (nchans_with_0p, nchans_with_1p, nchans_with_2p) = self.get_num_channels_partitioned_by_policy_count()
+        self.logger.info(f'num_channels_partitioned_by_policy_count. '
+                         f'0p: {nchans_with_0p}, 1p: {nchans_with_1p}, 2p: {nchans_with_2p}')
+        self.data_loaded.set()
+        util.trigger_callback('gossip_db_loaded')
+
+    def _load_graph_from_tables(self, c):
+        # Note: this method takes several seconds... mostly due to lnmsg.decode_msg being slow.
+        #       I believe lnmsg (and lightning.json) will need a rewrite anyway, so instead of tweaking
+        #       load_data() here, that should be done. see #6006
         c.execute("""SELECT * FROM channel_info""")
         for short_channel_id, msg in c:
             try:
                 ci = ChannelInfo.from_raw_msg(msg)
             except IncompatibleOrInsaneFeatures:
                 continue
-            self._channels[ShortChannelID.normalize(short_channel_id)] = ci
+            self._graph.add_channel(ci)
         c.execute("""SELECT * FROM node_info""")
         for node_id, msg in c:
             try:
@@ -674,18 +1424,8 @@ class ChannelDB(SqlDB):
         c.execute("""SELECT * FROM policy""")
         for key, msg in c:
             p = Policy.from_raw_msg(key, msg)
-            self._policies[(p.start_node, p.short_channel_id)] = p
-        for channel_info in self._channels.values():
-            self._channels_for_node[channel_info.node1_id].add(channel_info.short_channel_id)
-            self._channels_for_node[channel_info.node2_id].add(channel_info.short_channel_id)
-            self._update_num_policies_for_chan(channel_info.short_channel_id)
-        self.logger.info(f'load data {len(self._channels)} {len(self._policies)} {len(self._channels_for_node)}')
-        self.update_counts()
-        (nchans_with_0p, nchans_with_1p, nchans_with_2p) = self.get_num_channels_partitioned_by_policy_count()
-        self.logger.info(f'num_channels_partitioned_by_policy_count. '
-                         f'0p: {nchans_with_0p}, 1p: {nchans_with_1p}, 2p: {nchans_with_2p}')
-        self.data_loaded.set()
-        util.trigger_callback('gossip_db_loaded')
+            self._graph.set_policy(p)  # policies of unknown channels are ignored
+        self._graph.compact()
 
     def _update_num_policies_for_chan(self, short_channel_id: ShortChannelID) -> None:
         channel_info = self.get_channel_info(short_channel_id)
@@ -716,9 +1456,9 @@ class ChannelDB(SqlDB):
 
     def get_policy_for_node(self, short_channel_id: bytes, node_id: bytes, *,
                             my_channels: Dict[ShortChannelID, 'Channel'] = None) -> Optional['Policy']:
-        channel_info = self.get_channel_info(short_channel_id)
-        if channel_info is not None:  # publicly announced channel
-            policy = self._policies.get((node_id, short_channel_id))
+        if short_channel_id in self._graph:  # publicly announced channel
+            with self.lock:
+                policy = self._graph.get_policy(short_channel_id, node_id)
             if policy:
                 return policy
         else:  # private channel
@@ -731,7 +1471,8 @@ class ChannelDB(SqlDB):
 
     def get_channel_info(self, short_channel_id: ShortChannelID, *,
                          my_channels: Dict[ShortChannelID, 'Channel'] = None) -> Optional[ChannelInfo]:
-        ret = self._channels.get(short_channel_id)
+        with self.lock:
+            ret = self._graph.get_channel_info(short_channel_id)
         if ret:
             return ret
         # check if it's one of our own channels
@@ -743,8 +1484,8 @@ class ChannelDB(SqlDB):
         """Returns the set of short channel IDs where node_id is one of the channel participants."""
         if not self.data_loaded.is_set():
             raise Exception("channelDB data not loaded yet!")
-        relevant_channels = self._channels_for_node.get(node_id) or set()
-        relevant_channels = set(relevant_channels)  # copy
+        with self.lock:
+            relevant_channels = self._graph.get_channels_for_node(node_id)
         # add our own channels  # TODO maybe slow?
         for chan in (my_channels.values() or []):
             if node_id in (chan.node_id, chan.get_local_pubkey()):
@@ -764,6 +1505,18 @@ class ChannelDB(SqlDB):
             return
         return chan.get_local_pubkey(), chan.node_id
 
+    def get_graph_version(self) -> int:
+        return self._graph.version
+
+    def get_directed_edges(self, previous: DirectedEdges = None) -> Tuple[DirectedEdges, Optional[List[int]]]:
+        # building the edges from scratch takes a while; only the copies
+        # of the columns are made while holding the lock
+        with self.lock:
+            if self._graph.can_update_directed_edges(previous):
+                return self._graph.update_directed_edges(previous)
+            columns = self._graph.get_edge_columns()
+        return build_directed_edges(columns), None
+
     def get_node_info_for_node_id(self, node_id: bytes) -> Optional['NodeInfo']:
         return self._nodes.get(node_id)
 
@@ -773,7 +1526,7 @@ class ChannelDB(SqlDB):
 
     def get_node_policies(self) -> Dict[Tuple[bytes, ShortChannelID], Policy]:
         with self.lock:
-            return self._policies.copy()
+            return {(p.start_node, p.short_channel_id): p for p in self._graph.get_policies()}
 
     def to_dict(self) -> dict:
         """ Generates a graph representation in terms of a dictionary.
@@ -793,14 +1546,12 @@ class ChannelDB(SqlDB):
                 graph['nodes'][-1]['addresses'] = [addr._asdict() for addr in self._addresses[pk]]
 
             # gather channels
-            for cid, channelinfo in self._channels.items():
+            for channelinfo in self._graph.get_channel_infos():
                 graph['channels'].append(
                     channelinfo._asdict(),
                 )
-                policy1 = self._policies.get(
-                    (channelinfo.node1_id, channelinfo.short_channel_id))
-                policy2 = self._policies.get(
-                    (channelinfo.node2_id, channelinfo.short_channel_id))
+                policy1 = self._graph.get_policy(channelinfo.short_channel_id, channelinfo.node1_id)
+                policy2 = self._graph.get_policy(channelinfo.short_channel_id, channelinfo.node2_id)
                 graph['channels'][-1]['policy1'] = policy1._asdict() if policy1 else None
                 graph['channels'][-1]['policy2'] = policy2._asdict() if policy2 else None
 
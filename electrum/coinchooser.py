@@ -22,9 +22,10 @@
 # ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
+import bisect
 from collections import defaultdict
 from math import floor, log10
-from typing import NamedTuple, List, Callable, Sequence, Union, Dict, Tuple
+from typing import NamedTuple, List, Callable, Sequence, Union, Dict, Tuple, Optional
 from decimal import Decimal
 
 from .bitcoin import sha256, COIN, is_address
@@ -83,8 +84,76 @@ class Bucket(NamedTuple):
 
 class ScoredCandidate(NamedTuple):
     penalty: float
-    tx: PartialTransaction
     buckets: List[Bucket]
+    change_value: int             # total value of the change outputs the tx would get
+
+
+class ChangelessTarget(NamedTuple):
+    target: int           # effective value the selected buckets need to add up to
+    cost_of_change: int   # excess over target that is still left to fees instead of creating change
+
+
+# Iteration budget of branch_and_bound, as in Bitcoin Core.
+BNB_MAX_TRIES = 100_000
+
+
+def branch_and_bound(values: Sequence[int], *, target: int, cost_of_change: int,
+                     max_tries: int = BNB_MAX_TRIES) -> Optional[List[int]]:
+    """Depth-first search for a subset of values whose sum is within
+    [target, target + cost_of_change], i.e. for which no change output is
+    needed. Explores at most max_tries nodes of the search tree, and of the
+    subsets found, returns (the indices of) the one with the least excess
+    over target; or None if none was found.
+    The values need to be positive.
+    """
+    upper_bound = target + cost_of_change
+    # values above upper_bound cannot be part of any solution
+    order = sorted((i for i in range(len(values)) if values[i] <= upper_bound),
+                   key=lambda i: values[i], reverse=True)
+    vals = [values[i] for i in order]
+    neg_vals = [-val for val in vals]  # ascending, for bisect
+    n = len(vals)
+    remaining = [0] * (n + 1)  # remaining[k] == sum(vals[k:])
+    for k in reversed(range(n)):
+        remaining[k] = remaining[k + 1] + vals[k]
+    included = []  # type: List[int]  # indices into vals, in the current branch
+    depth = 0  # whether to include vals[:depth] has been decided
+    value = 0
+    best_included = None
+    best_excess = None
+    for _ in range(max_tries):
+        if value + remaining[depth] < target or value > upper_bound:
+            backtrack = True
+        elif value >= target:
+            excess = value - target
+            if best_excess is None or excess < best_excess:
+                best_included, best_excess = included[:], excess
+                if excess == 0:
+                    break
+            backtrack = True
+        else:
+            backtrack = False
+        if backtrack:
+            # explore the branch that omits the last included value
+            if not included:
+                break  # explored the whole tree
+            k = included.pop()
+            value -= vals[k]
+            depth = k + 1
+        elif value + vals[depth] > upper_bound:
+            # omit all the values that would overshoot
+            depth = bisect.bisect_left(neg_vals, value - upper_bound, lo=depth)
+        elif depth > 0 and vals[depth] == vals[depth - 1] and (not included or included[-1] != depth - 1):
+            # including this value after omitting an equal one would
+            # only lead to subsets that were already explored
+            depth += 1
+        else:
+            included.append(depth)
+            value += vals[depth]
+            depth += 1
+    if best_included is None:
+        return None
+    return sorted(order[k] for k in best_included)
 
 
 def strip_unneeded(bkts: List[Bucket], sufficient_funds) -> List[Bucket]:
@@ -106,6 +175,7 @@ class CoinChooserBase(Logger):
     def __init__(self, *, enable_output_value_rounding: bool):
         Logger.__init__(self)
         self.enable_output_value_rounding = enable_output_value_rounding
+        self.changeless_target = None  # type: Optional[ChangelessTarget]
 
     def keys(self, coins: Sequence[PartialTxInput]) -> Sequence[str]:
         raise NotImplementedError
@@ -149,30 +219,59 @@ class CoinChooserBase(Logger):
         return list(map(make_Bucket, buckets.keys(), buckets.values()))
 
     def penalty_func(self, base_tx, *,
-                     tx_from_buckets: Callable[[List[Bucket]], Tuple[PartialTransaction, List[PartialTxOutput]]]) \
+                     change_value_of_buckets: Callable[[List[Bucket]], int]) \
             -> Callable[[List[Bucket]], ScoredCandidate]:
         raise NotImplementedError
 
-    def _change_amounts(self, tx: PartialTransaction, count: int, fee_estimator_numchange) -> List[int]:
+    @classmethod
+    def _num_change_and_change_amount(cls, *, output_amounts: Sequence[int], fee: int, count: int,
+                                      fee_estimator_numchange) -> Tuple[int, int]:
         # Break change up if bigger than max_change
-        output_amounts = [o.value for o in tx.outputs()]
         # Don't split change of less than 0.02 BTC
         max_change = max(max(output_amounts) * 1.25, 0.02 * COIN)
 
         # Use N change outputs
         for n in range(1, count + 1):
             # How much is left if we add this many change outputs?
-            change_amount = max(0, tx.get_fee() - fee_estimator_numchange(n))
+            change_amount = max(0, fee - fee_estimator_numchange(n))
             if change_amount // n <= max_change:
                 break
+        return n, change_amount
 
+    @classmethod
+    def _trailing_zeroes(cls, output_amounts: Sequence[int]) -> List[int]:
         # Get a handle on the precision of the output amounts; round our
         # change to look similar
         def trailing_zeroes(val):
             s = str(val)
             return len(s) - len(s.rstrip('0'))
 
-        zeroes = [trailing_zeroes(i) for i in output_amounts]
+        return [trailing_zeroes(i) for i in output_amounts]
+
+    def _change_value(self, *, output_amounts: Sequence[int], fee: int, count: int,
+                      fee_estimator_numchange, dust_threshold: int) -> int:
+        """Returns the total value of the change outputs _change_outputs
+        would create, without consuming randomness.
+        """
+        n, change_amount = self._num_change_and_change_amount(
+            output_amounts=output_amounts, fee=fee, count=count,
+            fee_estimator_numchange=fee_estimator_numchange)
+        if n > 1:
+            # ignores the rounding of the randomized amounts, and that
+            # some of them might end up below dust_threshold
+            return change_amount
+        max_dp_to_round_for_privacy = 2 if self.enable_output_value_rounding else 0
+        N = int(pow(10, min(max_dp_to_round_for_privacy, min(self._trailing_zeroes(output_amounts)))))
+        amount = (change_amount // N) * N
+        return amount if amount >= dust_threshold else 0
+
+    def _change_amounts(self, tx: PartialTransaction, count: int, fee_estimator_numchange) -> List[int]:
+        output_amounts = [o.value for o in tx.outputs()]
+        n, change_amount = self._num_change_and_change_amount(
+            output_amounts=output_amounts, fee=tx.get_fee(), count=count,
+            fee_estimator_numchange=fee_estimator_numchange)
+
+        zeroes = self._trailing_zeroes(output_amounts)
         min_zeroes = min(zeroes)
         max_zeroes = max(zeroes)
 
@@ -320,6 +419,29 @@ class CoinChooserBase(Logger):
                                                             dust_threshold=dust_threshold,
                                                             base_weight=base_weight)
 
+        output_amounts = [o.value for o in base_tx.outputs()]
+        output_weights = {}  # type: Dict[str, int]  # change address -> weight
+
+        def change_value_of_buckets(buckets):
+            """Total value of the change outputs of tx_from_buckets(buckets).
+            Computed from the bucket values and weights only, so that
+            candidates can be scored without constructing their tx.
+            """
+            if change_addrs:
+                change_addr = change_addrs[0]
+            else:
+                # same as in _construct_tx_from_selected_buckets
+                change_addr = (base_tx.inputs() or buckets[0].coins)[0].address
+            if change_addr not in output_weights:
+                output_weights[change_addr] = 4 * Transaction.estimated_output_size(change_addr)
+            output_weight = output_weights[change_addr]
+            tx_weight = self._get_tx_weight(buckets, base_weight=base_weight)
+            fee = input_value + sum(bucket.value for bucket in buckets) - spent_amount
+            return self._change_value(
+                output_amounts=output_amounts, fee=fee, count=max(1, len(change_addrs)),
+                fee_estimator_numchange=lambda count: fee_estimator_w(tx_weight + count * output_weight),
+                dust_threshold=dust_threshold)
+
         # Collect the coins into buckets
         all_buckets = self.bucketize_coins(coins, fee_estimator_vb=fee_estimator_vb)
         # Filter some buckets out. Only keep those that have positive effective value.
@@ -327,16 +449,40 @@ class CoinChooserBase(Logger):
         # instead of per-coin, as each bucket should be either fully spent or not at all.
         # (e.g. CoinChooserPrivacy ensures that same-address coins go into one bucket)
         all_buckets = list(filter(lambda b: b.effective_value > 0, all_buckets))
+        self.changeless_target = self._get_changeless_target(
+            coins=coins, change_addrs=change_addrs, base_tx=base_tx, base_weight=base_weight,
+            fee_estimator_w=fee_estimator_w, dust_threshold=dust_threshold)
         # Choose a subset of the buckets
         scored_candidate = self.choose_buckets(all_buckets, sufficient_funds,
-                                               self.penalty_func(base_tx, tx_from_buckets=tx_from_buckets))
-        tx = scored_candidate.tx
+                                               self.penalty_func(base_tx, change_value_of_buckets=change_value_of_buckets))
+        # only the tx of the winning candidate gets constructed
+        tx, _ = tx_from_buckets(scored_candidate.buckets)
 
         self.logger.info(f"using {len(tx.inputs())} inputs")
         self.logger.info(f"using buckets: {[bucket.desc for bucket in scored_candidate.buckets]}")
 
         return tx
 
+    def _get_changeless_target(self, *, coins: Sequence[PartialTxInput], change_addrs: Sequence[str],
+                               base_tx: PartialTransaction, base_weight: int,
+                               fee_estimator_w: Callable, dust_threshold: int) -> Optional[ChangelessTarget]:
+        """Returns what the effective value of the selected buckets needs to
+        add up to for the tx not to have change, or None if unknown.
+        Approximate: the effective values of buckets are estimates.
+        """
+        change_addr = change_addrs[0] if change_addrs else (coins[0].address if coins else None)
+        if not change_addr:
+            return None
+        output_weight = 4 * Transaction.estimated_output_size(change_addr)
+        # err on the side of a higher fee: add the segwit marker and flag,
+        # and the rounding up of the weight to vbytes
+        fee = fee_estimator_w(base_weight + 2 + 3)
+        # change below dust_threshold, after paying for its own output, goes to fees
+        cost_of_change = fee_estimator_w(base_weight + output_weight) - fee + dust_threshold
+        target = base_tx.output_value() - base_tx.input_value() + fee
+        return ChangelessTarget(target=target,
+                                cost_of_change=cost_of_change)
+
     def choose_buckets(self, buckets: List[Bucket],
                        sufficient_funds: Callable,
                        penalty_func: Callable[[List[Bucket]], ScoredCandidate]) -> ScoredCandidate:
@@ -364,13 +510,15 @@ class CoinChooserRandom(CoinChooserBase):
         attempts = min(100, (len(buckets) - 1) * 10 + 1)
         permutation = list(range(len(buckets)))
         for i in range(attempts):
-            # Get a random permutation of the buckets, and
-            # incrementally combine buckets until sufficient
-            self.p.shuffle(permutation)
+            # Incrementally combine buckets in a random order until sufficient.
+            # Only the prefix of the permutation that gets used is shuffled
+            # (Fisher-Yates, front to back), which matters for large wallets.
             bkts = []
             bucket_value_sum = 0
-            for count, index in enumerate(permutation):
-                bucket = buckets[index]
+            for count in range(len(permutation)):
+                j = self.p.randint(count, len(permutation))
+                permutation[count], permutation[j] = permutation[j], permutation[count]
+                bucket = buckets[permutation[count]]
                 bkts.append(bucket)
                 bucket_value_sum += bucket.value
                 if sufficient_funds(bkts, bucket_value_sum=bucket_value_sum):
@@ -446,15 +594,14 @@ class CoinChooserPrivacy(CoinChooserRandom):
     def keys(self, coins):
         return [coin.scriptpubkey.hex() for coin in coins]
 
-    def penalty_func(self, base_tx, *, tx_from_buckets):
+    def penalty_func(self, base_tx, *, change_value_of_buckets):
         min_change = min(o.value for o in base_tx.outputs()) * 0.75
         max_change = max(o.value for o in base_tx.outputs()) * 1.33
 
         def penalty(buckets: List[Bucket]) -> ScoredCandidate:
             # Penalize using many buckets (~inputs)
             badness = len(buckets) - 1
-            tx, change_outputs = tx_from_buckets(buckets)
-            change = sum(o.value for o in change_outputs)
+            change = change_value_of_buckets(buckets)
             # Penalize change not roughly in output range
             if change == 0:
                 pass  # no change is great!
@@ -467,13 +614,61 @@ class CoinChooserPrivacy(CoinChooserRandom):
                 badness += (change - max_change) / (max_change + 10000)
                 # Penalize large change; 5 BTC excess ~= using 1 more input
                 badness += change / (COIN * 5)
-            return ScoredCandidate(badness, tx, buckets)
+            return ScoredCandidate(badness, buckets, change)
 
         return penalty
 
 
+class CoinChooserBranchAndBound(CoinChooserPrivacy):
+    """Looks for coins that add up to exactly the amount being sent
+    plus the fee, so that no change output is needed.
+    This saves the fee of the change output, and of spending it later,
+    and does not add to the UTXO set.
+    The search is bounded, and if no such coins are found, coins are
+    chosen as with the Privacy method.  Like with that method, coins
+    received on the same address are always spent together.
+    """
+
+    max_tries = BNB_MAX_TRIES
+
+    def choose_buckets(self, buckets, sufficient_funds, penalty_func):
+        if self.changeless_target is not None:
+            # like bucket_candidates_prefer_confirmed, prefer confirmed coins,
+            # then allow unconfirmed ones, but never those with unconfirmed parents
+            conf_buckets = [bkt for bkt in buckets if bkt.min_height > 0]
+            nonlocal_buckets = [bkt for bkt in buckets if bkt.min_height >= 0]
+            for bkts in (conf_buckets, nonlocal_buckets):
+                candidate = self._changeless_candidate(bkts, sufficient_funds, penalty_func)
+                if candidate is not None:
+                    return candidate
+                if len(bkts) == len(nonlocal_buckets):
+                    break
+        self.logger.info("no changeless selection found")
+        return super().choose_buckets(buckets, sufficient_funds, penalty_func)
+
+    def _changeless_candidate(self, buckets: List[Bucket], sufficient_funds,
+                              penalty_func) -> Optional[ScoredCandidate]:
+        ct = self.changeless_target
+        indices = branch_and_bound([bkt.effective_value for bkt in buckets],
+                                   target=ct.target,
+                                   cost_of_change=ct.cost_of_change,
+                                   max_tries=self.max_tries)
+        if indices is None:
+            return None
+        selected = [buckets[i] for i in indices]
+        if not sufficient_funds(selected, bucket_value_sum=sum(bkt.value for bkt in selected)):
+            return None
+        candidate = penalty_func(selected)
+        if candidate.change_value != 0:
+            # the effective values were a bit off, and there is change after all
+            return None
+        self.logger.info(f"found changeless selection of {len(selected)} out of {len(buckets)} buckets")
+        return candidate
+
+
 COIN_CHOOSERS = {
     'Privacy': CoinChooserPrivacy,
+    'BranchAndBound': CoinChooserBranchAndBound,
 }
 
 def get_name(config):
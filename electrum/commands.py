@@ -33,38 +33,28 @@ import base64
 import operator
 import asyncio
 import inspect
+import threading
+import weakref
+from collections import deque
+from concurrent.futures import Executor, Future
 from functools import wraps, partial
 from itertools import repeat
 from decimal import Decimal
-from typing import Optional, TYPE_CHECKING, Dict, List
+from typing import Optional, TYPE_CHECKING, Dict, List, Set
 
-from .import util, ecc
+from . import util
 from .util import (bfh, bh2u, format_satoshis, json_decode, json_normalize,
                    is_hash256_str, is_hex_str, to_bytes)
-from . import bitcoin
-from .bitcoin import is_address,  hash_160, COIN
-from .bip32 import BIP32Node
 from .i18n import _
-from .transaction import (Transaction, multisig_script, TxOutput, PartialTransaction, PartialTxOutput,
-                          tx_from_any, PartialTxInput, TxOutpoint)
-from .invoices import PR_PAID, PR_UNPAID, PR_UNKNOWN, PR_EXPIRED
-from .synchronizer import Notifier
-from .wallet import Abstract_Wallet, create_new_wallet, restore_wallet_from_text, Deterministic_Wallet
-from .address_synchronizer import TX_HEIGHT_LOCAL
-from .mnemonic import Mnemonic
-from .lnutil import SENT, RECEIVED
-from .lnutil import LnFeatures
-from .lnutil import ln_dummy_address
-from .lnpeer import channel_id_from_funding_tx
-from .plugin import run_hook
 from .version import ELECTRUM_VERSION
 from .simple_config import SimpleConfig
-from .invoices import LNInvoice
-from . import submarine_swaps
 
 
+# The modules needed to execute the commands are imported when they run:
+# the command line client only needs the command metadata defined here.
 if TYPE_CHECKING:
     from .network import Network
+    from .wallet import Abstract_Wallet
     from .daemon import Daemon
 
 
@@ -77,9 +67,11 @@ class NotSynchronizedException(Exception):
 
 def satoshis(amount):
     # satoshi conversion must not be performed by the parser
+    from .bitcoin import COIN
     return int(COIN*Decimal(amount)) if amount not in ['!', None] else amount
 
 def format_satoshis(x):
+    from .bitcoin import COIN
     return str(Decimal(x)/COIN) if x is not None else None
 
 
@@ -89,6 +81,7 @@ class Command:
         self.requires_network = 'n' in s
         self.requires_wallet = 'w' in s
         self.requires_password = 'p' in s
+        self.cpu_intensive = 'c' in s  # run in the executor of Commands, if any
         self.description = func.__doc__
         self.help = self.description.split('.')[0] if self.description else None
         varnames = func.__code__.co_varnames[1:func.__code__.co_argcount]
@@ -113,6 +106,79 @@ class Command:
             assert 'wallet' in varnames
 
 
+class CommandExecutor(Executor):
+    """Runs calls in at most max_workers threads, which exit when there is
+    nothing left to do. Unlike the workers of ThreadPoolExecutor before
+    Python 3.9, the threads are not daemon threads, so commands can write
+    the wallet file, see WalletDB._write. As idle threads exit, they do not
+    keep the process alive either.
+    """
+
+    def __init__(self, max_workers: int, *, thread_name_prefix: str = 'CommandExecutor'):
+        self._max_workers = max_workers
+        self._thread_name_prefix = thread_name_prefix
+        self._queue = deque()
+        self._threads = set()  # type: Set[threading.Thread]
+        self._num_threads_started = 0
+        self._lock = threading.Lock()
+        self._shutdown = False
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        future = Future()
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError('cannot schedule new futures after shutdown')
+            self._queue.append((future, fn, args, kwargs))
+            if len(self._threads) < self._max_workers:
+                self._num_threads_started += 1
+                t = threading.Thread(target=self._worker, daemon=False,
+                                     name=f'{self._thread_name_prefix}_{self._num_threads_started}')
+                self._threads.add(t)
+                t.start()
+        return future
+
+    def _worker(self):
+        while True:
+            with self._lock:
+                if not self._queue:
+                    self._threads.discard(threading.current_thread())
+                    return
+                future, fn, args, kwargs = self._queue.popleft()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            self._shutdown = True
+            threads = list(self._threads)
+        if wait:
+            for t in threads:
+                t.join()
+
+
+_in_command_thread = threading.local()
+
+
+def _run_command_in_thread(coro, lock: threading.Lock):
+    # asyncio.run needs Python 3.7
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    with lock:
+        _in_command_thread.value = True
+        try:
+            return loop.run_until_complete(coro)
+        finally:
+            _in_command_thread.value = False
+            asyncio.set_event_loop(None)
+            loop.close()
+
+
 def command(s):
     def decorator(func):
         global known_commands
@@ -141,7 +207,10 @@ def command(s):
                 raise Exception('wallet not loaded')
             if cmd.requires_password and password is None and wallet.has_password():
                 raise Exception('Password required')
-            return await func(*args, **kwargs)
+            if daemon and wallet:
+                with daemon.wallet_in_use(wallet):
+                    return await cmd_runner._run_command(cmd, func, args, kwargs)
+            return await cmd_runner._run_command(cmd, func, args, kwargs)
         return func_wrapper
     return decorator
 
@@ -150,11 +219,33 @@ class Commands:
 
     def __init__(self, *, config: 'SimpleConfig',
                  network: 'Network' = None,
-                 daemon: 'Daemon' = None, callback=None):
+                 daemon: 'Daemon' = None, callback=None,
+                 executor: Executor = None):
         self.config = config
         self.daemon = daemon
         self.network = network
         self._callback = callback
+        self.executor = executor
+        self._wallet_locks = weakref.WeakKeyDictionary()  # type: weakref.WeakKeyDictionary[Abstract_Wallet, threading.Lock]
+
+    def _get_wallet_lock(self, wallet: 'Abstract_Wallet') -> threading.Lock:
+        # only called from the event loop thread
+        lock = self._wallet_locks.get(wallet)
+        if lock is None:
+            lock = self._wallet_locks[wallet] = threading.Lock()
+        return lock
+
+    async def _run_command(self, cmd: Command, func, args, kwargs):
+        if (cmd.cpu_intensive and self.executor is not None
+                and not getattr(_in_command_thread, 'value', False)):
+            # The command does synchronous wallet work, which would block the event loop.
+            # Commands on the same wallet are serialized, so that e.g. two concurrent
+            # 'payto' calls do not pick the same coins.
+            lock = self._get_wallet_lock(kwargs.get('wallet'))
+            loop = asyncio.get_event_loop()
+            coro = func(*args, **kwargs)
+            return await loop.run_in_executor(self.executor, _run_command_in_thread, coro, lock)
+        return await func(*args, **kwargs)
 
     def _run(self, method, args, password_getter=None, **kwargs):
         """This wrapper is called from unit tests and the Qt python console."""
@@ -204,6 +295,7 @@ class Commands:
             'version': ELECTRUM_VERSION,
             'default_wallet': self.config.get_wallet_path(),
             'fee_per_kb': self.config.fee_per_kb(),
+            'subscription_stats': self.network.scripthash_mux.get_stats(),
         }
         return response
 
@@ -215,13 +307,18 @@ class Commands:
 
     @command('n')
     async def list_wallets(self):
-        """List wallets open in daemon"""
-        return [{'path': path, 'synchronized': w.is_up_to_date()}
-                for path, w in self.daemon.get_wallets().items()]
+        """List wallets open in daemon. Idle wallets that the daemon unloaded
+        (see max_loaded_wallets) are listed with 'loaded': false."""
+        wallets = [{'path': path, 'synchronized': w.is_up_to_date(), 'loaded': True}
+                   for path, w in self.daemon.get_wallets().items()]
+        wallets += [{'path': path, 'synchronized': False, 'loaded': False}
+                    for path in self.daemon.get_unloaded_wallets()]
+        return wallets
 
     @command('n')
     async def load_wallet(self, wallet_path=None, password=None):
         """Open wallet in daemon"""
+        from .plugin import run_hook
         wallet = self.daemon.load_wallet(wallet_path, password, manual_upgrades=False)
         if wallet is not None:
             run_hook('load_wallet', wallet, None)
@@ -238,6 +335,7 @@ class Commands:
         """Create a new wallet.
         If you want to be prompted for an argument, type '?' or ':' (concealed)
         """
+        from .wallet import create_new_wallet
         d = create_new_wallet(path=wallet_path,
                               passphrase=passphrase,
                               password=password,
@@ -257,6 +355,7 @@ class Commands:
         or bitcoin private keys.
         If you want to be prompted for an argument, type '?' or ':' (concealed)
         """
+        from .wallet import restore_wallet_from_text
         # TODO create a separate command that blocks until wallet is synced
         d = restore_wallet_from_text(text,
                                      path=wallet_path,
@@ -270,7 +369,7 @@ class Commands:
         }
 
     @command('wp')
-    async def password(self, password=None, new_password=None, wallet: Abstract_Wallet = None):
+    async def password(self, password=None, new_password=None, wallet: 'Abstract_Wallet' = None):
         """Change wallet password. """
         if wallet.storage.is_encrypted_with_hw_device() and new_password:
             raise Exception("Can't change the password of a wallet encrypted with a hw device.")
@@ -280,7 +379,7 @@ class Commands:
         return {'password':wallet.has_password()}
 
     @command('w')
-    async def get(self, key, wallet: Abstract_Wallet = None):
+    async def get(self, key, wallet: 'Abstract_Wallet' = None):
         """Return item from wallet storage"""
         return wallet.db.get(key)
 
@@ -329,13 +428,15 @@ class Commands:
         """Return the transaction history of any address. Note: This is a
         walletless server query, results are not checked by SPV.
         """
+        from . import bitcoin
         sh = bitcoin.address_to_scripthash(address)
         return await self.network.get_history_for_scripthash(sh)
 
-    @command('w')
-    async def listunspent(self, wallet: Abstract_Wallet = None):
+    @command('wc')
+    async def listunspent(self, wallet: 'Abstract_Wallet' = None):
         """List unspent outputs. Returns the list of unspent transaction
         outputs in your wallet."""
+        from .bitcoin import COIN
         coins = []
         for txin in wallet.get_utxos():
             d = txin.to_json()
@@ -349,6 +450,7 @@ class Commands:
         """Returns the UTXO list of any address. Note: This
         is a walletless server query, results are not checked by SPV.
         """
+        from . import bitcoin
         sh = bitcoin.address_to_scripthash(address)
         return await self.network.listunspent_for_scripthash(sh)
 
@@ -358,6 +460,8 @@ class Commands:
         Inputs must have a redeemPubkey.
         Outputs must be a list of {'address':address, 'value':satoshi_amount}.
         """
+        from . import ecc, bitcoin
+        from .transaction import PartialTransaction, PartialTxOutput, PartialTxInput, TxOutpoint
         keypairs = {}
         inputs = []  # type: List[PartialTxInput]
         locktime = jsontx.get('lockTime', 0)
@@ -389,9 +493,11 @@ class Commands:
         tx.sign(keypairs)
         return tx.serialize()
 
-    @command('wp')
-    async def signtransaction(self, tx, privkey=None, password=None, wallet: Abstract_Wallet = None):
+    @command('wpc')
+    async def signtransaction(self, tx, privkey=None, password=None, wallet: 'Abstract_Wallet' = None):
         """Sign a transaction. The wallet keys will be used unless a private key is provided."""
+        from . import ecc, bitcoin
+        from .transaction import tx_from_any
         tx = tx_from_any(tx)
         if privkey:
             txin_type, privkey2, compressed = bitcoin.deserialize_privkey(privkey)
@@ -404,12 +510,14 @@ class Commands:
     @command('')
     async def deserialize(self, tx):
         """Deserialize a serialized transaction"""
+        from .transaction import tx_from_any
         tx = tx_from_any(tx)
         return tx.to_json()
 
     @command('n')
     async def broadcast(self, tx):
         """Broadcast a transaction to the network. """
+        from .transaction import Transaction
         tx = Transaction(tx)
         await self.network.broadcast_transaction(tx)
         return tx.txid()
@@ -417,24 +525,28 @@ class Commands:
     @command('')
     async def createmultisig(self, num, pubkeys):
         """Create multisig address"""
+        from . import bitcoin
+        from .bitcoin import hash_160
+        from .transaction import multisig_script
         assert isinstance(pubkeys, list), (type(num), type(pubkeys))
         redeem_script = multisig_script(pubkeys, num)
         address = bitcoin.hash160_to_p2sh(hash_160(bfh(redeem_script)))
         return {'address':address, 'redeemScript':redeem_script}
 
     @command('w')
-    async def freeze(self, address, wallet: Abstract_Wallet = None):
+    async def freeze(self, address, wallet: 'Abstract_Wallet' = None):
         """Freeze address. Freeze the funds at one of your wallet\'s addresses"""
         return wallet.set_frozen_state_of_addresses([address], True)
 
     @command('w')
-    async def unfreeze(self, address, wallet: Abstract_Wallet = None):
+    async def unfreeze(self, address, wallet: 'Abstract_Wallet' = None):
         """Unfreeze address. Unfreeze the funds at one of your wallet\'s address"""
         return wallet.set_frozen_state_of_addresses([address], False)
 
     @command('wp')
-    async def getprivatekeys(self, address, password=None, wallet: Abstract_Wallet = None):
+    async def getprivatekeys(self, address, password=None, wallet: 'Abstract_Wallet' = None):
         """Get private keys of addresses. You may pass a single wallet address, or a list of wallet addresses."""
+        from .bitcoin import is_address
         if isinstance(address, str):
             address = address.strip()
         if is_address(address):
@@ -443,14 +555,14 @@ class Commands:
         return [wallet.export_private_key(address, password) for address in domain]
 
     @command('wp')
-    async def getprivatekeyforpath(self, path, password=None, wallet: Abstract_Wallet = None):
+    async def getprivatekeyforpath(self, path, password=None, wallet: 'Abstract_Wallet' = None):
         """Get private key corresponding to derivation path (address index).
         'path' can be either a str such as "m/0/50", or a list of ints such as [0, 50].
         """
         return wallet.export_private_key_for_path(path, password)
 
     @command('w')
-    async def ismine(self, address, wallet: Abstract_Wallet = None):
+    async def ismine(self, address, wallet: 'Abstract_Wallet' = None):
         """Check if address is in wallet. Return true if and only address is in wallet"""
         return wallet.is_mine(address)
 
@@ -462,16 +574,18 @@ class Commands:
     @command('')
     async def validateaddress(self, address):
         """Check that an address is valid. """
+        from .bitcoin import is_address
         return is_address(address)
 
     @command('w')
-    async def getpubkeys(self, address, wallet: Abstract_Wallet = None):
+    async def getpubkeys(self, address, wallet: 'Abstract_Wallet' = None):
         """Return the public keys for a wallet address. """
         return wallet.get_public_keys(address)
 
-    @command('w')
-    async def getbalance(self, wallet: Abstract_Wallet = None):
+    @command('wc')
+    async def getbalance(self, wallet: 'Abstract_Wallet' = None):
         """Return the balance of your wallet. """
+        from .bitcoin import COIN
         c, u, x = wallet.get_balance()
         l = wallet.lnworker.get_balance() if wallet.lnworker else None
         out = {"confirmed": str(Decimal(c)/COIN)}
@@ -488,6 +602,8 @@ class Commands:
         """Return the balance of any address. Note: This is a walletless
         server query, results are not checked by SPV.
         """
+        from . import bitcoin
+        from .bitcoin import COIN
         sh = bitcoin.address_to_scripthash(address)
         out = await self.network.get_balance_for_scripthash(sh)
         out["confirmed"] =  str(Decimal(out["confirmed"])/COIN)
@@ -512,18 +628,19 @@ class Commands:
         return ELECTRUM_VERSION
 
     @command('w')
-    async def getmpk(self, wallet: Abstract_Wallet = None):
+    async def getmpk(self, wallet: 'Abstract_Wallet' = None):
         """Get master public key. Return your wallet\'s master public key"""
         return wallet.get_master_public_key()
 
     @command('wp')
-    async def getmasterprivate(self, password=None, wallet: Abstract_Wallet = None):
+    async def getmasterprivate(self, password=None, wallet: 'Abstract_Wallet' = None):
         """Get master private key. Return your wallet\'s master private key"""
         return str(wallet.keystore.get_master_private_key(password))
 
     @command('')
     async def convert_xkey(self, xkey, xtype):
         """Convert xtype of a master key. e.g. xpub -> ypub"""
+        from .bip32 import BIP32Node
         try:
             node = BIP32Node.from_xkey(xkey)
         except:
@@ -531,13 +648,13 @@ class Commands:
         return node._replace(xtype=xtype).to_xkey()
 
     @command('wp')
-    async def getseed(self, password=None, wallet: Abstract_Wallet = None):
+    async def getseed(self, password=None, wallet: 'Abstract_Wallet' = None):
         """Get seed phrase. Print the generation seed of your wallet."""
         s = wallet.get_seed(password)
         return s
 
     @command('wp')
-    async def importprivkey(self, privkey, password=None, wallet: Abstract_Wallet = None):
+    async def importprivkey(self, privkey, password=None, wallet: 'Abstract_Wallet' = None):
         """Import a private key."""
         if not wallet.can_import_privkey():
             return "Error: This type of wallet cannot import private keys. Try to create a new wallet with that key."
@@ -577,7 +694,7 @@ class Commands:
         return tx.serialize() if tx else None
 
     @command('wp')
-    async def signmessage(self, address, message, password=None, wallet: Abstract_Wallet = None):
+    async def signmessage(self, address, message, password=None, wallet: 'Abstract_Wallet' = None):
         """Sign a message with a key. Use quotes if your message contains
         whitespaces"""
         sig = wallet.sign_message(address, message, password)
@@ -586,14 +703,16 @@ class Commands:
     @command('')
     async def verifymessage(self, address, signature, message):
         """Verify a signature."""
+        from . import ecc
         sig = base64.b64decode(signature)
         message = util.to_bytes(message)
         return ecc.verify_message_with_address(address, sig, message)
 
-    @command('wp')
+    @command('wpc')
     async def payto(self, destination, amount, fee=None, feerate=None, from_addr=None, from_coins=None, change_addr=None,
-                    nocheck=False, unsigned=False, rbf=None, password=None, locktime=None, addtransaction=False, wallet: Abstract_Wallet = None):
+                    nocheck=False, unsigned=False, rbf=None, password=None, locktime=None, addtransaction=False, wallet: 'Abstract_Wallet' = None):
         """Create a transaction. """
+        from .transaction import PartialTxOutput
         self.nocheck = nocheck
         tx_fee = satoshis(fee)
         domain_addr = from_addr.split(',') if from_addr else None
@@ -618,10 +737,11 @@ class Commands:
             await self.addtransaction(result, wallet=wallet)
         return result
 
-    @command('wp')
+    @command('wpc')
     async def paytomany(self, outputs, fee=None, feerate=None, from_addr=None, from_coins=None, change_addr=None,
-                        nocheck=False, unsigned=False, rbf=None, password=None, locktime=None, addtransaction=False, wallet: Abstract_Wallet = None):
+                        nocheck=False, unsigned=False, rbf=None, password=None, locktime=None, addtransaction=False, wallet: 'Abstract_Wallet' = None):
         """Create a multi-output transaction. """
+        from .transaction import PartialTxOutput
         self.nocheck = nocheck
         tx_fee = satoshis(fee)
         domain_addr = from_addr.split(',') if from_addr else None
@@ -649,8 +769,8 @@ class Commands:
             await self.addtransaction(result, wallet=wallet)
         return result
 
-    @command('w')
-    async def onchain_history(self, year=None, show_addresses=False, show_fiat=False, wallet: Abstract_Wallet = None):
+    @command('wc')
+    async def onchain_history(self, year=None, show_addresses=False, show_fiat=False, wallet: 'Abstract_Wallet' = None):
         """Wallet onchain history. Returns the transaction history of your wallet."""
         kwargs = {
             'show_addresses': show_addresses,
@@ -668,29 +788,29 @@ class Commands:
         return json_normalize(wallet.get_detailed_history(**kwargs))
 
     @command('w')
-    async def lightning_history(self, show_fiat=False, wallet: Abstract_Wallet = None):
+    async def lightning_history(self, show_fiat=False, wallet: 'Abstract_Wallet' = None):
         """ lightning history """
         lightning_history = wallet.lnworker.get_history() if wallet.lnworker else []
         return json_normalize(lightning_history)
 
     @command('w')
-    async def setlabel(self, key, label, wallet: Abstract_Wallet = None):
+    async def setlabel(self, key, label, wallet: 'Abstract_Wallet' = None):
         """Assign a label to an item. Item may be a bitcoin address or a
         transaction ID"""
         wallet.set_label(key, label)
 
     @command('w')
-    async def listcontacts(self, wallet: Abstract_Wallet = None):
+    async def listcontacts(self, wallet: 'Abstract_Wallet' = None):
         """Show your list of contacts"""
         return wallet.contacts
 
     @command('w')
-    async def getalias(self, key, wallet: Abstract_Wallet = None):
+    async def getalias(self, key, wallet: 'Abstract_Wallet' = None):
         """Retrieve alias. Lookup in your list of contacts, and for an OpenAlias DNS record."""
         return wallet.contacts.resolve(key)
 
     @command('w')
-    async def searchcontacts(self, query, wallet: Abstract_Wallet = None):
+    async def searchcontacts(self, query, wallet: 'Abstract_Wallet' = None):
         """Search through contacts, return matching entries. """
         results = {}
         for key, value in wallet.contacts.items():
@@ -698,8 +818,8 @@ class Commands:
                 results[key] = value
         return results
 
-    @command('w')
-    async def listaddresses(self, receiving=False, change=False, labels=False, frozen=False, unused=False, funded=False, balance=False, wallet: Abstract_Wallet = None):
+    @command('wc')
+    async def listaddresses(self, receiving=False, change=False, labels=False, frozen=False, unused=False, funded=False, balance=False, wallet: 'Abstract_Wallet' = None):
         """List wallet addresses. Returns the list of all addresses in your wallet. Use optional arguments to filter the results."""
         out = []
         for addr in wallet.get_addresses():
@@ -724,8 +844,9 @@ class Commands:
         return out
 
     @command('n')
-    async def gettransaction(self, txid, wallet: Abstract_Wallet = None):
+    async def gettransaction(self, txid, wallet: 'Abstract_Wallet' = None):
         """Retrieve a transaction. """
+        from .transaction import Transaction
         tx = None
         if wallet:
             tx = wallet.db.get_transaction(txid)
@@ -742,6 +863,7 @@ class Commands:
     @command('')
     async def encrypt(self, pubkey, message) -> str:
         """Encrypt a message with a public key. Use quotes if the message contains whitespaces."""
+        from . import ecc
         if not is_hex_str(pubkey):
             raise Exception(f"pubkey must be a hex string instead of {repr(pubkey)}")
         try:
@@ -753,7 +875,7 @@ class Commands:
         return encrypted.decode('utf-8')
 
     @command('wp')
-    async def decrypt(self, pubkey, encrypted, password=None, wallet: Abstract_Wallet = None) -> str:
+    async def decrypt(self, pubkey, encrypted, password=None, wallet: 'Abstract_Wallet' = None) -> str:
         """Decrypt a message encrypted with a public key."""
         if not is_hex_str(pubkey):
             raise Exception(f"pubkey must be a hex string instead of {repr(pubkey)}")
@@ -763,7 +885,7 @@ class Commands:
         return decrypted.decode('utf-8')
 
     @command('w')
-    async def getrequest(self, key, wallet: Abstract_Wallet = None):
+    async def getrequest(self, key, wallet: 'Abstract_Wallet' = None):
         """Return a payment request"""
         r = wallet.get_request(key)
         if not r:
@@ -776,8 +898,9 @@ class Commands:
     #    pass
 
     @command('w')
-    async def list_requests(self, pending=False, expired=False, paid=False, wallet: Abstract_Wallet = None):
+    async def list_requests(self, pending=False, expired=False, paid=False, wallet: 'Abstract_Wallet' = None):
         """List the payment requests you made."""
+        from .invoices import PR_PAID, PR_UNPAID, PR_EXPIRED
         if pending:
             f = PR_UNPAID
         elif expired:
@@ -792,13 +915,14 @@ class Commands:
         return [wallet.export_request(x) for x in out]
 
     @command('w')
-    async def createnewaddress(self, wallet: Abstract_Wallet = None):
+    async def createnewaddress(self, wallet: 'Abstract_Wallet' = None):
         """Create a new receiving address, beyond the gap limit of the wallet"""
         return wallet.create_new_address(False)
 
     @command('w')
-    async def changegaplimit(self, new_limit, iknowwhatimdoing=False, wallet: Abstract_Wallet = None):
+    async def changegaplimit(self, new_limit, iknowwhatimdoing=False, wallet: 'Abstract_Wallet' = None):
         """Change the gap limit of the wallet."""
+        from .wallet import Deterministic_Wallet
         if not iknowwhatimdoing:
             raise Exception("WARNING: Are you SURE you want to change the gap limit?\n"
                             "It makes recovering your wallet from seed difficult!\n"
@@ -810,10 +934,11 @@ class Commands:
         return wallet.change_gap_limit(new_limit)
 
     @command('wn')
-    async def getminacceptablegap(self, wallet: Abstract_Wallet = None):
+    async def getminacceptablegap(self, wallet: 'Abstract_Wallet' = None):
         """Returns the minimum value for gap limit that would be sufficient to discover all
         known addresses in the wallet.
         """
+        from .wallet import Deterministic_Wallet
         if not isinstance(wallet, Deterministic_Wallet):
             raise Exception("This wallet is not deterministic.")
         if not wallet.is_up_to_date():
@@ -821,13 +946,13 @@ class Commands:
         return wallet.min_acceptable_gap()
 
     @command('w')
-    async def getunusedaddress(self, wallet: Abstract_Wallet = None):
+    async def getunusedaddress(self, wallet: 'Abstract_Wallet' = None):
         """Returns the first unused address of the wallet, or None if all addresses are used.
         An address is considered as used if it has received a transaction, or if it is used in a payment request."""
         return wallet.get_unused_address()
 
     @command('w')
-    async def add_request(self, amount, memo='', expiration=3600, force=False, wallet: Abstract_Wallet = None):
+    async def add_request(self, amount, memo='', expiration=3600, force=False, wallet: 'Abstract_Wallet' = None):
         """Create a payment request, using the first unused address of the wallet.
         The address will be considered as used after this operation.
         If no payment is received, the address will be considered as unused if the payment request is deleted from the wallet."""
@@ -845,15 +970,16 @@ class Commands:
         return wallet.export_request(req)
 
     @command('wn')
-    async def add_lightning_request(self, amount, memo='', expiration=3600, wallet: Abstract_Wallet = None):
+    async def add_lightning_request(self, amount, memo='', expiration=3600, wallet: 'Abstract_Wallet' = None):
         amount_sat = int(satoshis(amount))
         key = await wallet.lnworker._add_request_coro(amount_sat, memo, expiration)
         wallet.save_db()
         return wallet.get_formatted_request(key)
 
     @command('w')
-    async def addtransaction(self, tx, wallet: Abstract_Wallet = None):
+    async def addtransaction(self, tx, wallet: 'Abstract_Wallet' = None):
         """ Add a transaction to the wallet history """
+        from .transaction import Transaction
         tx = Transaction(tx)
         if not wallet.add_transaction(tx):
             return False
@@ -861,7 +987,7 @@ class Commands:
         return tx.txid()
 
     @command('wp')
-    async def signrequest(self, address, password=None, wallet: Abstract_Wallet = None):
+    async def signrequest(self, address, password=None, wallet: 'Abstract_Wallet' = None):
         "Sign payment request with an OpenAlias"
         alias = self.config.get('alias')
         if not alias:
@@ -870,20 +996,20 @@ class Commands:
         wallet.sign_payment_request(address, alias, alias_addr, password)
 
     @command('w')
-    async def rmrequest(self, address, wallet: Abstract_Wallet = None):
+    async def rmrequest(self, address, wallet: 'Abstract_Wallet' = None):
         """Remove a payment request"""
         result = wallet.remove_payment_request(address)
         wallet.save_db()
         return result
 
     @command('w')
-    async def clear_requests(self, wallet: Abstract_Wallet = None):
+    async def clear_requests(self, wallet: 'Abstract_Wallet' = None):
         """Remove all payment requests"""
         wallet.clear_requests()
         return True
 
     @command('w')
-    async def clear_invoices(self, wallet: Abstract_Wallet = None):
+    async def clear_invoices(self, wallet: 'Abstract_Wallet' = None):
         """Remove all invoices"""
         wallet.clear_invoices()
         return True
@@ -893,6 +1019,7 @@ class Commands:
         """Watch an address. Every time the address changes, a http POST is sent to the URL.
         Call with an empty URL to stop watching an address.
         """
+        from .synchronizer import Notifier
         if not hasattr(self, "_notifier"):
             self._notifier = Notifier(self.network)
         if URL:
@@ -902,7 +1029,7 @@ class Commands:
         return True
 
     @command('wn')
-    async def is_synchronized(self, wallet: Abstract_Wallet = None):
+    async def is_synchronized(self, wallet: 'Abstract_Wallet' = None):
         """ return wallet synchronization status """
         return wallet.is_up_to_date()
 
@@ -926,10 +1053,11 @@ class Commands:
         return self.config.fee_per_kb(dyn=dyn, mempool=mempool, fee_level=fee_level)
 
     @command('w')
-    async def removelocaltx(self, txid, wallet: Abstract_Wallet = None):
+    async def removelocaltx(self, txid, wallet: 'Abstract_Wallet' = None):
         """Remove a 'local' transaction from the wallet, and its dependent
         transactions.
         """
+        from .address_synchronizer import TX_HEIGHT_LOCAL
         if not is_hash256_str(txid):
             raise Exception(f"{repr(txid)} is not a txid")
         height = wallet.get_tx_height(txid).height
@@ -943,7 +1071,7 @@ class Commands:
         wallet.save_db()
 
     @command('wn')
-    async def get_tx_status(self, txid, wallet: Abstract_Wallet = None):
+    async def get_tx_status(self, txid, wallet: 'Abstract_Wallet' = None):
         """Returns some information regarding the tx. For now, only confirmations.
         The transaction must be related to the wallet.
         """
@@ -962,13 +1090,14 @@ class Commands:
 
     # lightning network commands
     @command('wn')
-    async def add_peer(self, connection_string, timeout=20, gossip=False, wallet: Abstract_Wallet = None):
+    async def add_peer(self, connection_string, timeout=20, gossip=False, wallet: 'Abstract_Wallet' = None):
         lnworker = self.network.lngossip if gossip else wallet.lnworker
         await lnworker.add_peer(connection_string)
         return True
 
     @command('wn')
-    async def list_peers(self, gossip=False, wallet: Abstract_Wallet = None):
+    async def list_peers(self, gossip=False, wallet: 'Abstract_Wallet' = None):
+        from .lnutil import LnFeatures
         lnworker = self.network.lngossip if gossip else wallet.lnworker
         return [{
             'node_id':p.pubkey.hex(),
@@ -979,7 +1108,9 @@ class Commands:
         } for p in lnworker.peers.values()]
 
     @command('wpn')
-    async def open_channel(self, connection_string, amount, push_amount=0, password=None, wallet: Abstract_Wallet = None):
+    async def open_channel(self, connection_string, amount, push_amount=0, password=None, wallet: 'Abstract_Wallet' = None):
+        from .transaction import PartialTxOutput
+        from .lnutil import ln_dummy_address
         funding_sat = satoshis(amount)
         push_sat = satoshis(push_amount)
         dummy_output = PartialTxOutput.from_address_and_value(ln_dummy_address(), funding_sat)
@@ -993,11 +1124,13 @@ class Commands:
 
     @command('')
     async def decode_invoice(self, invoice: str):
+        from .invoices import LNInvoice
         invoice = LNInvoice.from_bech32(invoice)
         return invoice.to_debug_json()
 
     @command('wn')
-    async def lnpay(self, invoice, attempts=1, timeout=30, wallet: Abstract_Wallet = None):
+    async def lnpay(self, invoice, attempts=1, timeout=30, wallet: 'Abstract_Wallet' = None):
+        from .invoices import LNInvoice
         lnworker = wallet.lnworker
         lnaddr = lnworker._check_invoice(invoice)
         payment_hash = lnaddr.paymenthash
@@ -1011,14 +1144,14 @@ class Commands:
         }
 
     @command('w')
-    async def nodeid(self, wallet: Abstract_Wallet = None):
+    async def nodeid(self, wallet: 'Abstract_Wallet' = None):
         listen_addr = self.config.get('lightning_listen')
         return bh2u(wallet.lnworker.node_keypair.pubkey) + (('@' + listen_addr) if listen_addr else '')
 
     @command('w')
-    async def list_channels(self, wallet: Abstract_Wallet = None):
+    async def list_channels(self, wallet: 'Abstract_Wallet' = None):
         # we output the funding_outpoint instead of the channel_id because lnd uses channel_point (funding outpoint) to identify channels
-        from .lnutil import LOCAL, REMOTE, format_short_channel_id
+        from .lnutil import LOCAL, REMOTE, SENT, format_short_channel_id
         l = list(wallet.lnworker.channels.items())
         return [
             {
@@ -1038,7 +1171,7 @@ class Commands:
         ]
 
     @command('wn')
-    async def dumpgraph(self, wallet: Abstract_Wallet = None):
+    async def dumpgraph(self, wallet: 'Abstract_Wallet' = None):
         return wallet.lnworker.channel_db.to_dict()
 
     @command('n')
@@ -1048,39 +1181,42 @@ class Commands:
         self.network.notify('fee')
 
     @command('wn')
-    async def enable_htlc_settle(self, b: bool, wallet: Abstract_Wallet = None):
+    async def enable_htlc_settle(self, b: bool, wallet: 'Abstract_Wallet' = None):
         e = wallet.lnworker.enable_htlc_settle
         e.set() if b else e.clear()
 
     @command('n')
     async def clear_ln_blacklist(self):
-        self.network.path_finder.blacklist.clear()
+        self.network.path_finder.clear_blacklist()
 
     @command('w')
-    async def list_invoices(self, wallet: Abstract_Wallet = None):
+    async def list_invoices(self, wallet: 'Abstract_Wallet' = None):
         l = wallet.get_invoices()
         return [wallet.export_invoice(x) for x in l]
 
     @command('wn')
-    async def close_channel(self, channel_point, force=False, wallet: Abstract_Wallet = None):
+    async def close_channel(self, channel_point, force=False, wallet: 'Abstract_Wallet' = None):
+        from .lnpeer import channel_id_from_funding_tx
         txid, index = channel_point.split(':')
         chan_id, _ = channel_id_from_funding_tx(txid, int(index))
         coro = wallet.lnworker.force_close_channel(chan_id) if force else wallet.lnworker.close_channel(chan_id)
         return await coro
 
     @command('w')
-    async def export_channel_backup(self, channel_point, wallet: Abstract_Wallet = None):
+    async def export_channel_backup(self, channel_point, wallet: 'Abstract_Wallet' = None):
+        from .lnpeer import channel_id_from_funding_tx
         txid, index = channel_point.split(':')
         chan_id, _ = channel_id_from_funding_tx(txid, int(index))
         return wallet.lnworker.export_channel_backup(chan_id)
 
     @command('w')
-    async def import_channel_backup(self, encrypted, wallet: Abstract_Wallet = None):
+    async def import_channel_backup(self, encrypted, wallet: 'Abstract_Wallet' = None):
         return wallet.lnbackups.import_channel_backup(encrypted)
 
     @command('wn')
-    async def get_channel_ctx(self, channel_point, iknowwhatimdoing=False, wallet: Abstract_Wallet = None):
+    async def get_channel_ctx(self, channel_point, iknowwhatimdoing=False, wallet: 'Abstract_Wallet' = None):
         """ return the current commitment transaction of a channel """
+        from .lnpeer import channel_id_from_funding_tx
         if not iknowwhatimdoing:
             raise Exception("WARNING: this command is potentially unsafe.\n"
                             "To proceed, try again, with the --iknowwhatimdoing option.")
@@ -1091,12 +1227,12 @@ class Commands:
         return tx.serialize()
 
     @command('wn')
-    async def get_watchtower_ctn(self, channel_point, wallet: Abstract_Wallet = None):
+    async def get_watchtower_ctn(self, channel_point, wallet: 'Abstract_Wallet' = None):
         """ return the local watchtower's ctn of channel. used in regtests """
         return await self.network.local_watchtower.sweepstore.get_ctn(channel_point, None)
 
     @command('wnp')
-    async def normal_swap(self, onchain_amount, lightning_amount, password=None, wallet: Abstract_Wallet = None):
+    async def normal_swap(self, onchain_amount, lightning_amount, password=None, wallet: 'Abstract_Wallet' = None):
         """
         Normal submarine swap: send on-chain BTC, receive on Lightning
         Note that your funds will be locked for 24h if you do not have enough incoming capacity.
@@ -1123,7 +1259,7 @@ class Commands:
         }
 
     @command('wn')
-    async def reverse_swap(self, lightning_amount, onchain_amount, wallet: Abstract_Wallet = None):
+    async def reverse_swap(self, lightning_amount, onchain_amount, wallet: 'Abstract_Wallet' = None):
         """Reverse submarine swap: send on Lightning, receive on-chain
         """
         sm = wallet.lnworker.swap_manager
@@ -1227,8 +1363,11 @@ command_options = {
 }
 
 
+def convert_raw_tx_to_hex(raw):
+    from .transaction import convert_raw_tx_to_hex
+    return convert_raw_tx_to_hex(raw)
+
 # don't use floats because of rounding errors
-from .transaction import convert_raw_tx_to_hex
 json_loads = lambda x: json.loads(x, parse_float=lambda x: str(Decimal(x)))
 arg_types = {
     'num': int,
@@ -1365,6 +1504,17 @@ def get_parser():
     parser_daemon.add_argument("-d", "--detached", action="store_true", dest="detach", default=False, help="run daemon in detached mode")
     add_network_options(parser_daemon)
     add_global_options(parser_daemon)
+    # batch
+    parser_batch = subparsers.add_parser('batch', help="Run commands read from a file",
+                                         description="Read commands from a file (or stdin), one per line, "
+                                                     "and send them to the running daemon over a single connection. "
+                                                     "Results are printed one per line, as JSON.")
+    parser_batch.add_argument("commands_file", nargs='?', default=None, help="file with one command per line (default: stdin)")
+    parser_batch.add_argument("--batch-size", dest="batch_size", type=int, default=1,
+                              help="send this many commands at once; they are executed concurrently by the daemon")
+    parser_batch.add_argument("-W", "--password", dest="password", default=None, help="password, for commands that do not set it")
+    add_wallet_option(parser_batch)
+    add_global_options(parser_batch)
     # commands
     for cmdname in sorted(known_commands.keys()):
         cmd = known_commands[cmdname]
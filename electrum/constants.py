@@ -27,7 +27,6 @@ import os
 import json
 
 from .util import inv_dict
-from . import bitcoin
 
 
 def read_json(filename, default):
@@ -55,6 +54,7 @@ class AbstractNet:
 
     @classmethod
     def rev_genesis_bytes(cls) -> bytes:
+        from . import bitcoin
         return bytes.fromhex(bitcoin.rev_hex(cls.GENESIS))
 
 
@@ -29,9 +29,10 @@ import time
 import traceback
 import sys
 import threading
-from typing import Dict, Optional, Tuple, Iterable, Callable, Union, Sequence, Mapping
+from typing import Dict, Optional, Tuple, Iterable, Callable, Union, Sequence, Mapping, TYPE_CHECKING
 from base64 import b64decode, b64encode
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from contextlib import contextmanager
 import concurrent
 from concurrent import futures
 import json
@@ -41,21 +42,24 @@ from aiohttp import web, client_exceptions
 from aiorpcx import TaskGroup
 
 from . import util
-from .network import Network
 from .util import (json_decode, to_bytes, to_string, profiler, standardize_path, constant_time_compare)
-from .invoices import PR_PAID, PR_EXPIRED
 from .util import log_exceptions, ignore_exceptions, randrange
-from .wallet import Wallet, Abstract_Wallet
-from .storage import WalletStorage
-from .wallet_db import WalletDB
-from .commands import known_commands, Commands
+from .commands import known_commands, Commands, CommandExecutor
 from .simple_config import SimpleConfig
-from .exchange_rate import FxThread
 from .logging import get_logger, Logger
 
+# Modules only needed to run the daemon are imported in the methods using
+# them: the command line client only needs request() and DaemonClient.
+if TYPE_CHECKING:
+    from .network import Network
+    from .wallet import Abstract_Wallet
+
 
 _logger = get_logger(__name__)
 
+# seconds since its last command before a wallet may be unloaded
+MIN_WALLET_IDLE_TIME = 60
+
 
 class DaemonNotRunning(Exception):
     pass
@@ -90,31 +94,92 @@ def get_file_descriptor(config: SimpleConfig):
 
 
 def request(config: SimpleConfig, endpoint, args=(), timeout=60):
-    lockfile = get_lockfile(config)
-    while True:
-        create_time = None
+    client = DaemonClient(config)
+    try:
+        return client.request(endpoint, args, timeout=timeout)
+    finally:
+        client.close()
+
+
+class DaemonClient(Logger):
+    """Client for the JSON-RPC server of a running daemon.
+
+    The lockfile is read once, and all requests go through the same
+    HTTP session, so consecutive requests reuse the connection.
+    Requests are blocking; they run on the event loop of the calling thread,
+    which must be running in another thread (see create_and_start_event_loop).
+    """
+
+    def __init__(self, config: SimpleConfig, *, loop: asyncio.AbstractEventLoop = None):
+        Logger.__init__(self)
+        self.config = config
+        self.loop = loop or asyncio.get_event_loop()
+        self._session = None  # type: Optional[aiohttp.ClientSession]
+        self._rpc = None  # type: Optional[util.JsonRPCClient]
+        self._create_time = None  # type: Optional[float]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _read_lockfile(self) -> Tuple[str, float]:
         try:
-            with open(lockfile) as f:
+            with open(get_lockfile(self.config)) as f:
                 (host, port), create_time = ast.literal_eval(f.read())
         except Exception:
             raise DaemonNotRunning()
-        rpc_user, rpc_password = get_rpc_credentials(config)
-        server_url = 'http://%s:%d' % (host, port)
-        auth = aiohttp.BasicAuth(login=rpc_user, password=rpc_password)
-        loop = asyncio.get_event_loop()
-        async def request_coroutine():
-            async with aiohttp.ClientSession(auth=auth) as session:
-                c = util.JsonRPCClient(session, server_url)
-                return await c.request(endpoint, *args)
-        try:
-            fut = asyncio.run_coroutine_threadsafe(request_coroutine(), loop)
-            return fut.result(timeout=timeout)
-        except aiohttp.client_exceptions.ClientConnectorError as e:
-            _logger.info(f"failed to connect to JSON-RPC server {e}")
-            if not create_time or create_time < time.time() - 1.0:
-                raise DaemonNotRunning()
-        # Sleep a bit and try again; it might have just been started
-        time.sleep(1.0)
+        return 'http://%s:%d' % (host, port), create_time
+
+    async def _get_rpc(self) -> util.JsonRPCClient:
+        if self._rpc is None:
+            server_url, self._create_time = self._read_lockfile()
+            rpc_user, rpc_password = get_rpc_credentials(self.config)
+            auth = aiohttp.BasicAuth(login=rpc_user, password=rpc_password)
+            self._session = aiohttp.ClientSession(auth=auth)
+            self._rpc = util.JsonRPCClient(self._session, server_url)
+        return self._rpc
+
+    async def _close_session(self):
+        if self._session is not None:
+            await self._session.close()
+        self._session = None
+        self._rpc = None
+
+    def _run(self, coro_factory: Callable, timeout):
+        while True:
+            async def request_coroutine():
+                rpc = await self._get_rpc()
+                try:
+                    return await coro_factory(rpc)
+                except aiohttp.client_exceptions.ClientConnectorError:
+                    # the daemon might have been restarted on another port
+                    await self._close_session()
+                    raise
+            try:
+                fut = asyncio.run_coroutine_threadsafe(request_coroutine(), self.loop)
+                return fut.result(timeout=timeout)
+            except aiohttp.client_exceptions.ClientConnectorError as e:
+                self.logger.info(f"failed to connect to JSON-RPC server {e}")
+                if not self._create_time or self._create_time < time.time() - 1.0:
+                    raise DaemonNotRunning()
+            # Sleep a bit and try again; it might have just been started
+            time.sleep(1.0)
+
+    def request(self, endpoint, args=(), *, timeout=60):
+        return self._run(lambda rpc: rpc.request(endpoint, *args), timeout)
+
+    def request_batch(self, calls: Sequence[Tuple[str, Sequence]], *, timeout=60) -> list:
+        """Sends (endpoint, args) pairs as one JSON-RPC batch.
+        The daemon executes them concurrently. Results are returned in order.
+        """
+        return self._run(lambda rpc: rpc.batch_request(calls), timeout)
+
+    def close(self):
+        if self._session is not None and self.loop.is_running():
+            fut = asyncio.run_coroutine_threadsafe(self._close_session(), self.loop)
+            fut.result(timeout=5)
 
 
 def get_rpc_credentials(config: SimpleConfig) -> Tuple[str, str]:
@@ -152,7 +217,10 @@ class AuthenticatedServer(Logger):
         Logger.__init__(self)
         self.rpc_user = rpc_user
         self.rpc_password = rpc_password
-        self.auth_lock = asyncio.Lock()
+        # Only failed attempts are serialized (and delayed), so that concurrent
+        # clients with valid credentials never wait for each other.
+        self.auth_failure_lock = asyncio.Lock()
+        self._verified_auth_string = None  # type: Optional[str]
         self._methods = {}  # type: Dict[str, Callable]
 
     def register_method(self, f):
@@ -166,6 +234,9 @@ class AuthenticatedServer(Logger):
         auth_string = headers.get('Authorization', None)
         if auth_string is None:
             raise AuthenticationInvalidOrMissing('CredentialsMissing')
+        verified = self._verified_auth_string
+        if verified is not None and constant_time_compare(auth_string, verified):
+            return
         basic, _, encoded = auth_string.partition(' ')
         if basic != 'Basic':
             raise AuthenticationInvalidOrMissing('UnsupportedType')
@@ -174,30 +245,59 @@ class AuthenticatedServer(Logger):
         username, _, password = credentials.partition(':')
         if not (constant_time_compare(username, self.rpc_user)
                 and constant_time_compare(password, self.rpc_password)):
-            await asyncio.sleep(0.050)
+            async with self.auth_failure_lock:
+                await asyncio.sleep(0.050)
             raise AuthenticationCredentialsInvalid('Invalid Credentials')
+        self._verified_auth_string = auth_string
 
     async def handle(self, request):
-        async with self.auth_lock:
-            try:
-                await self.authenticate(request.headers)
-            except AuthenticationInvalidOrMissing:
-                return web.Response(headers={"WWW-Authenticate": "Basic realm=Electrum"},
-                                    text='Unauthorized', status=401)
-            except AuthenticationCredentialsInvalid:
-                return web.Response(text='Forbidden', status=403)
+        try:
+            await self.authenticate(request.headers)
+        except AuthenticationInvalidOrMissing:
+            return web.Response(headers={"WWW-Authenticate": "Basic realm=Electrum"},
+                                text='Unauthorized', status=401)
+        except AuthenticationCredentialsInvalid:
+            return web.Response(text='Forbidden', status=403)
         try:
             request = await request.text()
             request = json.loads(request)
-            method = request['method']
-            _id = request['id']
-            params = request.get('params', [])  # type: Union[Sequence, Mapping]
-            if method not in self._methods:
-                raise Exception(f"attempting to use unregistered method: {method}")
-            f = self._methods[method]
+            if isinstance(request, list):
+                # JSON-RPC 2.0 batch: the calls are executed concurrently
+                if not request:
+                    raise Exception("empty batch")
+                responses = await asyncio.gather(*[self._handle_batch_item(item) for item in request])
+                return web.json_response(responses)
+            f, _id, params = self._parse_request(request)
         except Exception as e:
             self.logger.exception("invalid request")
             return web.Response(text='Invalid Request', status=500)
+        return web.json_response(await self._call(f, _id, params))
+
+    def _parse_request(self, request) -> Tuple[Callable, object, Union[Sequence, Mapping]]:
+        method = request['method']
+        _id = request['id']
+        params = request.get('params', [])  # type: Union[Sequence, Mapping]
+        if method not in self._methods:
+            raise Exception(f"attempting to use unregistered method: {method}")
+        return self._methods[method], _id, params
+
+    async def _handle_batch_item(self, request) -> dict:
+        try:
+            f, _id, params = self._parse_request(request)
+        except Exception as e:
+            self.logger.info(f"invalid request in batch: {repr(e)}")
+            _id = request.get('id') if isinstance(request, dict) else None
+            return {
+                'id': _id,
+                'jsonrpc': '2.0',
+                'error': {
+                    'code': -32600,
+                    'message': 'Invalid Request',
+                },
+            }
+        return await self._call(f, _id, params)
+
+    async def _call(self, f, _id, params) -> dict:
         response = {
             'id': _id,
             'jsonrpc': '2.0',
@@ -213,7 +313,7 @@ class AuthenticatedServer(Logger):
                 'code': 1,
                 'message': str(e),
             }
-        return web.json_response(response)
+        return response
 
 
 class CommandsServer(AuthenticatedServer):
@@ -230,7 +330,13 @@ class CommandsServer(AuthenticatedServer):
         self.app.router.add_post("/", self.handle)
         self.register_method(self.ping)
         self.register_method(self.gui)
-        self.cmd_runner = Commands(config=self.config, network=self.daemon.network, daemon=self.daemon)
+        # CPU-intensive commands run in worker threads, so that they do not block other clients
+        num_workers = self.config.get('rpc_num_workers', 4)
+        self.cmd_executor = None
+        if num_workers > 0:
+            self.cmd_executor = CommandExecutor(num_workers, thread_name_prefix='rpc_cmd_thread')
+        self.cmd_runner = Commands(config=self.config, network=self.daemon.network, daemon=self.daemon,
+                                   executor=self.cmd_executor)
         for cmdname in known_commands:
             self.register_method(getattr(self.cmd_runner, cmdname))
         self.register_method(self.run_cmdline)
@@ -327,6 +433,7 @@ class PayServer(Logger):
         return list(self.daemon.get_wallets().values())[0]
 
     async def on_payment(self, evt, wallet, key, status):
+        from .invoices import PR_PAID
         if status == PR_PAID:
             self.pending[key].set()
 
@@ -375,6 +482,7 @@ class PayServer(Logger):
         return web.Response(body=pr.SerializeToString(), content_type='application/bitcoin-paymentrequest')
 
     async def get_status(self, request):
+        from .invoices import PR_PAID, PR_EXPIRED
         ws = web.WebSocketResponse()
         await ws.prepare(request)
         key = request.query_string
@@ -406,7 +514,7 @@ class PayServer(Logger):
 
 class Daemon(Logger):
 
-    network: Optional[Network]
+    network: Optional['Network']
 
     @profiler
     def __init__(self, config: SimpleConfig, fd=None, *, listen_jsonrpc=True):
@@ -421,6 +529,8 @@ class Daemon(Logger):
         if 'wallet_path' in config.cmdline_options:
             self.logger.warning("Ignoring parameter 'wallet_path' for daemon. "
                                 "Use the load_wallet command instead.")
+        from .network import Network
+        from .exchange_rate import FxThread
         self.asyncio_loop = asyncio.get_event_loop()
         self.network = None
         if not config.get('offline'):
@@ -428,8 +538,18 @@ class Daemon(Logger):
         self.fx = FxThread(config, self.network)
         self.gui_object = None
         # path -> wallet;   make sure path is standardized.
-        self._wallets = {}  # type: Dict[str, Abstract_Wallet]
+        # Ordered by last use; if 'max_loaded_wallets' is set, the least
+        # recently used idle wallets get unloaded, and are loaded again
+        # when a command needs them.
+        self._wallets = OrderedDict()  # type: Dict[str, Abstract_Wallet]
+        self._wallets_last_used = {}  # type: Dict[str, float]
+        self._unloaded_wallets = set()  # paths
+        self._num_commands_running = {}  # type: Dict[Abstract_Wallet, int]
+        self._wallets_lock = threading.RLock()
+        self.max_loaded_wallets = config.get('max_loaded_wallets', 0)
         daemon_jobs = []
+        if self.max_loaded_wallets:
+            daemon_jobs.append(self._unload_idle_wallets_job())
         # Setup commands server
         self.commands_server = None
         if listen_jsonrpc:
@@ -471,46 +591,76 @@ class Daemon(Logger):
         finally:
             self.logger.info("taskgroup stopped.")
 
-    def load_wallet(self, path, password, *, manual_upgrades=True) -> Optional[Abstract_Wallet]:
+    def load_wallet(self, path, password, *, manual_upgrades=True) -> Optional['Abstract_Wallet']:
+        from .storage import WalletStorage
+        from .wallet_sqlite_db import open_wallet_db
+        from .wallet import Wallet
         path = standardize_path(path)
         # wizard will be launched if we return
-        if path in self._wallets:
-            wallet = self._wallets[path]
-            return wallet
-        storage = WalletStorage(path)
-        if not storage.file_exists():
-            return
-        if storage.is_encrypted():
-            if not password:
+        with self._wallets_lock:
+            if path in self._wallets:
+                wallet = self._wallets[path]
+                self._touch_wallet(path)
+                return wallet
+            storage = WalletStorage(path)
+            if not storage.file_exists():
                 return
-            storage.decrypt(password)
-        # read data, pass it to db
-        db = WalletDB(storage.read(), manual_upgrades=manual_upgrades)
-        if db.requires_split():
-            return
-        if db.requires_upgrade():
-            return
-        if db.get_action():
-            return
-        wallet = Wallet(db, storage, config=self.config)
-        wallet.start_network(self.network)
-        self._wallets[path] = wallet
-        return wallet
+            if storage.is_encrypted():
+                if not password:
+                    return
+                storage.decrypt(password)
+            # read data, pass it to db
+            db = open_wallet_db(storage, manual_upgrades=manual_upgrades, config=self.config)
+            if db.requires_split():
+                return
+            if db.requires_upgrade():
+                return
+            if db.get_action():
+                return
+            wallet = Wallet(db, storage, config=self.config)
+            wallet.start_network(self.network)
+            self._wallets[path] = wallet
+            self._unloaded_wallets.discard(path)
+            self._touch_wallet(path)
+            self._unload_idle_wallets()
+            return wallet
 
-    def add_wallet(self, wallet: Abstract_Wallet) -> None:
+    def add_wallet(self, wallet: 'Abstract_Wallet') -> None:
         path = wallet.storage.path
         path = standardize_path(path)
-        self._wallets[path] = wallet
+        with self._wallets_lock:
+            self._wallets[path] = wallet
+            self._unloaded_wallets.discard(path)
+            self._touch_wallet(path)
 
-    def get_wallet(self, path: str) -> Optional[Abstract_Wallet]:
+    def get_wallet(self, path: str) -> Optional['Abstract_Wallet']:
         path = standardize_path(path)
-        return self._wallets.get(path)
-
-    def get_wallets(self) -> Dict[str, Abstract_Wallet]:
-        return dict(self._wallets)  # copy
+        with self._wallets_lock:
+            wallet = self._wallets.get(path)
+            if wallet is not None:
+                self._touch_wallet(path)
+                return wallet
+            if path in self._unloaded_wallets:
+                return self._reload_wallet(path)
+        return None
+
+    def get_wallets(self) -> Dict[str, 'Abstract_Wallet']:
+        """Returns the loaded wallets; see also get_unloaded_wallets."""
+        with self._wallets_lock:
+            return dict(self._wallets)  # copy
+
+    def get_unloaded_wallets(self) -> Sequence[str]:
+        """Returns the paths of the wallets that were unloaded because they
+        were idle. They are loaded again by get_wallet.
+        """
+        with self._wallets_lock:
+            return sorted(self._unloaded_wallets)
 
     def delete_wallet(self, path: str) -> bool:
+        from .wallet_sqlite_db import get_sqlite_path
         self.stop_wallet(path)
+        if os.path.exists(get_sqlite_path(path)):
+            os.unlink(get_sqlite_path(path))
         if os.path.exists(path):
             os.unlink(path)
             return True
@@ -519,12 +669,90 @@ class Daemon(Logger):
     def stop_wallet(self, path: str) -> bool:
         """Returns True iff a wallet was found."""
         path = standardize_path(path)
-        wallet = self._wallets.pop(path, None)
+        with self._wallets_lock:
+            self._wallets_last_used.pop(path, None)
+            if path in self._unloaded_wallets:
+                self._unloaded_wallets.discard(path)
+                return True
+            wallet = self._wallets.pop(path, None)
         if not wallet:
             return False
         wallet.stop()
         return True
 
+    @contextmanager
+    def wallet_in_use(self, wallet: 'Abstract_Wallet'):
+        """The wallet is not unloaded while a command runs on it."""
+        with self._wallets_lock:
+            self._num_commands_running[wallet] = self._num_commands_running.get(wallet, 0) + 1
+        try:
+            yield
+        finally:
+            with self._wallets_lock:
+                n = self._num_commands_running.pop(wallet) - 1
+                if n:
+                    self._num_commands_running[wallet] = n
+                # idle from now on
+                path = standardize_path(wallet.storage.path)
+                if self._wallets.get(path) is wallet:
+                    self._touch_wallet(path)
+
+    def _touch_wallet(self, path: str) -> None:
+        self._wallets.move_to_end(path)
+        self._wallets_last_used[path] = time.monotonic()
+
+    def _reload_wallet(self, path: str) -> Optional['Abstract_Wallet']:
+        from .plugin import run_hook
+        self.logger.info(f"reloading wallet {path}")
+        wallet = self.load_wallet(path, None, manual_upgrades=False)
+        if wallet is None:
+            # the file was deleted or became encrypted meanwhile
+            self._unloaded_wallets.discard(path)
+            self._wallets_last_used.pop(path, None)
+            return None
+        run_hook('load_wallet', wallet, None)
+        return wallet
+
+    def _can_unload_wallet(self, wallet: 'Abstract_Wallet', *, now: float) -> bool:
+        path = standardize_path(wallet.storage.path)
+        if wallet in self._num_commands_running:
+            return False
+        if now - self._wallets_last_used.get(path, now) < MIN_WALLET_IDLE_TIME:
+            return False
+        # we could not reload it without the password
+        if wallet.storage.is_encrypted():
+            return False
+        # channels need to be watched
+        if wallet.lnworker and wallet.lnworker.channels:
+            return False
+        return wallet.is_up_to_date()
+
+    def _unload_idle_wallets(self) -> None:
+        """Unloads the least recently used idle wallets while more than
+        'max_loaded_wallets' are loaded.
+        """
+        if not self.max_loaded_wallets or self.gui_object:
+            return
+        now = time.monotonic()
+        with self._wallets_lock:
+            num_to_unload = len(self._wallets) - self.max_loaded_wallets
+            for path, wallet in list(self._wallets.items()):
+                if num_to_unload <= 0:
+                    break
+                if not self._can_unload_wallet(wallet, now=now):
+                    continue
+                self.logger.info(f"unloading idle wallet {path}")
+                del self._wallets[path]
+                self._unloaded_wallets.add(path)
+                wallet.stop()
+                num_to_unload -= 1
+
+    async def _unload_idle_wallets_job(self):
+        # wallets that were busy when the last one was loaded become idle later
+        while True:
+            await asyncio.sleep(MIN_WALLET_IDLE_TIME / 2)
+            self._unload_idle_wallets()
+
     def run_daemon(self):
         self.running = True
         try:
@@ -545,8 +773,11 @@ class Daemon(Logger):
     def on_stop(self):
         if self.gui_object:
             self.gui_object.stop()
+        # let commands running in worker threads finish before stopping their wallets
+        if self.commands_server and self.commands_server.cmd_executor:
+            self.commands_server.cmd_executor.shutdown(wait=True)
         # stop network/wallets
-        for k, wallet in self._wallets.items():
+        for k, wallet in self.get_wallets().items():
             wallet.stop()
         if self.network:
             self.logger.info("shutting down network")
@@ -36,7 +36,7 @@ from .util import bfh, bh2u, assert_bytes, to_bytes, InvalidPassword, profiler,
 from .crypto import (sha256d, aes_encrypt_with_iv, aes_decrypt_with_iv, hmac_oneshot)
 from . import constants
 from .logging import get_logger
-from .ecc_fast import _libsecp256k1, SECP256K1_EC_UNCOMPRESSED
+from .ecc_fast import _libsecp256k1, SECP256K1_EC_UNCOMPRESSED, SECP256K1_EC_COMPRESSED
 
 _logger = get_logger(__name__)
 
@@ -137,6 +137,29 @@ class InvalidECPointException(Exception):
     """e.g. not on curve, or infinity"""
 
 
+def add_tweak_to_pubkey(pubkey: bytes, tweak: bytes) -> bytes:
+    """Returns the compressed pubkey of (pubkey + tweak*G).
+    Equivalent to (ECPrivkey(tweak) + ECPubkey(pubkey)), without the
+    intermediate conversions; used for bip32 public derivation.
+    """
+    assert isinstance(pubkey, bytes), f'pubkey must be bytes, not {type(pubkey)}'
+    assert len(tweak) == 32, len(tweak)
+    pubkey_ptr = create_string_buffer(64)
+    ret = _libsecp256k1.secp256k1_ec_pubkey_parse(
+        _libsecp256k1.ctx, pubkey_ptr, pubkey, len(pubkey))
+    if not ret:
+        raise InvalidECPointException('public key could not be parsed or is invalid')
+    # fails if tweak is not below the curve order, or if the result is infinity
+    ret = _libsecp256k1.secp256k1_ec_pubkey_tweak_add(_libsecp256k1.ctx, pubkey_ptr, tweak)
+    if not ret:
+        raise InvalidECPointException('tweak out of range, or result is infinity')
+    pubkey_serialized = create_string_buffer(33)
+    pubkey_size = c_size_t(33)
+    _libsecp256k1.secp256k1_ec_pubkey_serialize(
+        _libsecp256k1.ctx, pubkey_serialized, byref(pubkey_size), pubkey_ptr, SECP256K1_EC_COMPRESSED)
+    return bytes(pubkey_serialized)
+
+
 @functools.total_ordering
 class ECPubkey(object):
 
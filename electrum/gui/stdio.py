@@ -5,7 +5,7 @@ import logging
 
 from electrum import util
 from electrum import WalletStorage, Wallet
-from electrum.wallet_db import WalletDB
+from electrum.wallet_sqlite_db import open_wallet_db
 from electrum.util import format_satoshis
 from electrum.bitcoin import is_address, COIN
 from electrum.transaction import PartialTxOutput
@@ -31,7 +31,7 @@ class ElectrumGui:
             password = getpass.getpass('Password:', stream=None)
             storage.decrypt(password)
 
-        db = WalletDB(storage.read(), manual_upgrades=False)
+        db = open_wallet_db(storage, manual_upgrades=False, config=config)
 
         self.done = 0
         self.last_balance = ""
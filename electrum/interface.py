@@ -70,6 +70,14 @@ BUCKET_NAME_OF_ONION_SERVERS = 'onion'
 
 MAX_INCOMING_MSG_SIZE = 1_000_000  # in bytes
 
+# max number of header chunk requests in flight during catch-up
+HEADER_SYNC_PIPELINE_DEPTH = 4
+
+# JSON-RPC batching of history and transaction requests.
+# note: a whole batch response has to fit in MAX_INCOMING_MSG_SIZE
+NETWORK_BATCH_SIZE = 20
+NETWORK_BATCH_CONCURRENCY = 4
+
 _KNOWN_NETWORK_PROTOCOLS = {'t', 's'}
 PREFERRED_NETWORK_PROTOCOL = 's'
 assert PREFERRED_NETWORK_PROTOCOL in _KNOWN_NETWORK_PROTOCOLS
@@ -180,6 +188,26 @@ class NotificationSession(RPCSession):
             self.maybe_log(f"--> {response} (id: {msg_id})")
             return response
 
+    async def send_request_batch(self, requests: Sequence[Tuple[str, Sequence]], *, timeout=None) -> List[Any]:
+        """Sends (method, params) pairs as a single JSON-RPC batch.
+        Results are in the order of the requests. A request that failed
+        on the server is represented by an RPCError instance in the results.
+        """
+        async def send_batch():
+            async with self.send_batch() as batch:
+                for method, params in requests:
+                    batch.add_request(method, params)
+            return list(batch.results)
+
+        msg_id = next(self._msg_counter)
+        self.maybe_log(f"<-- batch {requests} (id: {msg_id})")
+        try:
+            results = await asyncio.wait_for(send_batch(), timeout)
+        except (TaskTimeout, asyncio.TimeoutError) as e:
+            raise RequestTimedOut(f'batch request timed out: {len(requests)} requests (id: {msg_id})') from e
+        self.maybe_log(f"--> {results} (id: {msg_id})")
+        return results
+
     def set_default_timeout(self, timeout):
         self.sent_request_timeout = timeout
         self.max_send_delay = timeout
@@ -360,6 +388,7 @@ class Interface(Logger):
         self.blockchain = None  # type: Optional[Blockchain]
         self._requested_chunks = set()  # type: Set[int]
         self.network = network
+        self._batch_semaphore = None  # type: Optional[asyncio.Semaphore]
         self.proxy = MySocksProxy.from_proxy_dict(proxy)
         self.session = None  # type: Optional[NotificationSession]
         self._ipaddr_bucket = None
@@ -567,15 +596,30 @@ class Interface(Logger):
         if can_return_early and index in self._requested_chunks:
             return
         self.logger.info(f"requesting chunk from height {height}")
-        size = 2016
-        if tip is not None:
-            size = min(size, tip - index * 2016 + 1)
-            size = max(size, 0)
+        size = self._chunk_size(index, tip)
         try:
             self._requested_chunks.add(index)
-            res = await self.session.send_request('blockchain.block.headers', [index * 2016, size])
+            hexdata = await self._fetch_chunk_hex(index, size)
         finally:
             self._requested_chunks.discard(index)
+        conn = self.blockchain.connect_chunk(index, hexdata)
+        if not conn:
+            return conn, 0
+        return conn, size
+
+    @classmethod
+    def _chunk_size(cls, index: int, tip: Optional[int]) -> int:
+        size = 2016
+        if tip is not None:
+            size = min(size, tip - index * 2016 + 1)
+            size = max(size, 0)
+        return size
+
+    async def _fetch_chunk_hex(self, index: int, size: int) -> str:
+        """Downloads 'size' headers starting at height index*2016, and
+        returns them as hex. The headers are not verified.
+        """
+        res = await self.session.send_request('blockchain.block.headers', [index * 2016, size])
         assert_dict_contains_field(res, field_name='count')
         assert_dict_contains_field(res, field_name='hex')
         assert_dict_contains_field(res, field_name='max')
@@ -586,10 +630,78 @@ class Interface(Logger):
             raise RequestCorrupted('inconsistent chunk hex and count')
         if res['count'] != size:
             raise RequestCorrupted(f"expected {size} headers but only got {res['count']}")
-        conn = self.blockchain.connect_chunk(index, res['hex'])
-        if not conn:
-            return conn, 0
-        return conn, res['count']
+        return res['hex']
+
+    def _get_helper_interfaces_for_header_sync(self, tip: int) -> Sequence['Interface']:
+        """Other connected interfaces that can serve headers up to tip."""
+        with self.network.interfaces_lock:
+            interfaces = list(self.network.interfaces.values())
+        return [iface for iface in interfaces
+                if iface is not self
+                and iface.ready.done() and not iface.ready.cancelled()
+                and iface.session and not iface.session.is_closing()
+                and iface.tip >= tip]
+
+    async def _fetch_chunk_hex_from(self, iface: 'Interface', index: int, size: int) -> Tuple[str, 'Interface']:
+        """Returns the chunk hex, and the interface that served it."""
+        if iface is not self:
+            try:
+                return await iface._fetch_chunk_hex(index, size), iface
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # helpers are best-effort; fall back to our own server
+                self.logger.info(f"chunk {index} from helper {iface} failed: {repr(e)}")
+        return await self._fetch_chunk_hex(index, size), self
+
+    async def request_chunks(self, height: int, tip: int) -> Tuple[bool, int]:
+        """Catches up from height towards tip chunk by chunk, keeping
+        several chunk requests in flight, spread over other connected
+        interfaces if available. Chunks are still verified and saved in
+        height order. A chunk from another interface that does not connect
+        is requested again from our own server, so that only our own
+        server's data can make us stop.
+        Returns whether the first chunk could be connected, and the number
+        of headers connected, counting from the start of the first chunk.
+        """
+        depth = self.network.config.get('header_sync_pipeline_depth', HEADER_SYNC_PIPELINE_DEPTH)
+        first_index, last_index = height // 2016, tip // 2016
+        if depth <= 1 or first_index == last_index:
+            return await self.request_chunk(height, tip)
+        self.logger.info(f"requesting chunks {first_index}..{last_index} (pipeline depth {depth})")
+        sources = [self] + list(self._get_helper_interfaces_for_header_sync(tip))
+        num_headers = 0
+        pending = []  # type: List[Tuple[int, asyncio.Task]]
+        async with TaskGroup() as group:
+            next_index = first_index
+            num_requests = 0
+            for index in range(first_index, last_index + 1):
+                while next_index <= last_index and len(pending) < depth:
+                    iface = sources[num_requests % len(sources)]
+                    num_requests += 1
+                    size = self._chunk_size(next_index, tip)
+                    task = await group.spawn(self._fetch_chunk_hex_from(iface, next_index, size))
+                    pending.append((next_index, task))
+                    next_index += 1
+                index_, task = pending.pop(0)
+                assert index_ == index, (index_, index)
+                hexdata, iface = await task
+                connected = self.blockchain.connect_chunk(index, hexdata)
+                if not connected and iface is not self:
+                    # The helper might follow another chain, or serve bad data.
+                    # Only a chunk served by our own server tells whether it conflicts.
+                    self.logger.info(f"chunk {index} from helper {iface} does not connect, "
+                                     f"requesting it from our own server")
+                    if iface in sources:
+                        sources.remove(iface)
+                    hexdata = await self._fetch_chunk_hex(index, self._chunk_size(index, tip))
+                    connected = self.blockchain.connect_chunk(index, hexdata)
+                if not connected:
+                    break
+                num_headers += len(hexdata) // (HEADER_SIZE * 2)
+                util.trigger_callback('network_updated')
+            await group.cancel_remaining()
+        return num_headers > 0, num_headers
 
     def is_main_server(self) -> bool:
         return (self.network.interface == self or
@@ -701,7 +813,7 @@ class Interface(Logger):
         while last is None or height <= next_height:
             prev_last, prev_height = last, height
             if next_height > height + 10:
-                could_connect, num_headers = await self.request_chunk(height, next_height)
+                could_connect, num_headers = await self.request_chunks(height, next_height)
                 if not could_connect:
                     if height <= constants.net.max_checkpoint():
                         raise GracefulDisconnect('server chain conflicts with checkpoints or genesis')
@@ -892,7 +1004,11 @@ class Interface(Logger):
         if not is_hash256_str(tx_hash):
             raise Exception(f"{repr(tx_hash)} is not a txid")
         raw = await self.session.send_request('blockchain.transaction.get', [tx_hash], timeout=timeout)
-        # validate response
+        self._validate_raw_transaction(raw, tx_hash)
+        return raw
+
+    @classmethod
+    def _validate_raw_transaction(cls, raw: Any, tx_hash: str) -> None:
         tx = Transaction(raw)
         try:
             tx.deserialize()  # see if raises
@@ -900,14 +1016,17 @@ class Interface(Logger):
             raise RequestCorrupted(f"cannot deserialize received transaction (txid {tx_hash})") from e
         if tx.txid() != tx_hash:
             raise RequestCorrupted(f"received tx does not match expected txid {tx_hash} (got {tx.txid()})")
-        return raw
 
     async def get_history_for_scripthash(self, sh: str) -> List[dict]:
         if not is_hash256_str(sh):
             raise Exception(f"{repr(sh)} is not a scripthash")
         # do request
         res = await self.session.send_request('blockchain.scripthash.get_history', [sh])
-        # check response
+        self._validate_history(res)
+        return res
+
+    @classmethod
+    def _validate_history(cls, res: Any) -> None:
         assert_list_or_tuple(res)
         for tx_item in res:
             assert_dict_contains_field(tx_item, field_name='height')
@@ -917,7 +1036,56 @@ class Interface(Logger):
             if tx_item['height'] in (-1, 0):
                 assert_dict_contains_field(tx_item, field_name='fee')
                 assert_non_negative_integer(tx_item['fee'])
-        return res
+
+    async def _send_batched_requests(self, method: str, params_list: Sequence[list]) -> List[Any]:
+        """Sends one request per params, grouped in JSON-RPC batches of at most
+        'network_batch_size' requests, with at most 'network_batch_concurrency'
+        batches in flight. Results are in the order of params_list; requests
+        that failed on the server are represented by RPCError instances.
+        """
+        config = self.network.config
+        batch_size = max(1, config.get('network_batch_size', NETWORK_BATCH_SIZE))
+        if self._batch_semaphore is None:
+            concurrency = max(1, config.get('network_batch_concurrency', NETWORK_BATCH_CONCURRENCY))
+            self._batch_semaphore = asyncio.Semaphore(concurrency)
+
+        async def send_batch(batch_params):
+            async with self._batch_semaphore:
+                if len(batch_params) == 1:  # no need for batch framing
+                    try:
+                        return [await self.session.send_request(method, batch_params[0])]
+                    except aiorpcx.jsonrpc.RPCError as e:
+                        return [e]
+                return await self.session.send_request_batch([(method, params) for params in batch_params])
+
+        async with TaskGroup() as group:
+            tasks = [await group.spawn(send_batch(params_list[i:i+batch_size]))
+                     for i in range(0, len(params_list), batch_size)]
+        return [result for task in tasks for result in task.result()]
+
+    async def get_history_for_scripthashes(self, shs: Sequence[str]) -> List[Union[List[dict], Exception]]:
+        """Batched get_history_for_scripthash. Results are in order.
+        Histories the server failed to return are RPCError instances."""
+        for sh in shs:
+            if not is_hash256_str(sh):
+                raise Exception(f"{repr(sh)} is not a scripthash")
+        results = await self._send_batched_requests('blockchain.scripthash.get_history', [[sh] for sh in shs])
+        for res in results:
+            if not isinstance(res, Exception):
+                self._validate_history(res)
+        return results
+
+    async def get_transactions(self, tx_hashes: Sequence[str]) -> List[Union[str, Exception]]:
+        """Batched get_transaction. Results are in order.
+        Transactions the server failed to return are RPCError instances."""
+        for tx_hash in tx_hashes:
+            if not is_hash256_str(tx_hash):
+                raise Exception(f"{repr(tx_hash)} is not a txid")
+        results = await self._send_batched_requests('blockchain.transaction.get', [[tx_hash] for tx_hash in tx_hashes])
+        for raw, tx_hash in zip(results, tx_hashes):
+            if not isinstance(raw, Exception):
+                self._validate_raw_transaction(raw, tx_hash)
+        return results
 
     async def listunspent_for_scripthash(self, sh: str) -> List[dict]:
         if not is_hash256_str(sh):
@@ -25,12 +25,45 @@
 import threading
 import copy
 import json
+from typing import Dict, Tuple, Sequence, List, Optional, Any
 
 from . import util
 from .logging import Logger
 
 JsonDBJsonEncoder = util.MyEncoder
 
+# Journal records are appended after the JSON snapshot, each one prefixed
+# by this separator. It cannot occur in json.dumps() output, which escapes
+# newlines inside strings and only indents with spaces.
+JOURNAL_SEPARATOR = '\n@'
+
+
+def split_journal(s: str) -> Tuple[str, List[str]]:
+    """Splits serialized db into the snapshot and its journal records."""
+    parts = s.split(JOURNAL_SEPARATOR)
+    return parts[0], parts[1:]
+
+
+def apply_journal_record(data: dict, record: str) -> None:
+    """Replays a record created by JsonDB.dump_pending_changes on 'data'.
+    Each change is [path, value] to set a value or [path] to delete it.
+    """
+    for change in json.loads(record):
+        path, value = change[0], change[1:]
+        node = data
+        for key in path[:-1]:
+            child = node.get(key)
+            if not isinstance(child, dict):
+                if not value:
+                    break  # already deleted
+                child = node[key] = {}
+            node = child
+        else:
+            if value:
+                node[path[-1]] = value[0]
+            else:
+                node.pop(path[-1], None)
+
 def modifier(func):
     def wrapper(self, *args, **kwargs):
         with self.lock:
@@ -48,14 +81,18 @@ def locked(func):
 class StoredObject:
 
     db = None
+    _path = None
 
     def __setattr__(self, key, value):
         if self.db:
             self.db.set_modified(True)
         object.__setattr__(self, key, value)
+        if self.db and self._path is not None:
+            self.db.record_change(self._path)
 
-    def set_db(self, db):
-        self.db = db
+    def set_db(self, db, path=None):
+        object.__setattr__(self, 'db', db)
+        object.__setattr__(self, '_path', path)
 
     def to_json(self):
         d = dict(vars(self))
@@ -70,13 +107,22 @@ _RaiseKeyError = object() # singleton for no-default behavior
 
 class StoredDict(dict):
 
+    _journaling = True
+
     def __init__(self, data, db, path):
         self.db = db
         self.lock = self.db.lock if self.db else threading.RLock()
         self.path = path
-        # recursively convert dicts to StoredDict
+        # recursively convert dicts to StoredDict.
+        # this is not a change, hence not journaled
+        self._journaling = False
         for k, v in list(data.items()):
             self.__setitem__(k, v)
+        self._journaling = True
+
+    def _record_change(self, key):
+        if self.db and self._journaling:
+            self.db.record_change(self.path + [key])
 
     def convert_key(self, key):
         """Convert int keys to str keys, as only those are allowed in json."""
@@ -91,6 +137,9 @@ class StoredDict(dict):
         is_new = key not in self
         # early return to prevent unnecessary disk writes
         if not is_new and self[key] == v:
+            if self[key] is v:
+                # might have been modified in-place (e.g. a list)
+                self._record_change(key)
             return
         # recursively set db and path
         if isinstance(v, StoredDict):
@@ -111,11 +160,12 @@ class StoredDict(dict):
                 v = self.db._convert_value(self.path, key, v)
         # set parent of StoredObject
         if isinstance(v, StoredObject):
-            v.set_db(self.db)
+            v.set_db(self.db, self.path + [key])
         # set item
         dict.__setitem__(self, key, v)
         if self.db:
             self.db.set_modified(True)
+        self._record_change(key)
 
     @locked
     def __delitem__(self, key):
@@ -123,6 +173,7 @@ class StoredDict(dict):
         dict.__delitem__(self, key)
         if self.db:
             self.db.set_modified(True)
+        self._record_change(key)
 
     @locked
     def __getitem__(self, key):
@@ -143,8 +194,17 @@ class StoredDict(dict):
             r = dict.pop(self, key, v)
         if self.db:
             self.db.set_modified(True)
+        self._record_change(key)
         return r
 
+    @locked
+    def clear(self):
+        dict.clear(self)
+        if self.db:
+            self.db.set_modified(True)
+            if self._journaling:
+                self.db.record_change(self.path)
+
     @locked
     def get(self, key, default=None):
         key = self.convert_key(key)
@@ -160,6 +220,8 @@ class JsonDB(Logger):
         self.lock = threading.RLock()
         self.data = data
         self._modified = False
+        # paths changed since the last write, in order of first change
+        self._pending_changes = {}  # type: Dict[Tuple[str, ...], None]
 
     def set_modified(self, b):
         with self.lock:
@@ -168,6 +230,41 @@ class JsonDB(Logger):
     def modified(self):
         return self._modified
 
+    def record_change(self, path: Sequence[str]) -> None:
+        """Remembers that the value at 'path' changed, so that the next
+        journal record includes it."""
+        with self.lock:
+            self._pending_changes[tuple(path)] = None
+
+    @locked
+    def dump_pending_changes(self) -> Optional[str]:
+        """Serializes the current values at all changed paths as a journal
+        record, see apply_journal_record. Returns None if nothing changed.
+
+        Values are looked up at write time, so a path changed many times
+        is written once, and replaying in order of first change gives the
+        current state.
+        """
+        if not self._pending_changes:
+            return None
+        changes = []
+        for path in self._pending_changes:
+            found, value = self._lookup(path)
+            changes.append([list(path), value] if found else [list(path)])
+        return json.dumps(changes, cls=JsonDBJsonEncoder)
+
+    def clear_pending_changes(self) -> None:
+        with self.lock:
+            self._pending_changes.clear()
+
+    def _lookup(self, path: Sequence[str]) -> Tuple[bool, Any]:
+        node = self.data
+        for key in path:
+            if not isinstance(node, dict) or key not in node:
+                return False, None
+            node = node[key]
+        return True, node
+
     @locked
     def get(self, key, default=None):
         v = self.data.get(key)
@@ -183,6 +280,8 @@ class JsonDB(Logger):
         except:
             self.logger.info(f"json error: cannot save {repr(key)} ({repr(value)})")
             return False
+        # the stored value might have been modified in-place
+        self.record_change([key])
         if value is not None:
             if self.data.get(key) != value:
                 self.data[key] = copy.deepcopy(value)
@@ -29,6 +29,7 @@ import hashlib
 import re
 from typing import Tuple, TYPE_CHECKING, Union, Sequence, Optional, Dict, List, NamedTuple
 from functools import lru_cache
+from concurrent.futures import Executor
 from abc import ABC, abstractmethod
 
 from . import bitcoin, ecc, constants, bip32
@@ -36,7 +37,8 @@ from .bitcoin import deserialize_privkey, serialize_privkey, BaseDecodeError
 from .transaction import Transaction, PartialTransaction, PartialTxInput, PartialTxOutput, TxInput
 from .bip32 import (convert_bip32_path_to_list_of_uint32, BIP32_PRIME,
                     is_xpub, is_xprv, BIP32Node, normalize_bip32_derivation,
-                    convert_bip32_intpath_to_strpath, is_xkey_consistent_with_key_origin_info)
+                    convert_bip32_intpath_to_strpath, is_xkey_consistent_with_key_origin_info,
+                    derive_child_pubkeys)
 from .ecc import string_to_number
 from .crypto import (pw_decode, pw_encode, sha256, sha256d, PW_HASH_VERSION_LATEST,
                      SUPPORTED_PW_HASH_VERSIONS, UnsupportedPasswordHashVersion, hash_160)
@@ -55,6 +57,10 @@ if TYPE_CHECKING:
 class CannotDerivePubkey(Exception): pass
 
 
+# number of child pubkeys per task, when deriving with an executor
+DERIVATION_CHUNK_SIZE = 1000
+
+
 class KeyStore(Logger, ABC):
     type: str
 
@@ -183,7 +189,7 @@ class Software_KeyStore(KeyStore):
         decrypted = ec.decrypt_message(message)
         return decrypted
 
-    def sign_transaction(self, tx, password):
+    def sign_transaction(self, tx, password, *, executor: Executor = None):
         if self.is_watching_only():
             return
         # Raise if password is not correct.
@@ -194,7 +200,7 @@ class Software_KeyStore(KeyStore):
             keypairs[k] = self.get_private_key(v, password)
         # Sign
         if keypairs:
-            tx.sign(keypairs)
+            tx.sign(keypairs, executor=executor)
 
     @abstractmethod
     def update_password(self, old_password, new_password):
@@ -372,6 +378,13 @@ class MasterPublicKeyMixin(ABC):
         """
         pass
 
+    def derive_pubkeys(self, for_change: int, start: int, stop: int, *,
+                       executor: Executor = None) -> List[bytes]:
+        """Returns the pubkeys at paths (for_change, n), for n in range(start, stop).
+        May raise CannotDerivePubkey.
+        """
+        return [self.derive_pubkey(for_change, n) for n in range(start, stop)]
+
     def get_pubkey_derivation(
             self,
             pubkey: bytes,
@@ -433,9 +446,9 @@ class Xpub(MasterPublicKeyMixin):
 
     def __init__(self, *, derivation_prefix: str = None, root_fingerprint: str = None):
         self.xpub = None
-        self.xpub_receive = None
-        self.xpub_change = None
         self._xpub_bip32_node = None  # type: Optional[BIP32Node]
+        # for_change -> node at the receiving/change branch of xpub
+        self._branch_bip32_nodes = {}  # type: Dict[int, BIP32Node]
 
         # "key origin" info (subclass should persist these):
         self._derivation_prefix = derivation_prefix  # type: Optional[str]
@@ -518,20 +531,34 @@ class Xpub(MasterPublicKeyMixin):
             self._derivation_prefix = derivation_prefix
         self.is_requesting_to_be_rewritten_to_wallet_file = True
 
-    @lru_cache(maxsize=None)
-    def derive_pubkey(self, for_change: int, n: int) -> bytes:
+    def get_bip32_node_for_branch(self, for_change: int) -> BIP32Node:
         for_change = int(for_change)
         if for_change not in (0, 1):
             raise CannotDerivePubkey("forbidden path")
-        xpub = self.xpub_change if for_change else self.xpub_receive
-        if xpub is None:
-            rootnode = self.get_bip32_node_for_xpub()
-            xpub = rootnode.subkey_at_public_derivation((for_change,)).to_xpub()
-            if for_change:
-                self.xpub_change = xpub
-            else:
-                self.xpub_receive = xpub
-        return self.get_pubkey_from_xpub(xpub, (n,))
+        node = self._branch_bip32_nodes.get(for_change)
+        if node is None:
+            node = self.get_bip32_node_for_xpub().subkey_at_public_derivation((for_change,))
+            self._branch_bip32_nodes[for_change] = node
+        return node
+
+    @lru_cache(maxsize=None)
+    def derive_pubkey(self, for_change: int, n: int) -> bytes:
+        return self.get_bip32_node_for_branch(for_change).child_pubkeys(n, n + 1)[0]
+
+    def derive_pubkeys(self, for_change: int, start: int, stop: int, *,
+                       executor: Executor = None) -> List[bytes]:
+        """Derives a range of pubkeys from the branch node, which is only
+        parsed once. If an 'executor' (e.g. a ProcessPoolExecutor) is given,
+        large ranges are split into chunks that are derived in parallel.
+        """
+        node = self.get_bip32_node_for_branch(for_change)
+        if executor is None or stop - start < 2 * DERIVATION_CHUNK_SIZE:
+            return node.child_pubkeys(start, stop)
+        pubkey = node.eckey.get_public_key_bytes(compressed=True)
+        futures = [executor.submit(derive_child_pubkeys, pubkey, node.chaincode,
+                                   i, min(i + DERIVATION_CHUNK_SIZE, stop))
+                   for i in range(start, stop, DERIVATION_CHUNK_SIZE)]
+        return [pk for fut in futures for pk in fut.result()]
 
     @classmethod
     def get_pubkey_from_xpub(self, xpub: str, sequence) -> bytes:
@@ -1,6 +1,7 @@
 import os
 import csv
 import io
+import struct
 from typing import Callable, Tuple, Any, Dict, List, Sequence, Union, Optional
 from collections import OrderedDict
 
@@ -270,6 +271,217 @@ def _resolve_field_count(field_count_str: str, *, vars_dict: dict, allow_any=Fal
     return field_count
 
 
+# Field types of fixed size, and the struct formats of the integer ones.
+# The serializer compiles the schemes of the CSV files into the steps below;
+# _read_field and _write_field, which interpret a field from its scheme row,
+# define their semantics.
+_FIXED_SIZE_TYPE_LEN = {
+    'byte': 1,
+    'chain_hash': 32,
+    'channel_id': 32,
+    'sha256': 32,
+    'signature': 64,
+    'point': 33,
+    'short_channel_id': 8,
+}
+_INT_TYPE_FORMAT = {'u8': 'B', 'u16': 'H', 'u32': 'I', 'u64': 'Q'}
+_INT_TYPE_LEN = {'u8': 1, 'u16': 2, 'u32': 4, 'u64': 8}
+_TRUNCATED_INT_TYPE_LEN = {'tu16': 2, 'tu32': 4, 'tu64': 8}
+
+
+def _read_bigsize_int_at(buf: bytes, pos: int, end: int) -> Tuple[Optional[int], int]:
+    """Like read_bigsize_int, for the bytes buf[pos:end]. Returns the value and the new position."""
+    if pos >= end:
+        return None, pos  # end of file
+    first = buf[pos]
+    if first < 0xfd:
+        return first, pos + 1
+    if first == 0xfd:
+        size, min_val = 2, 0xfd
+    elif first == 0xfe:
+        size, min_val = 4, 0x1_0000
+    else:
+        size, min_val = 8, 0x1_0000_0000
+    pos += 1
+    if pos + size > end:
+        raise UnexpectedEndOfStream()
+    val = int.from_bytes(buf[pos:pos + size], byteorder="big", signed=False)
+    if val < min_val:
+        raise FieldEncodingNotMinimal()
+    return val, pos + size
+
+
+def _read_field_at(buf: bytes, pos: int, end: int, *, field_type: str,
+                   count: Union[int, str]) -> Tuple[Union[bytes, int], int]:
+    """Like _read_field, for the bytes buf[pos:end]. Returns the value and the new position."""
+    if isinstance(count, int):
+        assert count >= 0, f"{count!r} must be non-neg int"
+    elif count != "...":
+        raise Exception(f"unexpected field count: {count!r}")
+    if count == 0:
+        return b"", pos
+    if field_type in _INT_TYPE_LEN:
+        assert count == 1, count
+        type_len = _INT_TYPE_LEN[field_type]
+        if pos + type_len > end:
+            raise UnexpectedEndOfStream()
+        return int.from_bytes(buf[pos:pos + type_len], byteorder="big", signed=False), pos + type_len
+    if field_type in _TRUNCATED_INT_TYPE_LEN:
+        assert count == 1, count
+        raw = buf[pos:min(end, pos + _TRUNCATED_INT_TYPE_LEN[field_type])]
+        if len(raw) > 0 and raw[0] == 0x00:
+            raise FieldEncodingNotMinimal()
+        return int.from_bytes(raw, byteorder="big", signed=False), pos + len(raw)
+    if field_type == 'varint':
+        assert count == 1, count
+        val, pos = _read_bigsize_int_at(buf, pos, end)
+        if val is None:
+            raise UnexpectedEndOfStream()
+        return val, pos
+    if count == "...":
+        return buf[pos:end], end  # read all
+    type_len = _FIXED_SIZE_TYPE_LEN.get(field_type)
+    if type_len is None:
+        raise UnknownMsgFieldType(f"unknown field type: {field_type!r}")
+    total_len = count * type_len
+    if pos + total_len > end:
+        raise UnexpectedEndOfStream()
+    return buf[pos:pos + total_len], pos + total_len
+
+
+def _field_to_bytes(*, field_type: str, count: Union[int, str], value: Union[bytes, int]) -> bytes:
+    """Returns what _write_field writes."""
+    with io.BytesIO() as fd:
+        _write_field(fd=fd, field_type=field_type, count=count, value=value)
+        return fd.getvalue()
+
+
+def _get_field_count_resolver(field_count_str: str, *, allow_any: bool) -> Callable[[dict], Union[int, str]]:
+    """Returns a function of vars_dict that is equivalent to _resolve_field_count."""
+    if field_count_str == "":
+        return lambda vars_dict: 1
+    if field_count_str == "...":
+        return lambda vars_dict: _resolve_field_count(field_count_str, vars_dict=vars_dict, allow_any=allow_any)
+    try:
+        field_count = int(field_count_str)
+    except ValueError:
+        return lambda vars_dict: _resolve_field_count(field_count_str, vars_dict=vars_dict, allow_any=allow_any)
+    return lambda vars_dict: field_count
+
+
+def _get_static_field_format(field_type: str, field_count_str: str) -> Optional[str]:
+    """Returns the struct format of a field of constant size that decodes to
+    the same value as _read_field, or None.
+    """
+    if field_count_str == "":
+        count = 1
+    elif field_count_str.isdigit():
+        count = int(field_count_str)
+    else:
+        return None  # variable size
+    if count == 0:
+        return None
+    if field_type in _INT_TYPE_FORMAT:
+        return _INT_TYPE_FORMAT[field_type] if count == 1 else None
+    if field_type in _FIXED_SIZE_TYPE_LEN:
+        return f"{count * _FIXED_SIZE_TYPE_LEN[field_type]}s"
+    return None
+
+
+# A decoding step reads a field, or consecutive fields, of buf[pos:end] into parsed, and
+# returns the new position. An encoding step returns the bytes of a field given its value.
+DecodingStep = Callable[[bytes, int, int, dict], int]
+EncodingStep = Callable[[dict, Union[bytes, int]], bytes]
+
+
+def _compile_struct_step(fields: Sequence[Tuple[str, str]]) -> DecodingStep:
+    field_names = tuple(field_name for field_name, fmt in fields)
+    s = struct.Struct('>' + ''.join(fmt for field_name, fmt in fields))
+    size = s.size
+    unpack_from = s.unpack_from
+
+    def step(buf, pos, end, parsed):
+        if pos + size > end:
+            raise UnexpectedEndOfStream()
+        parsed.update(zip(field_names, unpack_from(buf, pos)))
+        return pos + size
+    return step
+
+
+def _compile_field_step(field_name: str, field_type: str, field_count_str: str,
+                        *, allow_any: bool) -> DecodingStep:
+    get_count = _get_field_count_resolver(field_count_str, allow_any=allow_any)
+    type_len = _FIXED_SIZE_TYPE_LEN.get(field_type)
+    if type_len is not None and field_count_str not in ("", "...") and not field_count_str.isdigit():
+        # count given by a previous field
+        def step(buf, pos, end, parsed):
+            count = parsed[field_count_str]
+            if type(count) is not int or count <= 0:
+                parsed[field_name], pos = _read_field_at(buf, pos, end, field_type=field_type, count=get_count(parsed))
+                return pos
+            new_pos = pos + count * type_len
+            if new_pos > end:
+                raise UnexpectedEndOfStream()
+            parsed[field_name] = buf[pos:new_pos]
+            return new_pos
+        return step
+
+    def step(buf, pos, end, parsed):
+        parsed[field_name], pos = _read_field_at(buf, pos, end, field_type=field_type, count=get_count(parsed))
+        return pos
+    return step
+
+
+def _compile_decoding_steps(rows: Sequence[Tuple[str, str, str, bool]],
+                            *, allow_any: bool) -> List[Tuple[DecodingStep, bool]]:
+    """Compiles (field_name, field_type, field_count_str, is_optional) rows
+    into (step, is_optional) pairs. Consecutive mandatory fields of constant
+    size are read in one step.
+    """
+    steps = []
+    struct_fields = []
+    for field_name, field_type, field_count_str, is_optional in rows:
+        fmt = _get_static_field_format(field_type, field_count_str)
+        if fmt is not None and not is_optional:
+            struct_fields.append((field_name, fmt))
+            continue
+        if struct_fields:
+            steps.append((_compile_struct_step(struct_fields), False))
+            struct_fields = []
+        if fmt is not None:
+            step = _compile_struct_step([(field_name, fmt)])
+        else:
+            step = _compile_field_step(field_name, field_type, field_count_str, allow_any=allow_any)
+        steps.append((step, is_optional))
+    if struct_fields:
+        steps.append((_compile_struct_step(struct_fields), False))
+    return steps
+
+
+def _compile_encoding_step(field_type: str, field_count_str: str, *, allow_any: bool) -> EncodingStep:
+    get_count = _get_field_count_resolver(field_count_str, allow_any=allow_any)
+    fmt = _get_static_field_format(field_type, field_count_str)
+    if fmt is not None and field_type in _INT_TYPE_FORMAT:
+        type_len = _INT_TYPE_LEN[field_type]
+
+        def step(vars_dict, value):
+            if type(value) is int:
+                return value.to_bytes(type_len, byteorder="big", signed=False)
+            return _field_to_bytes(field_type=field_type, count=1, value=value)
+    elif fmt is not None:
+        total_len = struct.calcsize(fmt)
+        count = get_count({})
+
+        def step(vars_dict, value):
+            if type(value) is bytes and len(value) == total_len:
+                return value
+            return _field_to_bytes(field_type=field_type, count=count, value=value)
+    else:
+        def step(vars_dict, value):
+            return _field_to_bytes(field_type=field_type, count=get_count(vars_dict), value=value)
+    return step
+
+
 def _parse_msgtype_intvalue_for_onion_wire(value: str) -> int:
     msg_type_int = 0
     for component in value.split("|"):
@@ -291,6 +503,12 @@ class LNSerializer:
         self.in_tlv_stream_get_record_type_from_name = {}  # type: Dict[str, Dict[str, int]]
         self.in_tlv_stream_get_record_name_from_type = {}  # type: Dict[str, Dict[int, str]]
 
+        # the schemes are compiled on first use
+        self._msg_decoders = {}  # type: Dict[bytes, Tuple[str, List[Tuple[DecodingStep, bool]]]]
+        self._msg_encoders = {}  # type: Dict[str, List[Tuple[str, Optional[Callable], Optional[EncodingStep], Optional[str], bool]]]
+        self._tlv_record_decoders = {}  # type: Dict[str, Dict[int, Tuple[str, List[Tuple[DecodingStep, bool]]]]]
+        self._tlv_stream_encoders = {}  # type: Dict[str, List[Tuple[int, str, List[Tuple[str, EncodingStep]]]]]
+
         if for_onion_wire:
             path = os.path.join(os.path.dirname(__file__), "lnwire", "onion_wire.csv")
         else:
@@ -343,7 +561,170 @@ class LNSerializer:
                 else:
                     pass  # TODO
 
+    def _get_msg_decoder(self, msg_type_bytes: bytes) -> Tuple[str, List[Tuple[DecodingStep, bool]]]:
+        decoder = self._msg_decoders.get(msg_type_bytes)
+        if decoder is not None:
+            return decoder
+        scheme = self.msg_scheme_from_type[msg_type_bytes]
+        rows = []
+        steps = []
+        for row in scheme[1:]:
+            # msgdata,<msgname>,<fieldname>,<typename>,[<count>][,<option>]
+            if row[2] == "tlvs":
+                steps += _compile_decoding_steps(rows, allow_any=False)
+                rows = []
+                steps.append((self._compile_tlv_stream_step(tlv_stream_name=row[3]), False))
+            else:
+                rows.append((row[2], row[3], row[4], len(row) > 5))
+        steps += _compile_decoding_steps(rows, allow_any=False)
+        decoder = self._msg_decoders[msg_type_bytes] = (scheme[0][1], steps)
+        return decoder
+
+    def _compile_tlv_stream_step(self, *, tlv_stream_name: str) -> DecodingStep:
+        def step(buf, pos, end, parsed):
+            parsed[tlv_stream_name] = self._decode_tlv_stream(buf, pos, end, tlv_stream_name=tlv_stream_name)
+            return end
+        return step
+
+    def _get_tlv_record_decoders(self, tlv_stream_name: str) -> Dict[int, Tuple[str, List[Tuple[DecodingStep, bool]]]]:
+        decoders = self._tlv_record_decoders.get(tlv_stream_name)
+        if decoders is not None:
+            return decoders
+        decoders = {}
+        for tlv_record_type, scheme in self.in_tlv_stream_get_tlv_record_scheme_from_type[tlv_stream_name].items():
+            # tlvdata,<tlvstreamname>,<tlvname>,<fieldname>,<typename>,[<count>][,<option>]
+            rows = [(row[3], row[4], row[5], False) for row in scheme[1:]]
+            decoders[tlv_record_type] = (scheme[0][2], _compile_decoding_steps(rows, allow_any=True))
+        self._tlv_record_decoders[tlv_stream_name] = decoders
+        return decoders
+
+    def _decode_tlv_stream(self, buf: bytes, pos: int, end: int, *, tlv_stream_name: str) -> Dict[str, Dict[str, Any]]:
+        parsed = {}  # type: Dict[str, Dict[str, Any]]
+        decoders = self._get_tlv_record_decoders(tlv_stream_name)
+        last_seen_tlv_record_type = -1  # type: int
+        while pos < end:
+            tlv_record_type, pos = _read_bigsize_int_at(buf, pos, end)
+            tlv_len, pos = _read_bigsize_int_at(buf, pos, end)
+            if tlv_len is None or pos + tlv_len > end:
+                raise UnexpectedEndOfStream()
+            record_start, pos = pos, pos + tlv_len
+            if not (tlv_record_type > last_seen_tlv_record_type):
+                raise MsgInvalidFieldOrder(f"TLV records must be monotonically increasing by type. "
+                                           f"cur: {tlv_record_type}. prev: {last_seen_tlv_record_type}")
+            last_seen_tlv_record_type = tlv_record_type
+            try:
+                tlv_record_name, steps = decoders[tlv_record_type]
+            except KeyError:
+                if tlv_record_type % 2 == 0:
+                    # unknown "even" type: hard fail
+                    raise UnknownMandatoryTLVRecordType(f"{tlv_stream_name}/{tlv_record_type}") from None
+                else:
+                    # unknown "odd" type: skip it
+                    continue
+            record = parsed[tlv_record_name] = {}
+            field_pos = record_start
+            for step, is_optional in steps:
+                field_pos = step(buf, field_pos, pos, record)
+            if field_pos < pos:
+                raise MsgTrailingGarbage(f"TLV record ({tlv_stream_name}/{tlv_record_name}) has extra trailing garbage")
+        return parsed
+
+    def _get_msg_encoder(self, msg_type: str) -> List[Tuple[str, Optional[Callable], Optional[EncodingStep], Optional[str], bool]]:
+        encoder = self._msg_encoders.get(msg_type)
+        if encoder is not None:
+            return encoder
+        encoder = []
+        for row in self.msg_scheme_from_type[self.msg_type_from_name[msg_type]][1:]:
+            # msgdata,<msgname>,<fieldname>,<typename>,[<count>][,<option>]
+            field_name, field_type, field_count_str = row[2], row[3], row[4]
+            # a variable count is looked up even if the field is not written
+            get_count = None
+            if field_count_str != "" and not field_count_str.isdigit():
+                get_count = _get_field_count_resolver(field_count_str, allow_any=False)
+            if field_name == "tlvs":
+                encoder.append((field_name, get_count, None, field_type, False))
+            else:
+                step = _compile_encoding_step(field_type, field_count_str, allow_any=False)
+                encoder.append((field_name, get_count, step, None, len(row) > 5))
+        self._msg_encoders[msg_type] = encoder
+        return encoder
+
+    def _get_tlv_stream_encoder(self, tlv_stream_name: str) -> List[Tuple[int, str, List[Tuple[str, EncodingStep]]]]:
+        encoder = self._tlv_stream_encoders.get(tlv_stream_name)
+        if encoder is not None:
+            return encoder
+        encoder = []
+        # note: tlv_record_type is monotonically increasing
+        for tlv_record_type, scheme in self.in_tlv_stream_get_tlv_record_scheme_from_type[tlv_stream_name].items():
+            # tlvdata,<tlvstreamname>,<tlvname>,<fieldname>,<typename>,[<count>][,<option>]
+            fields = [(row[3], _compile_encoding_step(row[4], row[5], allow_any=True)) for row in scheme[1:]]
+            encoder.append((tlv_record_type, scheme[0][2], fields))
+        self._tlv_stream_encoders[tlv_stream_name] = encoder
+        return encoder
+
+    def _encode_tlv_stream(self, tlv_stream_name: str, kwargs: Dict[str, Dict[str, Any]]) -> bytes:
+        chunks = []
+        for tlv_record_type, tlv_record_name, fields in self._get_tlv_stream_encoder(tlv_stream_name):
+            if tlv_record_name not in kwargs:
+                continue
+            record = kwargs[tlv_record_name]
+            tlv_val = b"".join([step(record, record[field_name]) for field_name, step in fields])
+            chunks += [write_bigsize_int(tlv_record_type), write_bigsize_int(len(tlv_val)), tlv_val]
+        return b"".join(chunks)
+
     def write_tlv_stream(self, *, fd: io.BytesIO, tlv_stream_name: str, **kwargs) -> None:
+        fd.write(self._encode_tlv_stream(tlv_stream_name, kwargs))
+
+    def read_tlv_stream(self, *, fd: io.BytesIO, tlv_stream_name: str) -> Dict[str, Dict[str, Any]]:
+        data = fd.read()
+        return self._decode_tlv_stream(data, 0, len(data), tlv_stream_name=tlv_stream_name)
+
+    def encode_msg(self, msg_type: str, **kwargs) -> bytes:
+        """
+        Encode kwargs into a Lightning message (bytes)
+        of the type given in the msg_type string
+        """
+        encoder = self._get_msg_encoder(msg_type)
+        chunks = [self.msg_type_from_name[msg_type]]
+        for field_name, get_count, step, tlv_stream_name, is_optional in encoder:
+            if get_count is not None:
+                get_count(kwargs)
+            if tlv_stream_name is not None:
+                if tlv_stream_name in kwargs:
+                    chunks.append(self._encode_tlv_stream(tlv_stream_name, kwargs[tlv_stream_name]))
+                continue
+            try:
+                field_value = kwargs[field_name]
+            except KeyError:
+                if is_optional:
+                    break  # optional feature field not present
+                field_value = 0  # default mandatory fields to zero
+            chunks.append(step(kwargs, field_value))
+        return b"".join(chunks)
+
+    def decode_msg(self, data: bytes) -> Tuple[str, dict]:
+        """
+        Decode Lightning message by reading the first
+        two bytes to determine message type.
+
+        Returns message type string and parsed message contents dict
+        """
+        assert len(data) >= 2
+        if type(data) is not bytes:
+            data = bytes(data)
+        msg_type_name, steps = self._get_msg_decoder(data[:2])
+        parsed = {}
+        pos, end = 2, len(data)
+        for step, is_optional in steps:
+            try:
+                pos = step(data, pos, end, parsed)
+            except UnexpectedEndOfStream:
+                if is_optional:
+                    break  # optional feature field not present
+                raise
+        return msg_type_name, parsed
+
+    def _interpreted_write_tlv_stream(self, *, fd: io.BytesIO, tlv_stream_name: str, **kwargs) -> None:
         scheme_map = self.in_tlv_stream_get_tlv_record_scheme_from_type[tlv_stream_name]
         for tlv_record_type, scheme in scheme_map.items():  # note: tlv_record_type is monotonically increasing
             tlv_record_name = self.in_tlv_stream_get_record_name_from_type[tlv_stream_name][tlv_record_type]
@@ -372,7 +753,7 @@ class LNSerializer:
                         raise Exception(f"unexpected row in scheme: {row!r}")
                 _write_tlv_record(fd=fd, tlv_type=tlv_record_type, tlv_val=tlv_record_fd.getvalue())
 
-    def read_tlv_stream(self, *, fd: io.BytesIO, tlv_stream_name: str) -> Dict[str, Dict[str, Any]]:
+    def _interpreted_read_tlv_stream(self, *, fd: io.BytesIO, tlv_stream_name: str) -> Dict[str, Dict[str, Any]]:
         parsed = {}  # type: Dict[str, Dict[str, Any]]
         scheme_map = self.in_tlv_stream_get_tlv_record_scheme_from_type[tlv_stream_name]
         last_seen_tlv_record_type = -1  # type: int
@@ -418,11 +799,8 @@ class LNSerializer:
                     raise MsgTrailingGarbage(f"TLV record ({tlv_stream_name}/{tlv_record_name}) has extra trailing garbage")
         return parsed
 
-    def encode_msg(self, msg_type: str, **kwargs) -> bytes:
-        """
-        Encode kwargs into a Lightning message (bytes)
-        of the type given in the msg_type string
-        """
+    def _interpreted_encode_msg(self, msg_type: str, **kwargs) -> bytes:
+        """Reference implementation of encode_msg, interpreting the scheme."""
         #print(f">>> encode_msg. msg_type={msg_type}, payload={kwargs!r}")
         msg_type_bytes = self.msg_type_from_name[msg_type]
         scheme = self.msg_scheme_from_type[msg_type_bytes]
@@ -441,7 +819,7 @@ class LNSerializer:
                     if field_name == "tlvs":
                         tlv_stream_name = field_type
                         if tlv_stream_name in kwargs:
-                            self.write_tlv_stream(fd=fd, tlv_stream_name=tlv_stream_name, **(kwargs[tlv_stream_name]))
+                            self._interpreted_write_tlv_stream(fd=fd, tlv_stream_name=tlv_stream_name, **(kwargs[tlv_stream_name]))
                         continue
                     try:
                         field_value = kwargs[field_name]
@@ -460,13 +838,8 @@ class LNSerializer:
                     raise Exception(f"unexpected row in scheme: {row!r}")
             return fd.getvalue()
 
-    def decode_msg(self, data: bytes) -> Tuple[str, dict]:
-        """
-        Decode Lightning message by reading the first
-        two bytes to determine message type.
-
-        Returns message type string and parsed message contents dict
-        """
+    def _interpreted_decode_msg(self, data: bytes) -> Tuple[str, dict]:
+        """Reference implementation of decode_msg, interpreting the scheme."""
         #print(f"decode_msg >>> {data.hex()}")
         assert len(data) >= 2
         msg_type_bytes = data[:2]
@@ -487,7 +860,7 @@ class LNSerializer:
                     field_count = _resolve_field_count(field_count_str, vars_dict=parsed)
                     if field_name == "tlvs":
                         tlv_stream_name = field_type
-                        d = self.read_tlv_stream(fd=fd, tlv_stream_name=tlv_stream_name)
+                        d = self._interpreted_read_tlv_stream(fd=fd, tlv_stream_name=tlv_stream_name)
                         parsed[tlv_stream_name] = d
                         continue
                     #print(f">> count={field_count}. parsed={parsed}")
@@ -23,9 +23,11 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-import queue
-from collections import defaultdict
+from array import array
+from collections import defaultdict, OrderedDict
+from heapq import heappush, heappop, nsmallest
 from typing import Sequence, List, Tuple, Optional, Dict, NamedTuple, TYPE_CHECKING, Set
+import threading
 import time
 import attr
 
@@ -33,7 +35,7 @@ from .util import bh2u, profiler
 from .logging import Logger
 from .lnutil import (NUM_MAX_EDGES_IN_PAYMENT_PATH, ShortChannelID, LnFeatures,
                      NBLOCK_CLTV_EXPIRY_TOO_FAR_INTO_FUTURE)
-from .channel_db import ChannelDB, Policy, NodeInfo
+from .channel_db import ChannelDB, Policy, NodeInfo, DirectedEdges, FLAG_DISABLE
 
 if TYPE_CHECKING:
     from .lnchannel import Channel
@@ -48,6 +50,9 @@ class NoChannelPolicy(Exception):
 class LNPathInconsistent(Exception): pass
 
 
+MAX_CLTV_EXPIRY_DELTA_FOR_EDGE = 14 * 144  # cltv cannot be more than 2 weeks
+
+
 def fee_for_edge_msat(forwarded_amount_msat: int, fee_base_msat: int, fee_proportional_millionths: int) -> int:
     return fee_base_msat \
            + (forwarded_amount_msat * fee_proportional_millionths // 1_000_000)
@@ -87,8 +92,7 @@ class RouteEdge(PathEdge):
 
     def is_sane_to_use(self, amount_msat: int) -> bool:
         # TODO revise ad-hoc heuristics
-        # cltv cannot be more than 2 weeks
-        if self.cltv_expiry_delta > 14 * 144:
+        if self.cltv_expiry_delta > MAX_CLTV_EXPIRY_DELTA_FOR_EDGE:
             return False
         total_fee = self.fee_for_edge(amount_msat)
         if not is_fee_sane(total_fee, payment_amount_msat=amount_msat):
@@ -136,6 +140,54 @@ def is_fee_sane(fee_msat: int, *, payment_amount_msat: int) -> bool:
 
 
 BLACKLIST_DURATION = 3600
+BASE_EDGE_COST = 500  # one more edge ~ paying 500 msat more fees
+MAX_PATH_CANDIDATES = 8  # per destination and amount bucket
+PATH_CANDIDATES_DURATION = 600
+MAX_CACHED_PATH_CANDIDATES = 100
+
+
+class EdgeCosts(NamedTuple):
+    """The parts of the edge costs of LNPathFinder that do not depend on
+    the payment, for the public channels."""
+    edges: DirectedEdges
+    usable: bytearray  # enabled, sane cltv, and both directions have a policy
+    max_amount_msat: array  # largest amount allowed by htlc_maximum_msat and the capacity
+
+
+def _is_edge_usable(has_policy: int, has_reverse_policy: int, channel_flags: int, cltv_expiry_delta: int) -> bool:
+    # channels that did not publish both policies often return temporary channel failure
+    return bool(has_policy and has_reverse_policy and not channel_flags & FLAG_DISABLE
+                and cltv_expiry_delta <= MAX_CLTV_EXPIRY_DELTA_FOR_EDGE)
+
+
+def _get_max_amount_msat(htlc_maximum_msat: int, capacity_sat: int) -> int:
+    # payment_amt_msat // 1000 > capacity_sat  <=>  payment_amt_msat > 1000 * capacity_sat + 999
+    return htlc_maximum_msat if capacity_sat < 0 else min(htlc_maximum_msat, 1000 * capacity_sat + 999)
+
+
+def get_edge_costs(edges: DirectedEdges) -> EdgeCosts:
+    usable = bytearray(map(_is_edge_usable, edges.has_policy, edges.has_reverse_policy,
+                           edges.channel_flags, edges.cltv_expiry_delta))
+    max_amount_msat = array('Q', map(_get_max_amount_msat, edges.htlc_maximum_msat, edges.capacity_sat))
+    return EdgeCosts(edges=edges, usable=usable, max_amount_msat=max_amount_msat)
+
+
+def update_edge_costs(edge_costs: EdgeCosts, edges: DirectedEdges, changed_edges: Sequence[int]) -> EdgeCosts:
+    # the edges of added channels are appended, and are among the changed edges
+    num_new_edges = len(edges.short_channel_ids) - len(edge_costs.usable)
+    usable = edge_costs.usable + bytes(num_new_edges)
+    max_amount_msat = edge_costs.max_amount_msat + array('Q', bytes(8 * num_new_edges))
+    for e in changed_edges:
+        usable[e] = _is_edge_usable(edges.has_policy[e], edges.has_reverse_policy[e],
+                                    edges.channel_flags[e], edges.cltv_expiry_delta[e])
+        max_amount_msat[e] = _get_max_amount_msat(edges.htlc_maximum_msat[e], edges.capacity_sat[e])
+    return EdgeCosts(edges=edges, usable=usable, max_amount_msat=max_amount_msat)
+
+
+class PathCandidates(NamedTuple):
+    paths: List[LNPaymentPath]  # by cost
+    timestamp: float
+
 
 class LNPathFinder(Logger):
 
@@ -143,17 +195,46 @@ class LNPathFinder(Logger):
         Logger.__init__(self)
         self.channel_db = channel_db
         self.blacklist = dict() # short_chan_id -> timestamp
+        self._edge_costs = None  # type: Optional[EdgeCosts]
+        # (nodeA, nodeB, amount bucket, our channels) -> paths
+        self._path_candidates = OrderedDict()  # type: Dict[Tuple, PathCandidates]
+        self._path_candidates_lock = threading.Lock()
+
+    def get_edge_costs(self) -> EdgeCosts:
+        """Returns the EdgeCosts of the current graph. They are reused
+        until the graph changes, and then only updated for the changed
+        policies and channels, unless the graph was compacted."""
+        edge_costs = self._edge_costs
+        if edge_costs is not None and edge_costs.edges.version == self.channel_db.get_graph_version():
+            return edge_costs
+        edges, changed_edges = self.channel_db.get_directed_edges(edge_costs.edges if edge_costs else None)
+        if changed_edges is None:
+            edge_costs = get_edge_costs(edges)
+        else:
+            edge_costs = update_edge_costs(edge_costs, edges, changed_edges)
+        self._edge_costs = edge_costs
+        return edge_costs
 
     def add_to_blacklist(self, short_channel_id: ShortChannelID):
         self.logger.info(f'blacklisting channel {short_channel_id}')
         now = int(time.time())
         self.blacklist[short_channel_id] = now
 
+    def clear_blacklist(self):
+        self.blacklist.clear()
+        # the candidates were found without the blacklisted channels
+        with self._path_candidates_lock:
+            self._path_candidates.clear()
+
     def is_blacklisted(self, short_channel_id: ShortChannelID) -> bool:
         now = int(time.time())
         t = self.blacklist.get(short_channel_id, 0)
         return now - t < BLACKLIST_DURATION
 
+    def _get_blacklisted_channels(self) -> Set[ShortChannelID]:
+        now = int(time.time())
+        return {scid for scid, t in self.blacklist.items() if now - t < BLACKLIST_DURATION}
+
     def _edge_cost(self, short_channel_id: bytes, start_node: bytes, end_node: bytes,
                    payment_amt_msat: int, ignore_costs=False, is_mine=False, *,
                    my_channels: Dict[ShortChannelID, 'Channel'] = None) -> Tuple[float, int]:
@@ -192,7 +273,7 @@ class LNPathFinder(Logger):
         # - The larger the payment amount, and the longer the CLTV,
         #   the more irritating it is if the HTLC gets stuck.
         # - Paying lower fees is better. :)
-        base_cost = 500  # one more edge ~ paying 500 msat more fees
+        base_cost = BASE_EDGE_COST
         if ignore_costs:
             return base_cost, 0
         fee_msat = route_edge.fee_for_edge(payment_amt_msat)
@@ -204,61 +285,147 @@ class LNPathFinder(Logger):
                       invoice_amount_msat: int, *,
                       my_channels: Dict[ShortChannelID, 'Channel'] = None
                       ) -> Dict[bytes, PathEdge]:
+        node_ids, prev_node, distance_from_start, a, b = self._run_dijkstra(
+            nodeA, nodeB, invoice_amount_msat, my_channels=my_channels or {})
+        return {node_ids[start]: PathEdge(node_id=node_ids[end], short_channel_id=short_channel_id)
+                for start, (end, short_channel_id) in prev_node.items()}
+
+    def _run_dijkstra(self, nodeA: bytes, nodeB: bytes, invoice_amount_msat: int, *,
+                      my_channels: Dict[ShortChannelID, 'Channel'],
+                      edge_costs: EdgeCosts = None,
+                      ) -> Tuple[List[bytes], Dict[int, Tuple[int, ShortChannelID]], Dict[int, float], int, int]:
+        """Returns (node_ids, prev_node, distance_from_start, index of nodeA, index of nodeB).
+        prev_node maps the index of a node to the index of the next node
+        towards nodeB, and the channel to get there. Node indexes are
+        those of edge_costs.edges, then the nodes of our channels that are
+        not in the public graph.
+        """
         # note: we don't lock self.channel_db, so while the path finding runs,
         #       the underlying graph could potentially change... (not good but maybe ~OK?)
+        if edge_costs is None:
+            edge_costs = self.get_edge_costs()
+        edges = edge_costs.edges
+        # nodes are numbered as in edges; the nodes of our own channels
+        # that are not in the public graph are appended
+        node_ids = edges.node_ids
+        num_public_nodes = len(node_ids)
+        extra_nodes = {}  # type: Dict[bytes, int]
+        def get_node_index(node_id: bytes) -> int:
+            n = edges.node_index.get(node_id)
+            if n is None:
+                n = extra_nodes.get(node_id)
+                if n is None:
+                    n = extra_nodes[node_id] = num_public_nodes + len(extra_nodes)
+            return n
+        a = get_node_index(nodeA)
+        b = get_node_index(nodeB)
+        # our own channels, by end node. they are not taken from edges,
+        # as their costs depend on their balance
+        my_edges = defaultdict(list)  # type: Dict[int, List[Tuple[ShortChannelID, int]]]
+        for short_channel_id, chan in my_channels.items():
+            n1, n2 = get_node_index(chan.get_local_pubkey()), get_node_index(chan.node_id)
+            my_edges[n1].append((short_channel_id, n2))
+            my_edges[n2].append((short_channel_id, n1))
+        if extra_nodes:
+            node_ids = node_ids + sorted(extra_nodes, key=extra_nodes.get)
+        blacklist = self._get_blacklisted_channels()
+
+        get_edges_ending_at = edges.get_edges_ending_at
+        short_channel_ids = edges.short_channel_ids
+        start_nodes = edges.start_node
+        usable = edge_costs.usable
+        max_amount_msat = edge_costs.max_amount_msat
+        htlc_minimum_msat = edges.htlc_minimum_msat
+        fee_base_msat = edges.fee_base_msat
+        fee_proportional_millionths = edges.fee_proportional_millionths
+        cltv_expiry_delta = edges.cltv_expiry_delta
+        inf = float('inf')
 
         # run Dijkstra
         # The search is run in the REVERSE direction, from nodeB to nodeA,
         # to properly calculate compound routing fees.
-        distance_from_start = defaultdict(lambda: float('inf'))
-        distance_from_start[nodeB] = 0
-        prev_node = {}  # type: Dict[bytes, PathEdge]
-        nodes_to_explore = queue.PriorityQueue()
-        nodes_to_explore.put((0, invoice_amount_msat, nodeB))  # order of fields (in tuple) matters!
-
+        distance_from_start = {b: 0}  # type: Dict[int, float]
+        prev_node = {}  # type: Dict[int, Tuple[int, ShortChannelID]]
+        # order of fields (in tuple) matters! node ids before indexes, so that ties are broken as before
+        nodes_to_explore = [(0, invoice_amount_msat, nodeB, b)]
 
         # main loop of search
-        while nodes_to_explore.qsize() > 0:
-            dist_to_edge_endnode, amount_msat, edge_endnode = nodes_to_explore.get()
-            if edge_endnode == nodeA:
+        while nodes_to_explore:
+            dist_to_edge_endnode, amount_msat, _, edge_endnode = heappop(nodes_to_explore)
+            if edge_endnode == a:
                 break
             if dist_to_edge_endnode != distance_from_start[edge_endnode]:
-                # queue.PriorityQueue does not implement decrease_priority,
+                # heapq does not implement decrease_priority,
                 # so instead of decreasing priorities, we add items again into the queue.
                 # so there are duplicates in the queue, that we discard now:
                 continue
-            for edge_channel_id in self.channel_db.get_channels_for_node(edge_endnode, my_channels=my_channels):
-                assert isinstance(edge_channel_id, bytes)
-                if self.is_blacklisted(edge_channel_id):
+            if edge_endnode < num_public_nodes:
+                for e in get_edges_ending_at(edge_endnode):
+                    # same checks and costs as in _edge_cost
+                    if not usable[e]:
+                        continue
+                    short_channel_id = short_channel_ids[e]
+                    if short_channel_id in my_channels or short_channel_id in blacklist:
+                        continue
+                    if amount_msat < htlc_minimum_msat[e] or amount_msat > max_amount_msat[e]:
+                        continue
+                    fee_msat = fee_base_msat[e] + (amount_msat * fee_proportional_millionths[e] // 1_000_000)
+                    if not is_fee_sane(fee_msat, payment_amount_msat=amount_msat):
+                        continue
+                    edge_startnode = start_nodes[e]
+                    if edge_startnode == a:
+                        edge_cost, fee_msat = BASE_EDGE_COST, 0
+                    else:
+                        cltv_cost = cltv_expiry_delta[e] * amount_msat * 15 / 1_000_000_000
+                        edge_cost = BASE_EDGE_COST + fee_msat + cltv_cost
+                    alt_dist_to_neighbour = dist_to_edge_endnode + edge_cost
+                    if alt_dist_to_neighbour < distance_from_start.get(edge_startnode, inf):
+                        distance_from_start[edge_startnode] = alt_dist_to_neighbour
+                        prev_node[edge_startnode] = (edge_endnode, short_channel_id)
+                        heappush(nodes_to_explore, (alt_dist_to_neighbour, amount_msat + fee_msat,
+                                                    node_ids[edge_startnode], edge_startnode))
+            for edge_channel_id, edge_startnode in my_edges.get(edge_endnode, ()):
+                if edge_channel_id in blacklist:
                     continue
-                channel_info = self.channel_db.get_channel_info(edge_channel_id, my_channels=my_channels)
-                edge_startnode = channel_info.node2_id if channel_info.node1_id == edge_endnode else channel_info.node1_id
-                is_mine = edge_channel_id in my_channels
-                if is_mine:
-                    if edge_startnode == nodeA:  # payment outgoing, on our channel
-                        if not my_channels[edge_channel_id].can_pay(amount_msat, check_frozen=True):
-                            continue
-                    else:  # payment incoming, on our channel. (funny business, cycle weirdness)
-                        assert edge_endnode == nodeA, (bh2u(edge_startnode), bh2u(edge_endnode))
-                        if not my_channels[edge_channel_id].can_receive(amount_msat, check_frozen=True):
-                            continue
+                if edge_startnode == a:  # payment outgoing, on our channel
+                    if not my_channels[edge_channel_id].can_pay(amount_msat, check_frozen=True):
+                        continue
+                else:  # payment incoming, on our channel. (funny business, cycle weirdness)
+                    assert edge_endnode == a, (bh2u(node_ids[edge_startnode]), bh2u(node_ids[edge_endnode]))
+                    if not my_channels[edge_channel_id].can_receive(amount_msat, check_frozen=True):
+                        continue
                 edge_cost, fee_for_edge_msat = self._edge_cost(
                     edge_channel_id,
-                    start_node=edge_startnode,
-                    end_node=edge_endnode,
+                    start_node=node_ids[edge_startnode],
+                    end_node=node_ids[edge_endnode],
                     payment_amt_msat=amount_msat,
-                    ignore_costs=(edge_startnode == nodeA),
-                    is_mine=is_mine,
+                    ignore_costs=(edge_startnode == a),
+                    is_mine=True,
                     my_channels=my_channels)
-                alt_dist_to_neighbour = distance_from_start[edge_endnode] + edge_cost
-                if alt_dist_to_neighbour < distance_from_start[edge_startnode]:
+                alt_dist_to_neighbour = dist_to_edge_endnode + edge_cost
+                if alt_dist_to_neighbour < distance_from_start.get(edge_startnode, inf):
                     distance_from_start[edge_startnode] = alt_dist_to_neighbour
-                    prev_node[edge_startnode] = PathEdge(node_id=edge_endnode,
-                                                         short_channel_id=ShortChannelID(edge_channel_id))
+                    prev_node[edge_startnode] = (edge_endnode, ShortChannelID(edge_channel_id))
                     amount_to_forward_msat = amount_msat + fee_for_edge_msat
-                    nodes_to_explore.put((alt_dist_to_neighbour, amount_to_forward_msat, edge_startnode))
+                    heappush(nodes_to_explore, (alt_dist_to_neighbour, amount_to_forward_msat,
+                                                node_ids[edge_startnode], edge_startnode))
 
-        return prev_node
+        return node_ids, prev_node, distance_from_start, a, b
+
+    @staticmethod
+    def _get_path(node_ids: List[bytes], prev_node: Dict[int, Tuple[int, ShortChannelID]],
+                  start: int, end: int) -> Optional[LNPaymentPath]:
+        """Backtracks the result of _run_dijkstra, from start to end."""
+        if start != end and start not in prev_node:
+            return None  # no path found
+        # FIXME paths cannot be longer than 20 edges (onion packet)...
+        edge_startnode = start
+        path = []
+        while edge_startnode != end:
+            edge_endnode, short_channel_id = prev_node[edge_startnode]
+            path += [PathEdge(node_id=node_ids[edge_endnode], short_channel_id=short_channel_id)]
+            edge_startnode = edge_endnode
+        return path
 
     @profiler
     def find_path_for_payment(self, nodeA: bytes, nodeB: bytes,
@@ -272,20 +439,137 @@ class LNPathFinder(Logger):
         if my_channels is None:
             my_channels = {}
 
-        prev_node = self.get_distances(nodeA, nodeB, invoice_amount_msat, my_channels=my_channels)
-
-        if nodeA not in prev_node:
-            return None  # no path found
-
+        node_ids, prev_node, distance_from_start, a, b = self._run_dijkstra(
+            nodeA, nodeB, invoice_amount_msat, my_channels=my_channels)
         # backtrack from search_end (nodeA) to search_start (nodeB)
-        # FIXME paths cannot be longer than 20 edges (onion packet)...
-        edge_startnode = nodeA
-        path = []
-        while edge_startnode != nodeB:
-            edge = prev_node[edge_startnode]
-            path += [edge]
-            edge_startnode = edge.node_id
-        return path
+        return self._get_path(node_ids, prev_node, a, b)
+
+    def get_path_cost(self, path: LNPaymentPath, nodeA: bytes, invoice_amount_msat: int, *,
+                      my_channels: Dict[ShortChannelID, 'Channel']) -> float:
+        """Returns the cost of a path from nodeA, as in the path finding,
+        or inf if the path cannot be used for the payment now."""
+        cost = 0
+        amount_msat = invoice_amount_msat
+        for i in reversed(range(len(path))):
+            start_node = path[i - 1].node_id if i > 0 else nodeA
+            short_channel_id = path[i].short_channel_id
+            if self.is_blacklisted(short_channel_id):
+                return float('inf')
+            is_mine = short_channel_id in my_channels
+            if is_mine:
+                chan = my_channels[short_channel_id]
+                if start_node == nodeA:
+                    if not chan.can_pay(amount_msat, check_frozen=True):
+                        return float('inf')
+                elif not chan.can_receive(amount_msat, check_frozen=True):
+                    return float('inf')
+            edge_cost, fee_for_edge_msat = self._edge_cost(
+                short_channel_id,
+                start_node=start_node,
+                end_node=path[i].node_id,
+                payment_amt_msat=amount_msat,
+                ignore_costs=(start_node == nodeA),
+                is_mine=is_mine,
+                my_channels=my_channels)
+            cost += edge_cost
+            amount_msat += fee_for_edge_msat
+        return cost
+
+    def _find_path_candidates(self, nodeA: bytes, nodeB: bytes, invoice_amount_msat: int, *,
+                              my_channels: Dict[ShortChannelID, 'Channel']) -> List[LNPaymentPath]:
+        """Returns the shortest path from nodeA to nodeB, and alternatives to
+        it found by the same search, sorted by cost. An alternative leaves
+        the shortest path at one of its nodes through another channel, and
+        continues on the shortest known path from there to nodeB.
+        """
+        edge_costs = self.get_edge_costs()
+        node_ids, prev_node, distance_from_start, a, b = self._run_dijkstra(
+            nodeA, nodeB, invoice_amount_msat, my_channels=my_channels, edge_costs=edge_costs)
+        path = self._get_path(node_ids, prev_node, a, b)
+        if path is None:
+            return []
+        edges = edge_costs.edges
+        num_public_nodes = len(edges.node_ids)
+        node_index = {node_id: n for n, node_id in enumerate(node_ids[num_public_nodes:], num_public_nodes)}
+        node_index.update(edges.node_index)
+        # the alternatives are ranked by their cost for invoice_amount_msat on
+        # the new channel, before computing the cost of the best ones
+        sidetracks = []  # type: List[Tuple[float, int, ShortChannelID, int]]
+        blacklist = self._get_blacklisted_channels()
+        nodes = [a] + [node_index[edge.node_id] for edge in path]
+        for j, u in enumerate(nodes[:-1]):
+            prefix_cost = distance_from_start[a] - distance_from_start[u]
+            prefix_nodes = set(nodes[:j + 1])
+            if u == a:
+                for short_channel_id, chan in my_channels.items():
+                    w = node_index.get(chan.node_id)
+                    if w in distance_from_start and w not in prefix_nodes and short_channel_id not in blacklist:
+                        sidetracks.append((BASE_EDGE_COST + distance_from_start[w], j, short_channel_id, w))
+            if u >= num_public_nodes:
+                continue
+            for e in edges.get_edges_ending_at(u):
+                r = edges.reverse_edge[e]  # from u to the start node of e
+                w = edges.start_node[e]
+                short_channel_id = edges.short_channel_ids[e]
+                if not edge_costs.usable[r] or short_channel_id in my_channels or short_channel_id in blacklist \
+                        or w not in distance_from_start or w in prefix_nodes:
+                    continue
+                if u == a:
+                    edge_cost = BASE_EDGE_COST
+                else:
+                    fee_msat = fee_for_edge_msat(invoice_amount_msat, edges.fee_base_msat[r],
+                                                 edges.fee_proportional_millionths[r])
+                    cltv_cost = edges.cltv_expiry_delta[r] * invoice_amount_msat * 15 / 1_000_000_000
+                    edge_cost = BASE_EDGE_COST + fee_msat + cltv_cost
+                sidetracks.append((prefix_cost + edge_cost + distance_from_start[w], j, short_channel_id, w))
+        candidates = [(self.get_path_cost(path, nodeA, invoice_amount_msat, my_channels=my_channels), 0, path)]
+        seen = {tuple(edge.short_channel_id for edge in path)}
+        for _, j, short_channel_id, w in nsmallest(4 * MAX_PATH_CANDIDATES, sidetracks):
+            if short_channel_id == path[j].short_channel_id:
+                continue
+            candidate = list(path[:j]) + [PathEdge(node_id=node_ids[w], short_channel_id=short_channel_id)] \
+                        + self._get_path(node_ids, prev_node, w, b)
+            key = tuple(edge.short_channel_id for edge in candidate)
+            if key in seen or len({nodeA} | {edge.node_id for edge in candidate}) != len(candidate) + 1:
+                continue  # the path to nodeB goes back through the same nodes
+            seen.add(key)
+            cost = self.get_path_cost(candidate, nodeA, invoice_amount_msat, my_channels=my_channels)
+            if cost < float('inf'):
+                candidates.append((cost, len(candidates), candidate))
+        return [path for cost, i, path in sorted(candidates)[:MAX_PATH_CANDIDATES]]
+
+    @profiler
+    def find_path_from_candidates(self, nodeA: bytes, nodeB: bytes,
+                                  invoice_amount_msat: int, *,
+                                  my_channels: Dict[ShortChannelID, 'Channel'] = None) \
+            -> Optional[LNPaymentPath]:
+        """Return a path from nodeA to nodeB, like find_path_for_payment, but
+        reusing the candidate paths found for an earlier payment to nodeB
+        with a similar amount: the first one that can be used now, e.g.
+        whose channels were not blacklisted after a failed attempt. If there
+        is none, new candidates are found.
+        """
+        assert type(nodeA) is bytes
+        assert type(nodeB) is bytes
+        assert type(invoice_amount_msat) is int
+        if my_channels is None:
+            my_channels = {}
+        # amounts within a factor of 2 share the candidates
+        key = (nodeA, nodeB, invoice_amount_msat.bit_length(), tuple(sorted(my_channels)))
+        with self._path_candidates_lock:
+            candidates = self._path_candidates.pop(key, None)
+            if candidates is not None and time.time() - candidates.timestamp < PATH_CANDIDATES_DURATION:
+                self._path_candidates[key] = candidates  # most recently used last
+                for path in candidates.paths:
+                    if self.get_path_cost(path, nodeA, invoice_amount_msat, my_channels=my_channels) < float('inf'):
+                        return path
+        paths = self._find_path_candidates(nodeA, nodeB, invoice_amount_msat, my_channels=my_channels)
+        with self._path_candidates_lock:
+            self._path_candidates.pop(key, None)
+            self._path_candidates[key] = PathCandidates(paths=paths, timestamp=time.time())
+            while len(self._path_candidates) > MAX_CACHED_PATH_CANDIDATES:
+                self._path_candidates.popitem(last=False)
+        return paths[0] if paths else None
 
     def create_route_from_path(self, path: Optional[LNPaymentPath], from_node_id: bytes, *,
                                my_channels: Dict[ShortChannelID, 'Channel'] = None) -> LNPaymentRoute:
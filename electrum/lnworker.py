@@ -477,6 +477,7 @@ class LNGossip(LNWorker):
             if len(self.unknown_ids) == 0:
                 self.channel_db.prune_old_policies(self.max_age)
                 self.channel_db.prune_orphaned_channels()
+            self.channel_db.maybe_save_snapshot()
             await asyncio.sleep(120)
 
     async def add_new_ids(self, ids):
@@ -1139,7 +1140,7 @@ class LNWallet(LNWorker):
                 path = full_path[:-len(private_route)]
             else:
                 # find path now on public graph, to border node
-                path = self.network.path_finder.find_path_for_payment(
+                path = self.network.path_finder.find_path_from_candidates(
                     self.node_keypair.pubkey, border_node_pubkey, amount_msat,
                     my_channels=scid_to_my_channels)
             if not path:
@@ -1187,8 +1188,8 @@ class LNWallet(LNWorker):
         if route is None:
             if full_path:  # user pre-selected path
                 path = full_path
-            else:  # find path now
-                path = self.network.path_finder.find_path_for_payment(
+            else:  # find path now, or reuse one found for an earlier attempt
+                path = self.network.path_finder.find_path_from_candidates(
                     self.node_keypair.pubkey, invoice_pubkey, amount_msat,
                     my_channels=scid_to_my_channels)
             if not path:
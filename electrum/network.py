@@ -44,7 +44,8 @@ from aiohttp import ClientResponse
 from . import util
 from .util import (log_exceptions, ignore_exceptions,
                    bfh, SilentTaskGroup, make_aiohttp_session, send_exception_to_crash_reporter,
-                   is_hash256_str, is_non_negative_integer, MyEncoder, NetworkRetryManager)
+                   is_hash256_str, is_non_negative_integer, MyEncoder, NetworkRetryManager,
+                   LRUCache)
 
 from .bitcoin import COIN
 from . import constants
@@ -52,6 +53,7 @@ from . import blockchain
 from . import bitcoin
 from . import dns_hacks
 from .transaction import Transaction
+from .synchronizer import ScripthashMultiplexer
 from .blockchain import Blockchain, HEADER_SIZE
 from .interface import (Interface, PREFERRED_NETWORK_PROTOCOL,
                         RequestTimedOut, NetworkTimeout, BUCKET_NAME_OF_ONION_SERVERS,
@@ -74,6 +76,7 @@ _logger = get_logger(__name__)
 NUM_TARGET_CONNECTED_SERVERS = 10
 NUM_STICKY_SERVERS = 4
 NUM_RECENT_SERVERS = 20
+SHARED_TX_CACHE_SIZE = 5000
 
 
 def parse_servers(result: Sequence[Tuple[str, str, List[str]]]) -> Dict[str, dict]:
@@ -315,6 +318,12 @@ class Network(Logger, NetworkRetryManager[ServerAddr]):
         self.donation_address = ''
         self.relay_fee = None  # type: Optional[int]
 
+        # immutable data that the wallets of this process share, keyed by txid
+        self.tx_cache = LRUCache(maxsize=SHARED_TX_CACHE_SIZE)  # txid -> raw tx; complete txs only
+        self.verified_tx_cache = LRUCache(maxsize=SHARED_TX_CACHE_SIZE)  # txid -> TxMinedInfo
+        # scripthash subscriptions and histories, shared by the synchronizers and notifiers
+        self.scripthash_mux = ScripthashMultiplexer()
+
         dir_path = os.path.join(self.config.path, 'certs')
         util.make_dir(dir_path)
 
@@ -45,13 +45,8 @@ class SqlDB(Logger):
                 future, func, args, kwargs = self.db_requests.get(timeout=0.1)
             except queue.Empty:
                 continue
-            try:
-                result = func(self, *args, **kwargs)
-            except BaseException as e:
-                self.asyncio_loop.call_soon_threadsafe(future.set_exception, e)
+            if not self._run_request(future, func, args, kwargs):
                 continue
-            if not future.cancelled():
-                self.asyncio_loop.call_soon_threadsafe(future.set_result, result)
             # note: in sweepstore session.commit() is called inside
             # the sql-decorated methods, so commiting to disk is awaited
             if self.commit_interval:
@@ -59,9 +54,38 @@ class SqlDB(Logger):
                 if i == 0:
                     self.conn.commit()
         # write
+        self.before_close()
         self.conn.commit()
         self.conn.close()
         self.logger.info("SQL thread terminated")
 
+    def _run_request(self, future, func, args, kwargs) -> bool:
+        try:
+            result = func(self, *args, **kwargs)
+        except BaseException as e:
+            if self.asyncio_loop.is_running():
+                self.asyncio_loop.call_soon_threadsafe(future.set_exception, e)
+            else:
+                self.logger.info(f'error in queued sql request: {e!r}')
+            return False
+        if not future.cancelled() and self.asyncio_loop.is_running():
+            self.asyncio_loop.call_soon_threadsafe(future.set_result, result)
+        return True
+
+    def run_queued_requests(self):
+        """Executes the requests that are still queued. Must be called in the SQL thread."""
+        assert threading.currentThread() == self.sql_thread
+        while True:
+            try:
+                future, func, args, kwargs = self.db_requests.get_nowait()
+            except queue.Empty:
+                break
+            self._run_request(future, func, args, kwargs)
+
     def create_database(self):
         raise NotImplementedError()
+
+    def before_close(self):
+        """Called in the SQL thread once the event loop has stopped,
+        before the database is committed and closed."""
+        pass
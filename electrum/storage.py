@@ -29,13 +29,17 @@ import hashlib
 import base64
 import zlib
 from enum import IntEnum
+from typing import List, TYPE_CHECKING
 
-from . import ecc
 from .util import (profiler, InvalidPassword, WalletFileException, bfh, standardize_path,
                    test_read_write_permissions)
+from .json_db import JOURNAL_SEPARATOR, split_journal
 
 from .logging import Logger
 
+if TYPE_CHECKING:
+    from .ecc import ECPrivkey
+
 
 def get_derivation_used_for_hw_device_encryption():
     return ("m"
@@ -52,6 +56,11 @@ class StorageEncryptionVersion(IntEnum):
 class StorageReadWriteError(Exception): pass
 
 
+def journal_checksum(record: str) -> str:
+    # detects records torn by a crash during append
+    return hashlib.sha256(record.encode('utf-8')).hexdigest()[:8]
+
+
 # TODO: Rename to Storage
 class WalletStorage(Logger):
 
@@ -62,26 +71,76 @@ class WalletStorage(Logger):
         self.logger.info(f"wallet path {self.path}")
         self.pubkey = None
         self.decrypted = ''
+        # the wallet file is a snapshot followed by journal records, see append()
+        self._journal = []  # type: List[str]
+        self._snapshot_size = 0
+        self._journal_size = 0
         try:
             test_read_write_permissions(self.path)
         except IOError as e:
             raise StorageReadWriteError(e) from e
         if self.file_exists():
-            with open(self.path, "r", encoding='utf-8') as f:
-                self.raw = f.read()
+            with open(self.path, "rb") as f:
+                raw = f.read().decode('utf-8')
+            self.raw = self._load_journal(raw)
             self._encryption_version = self._init_encryption_version()
         else:
             self.raw = ''
             self._encryption_version = StorageEncryptionVersion.PLAINTEXT
+        self._snapshot_encryption = (self.pubkey, self._encryption_version)
+
+    def _load_journal(self, raw: str) -> str:
+        """Splits the file contents, keeps the valid journal records
+        and returns the snapshot."""
+        snapshot, records = split_journal(raw)
+        self._snapshot_size = len(snapshot.encode('utf-8'))
+        for record in records:
+            checksum, record = record[:8], record[8:]
+            if checksum != journal_checksum(record):
+                # everything from here on is a torn append; append() overwrites it
+                self.logger.warning(f"ignoring incomplete journal record in {self.path}")
+                break
+            self._journal.append(record)
+            self._journal_size += len((JOURNAL_SEPARATOR + checksum + record).encode('utf-8'))
+        return snapshot
 
     def read(self):
-        return self.decrypted if self.is_encrypted() else self.raw
+        if self.is_encrypted():
+            return self.decrypted
+        return self.raw + ''.join(JOURNAL_SEPARATOR + record for record in self._journal)
+
+    def snapshot_size(self) -> int:
+        return self._snapshot_size
+
+    def journal_size(self) -> int:
+        return self._journal_size
+
+    def can_append(self) -> bool:
+        """Whether journal records can be appended to the file, which needs the
+        snapshot to be encrypted the same way as new records would be."""
+        return self.file_exists() and self._snapshot_encryption == (self.pubkey, self._encryption_version)
+
+    def append(self, data: str) -> None:
+        """Appends a journal record to the file, to be replayed on top of the
+        snapshot written by write(). Each record is separately encrypted."""
+        assert self.can_append()
+        s = self.encrypt_before_writing(data)
+        record = (JOURNAL_SEPARATOR + journal_checksum(s) + s).encode('utf-8')
+        with open(self.path, "r+b") as f:
+            # drop whatever an interrupted append left behind
+            f.seek(self._snapshot_size + self._journal_size)
+            f.truncate()
+            f.write(record)
+            f.flush()
+            os.fsync(f.fileno())
+        self._journal_size += len(record)
 
     def write(self, data: str) -> None:
+        """Atomically replaces the file with a new snapshot."""
         s = self.encrypt_before_writing(data)
         temp_path = "%s.tmp.%s" % (self.path, os.getpid())
-        with open(temp_path, "w", encoding='utf-8') as f:
-            f.write(s)
+        with open(temp_path, "wb") as f:
+            f.write(s.encode('utf-8'))
             f.flush()
             os.fsync(f.fileno())
 
@@ -96,6 +155,9 @@ class WalletStorage(Logger):
         os.replace(temp_path, self.path)
         os.chmod(self.path, mode)
         self._file_exists = True
+        self._snapshot_size = len(s.encode('utf-8'))
+        self._journal_size = 0
+        self._snapshot_encryption = (self.pubkey, self._encryption_version)
         self.logger.info(f"saved {self.path}")
 
     def file_exists(self) -> bool:
@@ -145,6 +207,7 @@ class WalletStorage(Logger):
 
     @staticmethod
     def get_eckey_from_password(password):
+        from . import ecc
         secret = hashlib.pbkdf2_hmac('sha512', password.encode('utf-8'), b'', iterations=1024)
         ec_key = ecc.ECPrivkey.from_arbitrary_size_secret(secret)
         return ec_key
@@ -163,17 +226,23 @@ class WalletStorage(Logger):
             return
         ec_key = self.get_eckey_from_password(password)
         if self.raw:
-            enc_magic = self._get_encryption_magic()
-            s = zlib.decompress(ec_key.decrypt_message(self.raw, enc_magic))
-            s = s.decode('utf8')
+            s = self._decrypt(ec_key, self.raw)
+            s += ''.join(JOURNAL_SEPARATOR + self._decrypt(ec_key, record) for record in self._journal)
         else:
             s = ''
         self.pubkey = ec_key.get_public_key_hex()
         self.decrypted = s
+        self._snapshot_encryption = (self.pubkey, self._encryption_version)
+
+    def _decrypt(self, ec_key: 'ECPrivkey', ciphertext: str) -> str:
+        enc_magic = self._get_encryption_magic()
+        s = zlib.decompress(ec_key.decrypt_message(ciphertext, enc_magic))
+        return s.decode('utf8')
 
     def encrypt_before_writing(self, plaintext: str) -> str:
         s = plaintext
         if self.pubkey:
+            from . import ecc
             s = bytes(s, 'utf8')
             c = zlib.compress(s, level=zlib.Z_BEST_SPEED)
             enc_magic = self._get_encryption_magic()
@@ -24,15 +24,16 @@
 # SOFTWARE.
 import asyncio
 import hashlib
-from typing import Dict, List, TYPE_CHECKING, Tuple
+import weakref
+from typing import Dict, List, TYPE_CHECKING, Tuple, Sequence, Union, Optional
 from collections import defaultdict
 import logging
 
-from aiorpcx import TaskGroup, run_in_thread, RPCError
+from aiorpcx import run_in_thread, RPCError
 
 from . import util
 from .transaction import Transaction, PartialTransaction
-from .util import bh2u, make_aiohttp_session, NetworkJobOnDefaultServer, random_shuffled_copy
+from .util import bh2u, make_aiohttp_session, NetworkJobOnDefaultServer, random_shuffled_copy, LRUCache
 from .bitcoin import address_to_scripthash, is_address
 from .logging import Logger
 from .interface import GracefulDisconnect
@@ -40,6 +41,10 @@ from .interface import GracefulDisconnect
 if TYPE_CHECKING:
     from .network import Network
     from .address_synchronizer import AddressSynchronizer
+    from .interface import Interface, NotificationSession
+
+
+HISTORY_CACHE_SIZE = 1000
 
 
 class SynchronizerFailure(Exception): pass
@@ -54,6 +59,114 @@ def history_status(h):
     return bh2u(hashlib.sha256(status.encode('ascii')).digest())
 
 
+class ScripthashMultiplexer:
+    """Shares scripthash subscriptions and history requests between the
+    synchronizers and notifiers of a Network, so that a scripthash watched
+    by several of them is only subscribed to, and its history for a given
+    status only fetched, once.
+
+    Status notifications are fanned out to the queue of every consumer by
+    the NotificationSession, which also answers the subscriptions of later
+    consumers from its cache. Here, concurrent subscriptions wait for the
+    one sent to the server. A history is determined by its status, so
+    histories can be reused for any consumer that is given that status.
+    """
+
+    def __init__(self):
+        # session -> scripthash -> future, done once the server answered
+        self._subscriptions = weakref.WeakKeyDictionary()  # type: Dict[NotificationSession, Dict[str, asyncio.Future]]
+        # (scripthash, status) -> history
+        self._histories = LRUCache(maxsize=HISTORY_CACHE_SIZE)  # type: Dict[Tuple[str, str], List[dict]]
+        # (scripthash, status) -> future of the history, or None if it could not be fetched
+        self._pending_histories = {}  # type: Dict[Tuple[str, str], asyncio.Future]
+        self.num_subscriptions = 0
+        self.num_subscriptions_sent = 0
+        self.num_histories = 0
+        self.num_histories_sent = 0
+
+    def get_stats(self) -> dict:
+        return {
+            'subscriptions': self.num_subscriptions,
+            'subscriptions_saved': self.num_subscriptions - self.num_subscriptions_sent,
+            'histories': self.num_histories,
+            'histories_saved': self.num_histories - self.num_histories_sent,
+        }
+
+    async def subscribe(self, session: 'NotificationSession', scripthash: str, queue: asyncio.Queue) -> None:
+        """Subscribes queue to the status of scripthash, like session.subscribe."""
+        self.num_subscriptions += 1
+        subscriptions = self._subscriptions.setdefault(session, {})
+        fut = subscriptions.get(scripthash)
+        if fut is not None:
+            # answered from the cache of the session, once the first one is done
+            await asyncio.shield(fut)
+            await session.subscribe('blockchain.scripthash.subscribe', [scripthash], queue)
+            return
+        fut = subscriptions[scripthash] = asyncio.get_event_loop().create_future()
+        self.num_subscriptions_sent += 1
+        try:
+            await session.subscribe('blockchain.scripthash.subscribe', [scripthash], queue)
+        except BaseException:
+            # waiting consumers will send their own request
+            del subscriptions[scripthash]
+            raise
+        finally:
+            fut.set_result(None)
+
+    async def get_histories(self, interface: 'Interface',
+                            items: Sequence[Tuple[str, str]]) -> List[Union[List[dict], Exception]]:
+        """Returns the histories of (scripthash, status) pairs, in order, like
+        interface.get_history_for_scripthashes. Histories that another
+        consumer requested, or is requesting, for the same status are reused.
+        """
+        self.num_histories += len(items)
+        results = {}  # type: Dict[Tuple[str, str], Union[List[dict], Exception]]
+        waiting = {}  # type: Dict[Tuple[str, str], asyncio.Future]
+        to_fetch = []
+        for key in items:
+            if key in results or key in waiting:
+                continue
+            hist = self._histories.get(key)
+            if hist is not None:
+                results[key] = hist
+            elif key in self._pending_histories:
+                waiting[key] = self._pending_histories[key]
+            else:
+                self._pending_histories[key] = asyncio.get_event_loop().create_future()
+                to_fetch.append(key)
+        if to_fetch:
+            await self._fetch_histories(interface, to_fetch, results)
+        for key, fut in waiting.items():
+            hist = await asyncio.shield(fut)
+            if hist is None:
+                # the request of the other consumer failed; ours might not
+                await self._fetch_histories(interface, [key], results)
+            else:
+                results[key] = hist
+        return [results[key] for key in items]
+
+    async def _fetch_histories(self, interface: 'Interface', keys: Sequence[Tuple[str, str]],
+                               results: Dict[Tuple[str, str], Union[List[dict], Exception]]) -> None:
+        self.num_histories_sent += len(keys)
+        fetched = {}  # type: Dict[Tuple[str, str], Optional[List[dict]]]
+        try:
+            hists = await interface.get_history_for_scripthashes([scripthash for scripthash, status in keys])
+            for key, hist in zip(keys, hists):
+                results[key] = hist
+                if isinstance(hist, Exception):
+                    continue
+                hist_status = history_status([(item['tx_hash'], item['height']) for item in hist])
+                # the status might have changed since it was announced
+                if hist_status == key[1]:
+                    self._histories[key] = hist
+                    fetched[key] = hist
+        finally:
+            for key in keys:
+                fut = self._pending_histories.pop(key, None)
+                if fut is not None:
+                    fut.set_result(fetched.get(key))
+
+
 class SynchronizerBase(NetworkJobOnDefaultServer):
     """Subscribe over the network to a set of addresses, and monitor their statuses.
     Every time a status changes, run a coroutine provided by the subclass.
@@ -106,7 +219,7 @@ class SynchronizerBase(NetworkJobOnDefaultServer):
             self.scripthash_to_address[h] = addr
             self._requests_sent += 1
             try:
-                await self.session.subscribe('blockchain.scripthash.subscribe', [h], self.status_queue)
+                await self.network.scripthash_mux.subscribe(self.session, h, self.status_queue)
             except RPCError as e:
                 if e.message == 'history too large':  # no unique error code
                     raise GracefulDisconnect(e, log_level=logging.ERROR) from e
@@ -148,6 +261,7 @@ class Synchronizer(SynchronizerBase):
         super()._reset()
         self.requested_tx = {}
         self.requested_histories = set()
+        self._history_request_queue = asyncio.Queue()
 
     def diagnostic_name(self):
         return self.wallet.diagnostic_name()
@@ -163,32 +277,49 @@ class Synchronizer(SynchronizerBase):
             return
         if (addr, status) in self.requested_histories:
             return
-        # request address history
+        # request address history; requests get coalesced into batches
         self.requested_histories.add((addr, status))
-        h = address_to_scripthash(addr)
-        self._requests_sent += 1
-        result = await self.interface.get_history_for_scripthash(h)
-        self._requests_answered += 1
-        self.logger.info(f"receiving history {addr} {len(result)}")
-        hashes = set(map(lambda item: item['tx_hash'], result))
-        hist = list(map(lambda item: (item['tx_hash'], item['height']), result))
-        # tx_fees
-        tx_fees = [(item['tx_hash'], item.get('fee')) for item in result]
-        tx_fees = dict(filter(lambda x:x[1] is not None, tx_fees))
-        # Check that txids are unique
-        if len(hashes) != len(result):
-            self.logger.info(f"error: server history has non-unique txids: {addr}")
-        # Check that the status corresponds to what was announced
-        elif history_status(hist) != status:
-            self.logger.info(f"error: status mismatch: {addr}")
-        else:
-            # Store received history
-            self.wallet.receive_history_callback(addr, hist, tx_fees)
-            # Request transactions we don't have
-            await self._request_missing_txs(hist)
-
-        # Remove request; this allows up_to_date to be True
-        self.requested_histories.discard((addr, status))
+        await self._history_request_queue.put((addr, status))
+
+    async def send_history_requests(self):
+        """Coalesces pending history requests into batches."""
+        while True:
+            items = [await self._history_request_queue.get()]
+            while not self._history_request_queue.empty():
+                items.append(self._history_request_queue.get_nowait())
+            await self.taskgroup.spawn(self._request_histories(items))
+
+    async def _request_histories(self, items: List[Tuple[str, str]]):
+        self._requests_sent += len(items)
+        results = await self.network.scripthash_mux.get_histories(
+            self.interface, [(address_to_scripthash(addr), status) for addr, status in items])
+        self._requests_answered += len(items)
+        hist_of_new_txs = []
+        for (addr, status), result in zip(items, results):
+            if isinstance(result, Exception):
+                raise result
+            self.logger.info(f"receiving history {addr} {len(result)}")
+            hashes = set(map(lambda item: item['tx_hash'], result))
+            hist = list(map(lambda item: (item['tx_hash'], item['height']), result))
+            # tx_fees
+            tx_fees = [(item['tx_hash'], item.get('fee')) for item in result]
+            tx_fees = dict(filter(lambda x:x[1] is not None, tx_fees))
+            # Check that txids are unique
+            if len(hashes) != len(result):
+                self.logger.info(f"error: server history has non-unique txids: {addr}")
+            # Check that the status corresponds to what was announced
+            elif history_status(hist) != status:
+                self.logger.info(f"error: status mismatch: {addr}")
+            else:
+                # Store received history
+                self.wallet.receive_history_callback(addr, hist, tx_fees)
+                hist_of_new_txs.extend(hist)
+        # Request transactions we don't have
+        await self._request_missing_txs(hist_of_new_txs)
+
+        # Remove requests; this allows up_to_date to be True
+        for item in items:
+            self.requested_histories.discard(item)
 
     async def _request_missing_txs(self, hist, *, allow_server_not_finding_tx=False):
         # "hist" is a list of [tx_hash, tx_height] lists
@@ -199,31 +330,37 @@ class Synchronizer(SynchronizerBase):
             tx = self.wallet.db.get_transaction(tx_hash)
             if tx and not isinstance(tx, PartialTransaction):
                 continue  # already have complete tx
-            transaction_hashes.append(tx_hash)
             self.requested_tx[tx_hash] = tx_height
+            # another wallet of this process might have fetched it already
+            raw_tx = self.network.tx_cache.get(tx_hash)
+            if raw_tx is not None:
+                self._receive_transaction(tx_hash, raw_tx)
+                continue
+            transaction_hashes.append(tx_hash)
 
         if not transaction_hashes: return
-        async with TaskGroup() as group:
-            for tx_hash in transaction_hashes:
-                await group.spawn(self._get_transaction(tx_hash, allow_server_not_finding_tx=allow_server_not_finding_tx))
-
-    async def _get_transaction(self, tx_hash, *, allow_server_not_finding_tx=False):
-        self._requests_sent += 1
+        self._requests_sent += len(transaction_hashes)
         try:
-            raw_tx = await self.interface.get_transaction(tx_hash)
-        except RPCError as e:
-            # most likely, "No such mempool or blockchain transaction"
-            if allow_server_not_finding_tx:
-                self.requested_tx.pop(tx_hash)
-                return
-            else:
-                raise
+            raw_txs = await self.interface.get_transactions(transaction_hashes)
         finally:
-            self._requests_answered += 1
+            self._requests_answered += len(transaction_hashes)
+        for tx_hash, raw_tx in zip(transaction_hashes, raw_txs):
+            if isinstance(raw_tx, RPCError):
+                # most likely, "No such mempool or blockchain transaction"
+                if allow_server_not_finding_tx:
+                    self.requested_tx.pop(tx_hash)
+                    continue
+                raise raw_tx
+            elif isinstance(raw_tx, Exception):
+                raise raw_tx
+            self._receive_transaction(tx_hash, raw_tx)
+
+    def _receive_transaction(self, tx_hash, raw_tx):
         tx = Transaction(raw_tx)
         if tx_hash != tx.txid():
             raise SynchronizerFailure(f"received tx does not match expected txid ({tx_hash} != {tx.txid()})")
         tx_height = self.requested_tx.pop(tx_hash)
+        self.network.tx_cache[tx_hash] = raw_tx
         self.wallet.receive_tx_callback(tx_hash, tx, tx_height)
         self.logger.info(f"received tx {tx_hash} height: {tx_height} bytes: {len(raw_tx)}")
         # callbacks
@@ -231,13 +368,16 @@ class Synchronizer(SynchronizerBase):
 
     async def main(self):
         self.wallet.set_up_to_date(False)
+        await self.taskgroup.spawn(self.send_history_requests())
         # request missing txns, if any
+        hist = []
         for addr in random_shuffled_copy(self.wallet.db.get_history()):
             history = self.wallet.db.get_addr_history(addr)
             # Old electrum servers returned ['*'] when all history for the address
             # was pruned. This no longer happens but may remain in old wallets.
             if history == ['*']: continue
-            await self._request_missing_txs(history, allow_server_not_finding_tx=True)
+            hist.extend(history)
+        await self._request_missing_txs(hist, allow_server_not_finding_tx=True)
         # add addresses to bootstrap
         for addr in random_shuffled_copy(self.wallet.get_addresses()):
             await self._add_address(addr)
@@ -161,6 +161,18 @@ class Test_bitcoin(ElectrumTestCase):
         self.assertEqual(2 * G, inf + 2 * G)
         self.assertEqual(inf, 3 * G + (-3 * G))
 
+    def test_add_tweak_to_pubkey(self):
+        G = ecc.GENERATOR
+        n = G.order()
+        P = 5 * G
+        for pubkey in (P.get_public_key_bytes(compressed=True), P.get_public_key_bytes(compressed=False)):
+            self.assertEqual((P + 7 * G).get_public_key_bytes(compressed=True),
+                             ecc.add_tweak_to_pubkey(pubkey, (7).to_bytes(32, 'big')))
+        with self.assertRaises(ecc.InvalidECPointException):  # result at infinity
+            ecc.add_tweak_to_pubkey(P.get_public_key_bytes(), (n - 5).to_bytes(32, 'big'))
+        with self.assertRaises(ecc.InvalidECPointException):  # tweak not below the curve order
+            ecc.add_tweak_to_pubkey(P.get_public_key_bytes(), n.to_bytes(32, 'big'))
+
     def test_msg_signing(self):
         msg1 = b'Chancellor on brink of second bailout for banks'
         msg2 = b'Electrum'
@@ -4,7 +4,7 @@ import os
 
 from electrum import constants, blockchain
 from electrum.simple_config import SimpleConfig
-from electrum.blockchain import Blockchain, deserialize_header, hash_header
+from electrum.blockchain import Blockchain, deserialize_header, hash_header, serialize_header, MissingHeader
 from electrum.util import bh2u, bfh, make_dir
 
 from . import ElectrumTestCase
@@ -268,6 +268,34 @@ class TestBlockchain(ElectrumTestCase):
         self.assertEqual(hash_header(self.HEADERS['M']), chain_z.get_hash(9))
         self.assertEqual(hash_header(self.HEADERS['Z']), chain_z.get_hash(13))
 
+    def test_header_store_remaps_after_write_and_swap(self):
+        blockchain.blockchains[constants.net.GENESIS] = chain_u = Blockchain(
+            config=self.config, forkpoint=0, parent=None,
+            forkpoint_hash=constants.net.GENESIS, prev_hash=None)
+        open(chain_u.path(), 'w+').close()
+        self.assertIsNone(chain_u.read_header(0))
+        for name in 'ABCDEFOPQ':
+            self._append_header(chain_u, self.HEADERS[name])
+            # reads are served from the mapping, which must follow appends
+            self.assertEqual(hash_header(self.HEADERS[name]), chain_u.get_hash(chain_u.height()))
+
+        chain_l = chain_u.fork(self.HEADERS['G'])
+        for name in 'HIJK':
+            self._append_header(chain_l, self.HEADERS[name])
+        # chains were swapped; both files were rewritten and renamed
+        self.assertEqual(0, chain_l.forkpoint)
+        for height, name in enumerate('ABCDEFGHIJK'):
+            self.assertEqual(self.HEADERS[name], chain_l.read_header(height))
+        for height, name in enumerate('OPQ', start=6):
+            self.assertEqual(self.HEADERS[name], chain_u.read_header(height))
+        self.assertIsNone(chain_u.read_header(9))
+
+        # truncating write
+        chain_l.write(bfh(blockchain.serialize_header(self.HEADERS['G'])), 6 * 80)
+        self.assertEqual(6, chain_l.height())
+        self.assertEqual(hash_header(self.HEADERS['G']), chain_l.get_hash(6))
+        self.assertIsNone(chain_l.read_header(7))
+
     def test_doing_multiple_swaps_after_single_new_header(self):
         blockchain.blockchains[constants.net.GENESIS] = chain_u = Blockchain(
             config=self.config, forkpoint=0, parent=None,
@@ -385,6 +413,193 @@ class TestBlockchain(ElectrumTestCase):
         self.assertEqual([chain_z, chain_l], self.get_chains_that_contain_header_helper(self.HEADERS['I']))
 
 
+class TestVerifyChunk(ElectrumTestCase):
+
+    HEADERS = TestBlockchain.HEADERS
+    MAIN_CHAIN = 'ABCDEFOPQRSTU'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        constants.set_regtest()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        constants.set_mainnet()
+
+    def setUp(self):
+        super().setUp()
+        self.data_dir = self.electrum_path
+        make_dir(os.path.join(self.data_dir, 'forks'))
+        self.config = SimpleConfig({'electrum_path': self.data_dir})
+        blockchain.blockchains = {}
+        blockchain.blockchains[constants.net.GENESIS] = self.chain = Blockchain(
+            config=self.config, forkpoint=0, parent=None,
+            forkpoint_hash=constants.net.GENESIS, prev_hash=None)
+        open(self.chain.path(), 'w+').close()
+
+    def _append_header(self, chain: Blockchain, header: dict):
+        self.assertTrue(chain.can_connect(header))
+        chain.save_header(header)
+
+    def _chunk(self, names: str) -> bytes:
+        return b''.join(bfh(serialize_header(self.HEADERS[name])) for name in names)
+
+    @staticmethod
+    def _verify_chunk_per_header(chain: Blockchain, index: int, data: bytes) -> None:
+        # reference implementation: deserialize and hash every header separately
+        num = len(data) // 80
+        start_height = index * 2016
+        prev_hash = chain.get_hash(start_height - 1)
+        target = chain.get_target(index-1)
+        for i in range(num):
+            height = start_height + i
+            try:
+                expected_header_hash = chain.get_hash(height)
+            except MissingHeader:
+                expected_header_hash = None
+            header = deserialize_header(data[i*80:(i+1)*80], height)
+            Blockchain.verify_header(header, prev_hash, target, expected_header_hash)
+            prev_hash = hash_header(header)
+
+    def _assert_parity(self, data: bytes, *, valid: bool):
+        for verify in (self.chain.verify_chunk,
+                       lambda idx, d: self._verify_chunk_per_header(self.chain, idx, d)):
+            if valid:
+                verify(0, data)
+            else:
+                with self.assertRaises(Exception):
+                    verify(0, data)
+
+    def test_hash_raw_headers(self):
+        data = self._chunk(self.MAIN_CHAIN)
+        digests = blockchain.hash_raw_headers(data + b'\x00' * 10)
+        self.assertEqual([hash_header(self.HEADERS[name]) for name in self.MAIN_CHAIN],
+                         [bh2u(d[::-1]) for d in digests])
+
+    def test_valid_chunk_on_empty_chain(self):
+        self._assert_parity(self._chunk(self.MAIN_CHAIN), valid=True)
+        self._assert_parity(self._chunk('ABCDEFGHIJKL'), valid=True)
+
+    def test_broken_prev_hash_link(self):
+        self._assert_parity(self._chunk('ABCDEFPOQ'), valid=False)
+        self._assert_parity(self._chunk('ABCDEFOPQSR'), valid=False)
+
+    def test_chunk_must_match_local_headers(self):
+        for name in 'ABCDEFOP':
+            self._append_header(self.chain, self.HEADERS[name])
+        self._assert_parity(self._chunk(self.MAIN_CHAIN), valid=True)
+        self._assert_parity(self._chunk('ABCDEFGHIJ'), valid=False)
+
+    def test_connect_chunk(self):
+        self.assertFalse(self.chain.connect_chunk(0, self._chunk('ABCDEFOQP').hex()))
+        self.assertEqual(-1, self.chain.height())
+        self.assertTrue(self.chain.connect_chunk(0, self._chunk(self.MAIN_CHAIN).hex()))
+        self.assertEqual(12, self.chain.height())
+        self.assertEqual(hash_header(self.HEADERS['U']), self.chain.get_hash(12))
+
+
+class TestChainworkIndex(ElectrumTestCase):
+
+    NUM_HEADERS = 3 * 2016 + 50
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # synthetic mainnet-like chain, so that targets and chainwork are computed
+        cls.raw_headers = []
+        prev_hash = '00' * 32
+        timestamp = 1600000000
+        for height in range(cls.NUM_HEADERS):
+            timestamp += 300 + 150 * (height // 2016)
+            header = {'version': 1, 'prev_block_hash': prev_hash, 'merkle_root': '%064x' % height,
+                      'timestamp': timestamp, 'bits': 0x1d00ffff, 'nonce': 0}
+            raw = serialize_header(header)
+            cls.raw_headers.append(bfh(raw))
+            prev_hash = blockchain.hash_raw_header(raw)
+
+        class ChainworkTestNet(constants.BitcoinMainnet):
+            GENESIS = blockchain.hash_raw_header(bh2u(cls.raw_headers[0]))
+            CHECKPOINTS = []
+        constants.net = ChainworkTestNet
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        constants.set_mainnet()
+
+    def setUp(self):
+        super().setUp()
+        make_dir(os.path.join(self.electrum_path, 'forks'))
+        self.config = SimpleConfig({'electrum_path': self.electrum_path})
+        blockchain.blockchains = {}
+
+    def _new_chain(self) -> Blockchain:
+        blockchain.blockchains[constants.net.GENESIS] = chain = Blockchain(
+            config=self.config, forkpoint=0, parent=None,
+            forkpoint_hash=constants.net.GENESIS, prev_hash=None)
+        return chain
+
+    def _expected_chainwork(self, height: int) -> int:
+        headers = [deserialize_header(h, i) for i, h in enumerate(self.raw_headers)]
+        target = blockchain.MAX_TARGET
+        total = 0
+        for period in range(height // 2016 + 1):
+            num = 2016 if period < height // 2016 else height % 2016 + 1
+            total += num * Blockchain.target_to_work(target)
+            if num == 2016:
+                first, last = headers[period * 2016], headers[period * 2016 + 2015]
+                timespan = last['timestamp'] - first['timestamp']
+                timespan = min(max(timespan, 14 * 24 * 60 * 60 // 4), 14 * 24 * 60 * 60 * 4)
+                target = Blockchain.bits_to_target(last['bits']) * timespan // (14 * 24 * 60 * 60)
+                target = Blockchain.bits_to_target(Blockchain.target_to_bits(min(blockchain.MAX_TARGET, target)))
+        return total
+
+    def _sync_chain(self) -> Blockchain:
+        chain = self._new_chain()
+        open(chain.path(), 'w+').close()
+        for idx in range(3):
+            self.assertTrue(chain.connect_chunk(idx, b''.join(self.raw_headers[idx*2016:(idx+1)*2016]).hex()))
+        for height in range(3 * 2016, self.NUM_HEADERS):
+            chain.save_header(deserialize_header(self.raw_headers[height], height))
+        return chain
+
+    def test_index_is_updated_incrementally(self):
+        chain = self._sync_chain()
+        self.assertEqual(3, len(chain.chainwork_index.records))
+        self.assertEqual(3 * 96, os.path.getsize(chain.path() + '.chainwork'))
+        self.assertEqual(len({record.target for record in chain.chainwork_index.records}), 3)
+        for height in (0, 2015, 2016, 4100, 3 * 2016 - 1, self.NUM_HEADERS - 1):
+            self.assertEqual(self._expected_chainwork(height), chain.get_chainwork(height))
+
+    def test_index_is_reloaded_from_disk(self):
+        records = self._sync_chain().chainwork_index.records
+        chain = self._new_chain()
+        self.assertEqual(records, chain.chainwork_index.records)
+        self.assertEqual(self._expected_chainwork(self.NUM_HEADERS - 1), chain.get_chainwork())
+
+    def test_index_is_truncated_with_headers(self):
+        chain = self._sync_chain()
+        chain.write(self.raw_headers[3000], 3000 * 80)
+        self.assertEqual(1, len(chain.chainwork_index.records))
+        self.assertEqual(96, os.path.getsize(chain.path() + '.chainwork'))
+        self.assertEqual(self._expected_chainwork(3000), chain.get_chainwork())
+
+    def test_stale_index_is_discarded(self):
+        chain = self._sync_chain()
+        chain.header_store.close()
+        with open(chain.path(), 'rb+') as f:
+            f.seek(2 * 2016 * 80)
+            f.truncate()
+            f.write(b''.join(self.raw_headers[2 * 2016: 3 * 2016 - 1]))
+            f.write(bytes(80))
+        chain = self._new_chain()
+        self.assertEqual([], chain.chainwork_index.records)
+        self.assertFalse(os.path.exists(chain.path() + '.chainwork'))
+        self.assertEqual(self._expected_chainwork(2 * 2016 + 5), chain.get_chainwork(2 * 2016 + 5))
+
+
 class TestVerifyHeader(ElectrumTestCase):
 
     # Data for Bitcoin block header #100.
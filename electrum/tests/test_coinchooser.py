@@ -1,9 +1,38 @@
-from electrum.coinchooser import CoinChooserPrivacy
+from typing import Sequence, List
+
+from electrum import bitcoin
+from electrum.coinchooser import (CoinChooserPrivacy, CoinChooserBranchAndBound, branch_and_bound,
+                                  get_coin_chooser)
+from electrum.crypto import sha256
+from electrum.ecc import ECPrivkey
+from electrum.simple_config import SimpleConfig
+from electrum.transaction import PartialTxInput, PartialTxOutput, TxOutpoint
 from electrum.util import NotEnoughFunds
 
 from . import ElectrumTestCase
 
 
+def make_coins(values: Sequence[int]) -> List[PartialTxInput]:
+    """Returns p2wpkh coins with the given values, each on its own address."""
+    pubkey = ECPrivkey(bytes(31) + b'\x01').get_public_key_bytes(compressed=True)
+    coins = []
+    for i, value in enumerate(values):
+        h = sha256(i.to_bytes(4, 'little'))
+        txin = PartialTxInput(prevout=TxOutpoint(txid=h, out_idx=0))
+        txin.script_type = 'p2wpkh'
+        txin.pubkeys = [pubkey]
+        txin.num_sig = 1
+        txin._trusted_address = bitcoin.hash_to_segwit_addr(h[:20], witver=0)
+        txin._trusted_value_sats = value
+        txin.block_height = 600_000
+        coins.append(txin)
+    return coins
+
+
+def fee_estimator_vb(size) -> int:
+    return int(round(10 * size))  # 10 sat/vbyte
+
+
 class TestCoinChooser(ElectrumTestCase):
 
     def test_bucket_candidates_with_empty_buckets(self):
@@ -18,3 +47,113 @@ class TestCoinChooser(ElectrumTestCase):
             coin_chooser.bucket_candidates_any([], sufficient_funds)
         with self.assertRaises(NotEnoughFunds):
             coin_chooser.bucket_candidates_prefer_confirmed([], sufficient_funds)
+
+
+class TestCandidateScoring(ElectrumTestCase):
+
+    def test_change_value_same_as_constructed_tx(self):
+        winners = []
+
+        class CoinChooser(CoinChooserPrivacy):
+            def choose_buckets(self, buckets, sufficient_funds, penalty_func):
+                winner = super().choose_buckets(buckets, sufficient_funds, penalty_func)
+                winners.append(winner)
+                return winner
+
+        coins = make_coins([10_000 * i + 123 * i * i for i in range(1, 100)])
+        dest_addr = bitcoin.hash_to_segwit_addr(bytes(20), witver=0)
+        change_addr = bitcoin.hash_to_segwit_addr(b'\x01' * 20, witver=0)
+        for rounding in (False, True):
+            for change_addrs in ([change_addr], []):
+                for amount in (12_345, 150_000, 1_000_000, 3_210_000, 6_000_000):
+                    outputs = [PartialTxOutput.from_address_and_value(dest_addr, amount)]
+                    tx = CoinChooser(enable_output_value_rounding=rounding).make_tx(
+                        coins=coins, inputs=[], outputs=outputs, change_addrs=change_addrs,
+                        fee_estimator_vb=fee_estimator_vb, dust_threshold=546)
+                    change_value = tx.output_value() - amount
+                    self.assertEqual(change_value, winners[-1].change_value)
+                    self.assertEqual({coin.prevout for bkt in winners[-1].buckets for coin in bkt.coins},
+                                     {txin.prevout for txin in tx.inputs()})
+
+
+class TestBranchAndBound(ElectrumTestCase):
+
+    def test_exact_match(self):
+        values = [1, 2, 3, 4, 5, 8, 13, 21]
+        indices = branch_and_bound(values, target=30, cost_of_change=0)
+        self.assertEqual(30, sum(values[i] for i in indices))
+        self.assertEqual(indices, sorted(indices))
+
+    def test_least_excess_within_window(self):
+        values = [100, 205, 310, 420]
+        indices = branch_and_bound(values, target=500, cost_of_change=50)
+        self.assertEqual([1, 2], indices)  # 515; 520 has more excess
+        self.assertIsNone(branch_and_bound(values, target=500, cost_of_change=4))
+        self.assertIsNone(branch_and_bound(values, target=2000, cost_of_change=1000))
+
+    def test_target_not_positive(self):
+        self.assertEqual([], branch_and_bound([5, 7], target=0, cost_of_change=10))
+        self.assertIsNone(branch_and_bound([5, 7], target=-20, cost_of_change=10))
+
+    def test_many_equal_values(self):
+        # without skipping equivalent branches, this would exhaust the budget
+        values = [1000] * 1000 + [1]
+        indices = branch_and_bound(values, target=50_001, cost_of_change=0, max_tries=10_000)
+        self.assertEqual(51, len(indices))
+        self.assertIn(1000, indices)
+
+    def test_max_tries(self):
+        values = [2 ** i for i in range(20)]
+        self.assertIsNone(branch_and_bound(values, target=2 ** 20 - 1, cost_of_change=0, max_tries=10))
+        self.assertEqual(list(range(20)), branch_and_bound(values, target=2 ** 20 - 1, cost_of_change=0))
+
+
+class TestCoinChooserBranchAndBound(ElectrumTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.dest_addr = bitcoin.hash_to_segwit_addr(bytes(20), witver=0)
+        self.change_addr = bitcoin.hash_to_segwit_addr(b'\x01' * 20, witver=0)
+
+    def make_tx(self, coin_chooser, coins, amount):
+        outputs = [PartialTxOutput.from_address_and_value(self.dest_addr, amount)]
+        return coin_chooser.make_tx(coins=coins, inputs=[], outputs=outputs,
+                                    change_addrs=[self.change_addr],
+                                    fee_estimator_vb=fee_estimator_vb, dust_threshold=546)
+
+    def test_registered(self):
+        config = SimpleConfig({'electrum_path': self.electrum_path, 'coin_chooser': 'BranchAndBound'})
+        self.assertIsInstance(get_coin_chooser(config), CoinChooserBranchAndBound)
+
+    def test_changeless(self):
+        coins = make_coins([10_000 * i + 123 for i in range(1, 200)])
+        coin_chooser = CoinChooserBranchAndBound(enable_output_value_rounding=False)
+        tx = self.make_tx(coin_chooser, coins, 1_234_567)
+        self.assertEqual(1, len(tx.outputs()))
+        # the excess over the required fee is less than what a change output would cost
+        fee_without_excess = fee_estimator_vb(tx.estimated_size())
+        self.assertLessEqual(fee_without_excess, tx.get_fee())
+        self.assertLess(tx.get_fee() - fee_without_excess, coin_chooser.changeless_target.cost_of_change)
+        # the privacy chooser creates change for the same payment
+        tx = self.make_tx(CoinChooserPrivacy(enable_output_value_rounding=False), coins, 1_234_567)
+        self.assertEqual(2, len(tx.outputs()))
+
+    def test_falls_back_to_privacy(self):
+        coins = make_coins([1_000_000, 3_000_000])
+        tx1 = self.make_tx(CoinChooserBranchAndBound(enable_output_value_rounding=False), coins, 1_500_000)
+        tx2 = self.make_tx(CoinChooserPrivacy(enable_output_value_rounding=False), coins, 1_500_000)
+        self.assertEqual(2, len(tx1.outputs()))
+        self.assertEqual(tx2.serialize(), tx1.serialize())
+        with self.assertRaises(NotEnoughFunds):
+            self.make_tx(CoinChooserBranchAndBound(enable_output_value_rounding=False), coins, 5_000_000)
+
+    def test_prefers_confirmed_coins(self):
+        values = [10_000 * i + 123 for i in range(1, 100)]
+        coins = make_coins(values + [1_234_567 + 1_110])  # last one pays exactly for itself
+        tx = self.make_tx(CoinChooserBranchAndBound(enable_output_value_rounding=False), coins, 1_234_567)
+        self.assertEqual((1, 1), (len(tx.inputs()), len(tx.outputs())))
+        coins[-1].block_height = 0
+        tx = self.make_tx(CoinChooserBranchAndBound(enable_output_value_rounding=False), coins, 1_234_567)
+        self.assertEqual(1, len(tx.outputs()))
+        self.assertLess(1, len(tx.inputs()))
+        self.assertTrue(all(txin.block_height > 0 for txin in tx.inputs()))
@@ -1,11 +1,23 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
 import unittest
+from base64 import b64encode
 from unittest import mock
 from decimal import Decimal
 
 from electrum.util import create_and_start_event_loop
-from electrum.commands import Commands, eval_bool
+from electrum.commands import Commands, CommandExecutor, eval_bool
+from electrum import daemon
+from electrum.daemon import (AuthenticatedServer, Daemon, DaemonClient, DaemonNotRunning, get_lockfile,
+                             get_rpc_credentials)
 from electrum import storage, wallet
 from electrum.wallet import restore_wallet_from_text
+from electrum.wallet_sqlite_db import get_sqlite_path
 from electrum.simple_config import SimpleConfig
 
 from . import TestCaseForTestnet, ElectrumTestCase
@@ -128,6 +140,54 @@ class TestCommands(ElectrumTestCase):
                          cmds._run('getprivatekeys', (['bc1qdlgh4gp7rsty5vt49alv9can6jalz37z0sy7t3', 'bc1q7sfcrq7up7aegsycgveg2s5dlg66qzlwu065h3'], ), wallet=wallet))
 
 
+    @mock.patch.object(wallet.Abstract_Wallet, 'save_db')
+    def test_cpu_intensive_command_runs_in_executor(self, mock_save_db):
+        wallet = restore_wallet_from_text('bitter grass shiver impose acquire brush forget axis eager alone wine silver',
+                                          gap_limit=2,
+                                          path='if_this_exists_mocking_failed_648151893',
+                                          config=self.config)['wallet']
+        expected = Commands(config=self.config)._run('listaddresses', (), wallet=wallet)
+        threads = []
+        get_addresses = wallet.get_addresses
+        def get_addresses_recording_thread():
+            threads.append(threading.current_thread())
+            return get_addresses()
+        wallet.get_addresses = get_addresses_recording_thread
+        with CommandExecutor(2, thread_name_prefix='test_cmd_thread') as executor:
+            cmds = Commands(config=self.config, executor=executor)
+            self.assertEqual(expected, cmds._run('listaddresses', (), wallet=wallet))
+            # not marked as CPU-intensive
+            self.assertEqual(wallet.get_receiving_addresses()[0], cmds._run('getunusedaddress', (), wallet=wallet))
+        self.assertEqual(1, len(threads))
+        self.assertTrue(threads[0].name.startswith('test_cmd_thread'))
+        # not a daemon thread, so that the command can write the wallet file
+        self.assertFalse(threads[0].daemon)
+
+    def test_command_executor(self):
+        executor = CommandExecutor(2)
+        running = threading.Barrier(2)
+        release = threading.Event()
+        def job(i):
+            if i < 2:
+                running.wait(timeout=5)  # both workers run at the same time
+                release.wait(timeout=5)
+            return i * i, threading.current_thread()
+        futures = [executor.submit(job, i) for i in range(5)]
+        release.set()
+        results = [f.result(timeout=5) for f in futures]
+        self.assertEqual([0, 1, 4, 9, 16], [r for r, thread in results])
+        self.assertEqual(2, len({thread for r, thread in results}))
+        def raise_error():
+            raise ValueError('job failed')
+        with self.assertRaises(ValueError):
+            executor.submit(raise_error).result(timeout=5)
+        executor.shutdown(wait=True)
+        # idle workers exit
+        self.assertFalse(any(thread.is_alive() for r, thread in results))
+        with self.assertRaises(RuntimeError):
+            executor.submit(job, 0)
+
+
 class TestCommandsTestnet(TestCaseForTestnet):
 
     def setUp(self):
@@ -216,3 +276,253 @@ class TestCommandsTestnet(TestCaseForTestnet):
                          cmds._run('getprivatekeyforpath', ("m/0/10000",), wallet=wallet))
         self.assertEqual("p2wpkh:cUEr7LPYctHr72f1FVk3k72vT1j569qjZV9ncsrcjGG6FVaRNjN5",
                          cmds._run('getprivatekeyforpath', ("m/5h/100000/88h/7",), wallet=wallet))
+
+
+class TestAuthenticatedServer(ElectrumTestCase):
+
+    class Request:
+        def __init__(self, body, *, auth=('user', 'pass')):
+            self.headers = {}
+            if auth is not None:
+                self.headers['Authorization'] = 'Basic ' + b64encode(':'.join(auth).encode()).decode()
+            self._body = json.dumps(body)
+
+        async def text(self):
+            return self._body
+
+    def setUp(self):
+        super().setUp()
+        self.asyncio_loop, self._stop_loop, self._loop_thread = create_and_start_event_loop()
+        self.server = AuthenticatedServer('user', 'pass')
+        self.ongoing = 0
+        self.max_ongoing = 0
+
+        async def add(a, b):
+            self.ongoing += 1
+            self.max_ongoing = max(self.ongoing, self.max_ongoing)
+            await asyncio.sleep(0.01)
+            self.ongoing -= 1
+            return a + b
+        self.server.register_method(add)
+
+    def tearDown(self):
+        super().tearDown()
+        self.asyncio_loop.call_soon_threadsafe(self._stop_loop.set_result, 1)
+        self._loop_thread.join(timeout=1)
+
+    def handle(self, request):
+        fut = asyncio.run_coroutine_threadsafe(self.server.handle(request), self.asyncio_loop)
+        response = fut.result()
+        return response.status, response.text
+
+    def test_single_request(self):
+        status, text = self.handle(self.Request({'id': 7, 'method': 'add', 'params': [1, 2]}))
+        self.assertEqual(200, status)
+        self.assertEqual({'id': 7, 'jsonrpc': '2.0', 'result': 3}, json.loads(text))
+        status, text = self.handle(self.Request({'id': 8, 'method': 'sub', 'params': [1, 2]}))
+        self.assertEqual((500, 'Invalid Request'), (status, text))
+
+    def test_batch_request(self):
+        batch = [
+            {'id': 1, 'method': 'add', 'params': [1, 2]},
+            {'id': 2, 'method': 'add', 'params': {'a': 3, 'b': 4}},
+            {'id': 3, 'method': 'sub', 'params': [1, 2]},
+            {'id': 4, 'method': 'add', 'params': [1]},
+            {'id': 5, 'method': 'add', 'params': [5, 6]},
+        ]
+        status, text = self.handle(self.Request(batch))
+        self.assertEqual(200, status)
+        responses = json.loads(text)
+        self.assertEqual([1, 2, 3, 4, 5], [r['id'] for r in responses])
+        self.assertEqual([3, 7, 11], [responses[i]['result'] for i in (0, 1, 4)])
+        self.assertEqual(-32600, responses[2]['error']['code'])
+        self.assertEqual(1, responses[3]['error']['code'])
+        # the calls of a batch run concurrently
+        self.assertEqual(3, self.max_ongoing)
+        self.assertEqual((500, 'Invalid Request'), self.handle(self.Request([])))
+
+    def test_authentication(self):
+        request = {'id': 1, 'method': 'add', 'params': [1, 2]}
+        self.assertEqual(401, self.handle(self.Request(request, auth=None))[0])
+        self.assertEqual(403, self.handle(self.Request(request, auth=('user', 'wrong')))[0])
+        self.assertIsNone(self.server._verified_auth_string)
+        self.assertEqual(200, self.handle(self.Request(request))[0])
+        self.assertIsNotNone(self.server._verified_auth_string)
+        # the verified credentials are cached, others are still checked
+        self.assertEqual(200, self.handle(self.Request(request))[0])
+        self.assertEqual(403, self.handle(self.Request(request, auth=('user', 'pass2')))[0])
+        self.assertEqual(403, self.handle(self.Request(request, auth=('user2', 'pass')))[0])
+
+
+class TestDaemonClient(ElectrumTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.asyncio_loop, self._stop_loop, self._loop_thread = create_and_start_event_loop()
+        self.config = SimpleConfig({'electrum_path': self.electrum_path})
+        self.server = AuthenticatedServer(*get_rpc_credentials(self.config))
+        self.peers = set()
+
+        async def echo(*args):
+            return list(args)
+        self.server.register_method(echo)
+
+    def tearDown(self):
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.asyncio_loop).result()
+        super().tearDown()
+        self.asyncio_loop.call_soon_threadsafe(self._stop_loop.set_result, 1)
+        self._loop_thread.join(timeout=1)
+
+    def start_server(self):
+        from aiohttp import web
+
+        async def handle(request):
+            self.peers.add(request.transport.get_extra_info('peername'))
+            return await self.server.handle(request)
+
+        async def start():
+            app = web.Application()
+            app.router.add_post("/", handle)
+            self.runner = web.AppRunner(app)
+            await self.runner.setup()
+            site = web.TCPSite(self.runner, '127.0.0.1', 0)
+            await site.start()
+            return site._server.sockets[0].getsockname()[:2]
+        host_port = asyncio.run_coroutine_threadsafe(start(), self.asyncio_loop).result()
+        with open(get_lockfile(self.config), 'w') as f:
+            f.write(repr((host_port, time.time())))
+
+    def test_requests_reuse_connection(self):
+        self.start_server()
+        with DaemonClient(self.config) as client:
+            for i in range(5):
+                self.assertEqual([i, 'a'], client.request('echo', (i, 'a')))
+            self.assertEqual([[1], [2, 3], 'Error: ' + str({'code': -32600, 'message': 'Invalid Request'}), []],
+                             client.request_batch([('echo', (1,)), ('echo', (2, 3)), ('nope', ()), ('echo', ())]))
+        self.assertEqual(1, len(self.peers))
+
+    def test_daemon_not_running(self):
+        with self.assertRaises(DaemonNotRunning):
+            DaemonClient(self.config).request('echo')
+        self.runner = mock.Mock(cleanup=mock.AsyncMock())
+        # stale lockfile
+        with open(get_lockfile(self.config), 'w') as f:
+            f.write(repr((('127.0.0.1', 1), time.time() - 10)))
+        with self.assertRaises(DaemonNotRunning):
+            DaemonClient(self.config).request('echo')
+
+
+class TestDaemonWalletPool(ElectrumTestCase):
+
+    XPUB = 'xpub661MyMwAqRbcGH3yTb2kMQGnsLziRTJZ8vNthsVSCGbdBr8CGDWKxnGAFYgyKTzBtwvPPmfVAWJuFmxRXjSbUTg87wDkWQ5GmzpfUcN9t8Z'
+
+    def setUp(self):
+        super().setUp()
+        self.asyncio_loop, self._stop_loop, self._loop_thread = create_and_start_event_loop()
+        self.config = SimpleConfig({'electrum_path': self.electrum_path, 'offline': True,
+                                    'max_loaded_wallets': 2})
+        self.daemon = Daemon(self.config, listen_jsonrpc=False)
+        self.paths = []
+        for i in range(4):
+            path = os.path.join(self.electrum_path, f'wallet{i}')
+            restore_wallet_from_text(self.XPUB, path=path, config=self.config, gap_limit=2)
+            self.paths.append(path)
+
+    def tearDown(self):
+        for wallet in self.daemon.get_wallets().values():
+            wallet.stop()
+        asyncio.run_coroutine_threadsafe(self.daemon.taskgroup.cancel_remaining(), self.asyncio_loop).result()
+        super().tearDown()
+        self.asyncio_loop.call_soon_threadsafe(self._stop_loop.set_result, 1)
+        self._loop_thread.join(timeout=1)
+
+    def load_wallet(self, path):
+        wallet = self.daemon.load_wallet(path, None)
+        wallet.set_up_to_date(True)
+        return wallet
+
+    def test_recently_used_wallets_stay_loaded(self):
+        for path in self.paths:
+            self.load_wallet(path)
+        self.assertEqual(4, len(self.daemon.get_wallets()))
+        self.assertEqual([], self.daemon.get_unloaded_wallets())
+
+    @mock.patch.object(daemon, 'MIN_WALLET_IDLE_TIME', 0)
+    def test_lru_wallets_unloaded_and_reloaded(self):
+        wallets = [self.load_wallet(path) for path in self.paths[:3]]
+        self.assertEqual(self.paths[1:3], sorted(self.daemon.get_wallets()))
+        self.assertEqual(self.paths[:1], self.daemon.get_unloaded_wallets())
+        # using wallet1 makes wallet2 the least recently used one
+        self.assertIs(wallets[1], self.daemon.get_wallet(self.paths[1]))
+        wallet0 = self.daemon.get_wallet(self.paths[0])
+        self.assertIsNotNone(wallet0)
+        self.assertIsNot(wallets[0], wallet0)
+        self.assertEqual(wallets[0].get_receiving_addresses(), wallet0.get_receiving_addresses())
+        self.assertEqual([self.paths[0], self.paths[1]], sorted(self.daemon.get_wallets()))
+        self.assertEqual(self.paths[2:3], self.daemon.get_unloaded_wallets())
+        # closing an unloaded wallet forgets it
+        self.assertTrue(self.daemon.stop_wallet(self.paths[2]))
+        self.assertIsNone(self.daemon.get_wallet(self.paths[2]))
+        self.assertEqual([], self.daemon.get_unloaded_wallets())
+
+    @mock.patch.object(daemon, 'MIN_WALLET_IDLE_TIME', 0)
+    def test_busy_wallets_stay_loaded(self):
+        wallets = [self.load_wallet(path) for path in self.paths[:2]]
+        wallets[0].set_up_to_date(False)
+        self.load_wallet(self.paths[2])
+        self.assertEqual(self.paths[0:1] + self.paths[2:3], sorted(self.daemon.get_wallets()))
+        self.assertEqual(self.paths[1:2], self.daemon.get_unloaded_wallets())
+
+
+    @mock.patch.object(daemon, 'MIN_WALLET_IDLE_TIME', 0)
+    def test_wallets_with_running_commands_stay_loaded(self):
+        wallets = [self.load_wallet(path) for path in self.paths[:2]]
+        with self.daemon.wallet_in_use(wallets[0]):
+            with self.daemon.wallet_in_use(wallets[0]):
+                pass
+            self.load_wallet(self.paths[2])
+            self.assertEqual(self.paths[0:1] + self.paths[2:3], sorted(self.daemon.get_wallets()))
+        # wallet0 was used after wallet2 was loaded
+        self.load_wallet(self.paths[3])
+        self.assertEqual([self.paths[0], self.paths[3]], sorted(self.daemon.get_wallets()))
+        # commands mark their wallet as in use
+        cmds = Commands(config=self.config, daemon=self.daemon)
+        in_use = []
+        def get_addresses():
+            in_use.append(self.daemon._num_commands_running.get(wallet))
+            return []
+        wallet = self.daemon.get_wallet(self.paths[3])
+        wallet.get_addresses = get_addresses
+        asyncio.run_coroutine_threadsafe(cmds.listaddresses(wallet=self.paths[3]), self.asyncio_loop).result()
+        self.assertEqual([1], in_use)
+        self.assertEqual({}, self.daemon._num_commands_running)
+
+    def test_delete_wallet_deletes_sqlite_db(self):
+        sqlite_path = get_sqlite_path(self.paths[0])
+        open(sqlite_path, 'w').close()
+        self.assertTrue(self.daemon.delete_wallet(self.paths[0]))
+        self.assertFalse(os.path.exists(self.paths[0]))
+        self.assertFalse(os.path.exists(sqlite_path))
+
+
+class TestCommandLineClientImports(unittest.TestCase):
+    # Sending a command to a running daemon must not import the modules
+    # that are only needed by the daemon, the GUI, or offline commands.
+
+    def test_client_mode_imports(self):
+        code = ("import sys\n"
+                "from electrum import constants, daemon, SimpleConfig\n"
+                "from electrum.storage import WalletStorage\n"
+                "from electrum.commands import get_parser, known_commands\n"
+                "get_parser().parse_args(['getbalance'])\n"
+                "print(' '.join(sys.modules))\n")
+        repo_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        env = dict(os.environ, PYTHONPATH=repo_root)
+        out = subprocess.run([sys.executable, '-c', code], env=env, cwd=repo_root,
+                             stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+        modules = set(out.split())
+        self.assertIn('electrum.daemon', modules)
+        for module in ('electrum.wallet', 'electrum.wallet_db', 'electrum.network', 'electrum.lnworker',
+                       'electrum.paymentrequest', 'electrum.plugin', 'electrum.transaction', 'electrum.ecc',
+                       'google.protobuf', 'aiohttp_socks', 'dns.resolver'):
+            self.assertNotIn(module, modules)
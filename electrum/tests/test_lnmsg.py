@@ -1,4 +1,5 @@
 import io
+import random
 
 from electrum.lnmsg import (read_bigsize_int, write_bigsize_int, FieldEncodingNotMinimal,
                             UnexpectedEndOfStream, LNSerializer, UnknownMandatoryTLVRecordType,
@@ -383,3 +384,68 @@ class TestLNMsg(TestCaseForTestnet):
                                   {'chains': b'CI\x7f\xd7\xf8&\x95q\x08\xf4\xa3\x0f\xd9\xce\xc3\xae\xbay\x97 \x84\xe9\x0e\xad\x01\xea3\t\x00\x00\x00\x00'}
                           }}),
                          decode_msg(bfh("001000022200000302aaa2012043497fd7f826957108f4a30fd9cec3aeba79972084e90ead01ea330900000000")))
+
+
+class TestCompiledLNSerializer(TestCaseForTestnet):
+    # The compiled encoders and decoders must behave like the interpreter
+    # of the schemes, also for malformed input.
+
+    def _random_payload(self, rnd):
+        # mostly zero bytes, so that length fields are often small
+        return bytes(rnd.randrange(256) if rnd.random() < 0.3 else 0
+                     for i in range(rnd.choice((0, 1, 5, 40, 150, 400))))
+
+    def _result_or_exc_type(self, func, *args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            return type(e)
+
+    def test_parity_with_interpreter(self):
+        rnd = random.Random(42)
+        for lnser in (LNSerializer(), LNSerializer(for_onion_wire=True)):
+            num_decoded = 0
+            for msg_type_bytes, scheme in lnser.msg_scheme_from_type.items():
+                for i in range(30):
+                    data = msg_type_bytes + self._random_payload(rnd)
+                    decoded = self._result_or_exc_type(lnser.decode_msg, data)
+                    self.assertEqual(self._result_or_exc_type(lnser._interpreted_decode_msg, data), decoded, data.hex())
+                    if isinstance(decoded, type):
+                        continue
+                    num_decoded += 1
+                    msg_type, fields = decoded
+                    self.assertEqual(self._result_or_exc_type(lnser._interpreted_encode_msg, msg_type, **fields),
+                                     self._result_or_exc_type(lnser.encode_msg, msg_type, **fields), data.hex())
+            self.assertGreater(num_decoded, 100)
+            for tlv_stream_name in lnser.in_tlv_stream_get_tlv_record_scheme_from_type:
+                for i in range(100):
+                    data = self._random_payload(rnd)
+                    decoded = self._result_or_exc_type(lnser.read_tlv_stream, fd=io.BytesIO(data), tlv_stream_name=tlv_stream_name)
+                    self.assertEqual(self._result_or_exc_type(lnser._interpreted_read_tlv_stream, fd=io.BytesIO(data),
+                                                   tlv_stream_name=tlv_stream_name), decoded, data.hex())
+                    if isinstance(decoded, type):
+                        continue
+                    with io.BytesIO() as fd1, io.BytesIO() as fd2:
+                        self.assertEqual(
+                            self._result_or_exc_type(lnser._interpreted_write_tlv_stream, fd=fd1, tlv_stream_name=tlv_stream_name, **decoded),
+                            self._result_or_exc_type(lnser.write_tlv_stream, fd=fd2, tlv_stream_name=tlv_stream_name, **decoded))
+                        self.assertEqual(fd1.getvalue(), fd2.getvalue())
+
+    def test_encode_parity_for_unusual_values(self):
+        lnser = LNSerializer()
+        cases = [
+            ('ping', dict(num_pong_bytes=4, byteslen=3, ignored=b'\x00' * 3)),
+            ('ping', dict(num_pong_bytes=b'\x00\x04', byteslen=3, ignored=b'\x00' * 2)),  # wrong size
+            ('ping', dict(num_pong_bytes=2 ** 16, byteslen=0)),  # too large
+            ('ping', dict(num_pong_bytes=4)),  # count field missing
+            ('ping', dict(num_pong_bytes=-1, byteslen=0)),
+            ('ping', dict(num_pong_bytes=True, byteslen=b'\x00\x00')),
+            ('error', dict(channel_id=b'\x01' * 32, len=2, data=b'ab')),
+            ('error', dict(channel_id=1, len=0, data=b'')),  # int for a 32-byte field
+            ('error', dict(channel_id=bytearray(32), len=1, data=bytearray(b'a'))),
+            ('channel_update', dict(timestamp=1, htlc_maximum_msat=5)),
+        ]
+        for msg_type, fields in cases:
+            with self.subTest(msg_type=msg_type, fields=fields):
+                self.assertEqual(self._result_or_exc_type(lnser._interpreted_encode_msg, msg_type, **fields),
+                                 self._result_or_exc_type(lnser.encode_msg, msg_type, **fields))
@@ -2,8 +2,15 @@ import unittest
 import tempfile
 import shutil
 import asyncio
+import os
+import queue
+import random
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Tuple, List, Sequence
 
-from electrum.util import bh2u, bfh, create_and_start_event_loop
+from electrum.util import bh2u, bfh, create_and_start_event_loop, callback_mgr
 from electrum.lnonion import (OnionHopsDataSingle, new_onion_packet,
                               process_onion_packet, _decode_onion_error, decode_onion_error,
                               OnionFailureCode, OnionPacket)
@@ -11,8 +18,12 @@ from electrum import bitcoin, lnrouter
 from electrum.constants import BitcoinTestnet
 from electrum.simple_config import SimpleConfig
 from electrum.lnrouter import PathEdge
+from electrum.channel_db import ChannelDB, ChannelGraph, ChannelInfo, Policy, FLAG_DISABLE
+from electrum.lnmsg import encode_msg, decode_msg
+from electrum.sql_db import sql
+from electrum.lnutil import ShortChannelID
 
-from . import TestCaseForTestnet
+from . import ElectrumTestCase, TestCaseForTestnet
 from .test_bitcoin import needs_test_with_all_chacha20_implementations
 
 
@@ -97,6 +108,166 @@ class Test_LNRouter(TestCaseForTestnet):
         self._loop_thread.join(timeout=1)
         cdb.sql_thread.join(timeout=1)
 
+    def create_channel_db(self) -> ChannelDB:
+        class fake_network:
+            config = self.config
+            asyncio_loop = asyncio.get_event_loop()
+            trigger_callback = lambda *args: None
+            register_callback = lambda *args: None
+            interface = None
+        cdb = ChannelDB(fake_network())
+        cdb.data_loaded.set()
+        return cdb
+
+    def close_channel_db(self, cdb: ChannelDB):
+        self.asyncio_loop.call_soon_threadsafe(self._stop_loop.set_result, 1)
+        self._loop_thread.join(timeout=1)
+        cdb.sql_thread.join(timeout=1)
+
+    def test_get_distances_same_as_reference(self):
+        cdb = self.create_channel_db()
+        rnd = random.Random(7)
+        node_ids = add_random_channels(cdb._graph, rnd, num_nodes=60, num_channels=200)
+        path_finder = lnrouter.LNPathFinder(cdb)
+        for scid in rnd.sample(sorted(cdb.get_channel_ids()), 10):
+            path_finder.blacklist[scid] = int(time.time())
+        def compare_with_reference(num_searches):
+            num_paths = 0
+            for _ in range(num_searches):
+                nodeA, nodeB = rnd.sample(node_ids, 2)
+                amount_msat = rnd.choice([1000, rnd.randrange(10 ** 6), rnd.randrange(10 ** 9)])
+                expected = reference_get_distances(path_finder, nodeA, nodeB, amount_msat)
+                self.assertEqual(expected, path_finder.get_distances(nodeA, nodeB, amount_msat))
+                num_paths += nodeA in expected
+            self.assertLess(num_searches // 5, num_paths)
+        compare_with_reference(300)
+        def check_reverse_edges():
+            edges = path_finder.get_edge_costs().edges
+            end_nodes = {e: n for n in range(len(edges.node_ids)) for e in edges.get_edges_ending_at(n)}
+            self.assertEqual(len(edges.short_channel_ids), len(end_nodes))
+            for e, r in enumerate(edges.reverse_edge):
+                self.assertEqual((edges.short_channel_ids[e], edges.start_node[e]),
+                                 (edges.short_channel_ids[r], end_nodes[r]))
+        check_reverse_edges()
+        # the edge costs are reused until the graph changes
+        edge_costs = path_finder.get_edge_costs()
+        self.assertIs(edge_costs, path_finder.get_edge_costs())
+        # then they are updated for the changed policies...
+        policies = rnd.sample(sorted(cdb._graph.get_policies()), 80)
+        for policy in policies[:50]:
+            cdb._graph.set_policy(policy._replace(channel_flags=policy.channel_flags ^ FLAG_DISABLE,
+                                                  fee_base_msat=rnd.randrange(3000)))
+        for policy in policies[50:]:
+            cdb._graph.remove_policy(policy.key[:8], policy.key[8:])
+        self.assertIsNot(edge_costs, path_finder.get_edge_costs())
+        self.assertIs(edge_costs.edges.offsets, path_finder.get_edge_costs().edges.offsets)
+        compare_with_reference(100)
+        for policy in policies[50:]:
+            cdb._graph.set_policy(policy)
+        compare_with_reference(100)
+        # ...and for the added and removed channels
+        edge_costs = path_finder.get_edge_costs()
+        for scid in rnd.sample(sorted(cdb.get_channel_ids()), 10):
+            cdb._graph.remove_channel(scid)
+        node_ids += add_random_channels(cdb._graph, rnd, num_nodes=3, num_channels=15,
+                                        other_node_ids=node_ids, first_block=1000)
+        # not so many changes that the edges have to be rebuilt
+        self.assertLess(len(cdb._graph._policy_changes), cdb._graph.MIN_CHANGES_BEFORE_COMPACTION)
+        edges = path_finder.get_edge_costs().edges
+        self.assertEqual(edge_costs.edges.topology_version, edges.topology_version)
+        self.assertTrue(edges.added_edges)
+        check_reverse_edges()
+        compare_with_reference(100)
+        # same results as when building them from scratch, with the removed channels still in the graph
+        other_path_finder = lnrouter.LNPathFinder(cdb)
+        other_path_finder.blacklist = path_finder.blacklist
+        for _ in range(50):
+            nodeA, nodeB = rnd.sample(node_ids, 2)
+            self.assertEqual(path_finder.get_distances(nodeA, nodeB, 10 ** 6),
+                             other_path_finder.get_distances(nodeA, nodeB, 10 ** 6))
+        # they are rebuilt when the graph is compacted
+        cdb._graph.compact()
+        edges = path_finder.get_edge_costs().edges
+        self.assertNotEqual(edge_costs.edges.topology_version, edges.topology_version)
+        self.assertEqual({}, edges.added_edges)
+        check_reverse_edges()
+        compare_with_reference(100)
+        self.close_channel_db(cdb)
+
+    def test_find_path_candidates(self):
+        cdb = self.create_channel_db()
+        rnd = random.Random(3)
+        node_ids = add_random_channels(cdb._graph, rnd, num_nodes=60, num_channels=300)
+        path_finder = lnrouter.LNPathFinder(cdb)
+        num_alternatives = 0
+        for _ in range(50):
+            nodeA, nodeB = rnd.sample(node_ids, 2)
+            amount_msat = rnd.choice([rnd.randrange(10 ** 6), rnd.randrange(10 ** 9)])
+            paths = path_finder._find_path_candidates(nodeA, nodeB, amount_msat, my_channels={})
+            shortest_path = path_finder.find_path_for_payment(nodeA, nodeB, amount_msat)
+            if shortest_path is None:
+                self.assertEqual([], paths)
+                continue
+            costs = [path_finder.get_path_cost(path, nodeA, amount_msat, my_channels={}) for path in paths]
+            self.assertEqual(sorted(costs), costs)
+            self.assertLess(costs[-1], float('inf'))
+            self.assertLessEqual(costs[0], path_finder.get_path_cost(shortest_path, nodeA, amount_msat, my_channels={}))
+            self.assertEqual(len(paths), len({tuple(edge.short_channel_id for edge in path) for path in paths}))
+            self.assertLessEqual(len(paths), lnrouter.MAX_PATH_CANDIDATES)
+            for path in paths:
+                route = path_finder.create_route_from_path(path, nodeA)  # the edges chain together
+                self.assertEqual(nodeB, route[-1].node_id)
+                self.assertEqual(len(path) + 1, len({nodeA} | {edge.node_id for edge in path}))
+            num_alternatives += len(paths) - 1
+        self.assertLess(50, num_alternatives)
+        self.close_channel_db(cdb)
+
+    def test_find_path_from_candidates(self):
+        cdb = self.create_channel_db()
+        rnd = random.Random(5)
+        node_ids = add_random_channels(cdb._graph, rnd, num_nodes=60, num_channels=300)
+        path_finder = lnrouter.LNPathFinder(cdb)
+        num_dijkstra_runs = 0
+        run_dijkstra = path_finder._run_dijkstra
+        def counting_run_dijkstra(*args, **kwargs):
+            nonlocal num_dijkstra_runs
+            num_dijkstra_runs += 1
+            return run_dijkstra(*args, **kwargs)
+        path_finder._run_dijkstra = counting_run_dijkstra
+        amount_msat = 2 ** 20 + 12_345
+        for nodeA, nodeB in (rnd.sample(node_ids, 2) for _ in range(100)):
+            path = path_finder.find_path_from_candidates(nodeA, nodeB, amount_msat)
+            candidates = list(path_finder._path_candidates.values())[-1].paths
+            if len(candidates) >= 4:
+                break
+        else:
+            self.fail('no candidates found')
+        self.assertEqual(candidates[0], path)
+        # further payments with a similar amount reuse the path
+        num_runs = num_dijkstra_runs
+        self.assertEqual(path, path_finder.find_path_from_candidates(nodeA, nodeB, amount_msat + 1000))
+        self.assertEqual(num_runs, num_dijkstra_runs)
+        # after a failure, the next candidate without the failed channels is used
+        failed_channels = set()
+        while True:
+            failed_channels.add(path[len(path) // 2].short_channel_id)
+            path_finder.add_to_blacklist(path[len(path) // 2].short_channel_id)
+            expected = next((path for path in candidates
+                             if not failed_channels & {edge.short_channel_id for edge in path}), None)
+            path = path_finder.find_path_from_candidates(nodeA, nodeB, amount_msat)
+            if expected is None:
+                break
+            self.assertEqual(expected, path)
+            self.assertEqual(num_runs, num_dijkstra_runs)
+        # then new candidates are found
+        self.assertEqual(num_runs + 1, num_dijkstra_runs)
+        if path is not None:
+            self.assertFalse(failed_channels & {edge.short_channel_id for edge in path})
+        # other amounts have their own candidates
+        path_finder.find_path_from_candidates(nodeA, nodeB, 2 * amount_msat)
+        self.assertEqual(num_runs + 2, num_dijkstra_runs)
+        self.close_channel_db(cdb)
+
     @needs_test_with_all_chacha20_implementations
     def test_new_onion_packet_legacy(self):
         # test vector from bolt-04
@@ -306,3 +477,300 @@ class Test_LNRouter(TestCaseForTestnet):
         self.assertEqual(4, index_of_sender)
         self.assertEqual(OnionFailureCode.TEMPORARY_NODE_FAILURE, failure_msg.code)
         self.assertEqual(b'', failure_msg.data)
+
+
+def add_random_channels(graph: ChannelGraph, rnd: random.Random, *, num_nodes: int, num_channels: int,
+                        with_fees: bool = True, other_node_ids: Sequence[bytes] = (),
+                        first_block: int = 100) -> List[bytes]:
+    """Adds channels between random nodes, and returns the node ids. Some
+    channels lack policies, are disabled, or have other limits. The
+    channels can also connect to other_node_ids."""
+    node_ids = sorted(bytes([2]) + rnd.getrandbits(256).to_bytes(32, 'big') for _ in range(num_nodes))
+    node_pairs = set()
+    while len(node_pairs) < num_channels:
+        node_pairs.add(tuple(sorted(rnd.sample(node_ids + list(other_node_ids), 2))))  # no parallel channels
+    for i, (n1, n2) in enumerate(sorted(node_pairs)):
+        scid = ShortChannelID.from_components(first_block + i, 0, 0)
+        graph.add_channel(ChannelInfo(short_channel_id=scid, node1_id=n1, node2_id=n2,
+                                      capacity_sat=rnd.choice([None, rnd.randrange(10 ** 7)])))
+        for direction, node_id in enumerate((n1, n2)):
+            if rnd.random() < 0.1:
+                continue  # no policy
+            graph.set_policy(Policy(
+                key=scid + node_id,
+                cltv_expiry_delta=rnd.choice([rnd.randrange(10, 200), rnd.randrange(3000)]),
+                htlc_minimum_msat=rnd.choice([0, 1000, rnd.randrange(10 ** 7)]),
+                htlc_maximum_msat=rnd.choice([None, rnd.randrange(10 ** 10)]),
+                fee_base_msat=rnd.randrange(3000) if with_fees else 0,
+                fee_proportional_millionths=rnd.randrange(20_000) if with_fees else 0,
+                channel_flags=direction | (FLAG_DISABLE if rnd.random() < 0.1 else 0),
+                message_flags=1,
+                timestamp=0))
+    return node_ids
+
+
+def reference_get_distances(path_finder: lnrouter.LNPathFinder, nodeA: bytes, nodeB: bytes,
+                            invoice_amount_msat: int) -> Dict[bytes, PathEdge]:
+    """The search of LNPathFinder.get_distances as it was with queue.PriorityQueue,
+    and _edge_cost for every edge, for a payment that does not use our channels."""
+    my_channels = {}
+    distance_from_start = defaultdict(lambda: float('inf'))
+    distance_from_start[nodeB] = 0
+    prev_node = {}  # type: Dict[bytes, PathEdge]
+    nodes_to_explore = queue.PriorityQueue()
+    nodes_to_explore.put((0, invoice_amount_msat, nodeB))
+    while nodes_to_explore.qsize() > 0:
+        dist_to_edge_endnode, amount_msat, edge_endnode = nodes_to_explore.get()
+        if edge_endnode == nodeA:
+            break
+        if dist_to_edge_endnode != distance_from_start[edge_endnode]:
+            continue
+        for edge_channel_id in path_finder.channel_db.get_channels_for_node(edge_endnode, my_channels=my_channels):
+            if path_finder.is_blacklisted(edge_channel_id):
+                continue
+            channel_info = path_finder.channel_db.get_channel_info(edge_channel_id, my_channels=my_channels)
+            edge_startnode = channel_info.node2_id if channel_info.node1_id == edge_endnode else channel_info.node1_id
+            edge_cost, fee_for_edge_msat = path_finder._edge_cost(
+                edge_channel_id,
+                start_node=edge_startnode,
+                end_node=edge_endnode,
+                payment_amt_msat=amount_msat,
+                ignore_costs=(edge_startnode == nodeA),
+                my_channels=my_channels)
+            alt_dist_to_neighbour = distance_from_start[edge_endnode] + edge_cost
+            if alt_dist_to_neighbour < distance_from_start[edge_startnode]:
+                distance_from_start[edge_startnode] = alt_dist_to_neighbour
+                prev_node[edge_startnode] = PathEdge(node_id=edge_endnode,
+                                                     short_channel_id=ShortChannelID(edge_channel_id))
+                nodes_to_explore.put((alt_dist_to_neighbour, amount_msat + fee_for_edge_msat, edge_startnode))
+    return prev_node
+
+
+def random_policy(rnd: random.Random, short_channel_id: bytes, start_node: bytes) -> Policy:
+    return Policy(key=short_channel_id + start_node,
+                  cltv_expiry_delta=rnd.randrange(2 ** 16),
+                  htlc_minimum_msat=rnd.randrange(2 ** 64),
+                  htlc_maximum_msat=rnd.choice([None, rnd.randrange(2 ** 64)]),
+                  fee_base_msat=rnd.randrange(2 ** 32),
+                  fee_proportional_millionths=rnd.randrange(2 ** 32),
+                  channel_flags=rnd.randrange(256),
+                  message_flags=rnd.randrange(256),
+                  timestamp=rnd.randrange(2 ** 32))
+
+
+class TestChannelGraph(ElectrumTestCase):
+
+    def test_matches_dict_model(self):
+        rnd = random.Random(42)
+        graph = ChannelGraph()
+        graph.MIN_CHANGES_BEFORE_COMPACTION = 20
+        node_ids = [bytes([2]) + bytes([i]) * 32 for i in range(30)]
+        channels = {}  # type: Dict[bytes, ChannelInfo]
+        policies = {}  # type: Dict[Tuple[bytes, bytes], Policy]
+        for step in range(3000):
+            op = rnd.random()
+            if op < 0.4 or not channels:
+                n1, n2 = sorted(rnd.sample(node_ids, 2))
+                scid = ShortChannelID.from_components(rnd.randrange(100), 0, 0)
+                ci = ChannelInfo(short_channel_id=scid, node1_id=n1, node2_id=n2,
+                                 capacity_sat=rnd.choice([None, rnd.randrange(2 ** 40)]))
+                if scid in channels and channels[scid][1:3] != ci[1:3]:
+                    policies.pop((channels[scid].node1_id, scid), None)
+                    policies.pop((channels[scid].node2_id, scid), None)
+                channels[scid] = ci
+                graph.add_channel(ci)
+            elif op < 0.55:
+                scid = rnd.choice(list(channels))
+                ci = channels.pop(scid)
+                policies.pop((ci.node1_id, scid), None)
+                policies.pop((ci.node2_id, scid), None)
+                self.assertEqual(ci, graph.remove_channel(scid))
+            elif op < 0.9:
+                ci = rnd.choice(list(channels.values()))
+                node_id = rnd.choice(ci[1:3])
+                policy = random_policy(rnd, ci.short_channel_id, node_id)
+                policies[(node_id, ci.short_channel_id)] = policy
+                self.assertTrue(graph.set_policy(policy))
+            elif policies:
+                node_id, scid = rnd.choice(list(policies))
+                del policies[(node_id, scid)]
+                graph.remove_policy(scid, node_id)
+            if step % 100 == 0 or step == 2999:
+                self.assertEqual(len(channels), len(graph))
+                self.assertEqual(len(policies), graph.num_policies)
+                self.assertEqual(set(channels), graph.get_channel_ids())
+                for scid, ci in channels.items():
+                    self.assertEqual(ci, graph.get_channel_info(scid))
+                    for node_id in ci[1:3]:
+                        self.assertEqual(policies.get((node_id, scid)), graph.get_policy(scid, node_id))
+                for node_id in node_ids:
+                    expected = {scid for scid, ci in channels.items() if node_id in ci[1:3]}
+                    self.assertEqual(expected, graph.get_channels_for_node(node_id))
+                    self.assertEqual(bool(expected), graph.has_channels(node_id))
+                self.assertEqual(set(policies.values()), set(graph.get_policies()))
+                self.assertEqual(set(channels.values()), set(graph.get_channel_infos()))
+
+    def test_policy_of_unknown_channel_or_node(self):
+        graph = ChannelGraph()
+        scid = ShortChannelID.from_components(1, 2, 3)
+        node1, node2, node3 = (bytes([2]) + bytes([i]) * 32 for i in range(3))
+        rnd = random.Random(0)
+        self.assertFalse(graph.set_policy(random_policy(rnd, scid, node1)))
+        graph.add_channel(ChannelInfo(short_channel_id=scid, node1_id=node1, node2_id=node2, capacity_sat=None))
+        self.assertFalse(graph.set_policy(random_policy(rnd, scid, node3)))
+        self.assertTrue(graph.set_policy(random_policy(rnd, scid, node2)))
+        self.assertIsNone(graph.get_policy(scid, node1))
+        self.assertIsNone(graph.get_policy(scid, node3))
+        self.assertEqual(1, graph.num_policies)
+        # re-announcing the channel keeps its policies
+        graph.add_channel(ChannelInfo(short_channel_id=scid, node1_id=node1, node2_id=node2, capacity_sat=1000))
+        self.assertEqual(1000, graph.get_channel_info(scid).capacity_sat)
+        self.assertIsNotNone(graph.get_policy(bytes(scid), node2))
+        graph.remove_channel(scid)
+        self.assertEqual(0, graph.num_policies)
+        self.assertFalse(graph.has_channels(node1))
+        graph.compact()
+        self.assertEqual(set(), graph.get_channels_for_node(node1))
+
+
+class TestChannelDBSnapshot(TestCaseForTestnet):
+
+    def setUp(self):
+        super().setUp()
+        self.config = SimpleConfig({'electrum_path': self.electrum_path})
+
+    def tearDown(self):
+        if self._loop_thread.is_alive():
+            self.asyncio_loop.call_soon_threadsafe(self._stop_loop.set_result, 1)
+            self._loop_thread.join(timeout=1)
+        super().tearDown()
+
+    def open_channel_db(self) -> ChannelDB:
+        self.asyncio_loop, self._stop_loop, self._loop_thread = create_and_start_event_loop()
+        # the callbacks are triggered from the sql thread, which has no event loop
+        callback_mgr.asyncio_loop = self.asyncio_loop
+        class fake_network:
+            config = self.config
+            asyncio_loop = self.asyncio_loop
+            interface = None
+        return ChannelDB(fake_network())
+
+    def close_channel_db(self, cdb: ChannelDB):
+        self.asyncio_loop.call_soon_threadsafe(self._stop_loop.set_result, 1)
+        self._loop_thread.join(timeout=1)
+        cdb.sql_thread.join(timeout=5)
+
+    def run_sql(self, func, *args):
+        async def call():
+            return await func(*args)
+        return asyncio.run_coroutine_threadsafe(call(), self.asyncio_loop).result(timeout=5)
+
+    def add_gossip(self, cdb: ChannelDB, rnd: random.Random):
+        chain_hash = BitcoinTestnet.rev_genesis_bytes()
+        node_ids = sorted(bytes([2]) + rnd.getrandbits(256).to_bytes(32, 'big') for _ in range(10))
+        def payload(msg_type, **fields):
+            raw = encode_msg(msg_type, **fields)
+            return dict(decode_msg(raw)[1], raw=raw)
+        for i in range(20):
+            n1, n2 = sorted(rnd.sample(node_ids, 2))
+            scid = ShortChannelID.from_components(100 + i, 0, 0)
+            cdb.add_channel_announcement(payload(
+                'channel_announcement', node_signature_1=bytes(64), node_signature_2=bytes(64),
+                bitcoin_signature_1=bytes(64), bitcoin_signature_2=bytes(64), len=0, features=b'',
+                chain_hash=chain_hash, short_channel_id=scid, node_id_1=n1, node_id_2=n2,
+                bitcoin_key_1=n1, bitcoin_key_2=n2))
+            for direction in rnd.sample([0, 1], rnd.randrange(3)):
+                cdb.add_channel_update(payload(
+                    'channel_update', signature=bytes(64), chain_hash=chain_hash, short_channel_id=scid,
+                    timestamp=1_600_000_000 + rnd.randrange(1000), message_flags=b'\x01',
+                    channel_flags=bytes([direction]), cltv_expiry_delta=rnd.randrange(10, 200),
+                    htlc_minimum_msat=1000, fee_base_msat=rnd.randrange(2000),
+                    fee_proportional_millionths=rnd.randrange(5000), htlc_maximum_msat=10 ** 9), verbose=False)
+        for node_id in node_ids[:5]:
+            cdb.add_node_announcement(payload(
+                'node_announcement', signature=bytes(64), flen=1, features=b'\x02', timestamp=1_600_000_000,
+                node_id=node_id, rgb_color=bytes(3), alias='ünïcode'.encode('utf8').ljust(32, b'\x00'),
+                addrlen=0, addresses=b''))
+
+    def test_snapshot_round_trip(self):
+        cdb = self.open_channel_db()
+        self.run_sql(cdb.load_data)
+        self.add_gossip(cdb, random.Random(1))
+        expected = cdb.to_dict()
+        expected_counts = cdb.get_num_channels_partitioned_by_policy_count()
+        expected_adjacency = {n['node_id']: cdb.get_channels_for_node(bytes.fromhex(n['node_id']), my_channels={})
+                              for n in expected['nodes']}
+        self.assertEqual(5, len(expected['nodes']))
+        self.close_channel_db(cdb)  # writes the snapshot
+        self.assertTrue(os.path.exists(cdb.snapshot_path))
+
+        for use_snapshot in (True, False):
+            if not use_snapshot:
+                os.remove(cdb.snapshot_path)
+            cdb = self.open_channel_db()
+            with self.assertLogs(cdb.logger, level='INFO') as logs:
+                self.run_sql(cdb.load_data)
+            source = 'snapshot' if use_snapshot else 'tables'
+            self.assertTrue(any(f'load data from {source}' in line for line in logs.output), logs.output)
+            self.assertEqual(expected, cdb.to_dict())
+            self.assertEqual(expected_counts, cdb.get_num_channels_partitioned_by_policy_count())
+            for node_id, scids in expected_adjacency.items():
+                self.assertEqual(scids, cdb.get_channels_for_node(bytes.fromhex(node_id), my_channels={}))
+            self.close_channel_db(cdb)
+        # the snapshot was written again after loading from the tables
+        self.assertTrue(os.path.exists(cdb.snapshot_path))
+
+    def test_snapshot_invalidated_by_writes(self):
+        count_tokens = sql(lambda db: db.conn.execute("SELECT COUNT(*) FROM snapshot").fetchone()[0])
+        cdb = self.open_channel_db()
+        self.run_sql(cdb.load_data)
+        self.assertEqual(1, self.run_sql(count_tokens, cdb))  # written after loading
+        self.add_gossip(cdb, random.Random(2))
+        self.assertEqual(0, self.run_sql(count_tokens, cdb))
+        self.run_sql(cdb._db_write_snapshot)
+        self.assertEqual(1, self.run_sql(count_tokens, cdb))
+        cdb.remove_channel(next(iter(cdb.get_channel_ids())))
+        self.assertEqual(0, self.run_sql(count_tokens, cdb))
+        expected = cdb.to_dict()
+        self.close_channel_db(cdb)
+        # a snapshot that does not match the token in the database is not used
+        with open(cdb.snapshot_path, 'r+b') as f:
+            f.seek(100)
+            f.write(b'x')
+        cdb = self.open_channel_db()
+        with self.assertLogs(cdb.logger, level='INFO') as logs:
+            self.run_sql(cdb.load_data)
+        self.assertTrue(any('load data from tables' in line for line in logs.output), logs.output)
+        self.assertEqual(expected, cdb.to_dict())
+        self.close_channel_db(cdb)
+
+    def test_snapshot_includes_queued_writes(self):
+        count_tokens = sql(lambda db: db.conn.execute("SELECT COUNT(*) FROM snapshot").fetchone()[0])
+        cdb = self.open_channel_db()
+        self.run_sql(cdb.load_data)
+        self.add_gossip(cdb, random.Random(3))
+        self.assertEqual(0, self.run_sql(count_tokens, cdb))
+        # change the graph after the snapshot was requested, but before it is written
+        release = threading.Event()
+        async def request_snapshot():
+            sql(lambda db: release.wait(5))(cdb)  # keeps the sql thread busy
+            return cdb._db_write_snapshot()
+        snapshot_written = self.run_sql(request_snapshot)
+        for scid in list(cdb.get_channel_ids())[:5]:
+            cdb.remove_channel(scid)
+        release.set()
+        self.run_sql(lambda: snapshot_written)
+        # the queued deletions were executed before the snapshot, so it is still valid
+        self.assertEqual(1, self.run_sql(count_tokens, cdb))
+        expected = cdb.to_dict()
+        self.close_channel_db(cdb)
+        for use_snapshot in (True, False):
+            if not use_snapshot:
+                os.remove(cdb.snapshot_path)
+            cdb = self.open_channel_db()
+            with self.assertLogs(cdb.logger, level='INFO') as logs:
+                self.run_sql(cdb.load_data)
+            source = 'snapshot' if use_snapshot else 'tables'
+            self.assertTrue(any(f'load data from {source}' in line for line in logs.output), logs.output)
+            self.assertEqual(expected, cdb.to_dict())
+            self.close_channel_db(cdb)
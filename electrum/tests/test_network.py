@@ -1,13 +1,20 @@
 import asyncio
 import tempfile
+import threading
 import unittest
+from collections import defaultdict
+
+from aiorpcx import RPCError
 
 from electrum import constants
 from electrum.simple_config import SimpleConfig
 from electrum import blockchain
-from electrum.interface import Interface, ServerAddr
+from electrum.interface import Interface, ServerAddr, RequestCorrupted, NotificationSession
+from electrum.synchronizer import ScripthashMultiplexer, Synchronizer, history_status
 from electrum.crypto import sha256
-from electrum.util import bh2u
+from electrum.transaction import PartialTransaction, Transaction
+from electrum import util
+from electrum.util import bh2u, LRUCache
 
 from . import ElectrumTestCase
 
@@ -117,6 +124,301 @@ class TestNetwork(ElectrumTestCase):
         self.assertEqual(self.interface.q.qsize(), 0)
 
 
+class MockChunkInterface(MockInterface):
+    """Serves chunks of fake headers with a per-chunk delay."""
+    def __init__(self, config, *, delays=None, fail=False, bad_data=False):
+        super().__init__(config)
+        self.delays = delays or {}
+        self.fail = fail
+        self.bad_data = bad_data
+        self.served = []
+        self.ready.set_result(1)
+    async def _fetch_chunk_hex(self, index, size):
+        await asyncio.sleep(self.delays.get(index, 0))
+        if self.fail:
+            raise RequestCorrupted('mock failure')
+        self.served.append(index)
+        if self.bad_data:
+            return 'ff' * 80 * size
+        return bytes([index % 256]).hex() * 80 * size
+
+class MockSession:
+    def is_closing(self): return False
+
+
+class TestHeaderSyncPipeline(ElectrumTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        constants.set_regtest()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        constants.set_mainnet()
+
+    def setUp(self):
+        super().setUp()
+        self.config = SimpleConfig({'electrum_path': self.electrum_path})
+        # later chunks arrive first
+        self.interface = MockChunkInterface(self.config, delays={i: 0.01 * (6 - i) for i in range(6)})
+        self.interface.tip = 5 * 2016 + 100
+        self.interface.network.interfaces = {}
+        self.interface.network.interfaces_lock = threading.Lock()
+        self.connected = []
+        self.fail_at = None
+        def connect_chunk(index, hexdata):
+            if index == self.fail_at or hexdata.startswith('ff'):
+                return False
+            self.connected.append((index, len(hexdata) // 160))
+            return True
+        self.interface.blockchain.connect_chunk = connect_chunk
+
+    def _run(self, coro):
+        return asyncio.get_event_loop().run_until_complete(coro)
+
+    def _add_helper(self, **kwargs) -> MockChunkInterface:
+        helper = MockChunkInterface(self.config, **kwargs)
+        helper.session = MockSession()
+        helper.tip = self.interface.tip
+        self.interface.network.interfaces[helper.server] = helper
+        return helper
+
+    def test_chunks_are_connected_in_order(self):
+        res = self._run(self.interface.request_chunks(2016 + 5, self.interface.tip))
+        self.assertEqual((True, 4 * 2016 + 101), res)
+        self.assertEqual([(1, 2016), (2, 2016), (3, 2016), (4, 2016), (5, 101)], self.connected)
+
+    def test_stops_at_first_chunk_that_does_not_connect(self):
+        self.fail_at = 3
+        res = self._run(self.interface.request_chunks(0, self.interface.tip))
+        self.assertEqual((True, 3 * 2016), res)
+        self.assertEqual([0, 1, 2], [index for index, size in self.connected])
+        self.fail_at = 0
+        self.assertEqual((False, 0), self._run(self.interface.request_chunks(0, self.interface.tip)))
+
+    def test_requests_are_spread_over_helpers(self):
+        helper = self._add_helper()
+        self._run(self.interface.request_chunks(0, self.interface.tip))
+        self.assertEqual([0, 1, 2, 3, 4, 5], [index for index, size in self.connected])
+        self.assertEqual([1, 3, 5], sorted(helper.served))
+        self.assertEqual([0, 2, 4], sorted(self.interface.served))
+
+    def test_failing_helper_falls_back_to_own_server(self):
+        self._add_helper(fail=True)
+        self._run(self.interface.request_chunks(0, self.interface.tip))
+        self.assertEqual([0, 1, 2, 3, 4, 5], [index for index, size in self.connected])
+        self.assertEqual([0, 1, 2, 3, 4, 5], sorted(self.interface.served))
+
+    def test_bad_chunk_from_helper_is_requested_from_own_server(self):
+        helper = self._add_helper(bad_data=True)
+        res = self._run(self.interface.request_chunks(0, self.interface.tip))
+        self.assertEqual((True, 5 * 2016 + 101), res)
+        self.assertEqual([0, 1, 2, 3, 4, 5], [index for index, size in self.connected])
+        self.assertEqual([0, 1, 2, 3, 4, 5], sorted(self.interface.served))
+        # no more requests are sent to the helper after its first bad chunk
+        self.assertLess(len(helper.served), 3)
+        # a chunk of our own server that does not connect still stops the catch-up
+        self.fail_at = 3
+        res = self._run(self.interface.request_chunks(2016, self.interface.tip))
+        self.assertEqual((True, 2 * 2016), res)
+
+    def test_pipelining_can_be_disabled(self):
+        self.config.set_key('header_sync_pipeline_depth', 1)
+        self._add_helper()
+        self.assertEqual((True, 2016), self._run(self.interface.request_chunks(0, self.interface.tip)))
+        self.assertEqual([(0, 2016)], self.connected)
+
+
+class MockBatchSession:
+    def __init__(self):
+        self.batches = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+    async def send_request(self, method, params):
+        return (await self.send_request_batch([(method, params)]))[0]
+    async def send_request_batch(self, requests):
+        self.batches.append(len(requests))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        return [RPCError(1, 'not found') if params[0] == 'missing' else params[0] * 2
+                for method, params in requests]
+
+
+class TestBatchedRequests(ElectrumTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.config = SimpleConfig({'electrum_path': self.electrum_path,
+                                    'network_batch_size': 3,
+                                    'network_batch_concurrency': 2})
+        self.interface = MockInterface(self.config)
+        self.interface.session = MockBatchSession()
+
+    def test_batches_are_split_and_results_ordered(self):
+        params_list = [['a'], ['b'], ['missing'], ['c'], ['d'], ['e'], ['f'], ['g']]
+        results = asyncio.get_event_loop().run_until_complete(
+            self.interface._send_batched_requests('method', params_list))
+        self.assertEqual([3, 3, 2], self.interface.session.batches)
+        self.assertEqual(2, self.interface.session.max_in_flight)
+        self.assertEqual(['aa', 'bb'], results[:2])
+        self.assertIsInstance(results[2], RPCError)
+        self.assertEqual(['cc', 'dd', 'ee', 'ff', 'gg'], results[3:])
+
+
+
+class MockNotificationSession(NotificationSession):
+    def __init__(self):
+        self.subscriptions = defaultdict(list)
+        self.cache = {}
+        self.requests = []
+    async def send_request(self, method, params):
+        self.requests.append((method, params))
+        await asyncio.sleep(0.01)
+        return 'status of ' + params[0]
+
+
+class MockHistoryInterface:
+    def __init__(self):
+        self.requested = []
+    async def get_history_for_scripthashes(self, shs):
+        self.requested.extend(shs)
+        await asyncio.sleep(0.01)
+        return [RPCError(1, 'not found') if sh == 'missing' else [{'tx_hash': sh * 2, 'height': 100}]
+                for sh in shs]
+
+
+class TestScripthashMultiplexer(ElectrumTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.mux = ScripthashMultiplexer()
+
+    def _run(self, *coros):
+        return asyncio.get_event_loop().run_until_complete(asyncio.gather(*coros))
+
+    def test_subscriptions_are_shared(self):
+        session = MockNotificationSession()
+        queues = [asyncio.Queue() for i in range(3)]
+        self._run(*[self.mux.subscribe(session, 'ab', queue) for queue in queues])
+        self._run(self.mux.subscribe(session, 'cd', queues[0]))
+        self.assertEqual([('blockchain.scripthash.subscribe', ['ab']),
+                          ('blockchain.scripthash.subscribe', ['cd'])], session.requests)
+        for queue in queues:
+            self.assertEqual(['ab', 'status of ab'], queue.get_nowait())
+        self.assertEqual(['cd', 'status of cd'], queues[0].get_nowait())
+        # notifications go to every consumer
+        key = session.get_hashable_key_for_rpc_call('blockchain.scripthash.subscribe', ['ab'])
+        self.assertEqual(queues, session.subscriptions[key])
+        # the subscriptions of a new session are sent again
+        session2 = MockNotificationSession()
+        self._run(self.mux.subscribe(session2, 'ab', queues[0]))
+        self.assertEqual(1, len(session2.requests))
+        self.assertEqual({'subscriptions': 5, 'subscriptions_saved': 2, 'histories': 0, 'histories_saved': 0},
+                         self.mux.get_stats())
+
+    def test_histories_are_shared(self):
+        interface = MockHistoryInterface()
+        status = {sh: history_status([(sh * 2, 100)]) for sh in ('a', 'b', 'c')}
+        items1 = [('a', status['a']), ('b', status['b']), ('missing', 'x')]
+        items2 = [('b', status['b']), ('c', status['c']), ('c', 'outdated status')]
+        results1, results2 = self._run(self.mux.get_histories(interface, items1),
+                                       self.mux.get_histories(interface, items2))
+        self.assertEqual(['a', 'b', 'missing', 'c', 'c'], interface.requested)
+        self.assertEqual([{'tx_hash': 'aa', 'height': 100}], results1[0])
+        self.assertIs(results1[1], results2[0])
+        self.assertIsInstance(results1[2], RPCError)
+        self.assertEqual(results2[1], results2[2])
+        # histories are reused for the status they were fetched for
+        results3, = self._run(self.mux.get_histories(interface, [('a', status['a']), ('c', 'outdated status')]))
+        self.assertIs(results1[0], results3[0])
+        self.assertEqual(['a', 'b', 'missing', 'c', 'c', 'c'], interface.requested)
+        self.assertEqual(2, self.mux.get_stats()['histories_saved'])
+
+RAW_TX = '02000000000101a5883f3de780d260e6f26cf85144403c7744a65a44cd38f9ff45aecadf010c540100000000fdffffff0220a10700000000001600145f4cfb0e1d2a7055634074bfbc9f546ac019e47f08de3c000000000016001424b32aadb42a89016c4de8f11741c3b29b15f21c02473044022045cc6c1cc875cbb0c0d8fe323dc1de9716e49ed5659741b0fb3dd9a196894066022077c242640071d12ec5763c5870f482a4823d8713e4bd14353dd621ed29a7f96d012102aea8d439a0f79d8b58e8d7bda83009f587e1f3da350adaa484329bf47cd03465fef61c00'
+TXID = 'bf0272eb0cd61ef36a7d69b4714ea4291bf5cbab229abd4bcb67c5111f92bb01'
+
+
+class MockTxNetwork:
+    def __init__(self):
+        self.asyncio_loop = asyncio.get_event_loop()
+        self.interface = None
+        self.tx_cache = LRUCache(maxsize=10)
+
+
+class MockTxInterface:
+    def __init__(self):
+        self.requested = []
+    async def get_transactions(self, tx_hashes):
+        self.requested.extend(tx_hashes)
+        return [RAW_TX if tx_hash == TXID else RPCError(1, 'not found') for tx_hash in tx_hashes]
+
+
+class MockTxDB:
+    def __init__(self):
+        self.txs = {}
+    def get_transaction(self, tx_hash):
+        return self.txs.get(tx_hash)
+
+
+class MockTxWallet:
+    def __init__(self, network):
+        self.network = network
+        self.db = MockTxDB()
+    def diagnostic_name(self):
+        return 'mock_wallet'
+    def receive_tx_callback(self, tx_hash, tx, tx_height):
+        self.db.txs[tx_hash] = tx
+
+
+class TestSharedTxCache(ElectrumTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.network = MockTxNetwork()
+        self.interface = MockTxInterface()
+        self.synchronizers = []
+
+    def tearDown(self):
+        for synchronizer in self.synchronizers:
+            util.unregister_callback(synchronizer._restart)
+        super().tearDown()
+
+    def _make_synchronizer(self):
+        synchronizer = Synchronizer(MockTxWallet(self.network))
+        synchronizer.interface = self.interface
+        self.synchronizers.append(synchronizer)
+        return synchronizer
+
+    def _request(self, synchronizer, hist):
+        asyncio.get_event_loop().run_until_complete(
+            synchronizer._request_missing_txs(hist, allow_server_not_finding_tx=True))
+
+    def test_txs_are_shared_between_wallets(self):
+        missing = 'ab' * 32
+        s1, s2 = self._make_synchronizer(), self._make_synchronizer()
+        self._request(s1, [(TXID, 100), (missing, 100)])
+        self.assertEqual([TXID, missing], self.interface.requested)
+        self.assertEqual(RAW_TX, self.network.tx_cache[TXID])
+        self.assertNotIn(missing, self.network.tx_cache)
+        # the second wallet gets the tx from the cache
+        self._request(s2, [(TXID, 100), (missing, 100)])
+        self.assertEqual([TXID, missing, missing], self.interface.requested)
+        self.assertEqual(TXID, s2.wallet.db.get_transaction(TXID).txid())
+        self.assertEqual({}, s2.requested_tx)
+
+    def test_partial_tx_is_replaced_from_cache(self):
+        self.network.tx_cache[TXID] = RAW_TX
+        synchronizer = self._make_synchronizer()
+        synchronizer.wallet.db.txs[TXID] = PartialTransaction.from_tx(Transaction(RAW_TX))
+        self._request(synchronizer, [(TXID, 100)])
+        self.assertEqual([], self.interface.requested)
+        self.assertNotIsInstance(synchronizer.wallet.db.get_transaction(TXID), PartialTransaction)
+
+
 if __name__=="__main__":
     constants.set_regtest()
     unittest.main()
@@ -1,4 +1,8 @@
-from typing import NamedTuple, Union
+import os
+import re
+import random
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple, Union, Sequence
 
 from electrum import transaction, bitcoin
 from electrum.transaction import (convert_raw_tx_to_hex, tx_from_any, Transaction,
@@ -8,6 +12,7 @@ from electrum.util import bh2u, bfh
 from electrum.bitcoin import (deserialize_privkey, opcodes,
                               construct_script, construct_witness)
 from electrum.ecc import ECPrivkey
+from electrum.crypto import sha256d
 
 from . import ElectrumTestCase, TestCaseForTestnet
 
@@ -847,6 +852,222 @@ class TestTransaction(ElectrumTestCase):
 # txns from Bitcoin Core ends <---
 
 
+def parse_network_tx_with_bcdatastream(raw: bytes):
+    """The BCDataStream-based parser Transaction.deserialize used to have."""
+    vds = transaction.BCDataStream()
+    vds.write(raw)
+    version = vds.read_int32()
+    n_vin = vds.read_compact_size()
+    is_segwit = (n_vin == 0)
+    if is_segwit:
+        marker = vds.read_bytes(1)
+        if marker != b'\x01':
+            raise ValueError('invalid txn marker byte: {}'.format(marker))
+        n_vin = vds.read_compact_size()
+    if n_vin < 1:
+        raise transaction.SerializationError('tx needs to have at least 1 input')
+    inputs = [transaction.parse_input(vds) for i in range(n_vin)]
+    n_vout = vds.read_compact_size()
+    if n_vout < 1:
+        raise transaction.SerializationError('tx needs to have at least 1 output')
+    outputs = [transaction.parse_output(vds) for i in range(n_vout)]
+    if is_segwit:
+        for txin in inputs:
+            transaction.parse_witness(vds, txin)
+    locktime = vds.read_uint32()
+    if vds.can_read_more():
+        raise transaction.SerializationError('extra junk at the end')
+    return version, inputs, outputs, locktime
+
+
+def raw_txs_from_test_vectors():
+    """Returns the raw network txs found in this file."""
+    with open(os.path.join(os.path.dirname(__file__), 'test_transaction.py')) as f:
+        text = f.read()
+    raw_txs = []
+    for match in set(re.findall(r"['\"]([0-9a-f]{120,})['\"]", text)):
+        try:
+            parse_network_tx_with_bcdatastream(bfh(match))
+        except Exception:
+            continue
+        raw_txs.append(match)
+    return sorted(raw_txs)
+
+
+class TestTxParser(ElectrumTestCase):
+
+    def _parse_both(self, raw: bytes):
+        """Returns the results of both parsers, or the exception types they raised."""
+        results = []
+        for parse in (transaction.parse_network_tx, parse_network_tx_with_bcdatastream):
+            try:
+                version, inputs, outputs, locktime = parse(raw)
+            except (transaction.SerializationError, ValueError) as e:
+                results.append(type(e))
+                continue
+            results.append((
+                version,
+                [(txin.prevout, txin.script_sig, txin.nsequence, txin.witness) for txin in inputs],
+                [(txout.value, txout.scriptpubkey) for txout in outputs],
+                locktime,
+            ))
+        return results
+
+    def test_parity_with_bcdatastream_parser(self):
+        raw_txs = raw_txs_from_test_vectors()
+        self.assertGreater(len(raw_txs), 50)
+        for raw_tx in raw_txs:
+            new, old = self._parse_both(bfh(raw_tx))
+            self.assertEqual(old, new)
+            self.assertNotIsInstance(new, type)
+            # round trip
+            tx = Transaction(raw_tx)
+            self.assertEqual(raw_tx, tx.serialize_to_network())
+
+    def test_non_canonical_witness_sizes(self):
+        # first witness element has its length encoded as fd0100 instead of 01
+        raw = bfh(signed_segwit_blob)
+        witness_start = raw.index(bfh('02473044'))
+        raw = raw[:witness_start] + bfh('02fd4700') + raw[witness_start + 2:]
+        new, old = self._parse_both(raw)
+        self.assertEqual(old, new)
+        self.assertEqual(Transaction(signed_segwit_blob).inputs()[0].witness, new[1][0][3])
+
+    def test_fuzz(self):
+        rand = random.Random(1234)
+        raw_txs = [bfh(raw_tx) for raw_tx in raw_txs_from_test_vectors()]
+        for i in range(3000):
+            raw = bytearray(rand.choice(raw_txs))
+            mutation = rand.randrange(4)
+            if mutation == 0:  # truncate
+                raw = raw[:rand.randrange(len(raw))]
+            elif mutation == 1:  # flip bytes
+                for j in range(rand.randint(1, 4)):
+                    raw[rand.randrange(len(raw))] = rand.randrange(256)
+            elif mutation == 2:  # append junk
+                raw += bytes(rand.randrange(256) for j in range(rand.randint(1, 8)))
+            else:  # insert compact size prefixes
+                pos = rand.randrange(len(raw))
+                raw[pos:pos] = bytes([rand.choice([0xfd, 0xfe, 0xff])])
+            new, old = self._parse_both(bytes(raw))
+            self.assertEqual(old, new, raw.hex())
+
+
+def serialize_preimage_with_hex_strings(tx: PartialTransaction, txin_index: int) -> str:
+    """The hex-string based serialize_preimage PartialTransaction used to have."""
+    int_to_hex, var_int = bitcoin.int_to_hex, bitcoin.var_int
+    nVersion = int_to_hex(tx.version, 4)
+    nLocktime = int_to_hex(tx.locktime, 4)
+    inputs = tx.inputs()
+    outputs = tx.outputs()
+    txin = inputs[txin_index]
+    nHashType = int_to_hex(transaction.SIGHASH_ALL, 4)
+    preimage_script = tx.get_preimage_script(txin)
+    if txin.is_segwit():
+        hashPrevouts = bh2u(sha256d(b''.join(txin.prevout.serialize_to_network() for txin in inputs)))
+        hashSequence = bh2u(sha256d(bfh(''.join(int_to_hex(txin.nsequence, 4) for txin in inputs))))
+        hashOutputs = bh2u(sha256d(bfh(''.join(o.serialize_to_network().hex() for o in outputs))))
+        outpoint = txin.prevout.serialize_to_network().hex()
+        scriptCode = var_int(len(preimage_script) // 2) + preimage_script
+        amount = int_to_hex(txin.value_sats(), 8)
+        nSequence = int_to_hex(txin.nsequence, 4)
+        return nVersion + hashPrevouts + hashSequence + outpoint + scriptCode + amount + nSequence + hashOutputs + nLocktime + nHashType
+    txins = var_int(len(inputs)) + ''.join(tx.serialize_input(txin, preimage_script if txin_index == k else '')
+                                           for k, txin in enumerate(inputs))
+    txouts = var_int(len(outputs)) + ''.join(o.serialize_to_network().hex() for o in outputs)
+    return nVersion + txins + txouts + nLocktime + nHashType
+
+
+def make_unsigned_tx(script_types: Sequence[str], *, num_outputs: int = 2) -> PartialTransaction:
+    """Returns an unsigned tx spending one input of each of script_types,
+    all with the keys of the same private key.
+    """
+    privkey = ECPrivkey(bytes(31) + b'\x01')
+    pubkey = privkey.get_public_key_bytes(compressed=True)
+    inputs = []
+    for i, script_type in enumerate(script_types):
+        txin = PartialTxInput(prevout=TxOutpoint(txid=sha256d(bytes([i % 256, i // 256])), out_idx=i % 3))
+        txin.script_type = script_type
+        txin.pubkeys = [pubkey]
+        txin.num_sig = 1
+        txin._trusted_value_sats = 100_000 + i
+        txin.nsequence = 0xffffffff - 2 - i % 2
+        inputs.append(txin)
+    outputs = [PartialTxOutput.from_address_and_value(
+                   bitcoin.pubkey_to_address('p2wpkh', pubkey.hex()), 50_000 + i)
+               for i in range(num_outputs)]
+    return PartialTransaction.from_io(inputs, outputs, locktime=654321, version=2)
+
+
+class TestSighash(ElectrumTestCase):
+
+    SCRIPT_TYPES = ['p2pkh', 'p2wpkh', 'p2wpkh-p2sh', 'p2pkh', 'p2sh', 'p2wsh', 'p2wsh-p2sh', 'p2pkh', 'p2pk']
+
+    def test_preimage_same_as_hex_strings(self):
+        tx = make_unsigned_tx(self.SCRIPT_TYPES)
+        cache = transaction.SighashCache(tx)
+        for i in range(len(self.SCRIPT_TYPES)):
+            expected = serialize_preimage_with_hex_strings(tx, i)
+            self.assertEqual(expected, tx.serialize_preimage(i))
+            self.assertEqual(expected, tx.serialize_preimage(i, sighash_cache=cache))
+
+    def test_sighash_with_midstates(self):
+        tx = make_unsigned_tx(self.SCRIPT_TYPES)
+        cache = transaction.SighashCache(tx)
+        txins = tx.inputs()
+        # out of order on purpose, so that midstates get reused
+        for i in [5, 0, 8, 3, 3, 7, 1, 2, 4, 6]:
+            script_code = bfh(tx.get_preimage_script(txins[i]))
+            self.assertEqual(sha256d(bfh(serialize_preimage_with_hex_strings(tx, i))),
+                             cache.get_sighash(i, txins[i], script_code))
+
+    def test_sign_same_as_sign_without_cache(self):
+        tx1 = make_unsigned_tx(self.SCRIPT_TYPES)
+        tx2 = make_unsigned_tx(self.SCRIPT_TYPES)
+        privkey = bytes(31) + b'\x01'
+        tx1.sign({ECPrivkey(privkey).get_public_key_hex(compressed=True): (privkey, True)})
+        self.assertTrue(tx1.is_complete())
+        for i, txin in enumerate(tx1.inputs()):
+            self.assertEqual(list(txin.part_sigs.values()), [bfh(tx2.sign_txin(i, privkey))])
+
+    def test_update_signatures_same_as_sign(self):
+        tx1 = make_unsigned_tx(self.SCRIPT_TYPES)
+        tx2 = make_unsigned_tx(self.SCRIPT_TYPES)
+        privkey = bytes(31) + b'\x01'
+        tx1.sign({ECPrivkey(privkey).get_public_key_hex(compressed=True): (privkey, True)})
+        tx2.update_signatures([list(txin.part_sigs.values())[0].hex() for txin in tx1.inputs()])
+        self.assertTrue(tx2.is_complete())
+        self.assertEqual(tx1.serialize(), tx2.serialize())
+
+    def test_sign_with_executor(self):
+        privkeys = [bytes(31) + bytes([i]) for i in (1, 2, 3)]
+        keypairs = {ECPrivkey(sec).get_public_key_hex(compressed=True): (sec, True) for sec in privkeys}
+
+        def make_tx():
+            tx = make_unsigned_tx(self.SCRIPT_TYPES * 3)
+            # 2-of-3 multisig, with all three keys available
+            for txin in tx.inputs():
+                if txin.script_type in ('p2sh', 'p2wsh', 'p2wsh-p2sh'):
+                    txin.pubkeys = [ECPrivkey(sec).get_public_key_bytes(compressed=True) for sec in privkeys]
+                    txin.num_sig = 2
+            return tx
+        tx1 = make_tx()
+        tx1.sign(dict(keypairs))
+        tx2 = make_tx()
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            tx2.sign(dict(keypairs), executor=executor)
+        self.assertTrue(tx2.is_complete())
+        self.assertEqual(tx1.serialize(), tx2.serialize())
+
+    def test_only_sighash_all(self):
+        tx = make_unsigned_tx(['p2wpkh', 'p2pkh'])
+        for txin in tx.inputs():
+            txin.sighash = 3  # SIGHASH_SINGLE
+        for i in range(2):
+            with self.assertRaises(Exception):
+                tx.serialize_preimage(i)
+
+
 class TestTransactionTestnet(TestCaseForTestnet):
 
     def test_spending_op_cltv_p2sh(self):
@@ -4,7 +4,7 @@ from electrum.util import (format_satoshis, format_fee_satoshis, parse_URI,
                            is_hash256_str, chunks, is_ip_address, list_enabled_bits,
                            format_satoshis_plain, is_private_netaddress, is_hex_str,
                            is_integer, is_non_negative_integer, is_int_or_float,
-                           is_non_negative_int_or_float)
+                           is_non_negative_int_or_float, LRUCache)
 
 from . import ElectrumTestCase
 
@@ -212,6 +212,19 @@ class TestUtil(ElectrumTestCase):
         with self.assertRaises(ValueError):
             list(chunks([1, 2, 3], 0))
 
+    def test_lru_cache(self):
+        cache = LRUCache(maxsize=2)
+        cache['a'] = 1
+        cache['b'] = 2
+        self.assertEqual(1, cache.get('a'))
+        cache['c'] = 3
+        # 'b' was the least recently used
+        self.assertEqual(['a', 'c'], list(cache.keys()))
+        self.assertIsNone(cache.get('b'))
+        cache['a'] = 4
+        cache['d'] = 5
+        self.assertEqual({'a': 4, 'd': 5}, dict(cache))
+
     def test_list_enabled_bits(self):
         self.assertEqual((0, 2, 3, 6), list_enabled_bits(77))
         self.assertEqual((), list_enabled_bits(0))
@@ -1,8 +1,12 @@
 # -*- coding: utf-8 -*-
+import asyncio
 
+from electrum import util
 from electrum.bitcoin import hash_encode
+from electrum.blockchain import hash_header
+from electrum.simple_config import SimpleConfig
 from electrum.transaction import Transaction
-from electrum.util import bfh
+from electrum.util import bfh, LRUCache
 from electrum.verifier import SPV, InnerNodeOfSpvProofIsValidTx
 
 from . import TestCaseForTestnet
@@ -48,3 +52,97 @@ class VerifierTestCase(TestCaseForTestnet):
         f_tx_hash = hash_encode(bfh(VALID_64_BYTE_TX[:64]))
         with self.assertRaises(InnerNodeOfSpvProofIsValidTx):
             SPV.hash_merkle_root(fake_mbranch, f_tx_hash, 6)
+
+
+class MockBlockchain:
+    def __init__(self, headers):
+        self.headers = headers
+    def height(self):
+        return max(self.headers)
+    def read_header(self, height):
+        return self.headers.get(height)
+
+
+class MockNetwork:
+    def __init__(self, config, blockchain):
+        self.config = config
+        self.asyncio_loop = asyncio.get_event_loop()
+        self.interface = None
+        self.bhi_lock = asyncio.Lock()
+        self.verified_tx_cache = LRUCache(maxsize=10)
+        self.merkle_requests = []
+        self._blockchain = blockchain
+    def blockchain(self):
+        return self._blockchain
+    async def get_merkle_for_transaction(self, tx_hash, tx_height):
+        self.merkle_requests.append(tx_hash)
+        return {'block_height': tx_height, 'pos': 3, 'merkle': MERKLE_BRANCH}
+
+
+class MockWallet:
+    def __init__(self, unverified):
+        self.unverified = unverified
+        self.verified = {}
+    def diagnostic_name(self):
+        return 'mock_wallet'
+    def get_unverified_txs(self):
+        return {txid: height for txid, height in self.unverified.items() if txid not in self.verified}
+    def add_verified_tx(self, tx_hash, info):
+        self.verified[tx_hash] = info
+
+
+class TestSharedVerification(TestCaseForTestnet):
+
+    def setUp(self):
+        super().setUp()
+        self.txid = Transaction(VALID_64_BYTE_TX).txid()
+        self.header = {'version': 1, 'prev_block_hash': '00' * 32, 'merkle_root': MERKLE_ROOT,
+                       'timestamp': 1234, 'bits': 0x1d00ffff, 'nonce': 0, 'block_height': 100}
+        self.network = MockNetwork(SimpleConfig({'electrum_path': self.electrum_path}),
+                                   MockBlockchain({100: self.header}))
+        self.spvs = []
+
+    def tearDown(self):
+        for spv in self.spvs:
+            util.unregister_callback(spv._restart)
+        super().tearDown()
+
+    def _make_spv(self, wallet):
+        spv = SPV(self.network, wallet)
+        spv.blockchain = self.network.blockchain()
+        self.spvs.append(spv)
+        return spv
+
+    def _run(self, coro):
+        return asyncio.get_event_loop().run_until_complete(coro)
+
+    def _run_first_verification(self):
+        wallet = MockWallet({self.txid: 100})
+        self._run(self._make_spv(wallet)._request_and_verify_single_proof(self.txid, 100))
+        return wallet.verified[self.txid]
+
+    def test_verification_is_shared_between_wallets(self):
+        wallet1, wallet2 = MockWallet({self.txid: 100}), MockWallet({self.txid: 100})
+        spv1, spv2 = self._make_spv(wallet1), self._make_spv(wallet2)
+        self._run(spv1._request_and_verify_single_proof(self.txid, 100))
+        self.assertEqual([self.txid], self.network.merkle_requests)
+        self.assertEqual(hash_header(self.header), wallet1.verified[self.txid].header_hash)
+        self.assertIn(self.txid, self.network.verified_tx_cache)
+        # the second wallet does not request a merkle proof
+        self._run(spv2._request_proofs())
+        self.assertEqual([self.txid], self.network.merkle_requests)
+        self.assertEqual(wallet1.verified, wallet2.verified)
+        self.assertEqual(MERKLE_ROOT, spv2.merkle_roots[self.txid])
+
+    def test_shared_verification_for_other_block_is_not_used(self):
+        info = self._run_first_verification()
+        wallet = MockWallet({})
+        spv = self._make_spv(wallet)
+        # the tx is unconfirmed for this wallet, or at another height
+        self.assertFalse(spv._use_shared_verification(self.txid, 101, self.header))
+        # the block was reorged out
+        other_header = dict(self.header, nonce=1)
+        self.assertFalse(spv._use_shared_verification(self.txid, 100, other_header))
+        self.assertEqual({}, wallet.verified)
+        self.assertTrue(spv._use_shared_verification(self.txid, 100, self.header))
+        self.assertEqual({self.txid: info}, wallet.verified)
@@ -7,14 +7,17 @@ from decimal import Decimal
 import time
 
 from io import StringIO
-from electrum.storage import WalletStorage
+from electrum.storage import WalletStorage, StorageEncryptionVersion
 from electrum.wallet_db import FINAL_SEED_VERSION
 from electrum.wallet import (Abstract_Wallet, Standard_Wallet, create_new_wallet,
                              restore_wallet_from_text, Imported_Wallet, Wallet)
 from electrum.exchange_rate import ExchangeBase, FxThread
-from electrum.util import TxMinedInfo, InvalidPassword
+from electrum.util import TxMinedInfo, InvalidPassword, WalletFileException
 from electrum.bitcoin import COIN
-from electrum.wallet_db import WalletDB
+from electrum.wallet_db import WalletDB, TX_CACHE_SIZE
+from electrum.wallet_sqlite_db import SqliteWalletDB, get_sqlite_path, open_wallet_db
+from electrum.json_db import JOURNAL_SEPARATOR
+from electrum.transaction import TxOutpoint, Transaction, PartialTransaction
 from electrum.simple_config import SimpleConfig
 
 from . import ElectrumTestCase
@@ -83,6 +86,435 @@ class TestWalletStorage(WalletTestCase):
         for key, value in some_dict.items():
             self.assertEqual(d[key], value)
 
+
+class TestWalletStorageJournal(WalletTestCase):
+
+    def _create_db(self):
+        storage = WalletStorage(self.wallet_path)
+        db = WalletDB('', manual_upgrades=False)
+        db.put('labels', {'a': 'first'})
+        db.write(storage)
+        return storage, db
+
+    def _load_db(self, password=None):
+        storage = WalletStorage(self.wallet_path)
+        if password is not None:
+            storage.decrypt(password)
+        return storage, WalletDB(storage.read(), manual_upgrades=False)
+
+    def assertSameData(self, db1, db2):
+        self.assertEqual(json.loads(db1.dump()), json.loads(db2.dump()))
+
+    def _file_contents(self):
+        with open(self.wallet_path, "r") as f:
+            return f.read()
+
+    def test_changes_are_appended_and_replayed(self):
+        storage, db = self._create_db()
+        snapshot = self._file_contents()
+        labels = db.get_dict('labels')
+        labels['b'] = 'second'
+        labels['a'] = 'changed'
+        db.write(storage)
+        db.get_dict('nested')['x'] = {'y': {'z': 1}, 'l': [1, 2]}
+        db.write(storage)
+        nested = db.get_dict('nested')
+        nested['x']['y'].pop('z')
+        del labels['b']
+        # in-place modification of a list, then re-assignment
+        l = nested['x']['l']
+        l.append(3)
+        nested['x']['l'] = l
+        db.add_prevout_by_scripthash('00' * 32, prevout=TxOutpoint(bytes(32), 1), value=1000)
+        db.put('some_key', [1, 2])
+        db.write(storage)
+        contents = self._file_contents()
+        self.assertTrue(contents.startswith(snapshot))
+        self.assertEqual(3, contents.count(JOURNAL_SEPARATOR))
+        storage2, db2 = self._load_db()
+        self.assertSameData(db, db2)
+        self.assertEqual([1, 2, 3], db2.get_dict('nested')['x']['l'])
+        self.assertEqual({}, db2.get_dict('nested')['x']['y'])
+        self.assertEqual({(TxOutpoint(bytes(32), 1), 1000)}, db2.get_prevouts_by_scripthash('00' * 32))
+        # cleared dicts and removed top-level keys
+        db2.get_dict('labels').clear()
+        db2.put('some_key', None)
+        db2.write(storage2)
+        storage3, db3 = self._load_db()
+        self.assertSameData(db2, db3)
+        self.assertIsNone(db3.get('some_key'))
+
+    def test_stored_object_attribute_change_is_journaled(self):
+        storage, db = self._create_db()
+        db.get_dict('log')['fee_updates'] = {'0': {'rate': 1, 'ctn_local': 0, 'ctn_remote': None}}
+        db.write(storage)
+        fee_update = db.get_dict('log')['fee_updates']['0']
+        fee_update.ctn_remote = 3
+        db.write(storage)
+        storage2, db2 = self._load_db()
+        self.assertEqual(3, db2.get_dict('log')['fee_updates']['0'].ctn_remote)
+
+    def test_torn_record_is_discarded_and_overwritten(self):
+        storage, db = self._create_db()
+        db.get_dict('labels')['b'] = 'second'
+        db.write(storage)
+        data_before = json.loads(db.dump())
+        db.get_dict('labels')['c'] = 'third'
+        db.write(storage)
+        # simulate a crash in the middle of the last append
+        with open(self.wallet_path, "r+b") as f:
+            f.truncate(os.path.getsize(self.wallet_path) - 5)
+        storage2, db2 = self._load_db()
+        self.assertEqual(data_before, json.loads(db2.dump()))
+        # the next append replaces the torn record
+        db2.get_dict('labels')['d'] = 'fourth'
+        db2.write(storage2)
+        storage3, db3 = self._load_db()
+        self.assertSameData(db2, db3)
+        self.assertEqual('fourth', db3.get_dict('labels')['d'])
+        self.assertNotIn('c', db3.get_dict('labels'))
+
+    def test_garbage_after_journal_is_ignored(self):
+        storage, db = self._create_db()
+        db.get_dict('labels')['b'] = 'second'
+        db.write(storage)
+        with open(self.wallet_path, "a") as f:
+            f.write(JOURNAL_SEPARATOR + 'deadbeef[[["labels"]]]')
+        storage2, db2 = self._load_db()
+        self.assertSameData(db, db2)
+
+    def test_journal_is_compacted(self):
+        storage, db = self._create_db()
+        labels = db.get_dict('labels')
+        for i in range(100):
+            labels[str(i)] = 'x' * 100
+            db.write(storage)
+            # a snapshot is written before the journal outgrows it
+            self.assertLessEqual(storage.journal_size(), storage.snapshot_size() + 200)
+        db.write(storage, consolidate=True)
+        self.assertEqual(0, storage.journal_size())
+        self.assertEqual(json.loads(db.dump()), json.loads(self._file_contents()))
+
+    def test_encrypted_journal(self):
+        storage, db = self._create_db()
+        db.get_dict('labels')['b'] = 'second'
+        db.write(storage)
+        storage.set_password('secret', enc_version=StorageEncryptionVersion.USER_PASSWORD)
+        db.set_modified(True)
+        # changing the encryption requires a new snapshot
+        self.assertFalse(storage.can_append())
+        db.write(storage)
+        self.assertEqual(0, storage.journal_size())
+        db.get_dict('labels')['c'] = 'third'
+        db.write(storage)
+        self.assertGreater(storage.journal_size(), 0)
+        storage2, db2 = self._load_db(password='secret')
+        self.assertSameData(db, db2)
+        self.assertEqual('third', db2.get_dict('labels')['c'])
+
+class TestWalletDBTransactions(WalletTestCase):
+
+    RAW_TX = '02000000000101a5883f3de780d260e6f26cf85144403c7744a65a44cd38f9ff45aecadf010c540100000000fdffffff0220a10700000000001600145f4cfb0e1d2a7055634074bfbc9f546ac019e47f08de3c000000000016001424b32aadb42a89016c4de8f11741c3b29b15f21c02473044022045cc6c1cc875cbb0c0d8fe323dc1de9716e49ed5659741b0fb3dd9a196894066022077c242640071d12ec5763c5870f482a4823d8713e4bd14353dd621ed29a7f96d012102aea8d439a0f79d8b58e8d7bda83009f587e1f3da350adaa484329bf47cd03465fef61c00'
+    TXID = 'bf0272eb0cd61ef36a7d69b4714ea4291bf5cbab229abd4bcb67c5111f92bb01'
+
+    def _load_db_with_txs(self, txids):
+        data = {
+            'seed_version': FINAL_SEED_VERSION,
+            'transactions': {txid: self.RAW_TX for txid in txids},
+            'txo': {txid: {'addr': {'0': [1000, False]}} for txid in txids},
+        }
+        return WalletDB(json.dumps(data), manual_upgrades=False)
+
+    def test_transactions_are_parsed_on_demand(self):
+        db = self._load_db_with_txs([self.TXID])
+        self.assertEqual(self.RAW_TX, db.transactions[self.TXID])
+        tx = db.get_transaction(self.TXID)
+        self.assertEqual(self.TXID, tx.txid())
+        self.assertIs(tx, db.get_transaction(self.TXID))
+        self.assertIsNone(db.get_transaction('00' * 32))
+        self.assertEqual(self.RAW_TX, json.loads(db.dump())['transactions'][self.TXID])
+        self.assertIs(tx, db.remove_transaction(self.TXID))
+        self.assertIsNone(db.get_transaction(self.TXID))
+
+    def test_parsed_transactions_are_bounded(self):
+        # the txids do not match the raw tx, which is not checked on load
+        txids = ['%064x' % i for i in range(TX_CACHE_SIZE + 10)]
+        db = self._load_db_with_txs(txids)
+        first_tx = db.get_transaction(txids[0])
+        for txid in txids[1:]:
+            db.get_transaction(txid)
+        self.assertEqual(TX_CACHE_SIZE, len(db._parsed_txs))
+        # evicted txs are parsed again from the raw data
+        tx = db.get_transaction(txids[0])
+        self.assertIsNot(first_tx, tx)
+        self.assertEqual(self.TXID, tx.txid())
+
+    def test_raw_transactions_shared_between_wallets(self):
+        db1 = self._load_db_with_txs([self.TXID])
+        db2 = self._load_db_with_txs([self.TXID])
+        self.assertIs(db1.transactions[self.TXID], db2.transactions[self.TXID])
+        db3 = WalletDB('', manual_upgrades=False)
+        db3.add_transaction(self.TXID, Transaction(bytes.fromhex(self.RAW_TX)))
+        self.assertIs(db1.transactions[self.TXID], db3.transactions[self.TXID])
+
+    def test_partial_tx_does_not_overwrite_complete_tx(self):
+        db = WalletDB('', manual_upgrades=False)
+        tx = Transaction(self.RAW_TX)
+        ptx = PartialTransaction.from_tx(tx)
+        ptx.inputs()[0].script_sig = None
+        ptx.inputs()[0].witness = None
+        ptx.inputs()[0].script_type = 'p2wpkh'
+        self.assertFalse(ptx.is_complete())
+        db.add_transaction(self.TXID, ptx)
+        self.assertIsInstance(db.get_transaction(self.TXID), PartialTransaction)
+        db.add_transaction(self.TXID, tx)
+        db.add_transaction(self.TXID, ptx)
+        self.assertEqual(self.RAW_TX, db.transactions[self.TXID])
+        self.assertIs(tx, db.get_transaction(self.TXID))
+
+
+class TestSqliteWalletDB(WalletTestCase):
+
+    RAW_TX = '02000000000101a5883f3de780d260e6f26cf85144403c7744a65a44cd38f9ff45aecadf010c540100000000fdffffff0220a10700000000001600145f4cfb0e1d2a7055634074bfbc9f546ac019e47f08de3c000000000016001424b32aadb42a89016c4de8f11741c3b29b15f21c02473044022045cc6c1cc875cbb0c0d8fe323dc1de9716e49ed5659741b0fb3dd9a196894066022077c242640071d12ec5763c5870f482a4823d8713e4bd14353dd621ed29a7f96d012102aea8d439a0f79d8b58e8d7bda83009f587e1f3da350adaa484329bf47cd03465fef61c00'
+    TXID = 'bf0272eb0cd61ef36a7d69b4714ea4291bf5cbab229abd4bcb67c5111f92bb01'
+
+    def _fill(self, db):
+        txid = self.TXID
+        db.add_transaction(txid, Transaction(self.RAW_TX))
+        db.add_txi_addr(txid, 'addr1', 'aa' * 32 + ':1', 500)
+        db.add_txi_addr(txid, 'addr1', 'bb' * 32 + ':0', 700)
+        db.add_txo_addr(txid, 'addr2', 0, 1000, False)
+        db.add_txo_addr(txid, 'addr2', '1', 2000, True)
+        db.set_spent_outpoint('aa' * 32, 1, txid)
+        db.set_addr_history('addr1', [(txid, 100)])
+        db.set_addr_history('addr2', [])
+        db.add_prevout_by_scripthash('00' * 32, prevout=TxOutpoint(bytes(32), 1), value=1000)
+        db.add_verified_tx(txid, TxMinedInfo(height=100, timestamp=1234, txpos=3, header_hash='cc' * 32))
+        db.add_tx_fee_from_server(txid, 300)
+        db.add_num_inputs_to_tx(txid, 2)
+
+    def _snapshot(self, db):
+        txid = self.TXID
+        return {
+            'txi_addresses': sorted(db.get_txi_addresses(txid)),
+            'txo_addresses': sorted(db.get_txo_addresses(txid)),
+            'txi_addr': sorted(db.get_txi_addr(txid, 'addr1')),
+            'txo_addr': db.get_txo_addr(txid, 'addr2'),
+            'list_txi': sorted(db.list_txi()),
+            'list_txo': sorted(db.list_txo()),
+            'spent_outpoints': sorted(map(tuple, db.list_spent_outpoints())),
+            'spent_outpoint': db.get_spent_outpoint('aa' * 32, '1'),
+            'prevouts': db.get_prevouts_by_scripthash('00' * 32),
+            'tx': db.get_transaction(txid).serialize(),
+            'transactions': sorted(db.list_transactions()),
+            'has_tx': db.has_transaction(txid),
+            'history': sorted(db.get_history()),
+            'addr_history': [tuple(x) for x in db.get_addr_history('addr1')],
+            'in_history': db.is_addr_in_history('addr2'),
+            'verified': db.get_verified_tx(txid),
+            'is_verified': db.is_in_verified_tx(txid),
+            'fee': db.get_tx_fee(txid, trust_server=True),
+            'fee_we_calculated': db.get_tx_fee(txid),
+            'num_all_inputs': db.get_num_all_inputs_of_tx(txid),
+            'num_ismine_inputs': db.get_num_ismine_inputs_of_tx(txid),
+        }
+
+    def _open_sqlite_db(self):
+        storage = WalletStorage(self.wallet_path)
+        db = SqliteWalletDB(storage.read(), manual_upgrades=False, path=get_sqlite_path(self.wallet_path))
+        return storage, db
+
+    def test_same_results_as_wallet_db(self):
+        json_db = WalletDB('', manual_upgrades=False)
+        self._fill(json_db)
+        storage, sqlite_db = self._open_sqlite_db()
+        self._fill(sqlite_db)
+        self.assertEqual(self._snapshot(json_db), self._snapshot(sqlite_db))
+        for db in (json_db, sqlite_db):
+            db.add_tx_fee_we_calculated(self.TXID, 400)
+            db.add_tx_fee_from_server(self.TXID, 500)
+            db.remove_prevout_by_scripthash('00' * 32, prevout=TxOutpoint(bytes(32), 1), value=1000)
+            db.remove_spent_outpoint('aa' * 32, 1)
+            db.remove_verified_tx(self.TXID)
+            db.remove_addr_history('addr1')
+        self.assertEqual(self._snapshot(json_db), self._snapshot(sqlite_db))
+        for db in (json_db, sqlite_db):
+            db.clear_history()
+            self.assertEqual([], db.list_transactions())
+            self.assertEqual([], db.get_history())
+            self.assertIsNone(db.get_transaction(self.TXID))
+        sqlite_db.close()
+
+    def test_migration_from_json_and_reload(self):
+        storage = WalletStorage(self.wallet_path)
+        json_db = WalletDB('', manual_upgrades=False)
+        self._fill(json_db)
+        json_db.get_dict('labels')['a'] = 'label'
+        json_db.write(storage)
+        expected = self._snapshot(json_db)
+        # an existing json wallet is migrated when the config asks for it
+        db = open_wallet_db(WalletStorage(self.wallet_path), manual_upgrades=False, config=self.config)
+        self.assertNotIsInstance(db, SqliteWalletDB)
+        self.config.set_key('wallet_db_backend', 'sqlite')
+        storage = WalletStorage(self.wallet_path)
+        db = open_wallet_db(storage, manual_upgrades=False, config=self.config)
+        self.assertIsInstance(db, SqliteWalletDB)
+        self.assertEqual(expected, self._snapshot(db))
+        self.assertEqual('label', db.get_dict('labels')['a'])
+        db.write(storage)
+        db.close()
+        with open(self.wallet_path, "r") as f:
+            data = json.loads(f.read())
+        self.assertNotIn('transactions', data)
+        self.assertNotIn('txi', data)
+        # once the sqlite file exists, it is used regardless of the config
+        self.config.set_key('wallet_db_backend', None)
+        storage2 = WalletStorage(self.wallet_path)
+        db2 = open_wallet_db(storage2, manual_upgrades=False, config=self.config)
+        self.assertIsInstance(db2, SqliteWalletDB)
+        self.assertEqual(expected, self._snapshot(db2))
+        self.assertEqual('label', db2.get_dict('labels')['a'])
+        db2.close()
+
+    def test_changes_are_committed_on_write(self):
+        storage, db = self._open_sqlite_db()
+        self._fill(db)
+        db.write(storage)
+        db.remove_verified_tx(self.TXID)
+        # not written: the change is lost
+        db.conn.rollback()
+        db.close()
+        storage2, db2 = self._open_sqlite_db()
+        self.assertTrue(db2.is_in_verified_tx(self.TXID))
+        db2.remove_verified_tx(self.TXID)
+        db2.write(storage2)
+        db2.close()
+        storage3, db3 = self._open_sqlite_db()
+        self.assertFalse(db3.is_in_verified_tx(self.TXID))
+        db3.close()
+
+    def _migrate_json_wallet(self):
+        json_db = WalletDB('', manual_upgrades=False)
+        self._fill(json_db)
+        json_db.write(WalletStorage(self.wallet_path))
+        self.config.set_key('wallet_db_backend', 'sqlite')
+        storage = WalletStorage(self.wallet_path)
+        db = open_wallet_db(storage, manual_upgrades=False, config=self.config)
+        self.assertIsInstance(db, SqliteWalletDB)
+        return storage, db
+
+    def test_crash_during_migration(self):
+        storage, db = self._migrate_json_wallet()
+        db.remove_verified_tx(self.TXID)
+        # simulate a crash after committing sqlite but before rewriting the wallet file
+        db.conn.commit()
+        db.close()
+        # the wallet file does not know the sqlite db yet, so it is migrated again
+        storage2 = WalletStorage(self.wallet_path)
+        db2 = open_wallet_db(storage2, manual_upgrades=False, config=self.config)
+        self.assertTrue(db2.is_in_verified_tx(self.TXID))
+        db2.write(storage2)
+        db2.close()
+        storage3 = WalletStorage(self.wallet_path)
+        db3 = open_wallet_db(storage3, manual_upgrades=False, config=self.config)
+        self.assertTrue(db3.is_in_verified_tx(self.TXID))
+        db3.close()
+
+    def test_sqlite_db_of_other_wallet_file_is_not_used(self):
+        storage, db = self._migrate_json_wallet()
+        db.write(storage)
+        db.close()
+        self.config.set_key('wallet_db_backend', None)
+        # a new wallet at the same path, e.g. after the old one was deleted
+        new_db = WalletDB('', manual_upgrades=False)
+        new_db.add_verified_tx('dd' * 32, TxMinedInfo(height=200, timestamp=5678, txpos=1, header_hash='ee' * 32))
+        os.unlink(self.wallet_path)
+        new_db.write(WalletStorage(self.wallet_path))
+        db2 = open_wallet_db(WalletStorage(self.wallet_path), manual_upgrades=False, config=self.config)
+        self.assertNotIsInstance(db2, SqliteWalletDB)
+        self.assertTrue(db2.is_in_verified_tx('dd' * 32))
+        self.assertFalse(db2.is_in_verified_tx(self.TXID))
+        self.assertFalse(os.path.exists(get_sqlite_path(self.wallet_path)))
+        self.assertTrue(os.path.exists(get_sqlite_path(self.wallet_path) + '.orphaned'))
+
+    def test_restore_json_backup_next_to_sqlite_db(self):
+        storage, db = self._migrate_json_wallet()
+        db.write(storage)
+        backup = db.dump_as_json_wallet()
+        db.remove_verified_tx(self.TXID)
+        db.add_verified_tx('dd' * 32, TxMinedInfo(height=200, timestamp=5678, txpos=1, header_hash='ee' * 32))
+        db.write(storage)
+        db.close()
+        # the backup has the history of the sqlite db
+        backup_db = WalletDB(backup, manual_upgrades=False)
+        self.assertEqual(self._snapshot(backup_db)['verified'], TxMinedInfo(
+            height=100, conf=None, timestamp=1234, txpos=3, header_hash='cc' * 32))
+        with open(self.wallet_path, 'w') as f:
+            f.write(backup)
+        db2 = open_wallet_db(WalletStorage(self.wallet_path), manual_upgrades=False, config=self.config)
+        self.assertIsInstance(db2, SqliteWalletDB)
+        self.assertEqual(self._snapshot(backup_db), self._snapshot(db2))
+        self.assertFalse(db2.is_in_verified_tx('dd' * 32))
+        db2.close()
+
+    def test_encrypted_wallet_is_not_migrated(self):
+        self.config.set_key('wallet_db_backend', 'sqlite')
+        storage = WalletStorage(self.wallet_path)
+        storage.set_password('secret', StorageEncryptionVersion.USER_PASSWORD)
+        json_db = WalletDB('', manual_upgrades=False)
+        self._fill(json_db)
+        json_db.write(storage)
+        storage = WalletStorage(self.wallet_path)
+        storage.decrypt('secret')
+        db = open_wallet_db(storage, manual_upgrades=False, config=self.config)
+        self.assertNotIsInstance(db, SqliteWalletDB)
+        self.assertFalse(os.path.exists(get_sqlite_path(self.wallet_path)))
+
+    def test_sqlite_wallet_file_cannot_be_encrypted(self):
+        restore_wallet_from_text('bitter grass shiver impose acquire brush forget axis eager alone wine silver',
+                                 path=self.wallet_path, config=self.config, gap_limit=2)
+        self.config.set_key('wallet_db_backend', 'sqlite')
+        storage = WalletStorage(self.wallet_path)
+        wallet = Wallet(open_wallet_db(storage, manual_upgrades=False, config=self.config), storage, config=self.config)
+        with self.assertRaises(WalletFileException):
+            wallet.update_password(None, 'secret', encrypt_storage=True)
+        self.assertFalse(storage.is_encrypted())
+        wallet.update_password(None, 'secret', encrypt_storage=False)
+        self.assertTrue(wallet.has_password())
+        self.assertFalse(storage.is_encrypted())
+        wallet.db.close()
+
+    def test_save_backup_includes_sqlite_tables(self):
+        restore_wallet_from_text('bitter grass shiver impose acquire brush forget axis eager alone wine silver',
+                                 path=self.wallet_path, config=self.config, gap_limit=2)
+        self.config.set_key('wallet_db_backend', 'sqlite')
+        self.config.set_key('backup_dir', self.user_dir)
+        storage = WalletStorage(self.wallet_path)
+        wallet = Wallet(open_wallet_db(storage, manual_upgrades=False, config=self.config), storage, config=self.config)
+        self._fill(wallet.db)
+        backup_path = wallet.save_backup()
+        expected = self._snapshot(wallet.db)
+        wallet.db.close()
+        backup_db = WalletDB(WalletStorage(backup_path).read(), manual_upgrades=False)
+        self.assertEqual(expected, self._snapshot(backup_db))
+        self.assertNotIn('sqlite_db_id', backup_db.data)
+
+    def test_stopping_the_wallet_closes_the_sqlite_db(self):
+        restore_wallet_from_text('bitter grass shiver impose acquire brush forget axis eager alone wine silver',
+                                 path=self.wallet_path, config=self.config, gap_limit=2)
+        self.config.set_key('wallet_db_backend', 'sqlite')
+        storage = WalletStorage(self.wallet_path)
+        wallet = Wallet(open_wallet_db(storage, manual_upgrades=False, config=self.config), storage, config=self.config)
+        self._fill(wallet.db)
+        expected = self._snapshot(wallet.db)
+        wallet.stop()
+        self.assertIsNone(wallet.db.conn)
+        storage2 = WalletStorage(self.wallet_path)
+        db2 = open_wallet_db(storage2, manual_upgrades=False, config=self.config)
+        self.assertEqual(expected, self._snapshot(db2))
+        db2.close()
+
+
 class FakeExchange(ExchangeBase):
     def __init__(self, rate):
         super().__init__(lambda self: None, lambda self: None)
@@ -5,13 +5,14 @@ import tempfile
 from typing import Sequence
 import asyncio
 import copy
+from concurrent.futures import ThreadPoolExecutor
 
-from electrum import storage, bitcoin, keystore, bip32, wallet
+from electrum import storage, bitcoin, keystore, bip32, wallet, util
 from electrum import Transaction
 from electrum import SimpleConfig
 from electrum.address_synchronizer import TX_HEIGHT_UNCONFIRMED, TX_HEIGHT_UNCONF_PARENT
 from electrum.wallet import sweep, Multisig_Wallet, Standard_Wallet, Imported_Wallet, restore_wallet_from_text, Abstract_Wallet
-from electrum.util import bfh, bh2u, create_and_start_event_loop
+from electrum.util import bfh, bh2u, create_and_start_event_loop, TxMinedInfo
 from electrum.transaction import TxOutput, Transaction, PartialTransaction, PartialTxOutput, PartialTxInput, tx_from_any
 from electrum.mnemonic import seed_type
 
@@ -426,6 +427,29 @@ class TestWalletKeystoreAddressIntegrityForMainnet(ElectrumTestCase):
         self.assertEqual(w.get_receiving_addresses()[0], '35LeC45QgCVeRor1tJD6LiDgPbybBXisns')
         self.assertEqual(w.get_change_addresses()[0], '39RhtDchc6igmx5tyoimhojFL1ZbQBrXa6')
 
+    @mock.patch.object(wallet.Abstract_Wallet, 'save_db')
+    def test_bulk_address_derivation(self, mock_save_db):
+        xpub1 = 'xpub661MyMwAqRbcGH3yTb2kMQGnsLziRTJZ8vNthsVSCGbdBr8CGDWKxnGAFYgyKTzBtwvPPmfVAWJuFmxRXjSbUTg87wDkWQ5GmzpfUcN9t8Z'
+        xpub2 = 'xpub68qvwUg8sewQvcUgwxuTYr9rrgu5nfn6BwajQpYT9p8fXWxdCRHpN86UWruWJAD1ede8Sv8ERrTa22Gyc4SBfm7zFpcyoVWVBKCVwnw6s1J'
+        ks1 = keystore.from_xpub(xpub1)
+        ks2 = keystore.from_xpub(xpub2)
+        w = WalletIntegrityHelper.create_multisig_wallet([ks1, ks2], '2of2', config=self.config, gap_limit=30)
+        self.assertEqual(30, len(w.get_receiving_addresses()))
+        for for_change, addresses in ((0, w.get_receiving_addresses()), (1, w.get_change_addresses())):
+            for n, addr in enumerate(addresses):
+                pubkeys = [bip32.BIP32Node.from_xkey(xpub).subkey_at_public_derivation((for_change, n))
+                           .eckey.get_public_key_hex() for xpub in (xpub1, xpub2)]
+                self.assertEqual(w.pubkeys_to_address(pubkeys), addr)
+                self.assertEqual([for_change, n], list(w.get_address_index(addr)))
+        self.assertEqual(w.derive_addresses(0, 25, 35)[:5], w.get_receiving_addresses()[25:])
+        # deriving with an executor gives the same pubkeys, in order
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            pubkeys = ks1.derive_pubkeys(0, 10, 10 + 2 * keystore.DERIVATION_CHUNK_SIZE + 1, executor=executor)
+        self.assertEqual(ks1.derive_pubkeys(0, 10, 10 + 2 * keystore.DERIVATION_CHUNK_SIZE + 1), pubkeys)
+        self.assertEqual(ks1.derive_pubkey(0, 2010), pubkeys[-1])
+        with self.assertRaises(keystore.CannotDerivePubkey):
+            ks1.derive_pubkeys(2, 0, 1)
+
     @mock.patch.object(wallet.Abstract_Wallet, 'save_db')
     def test_bip32_extended_version_bytes(self, mock_save_db):
         seed_words = 'crouch dumb relax small truck age shine pink invite spatial object tenant'
@@ -641,6 +665,25 @@ class TestWalletSending(TestCaseForTestnet):
         self.assertEqual((0, funding_output_value - 250000 - 5000 + 100000, 0), wallet1.get_balance())
         self.assertEqual((0, 250000 - 5000 - 100000, 0), wallet2.get_balance())
 
+    @mock.patch.object(wallet, 'MIN_INPUTS_TO_SIGN_IN_EXECUTOR', 1)
+    @mock.patch.object(wallet.Abstract_Wallet, 'save_db')
+    def test_sending_with_signing_executor(self, mock_save_db):
+        self.config.set_key('sign_num_workers', 2)
+        wallet1 = self.create_standard_wallet_from_seed('bitter grass shiver impose acquire brush forget axis eager alone wine silver')
+        wallet2 = self.create_standard_wallet_from_seed('cycle rocket west magnet parrot shuffle foot correct salt library feed song')
+
+        funding_tx = Transaction('01000000014576dacce264c24d81887642b726f5d64aa7825b21b350c7b75a57f337da6845010000006b483045022100a3f8b6155c71a98ad9986edd6161b20d24fad99b6463c23b463856c0ee54826d02200f606017fd987696ebbe5200daedde922eee264325a184d5bbda965ba5160821012102e5c473c051dae31043c335266d0ef89c1daab2f34d885cc7706b267f3269c609ffffffff0240420f0000000000160014e30a3abc69ed5957220a66242ed33a4f024e9ef4a2ddb90e000000001976a914c384950342cb6f8df55175b48586838b03130fad88ac00000000')
+        wallet1.receive_tx_callback(funding_tx.txid(), funding_tx, TX_HEIGHT_UNCONFIRMED)
+
+        # same tx as in test_sending_between_p2wpkh_and_compressed_p2pkh, signed in the executor
+        outputs = [PartialTxOutput.from_address_and_value(wallet2.get_receiving_address(), 250000)]
+        with mock.patch.object(wallet, 'ThreadPoolExecutor', wraps=ThreadPoolExecutor) as mock_executor:
+            tx = wallet1.mktx(outputs=outputs, password=None, fee=5000, tx_version=1)
+        mock_executor.assert_called_once()
+        self.assertTrue(tx.is_complete())
+        self.assertEqual('cdcb825dc40e0ec4fca6b0d94de66d311483669b01ccb34c10fe4e7eb945ccbf', tx.txid())
+        self.assertEqual('b79726607dda89b81b2ee1a09426bc79875781db16446ebc1ecf3c353509bd4b', tx.wtxid())
+
     @mock.patch.object(wallet.Abstract_Wallet, 'save_db')
     def test_sending_between_p2sh_2of3_and_uncompressed_p2pkh(self, mock_save_db):
         # wallets 1a and 1b have to have the same addresses
@@ -2919,3 +2962,69 @@ class TestWalletHistory_DoubleSpend(TestCaseForTestnet):
         txC = Transaction(self.transactions["2337490b670cb73b3584881d13cc27470a7aebca394f2862b7d8cefb550632f1"])
         w.add_transaction(txC)
         self.assertEqual(999890, sum(w.get_balance()))
+
+
+class TestWalletHistory_IncrementalCache(TestCaseForTestnet):
+    transactions = TestWalletHistory_SimpleRandomOrder.transactions
+    txid_list = TestWalletHistory_SimpleRandomOrder.txid_list
+
+    def setUp(self):
+        super().setUp()
+        self.config = SimpleConfig({'electrum_path': self.electrum_path})
+
+    def create_old_wallet(self):
+        ks = keystore.from_old_mpk('e9d4b7866dd1e91c862aebf62a49548c7dbf7bcc6e4b7b8c9da820c7737968df9c09d5a3e271dc814a29981f81b3faaf2737b551ef5dcc6189cf0f8252c442b3')
+        w = WalletIntegrityHelper.create_standard_wallet(ks, gap_limit=20, config=self.config)
+        w.create_new_address(for_change=True)
+        return w
+
+    def _assert_history_matches_full_recompute(self, w):
+        hist = w.get_history()
+        # passing an explicit domain bypasses the cache
+        ref = w.get_history(domain=w.get_addresses())
+        self.assertEqual({item.txid: (item.tx_mined_status, item.delta, item.fee) for item in ref},
+                         {item.txid: (item.tx_mined_status, item.delta, item.fee) for item in hist})
+        self.assertEqual(len(ref), len(hist))
+        txpos = [w.get_txpos(item.txid) for item in hist]
+        self.assertEqual(sorted(txpos), txpos)
+        balance = 0
+        for item in hist:
+            balance += item.delta
+            self.assertEqual(balance, item.balance)
+        self.assertEqual(sum(w.get_balance()), balance)
+
+    @mock.patch.object(util, 'trigger_callback')
+    @mock.patch.object(wallet.Abstract_Wallet, 'save_db')
+    def test_history_cache_follows_wallet_changes(self, mock_save_db, mock_trigger_callback):
+        w = self.create_old_wallet()
+        self.assertEqual([], w.get_history())
+        for n, i in enumerate([2, 12, 7, 9, 11, 10, 16, 6, 17, 1, 13, 15, 5, 8, 4, 0, 14, 18, 3]):
+            tx = Transaction(self.transactions[self.txid_list[i]])
+            w.receive_tx_callback(tx.txid(), tx, 1_200_000 + n % 5)
+            self._assert_history_matches_full_recompute(w)
+        self.assertEqual(27633300, w.get_history()[-1].balance)
+        # verify some txs, then roll part of it back in a reorg
+        for n, txid in enumerate(self.txid_list[:8]):
+            height = w.get_tx_height(txid).height
+            w.add_verified_tx(txid, TxMinedInfo(height=height, timestamp=1_500_000_000 + n,
+                                                txpos=n, header_hash='00' * 32))
+            self._assert_history_matches_full_recompute(w)
+        blockchain = mock.Mock()
+        blockchain.read_header.return_value = None
+        self.assertTrue(w.undo_verifications(blockchain, 1_200_002))
+        self._assert_history_matches_full_recompute(w)
+        # new blocks only change confirmation counts
+        w.db.put('stored_height', 1_200_100)
+        self._assert_history_matches_full_recompute(w)
+        # removing a tx also affects its children
+        txid = self.txid_list[3]
+        for txid2 in {txid} | w.get_depending_transactions(txid):
+            w.remove_transaction(txid2)
+        self.assertNotIn(txid, [item.txid for item in w.get_history()])
+        self._assert_history_matches_full_recompute(w)
+        tx = Transaction(self.transactions[txid])
+        w.add_transaction(tx)
+        self.assertIn(txid, [item.txid for item in w.get_history()])
+        self._assert_history_matches_full_recompute(w)
+        w.clear_history()
+        self.assertEqual([], w.get_history())
@@ -29,12 +29,14 @@
 
 import struct
 import traceback
+import hashlib
 import sys
 import io
 import base64
 from typing import (Sequence, Union, NamedTuple, Tuple, Optional, Iterable,
                     Callable, List, Dict, Set, TYPE_CHECKING)
 from collections import defaultdict
+from concurrent.futures import Executor
 from enum import IntEnum
 import itertools
 import binascii
@@ -163,12 +165,6 @@ class TxOutput:
         return d
 
 
-class BIP143SharedTxDigestFields(NamedTuple):
-    hashPrevouts: str
-    hashSequence: str
-    hashOutputs: str
-
-
 class TxOutpoint(NamedTuple):
     txid: bytes  # endianness same as hex string displayed; reverse of tx serialization order
     out_idx: int
@@ -500,6 +496,140 @@ def parse_output(vds: BCDataStream) -> TxOutput:
     return TxOutput(value=value, scriptpubkey=scriptpubkey)
 
 
+# Parser for network-serialized txs, used by Transaction.deserialize.
+# It reads fields with precompiled structs at offsets into the raw bytes,
+# instead of going through BCDataStream, so that the only copies made are
+# the bytes objects of the resulting TxInputs/TxOutputs.
+
+_STRUCT_UINT16 = struct.Struct('<H')
+_STRUCT_INT32 = struct.Struct('<i')
+_STRUCT_UINT32 = struct.Struct('<I')
+_STRUCT_INT64 = struct.Struct('<q')
+_STRUCT_UINT64 = struct.Struct('<Q')
+_STRUCT_PREVOUT = struct.Struct('<32sI')
+_COMPACT_SIZE_STRUCTS = {253: _STRUCT_UINT16, 254: _STRUCT_UINT32, 255: _STRUCT_UINT64}
+
+
+def _unpack_from(st: struct.Struct, buf: bytes, pos: int):
+    try:
+        return st.unpack_from(buf, pos)
+    except struct.error as e:
+        raise SerializationError(e) from e
+
+
+def _read_compact_size(buf: bytes, pos: int) -> Tuple[int, int]:
+    """Returns (size, position after the compact size)."""
+    try:
+        size = buf[pos]
+    except IndexError as e:
+        raise SerializationError("attempt to read past end of buffer") from e
+    pos += 1
+    if size < 253:
+        return size, pos
+    st = _COMPACT_SIZE_STRUCTS[size]
+    (size,) = _unpack_from(st, buf, pos)
+    return size, pos + st.size
+
+
+def _read_bytes(buf: bytes, pos: int, length: int) -> Tuple[bytes, int]:
+    end = pos + length
+    if end > len(buf):
+        raise SerializationError('attempt to read past end of buffer')
+    return buf[pos:end], end
+
+
+def _compact_size_len(size: int) -> int:
+    if size < 253:
+        return 1
+    if size <= 0xffff:
+        return 3
+    if size <= 0xffffffff:
+        return 5
+    return 9
+
+
+def _compact_size(size: int) -> bytes:
+    """Same as bitcoin.var_int, but returns bytes."""
+    assert size >= 0, size
+    if size < 253:
+        return bytes((size,))
+    if size <= 0xffff:
+        return b'\xfd' + _STRUCT_UINT16.pack(size)
+    if size <= 0xffffffff:
+        return b'\xfe' + _STRUCT_UINT32.pack(size)
+    return b'\xff' + _STRUCT_UINT64.pack(size)
+
+
+def _parse_input_at(buf: bytes, pos: int) -> Tuple[TxInput, int]:
+    prevout_hash, prevout_n = _unpack_from(_STRUCT_PREVOUT, buf, pos)
+    script_len, pos = _read_compact_size(buf, pos + 36)
+    script_sig, pos = _read_bytes(buf, pos, script_len)
+    (nsequence,) = _unpack_from(_STRUCT_UINT32, buf, pos)
+    prevout = TxOutpoint(txid=prevout_hash[::-1], out_idx=prevout_n)
+    return TxInput(prevout=prevout, script_sig=script_sig, nsequence=nsequence), pos + 4
+
+
+def _parse_output_at(buf: bytes, pos: int) -> Tuple[TxOutput, int]:
+    (value,) = _unpack_from(_STRUCT_INT64, buf, pos)
+    if value > TOTAL_COIN_SUPPLY_LIMIT_IN_BTC * COIN:
+        raise SerializationError('invalid output amount (too large)')
+    if value < 0:
+        raise SerializationError('invalid output amount (negative)')
+    script_len, pos = _read_compact_size(buf, pos + 8)
+    scriptpubkey, pos = _read_bytes(buf, pos, script_len)
+    return TxOutput(value=value, scriptpubkey=scriptpubkey), pos
+
+
+def _parse_witness_at(buf: bytes, pos: int) -> Tuple[bytes, int]:
+    # The witness is stored in its serialized form, so if all compact sizes
+    # are canonical, that is just the slice of the raw tx.
+    start = pos
+    n, pos = _read_compact_size(buf, pos)
+    is_canonical = (pos - start == _compact_size_len(n))
+    elements = []
+    for i in range(n):
+        item_start = pos
+        item_len, pos = _read_compact_size(buf, pos)
+        is_canonical &= (pos - item_start == _compact_size_len(item_len))
+        item, pos = _read_bytes(buf, pos, item_len)
+        elements.append(item)
+    if is_canonical:
+        return buf[start:pos], pos
+    return bfh(construct_witness(elements)), pos
+
+
+def parse_network_tx(raw: bytes) -> Tuple[int, List[TxInput], List[TxOutput], int]:
+    """Parses a network-serialized tx into (version, inputs, outputs, locktime)."""
+    (version,) = _unpack_from(_STRUCT_INT32, raw, 0)
+    n_vin, pos = _read_compact_size(raw, 4)
+    is_segwit = (n_vin == 0)
+    if is_segwit:
+        marker, pos = _read_bytes(raw, pos, 1)
+        if marker != b'\x01':
+            raise ValueError('invalid txn marker byte: {}'.format(marker))
+        n_vin, pos = _read_compact_size(raw, pos)
+    if n_vin < 1:
+        raise SerializationError('tx needs to have at least 1 input')
+    inputs = []
+    for i in range(n_vin):
+        txin, pos = _parse_input_at(raw, pos)
+        inputs.append(txin)
+    n_vout, pos = _read_compact_size(raw, pos)
+    if n_vout < 1:
+        raise SerializationError('tx needs to have at least 1 output')
+    outputs = []
+    for i in range(n_vout):
+        txout, pos = _parse_output_at(raw, pos)
+        outputs.append(txout)
+    if is_segwit:
+        for txin in inputs:
+            txin.witness, pos = _parse_witness_at(raw, pos)
+    (locktime,) = _unpack_from(_STRUCT_UINT32, raw, pos)
+    if pos + 4 < len(raw):
+        raise SerializationError('extra junk at the end')
+    return version, inputs, outputs, locktime
+
+
 # pay & redeem scripts
 
 def multisig_script(public_keys: Sequence[str], m: int) -> str:
@@ -580,29 +710,11 @@ class Transaction:
             return
 
         raw_bytes = bfh(self._cached_network_ser)
-        vds = BCDataStream()
-        vds.write(raw_bytes)
-        self._version = vds.read_int32()
-        n_vin = vds.read_compact_size()
-        is_segwit = (n_vin == 0)
-        if is_segwit:
-            marker = vds.read_bytes(1)
-            if marker != b'\x01':
-                raise ValueError('invalid txn marker byte: {}'.format(marker))
-            n_vin = vds.read_compact_size()
-        if n_vin < 1:
-            raise SerializationError('tx needs to have at least 1 input')
-        self._inputs = [parse_input(vds) for i in range(n_vin)]
-        n_vout = vds.read_compact_size()
-        if n_vout < 1:
-            raise SerializationError('tx needs to have at least 1 output')
-        self._outputs = [parse_output(vds) for i in range(n_vout)]
-        if is_segwit:
-            for txin in self._inputs:
-                parse_witness(vds, txin)
-        self._locktime = vds.read_uint32()
-        if vds.can_read_more():
-            raise SerializationError('extra junk at the end')
+        version, inputs, outputs, locktime = parse_network_tx(raw_bytes)
+        self._version = version
+        self._locktime = locktime
+        self._outputs = outputs
+        self._inputs = inputs
 
     @classmethod
     def get_siglist(self, txin: 'PartialTxInput', *, estimate_size=False):
@@ -751,16 +863,6 @@ class Transaction:
         s += int_to_hex(txin.nsequence, 4)
         return s
 
-    def _calc_bip143_shared_txdigest_fields(self) -> BIP143SharedTxDigestFields:
-        inputs = self.inputs()
-        outputs = self.outputs()
-        hashPrevouts = bh2u(sha256d(b''.join(txin.prevout.serialize_to_network() for txin in inputs)))
-        hashSequence = bh2u(sha256d(bfh(''.join(int_to_hex(txin.nsequence, 4) for txin in inputs))))
-        hashOutputs = bh2u(sha256d(bfh(''.join(o.serialize_to_network().hex() for o in outputs))))
-        return BIP143SharedTxDigestFields(hashPrevouts=hashPrevouts,
-                                          hashSequence=hashSequence,
-                                          hashOutputs=hashOutputs)
-
     def is_segwit(self, *, guess_for_address=False):
         return any(txin.is_segwit(guess_for_address=guess_for_address)
                    for txin in self.inputs())
@@ -1537,6 +1639,98 @@ class PartialTxOutput(TxOutput, PSBTSection):
         self._unknown.update(other_txout._unknown)
 
 
+def sign_sighash(privkey_bytes: bytes, pre_hash: bytes) -> str:
+    """Returns the hex signature (with SIGHASH_ALL byte) of a txin sighash.
+    Module-level, so that it can be run in a process pool.
+    """
+    privkey = ecc.ECPrivkey(privkey_bytes)
+    sig = privkey.sign_transaction(pre_hash)
+    sig = bh2u(sig) + '01'  # SIGHASH_ALL
+    return sig
+
+
+class SighashCache:
+    """Computes the signature hashes of the inputs of a transaction.
+
+    The parts of the preimages that do not depend on the input being signed
+    are serialized once: the BIP143 hashPrevouts/hashSequence/hashOutputs
+    for segwit inputs; and for legacy inputs the serialized inputs and
+    outputs, together with sha256 midstates of the preimage prefixes.
+    Only valid as long as the inputs and outputs of the tx do not change.
+    """
+
+    def __init__(self, tx: 'PartialTransaction'):
+        inputs = tx.inputs()
+        outputs = tx.outputs()
+        self.nVersion = bfh(int_to_hex(tx.version, 4))
+        self.nLocktime = bfh(int_to_hex(tx.locktime, 4))
+        self.prevouts = [txin.prevout.serialize_to_network() for txin in inputs]
+        self.sequences = [_STRUCT_UINT32.pack(txin.nsequence) for txin in inputs]
+        self.serialized_outputs = _compact_size(len(outputs)) + b''.join(o.serialize_to_network() for o in outputs)
+        self.hashPrevouts = sha256d(b''.join(self.prevouts))
+        self.hashSequence = sha256d(b''.join(self.sequences))
+        self.hashOutputs = sha256d(self.serialized_outputs[_compact_size_len(len(outputs)):])
+        # legacy only, filled lazily
+        self._txins_without_script = None  # type: Optional[List[bytes]]
+        self._midstates = None  # type: Optional[list]  # of hashlib sha256 objects
+
+    @classmethod
+    def _get_nhashtype(cls, txin: 'PartialTxInput') -> bytes:
+        sighash = txin.sighash if txin.sighash is not None else SIGHASH_ALL
+        if sighash != SIGHASH_ALL:
+            raise Exception("only SIGHASH_ALL signing is supported!")
+        return _STRUCT_UINT32.pack(sighash)
+
+    def _serialize_txin(self, txin_index: int, script_code: bytes) -> bytes:
+        return (self.prevouts[txin_index] + _compact_size(len(script_code)) + script_code
+                + self.sequences[txin_index])
+
+    def _get_txins_without_script(self) -> List[bytes]:
+        if self._txins_without_script is None:
+            self._txins_without_script = [prevout + b'\x00' + nsequence
+                                          for prevout, nsequence in zip(self.prevouts, self.sequences)]
+        return self._txins_without_script
+
+    def _get_midstate(self, txin_index: int):
+        """Returns the sha256 state after hashing the legacy preimage up to,
+        but excluding, the input at txin_index.
+        """
+        txins = self._get_txins_without_script()
+        if self._midstates is None:
+            self._midstates = [hashlib.sha256(self.nVersion + _compact_size(len(txins)))]
+        while len(self._midstates) <= txin_index:
+            h = self._midstates[-1].copy()
+            h.update(txins[len(self._midstates) - 1])
+            self._midstates.append(h)
+        return self._midstates[txin_index]
+
+    def serialize_preimage(self, txin_index: int, txin: 'PartialTxInput', script_code: bytes) -> bytes:
+        nHashType = self._get_nhashtype(txin)
+        if txin.is_segwit():
+            return (self.nVersion + self.hashPrevouts + self.hashSequence
+                    + self.prevouts[txin_index] + _compact_size(len(script_code)) + script_code
+                    + bfh(int_to_hex(txin.value_sats(), 8)) + self.sequences[txin_index]
+                    + self.hashOutputs + self.nLocktime + nHashType)
+        txins = self._get_txins_without_script()
+        return (self.nVersion + _compact_size(len(txins)) + b''.join(txins[:txin_index])
+                + self._serialize_txin(txin_index, script_code) + b''.join(txins[txin_index+1:])
+                + self.serialized_outputs + self.nLocktime + nHashType)
+
+    def get_sighash(self, txin_index: int, txin: 'PartialTxInput', script_code: bytes) -> bytes:
+        """Returns the hash that is signed for the input at txin_index,
+        i.e. sha256d(serialize_preimage(...)).
+        """
+        if txin.is_segwit():
+            return sha256d(self.serialize_preimage(txin_index, txin, script_code))
+        nHashType = self._get_nhashtype(txin)
+        txins = self._get_txins_without_script()
+        h = self._get_midstate(txin_index).copy()
+        h.update(self._serialize_txin(txin_index, script_code))
+        h.update(b''.join(txins[txin_index+1:]))
+        h.update(self.serialized_outputs + self.nLocktime + nHashType)
+        return hashlib.sha256(h.digest()).digest()
+
+
 class PartialTransaction(Transaction):
 
     def __init__(self):
@@ -1785,38 +1979,20 @@ class PartialTransaction(Transaction):
             return None
 
     def serialize_preimage(self, txin_index: int, *,
-                           bip143_shared_txdigest_fields: BIP143SharedTxDigestFields = None) -> str:
-        nVersion = int_to_hex(self.version, 4)
-        nLocktime = int_to_hex(self.locktime, 4)
-        inputs = self.inputs()
-        outputs = self.outputs()
-        txin = inputs[txin_index]
-        sighash = txin.sighash if txin.sighash is not None else SIGHASH_ALL
-        if sighash != SIGHASH_ALL:
-            raise Exception("only SIGHASH_ALL signing is supported!")
-        nHashType = int_to_hex(sighash, 4)
-        preimage_script = self.get_preimage_script(txin)
-        if txin.is_segwit():
-            if bip143_shared_txdigest_fields is None:
-                bip143_shared_txdigest_fields = self._calc_bip143_shared_txdigest_fields()
-            hashPrevouts = bip143_shared_txdigest_fields.hashPrevouts
-            hashSequence = bip143_shared_txdigest_fields.hashSequence
-            hashOutputs = bip143_shared_txdigest_fields.hashOutputs
-            outpoint = txin.prevout.serialize_to_network().hex()
-            scriptCode = var_int(len(preimage_script) // 2) + preimage_script
-            amount = int_to_hex(txin.value_sats(), 8)
-            nSequence = int_to_hex(txin.nsequence, 4)
-            preimage = nVersion + hashPrevouts + hashSequence + outpoint + scriptCode + amount + nSequence + hashOutputs + nLocktime + nHashType
-        else:
-            txins = var_int(len(inputs)) + ''.join(self.serialize_input(txin, preimage_script if txin_index==k else '')
-                                                   for k, txin in enumerate(inputs))
-            txouts = var_int(len(outputs)) + ''.join(o.serialize_to_network().hex() for o in outputs)
-            preimage = nVersion + txins + txouts + nLocktime + nHashType
-        return preimage
+                           sighash_cache: SighashCache = None) -> str:
+        if sighash_cache is None:
+            sighash_cache = SighashCache(self)
+        txin = self.inputs()[txin_index]
+        preimage_script = bfh(self.get_preimage_script(txin))
+        return sighash_cache.serialize_preimage(txin_index, txin, preimage_script).hex()
 
-    def sign(self, keypairs) -> None:
+    def sign(self, keypairs, *, executor: Executor = None) -> None:
         # keypairs:  pubkey_hex -> (secret_bytes, is_compressed)
-        bip143_shared_txdigest_fields = self._calc_bip143_shared_txdigest_fields()
+        sighash_cache = SighashCache(self)
+        if executor is not None:
+            # sighashes are computed here, ECDSA signing runs in the executor;
+            # the signatures are then added below, in the same order as without it
+            sigs = self._create_signatures_in_executor(keypairs, sighash_cache, executor)
         for i, txin in enumerate(self.inputs()):
             pubkeys = [pk.hex() for pk in txin.pubkeys]
             for pubkey in pubkeys:
@@ -1825,23 +2001,48 @@ class PartialTransaction(Transaction):
                 if pubkey not in keypairs:
                     continue
                 _logger.info(f"adding signature for {pubkey}")
-                sec, compressed = keypairs[pubkey]
-                sig = self.sign_txin(i, sec, bip143_shared_txdigest_fields=bip143_shared_txdigest_fields)
+                if executor is not None:
+                    sig = sigs[(i, pubkey)]
+                else:
+                    sec, compressed = keypairs[pubkey]
+                    sig = self.sign_txin(i, sec, sighash_cache=sighash_cache)
                 self.add_signature_to_txin(txin_idx=i, signing_pubkey=pubkey, sig=sig)
 
         _logger.debug(f"is_complete {self.is_complete()}")
         del keypairs
         self.invalidate_ser_cache()
 
-    def sign_txin(self, txin_index, privkey_bytes, *, bip143_shared_txdigest_fields=None) -> str:
+    def _create_signatures_in_executor(self, keypairs, sighash_cache: SighashCache,
+                                       executor: Executor) -> Dict[Tuple[int, str], str]:
+        """Returns (txin_index, pubkey_hex) -> sig, for all inputs that are
+        not complete yet and for all of their pubkeys in keypairs.
+        """
+        futures = {}
+        for i, txin in enumerate(self.inputs()):
+            if txin.is_complete():
+                continue
+            pre_hash = None
+            for pk in txin.pubkeys:
+                pubkey = pk.hex()
+                if pubkey not in keypairs:
+                    continue
+                if pre_hash is None:
+                    pre_hash = self._get_txin_sighash(i, sighash_cache=sighash_cache)
+                sec, compressed = keypairs[pubkey]
+                futures[(i, pubkey)] = executor.submit(sign_sighash, sec, pre_hash)
+        return {key: fut.result() for key, fut in futures.items()}
+
+    def _get_txin_sighash(self, txin_index: int, *, sighash_cache: SighashCache = None) -> bytes:
         txin = self.inputs()[txin_index]
         txin.validate_data(for_signing=True)
-        pre_hash = sha256d(bfh(self.serialize_preimage(txin_index,
-                                                       bip143_shared_txdigest_fields=bip143_shared_txdigest_fields)))
-        privkey = ecc.ECPrivkey(privkey_bytes)
-        sig = privkey.sign_transaction(pre_hash)
-        sig = bh2u(sig) + '01'  # SIGHASH_ALL
-        return sig
+        if sighash_cache is None:
+            sighash_cache = SighashCache(self)
+        preimage_script = bfh(self.get_preimage_script(txin))
+        return sighash_cache.get_sighash(txin_index, txin, preimage_script)
+
+    def sign_txin(self, txin_index, privkey_bytes, *, sighash_cache: SighashCache = None) -> str:
+        pre_hash = self._get_txin_sighash(txin_index, sighash_cache=sighash_cache)
+        return sign_sighash(privkey_bytes, pre_hash)
 
     def is_complete(self) -> bool:
         return all([txin.is_complete() for txin in self.inputs()])
@@ -1889,12 +2090,13 @@ class PartialTransaction(Transaction):
             return
         if len(self.inputs()) != len(signatures):
             raise Exception('expected {} signatures; got {}'.format(len(self.inputs()), len(signatures)))
+        sighash_cache = SighashCache(self)
         for i, txin in enumerate(self.inputs()):
             pubkeys = [pk.hex() for pk in txin.pubkeys]
             sig = signatures[i]
             if bfh(sig) in list(txin.part_sigs.values()):
                 continue
-            pre_hash = sha256d(bfh(self.serialize_preimage(i)))
+            pre_hash = sighash_cache.get_sighash(i, txin, bfh(self.get_preimage_script(txin)))
             sig_string = ecc.sig_string_from_der_sig(bfh(sig[:-2]))
             for recid in range(4):
                 try:
@@ -48,11 +48,9 @@ import secrets
 
 import attr
 import aiohttp
-from aiohttp_socks import ProxyConnector, ProxyType
 import aiorpcx
 from aiorpcx import TaskGroup
 import certifi
-import dns.resolver
 
 from .i18n import _
 from .logging import get_logger, Logger
@@ -1026,6 +1024,7 @@ def make_aiohttp_session(proxy: Optional[dict], headers=None, timeout=None):
     ssl_context = ssl.create_default_context(purpose=ssl.Purpose.SERVER_AUTH, cafile=ca_path)
 
     if proxy:
+        from aiohttp_socks import ProxyConnector, ProxyType
         connector = ProxyConnector(
             proxy_type=ProxyType.SOCKS5 if proxy['mode'] == 'socks5' else ProxyType.SOCKS4,
             host=proxy['host'],
@@ -1192,6 +1191,29 @@ class OrderedDictWithIndex(OrderedDict):
         return ret
 
 
+class LRUCache(OrderedDict):
+    """An OrderedDict that holds at most 'maxsize' items.
+    Setting an item, or reading it with get(), marks it as most recently used;
+    the least recently used item is evicted when the cache is full.
+    """
+
+    def __init__(self, *, maxsize: int):
+        super().__init__()
+        self.maxsize = maxsize
+
+    def get(self, key, default=None):
+        if key not in self:
+            return default
+        self.move_to_end(key)
+        return self[key]
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        while len(self) > self.maxsize:
+            self.popitem(last=False)
+
+
 def multisig_type(wallet_type):
     '''If wallet_type is mofn multi-sig, return [m, n],
     otherwise return None.'''
@@ -1234,6 +1256,7 @@ def list_enabled_bits(x: int) -> Sequence[int]:
 
 
 def resolve_dns_srv(host: str):
+    import dns.resolver
     srv_records = dns.resolver.resolve(host, 'SRV')
     # priority: prefer lower
     # weight: tie breaker; prefer higher
@@ -1411,6 +1434,24 @@ class JsonRPCClient:
                 text = await resp.text()
                 return 'Error: ' + str(text)
 
+    async def batch_request(self, calls: Sequence[Tuple[str, Sequence]]) -> list:
+        """Sends (endpoint, args) pairs as one JSON-RPC 2.0 batch.
+        Results are returned in the order of the calls.
+        """
+        first_id = self._id + 1
+        self._id += len(calls)
+        data = json.dumps([{"jsonrpc": "2.0", "id": str(first_id + i), "method": endpoint, "params": list(args)}
+                           for i, (endpoint, args) in enumerate(calls)])
+        async with self.session.post(self.url, data=data) as resp:
+            if resp.status != 200:
+                text = await resp.text()
+                return ['Error: ' + str(text)] * len(calls)
+            results = {}
+            for r in await resp.json():
+                error = r.get('error')
+                results[r.get('id')] = 'Error: ' + str(error) if error else r.get('result')
+        return [results.get(str(first_id + i)) for i in range(len(calls))]
+
     def add_method(self, endpoint):
         async def coro(*args):
             return await self.request(endpoint, *args)
@@ -89,6 +89,9 @@ class SPV(NetworkJobOnDefaultServer):
                 if tx_height < constants.net.max_checkpoint():
                     await self.taskgroup.spawn(self.network.request_chunk(tx_height, None, can_return_early=True))
                 continue
+            # another wallet of this process might have verified it already
+            if self._use_shared_verification(tx_hash, tx_height, header):
+                continue
             # request now
             self.logger.info(f'requested merkle {tx_hash}')
             self.requested_merkle.add(tx_hash)
@@ -115,11 +118,13 @@ class SPV(NetworkJobOnDefaultServer):
         # we need to wait if header sync/reorg is still ongoing, hence lock:
         async with self.network.bhi_lock:
             header = self.network.blockchain().read_header(tx_height)
+        verified = True
         try:
             verify_tx_is_in_block(tx_hash, merkle_branch, pos, header, tx_height)
         except MerkleVerificationFailure as e:
             if self.network.config.get("skipmerklecheck"):
                 self.logger.info(f"skipping merkle proof check {tx_hash}")
+                verified = False
             else:
                 self.logger.info(repr(e))
                 raise GracefulDisconnect(e) from e
@@ -132,7 +137,24 @@ class SPV(NetworkJobOnDefaultServer):
                               timestamp=header.get('timestamp'),
                               txpos=pos,
                               header_hash=header_hash)
+        if verified:
+            self.network.verified_tx_cache[tx_hash] = tx_info
+        self.wallet.add_verified_tx(tx_hash, tx_info)
+
+    def _use_shared_verification(self, tx_hash: str, tx_height: int, header: dict) -> bool:
+        """Marks tx_hash as verified if it was already verified in the block
+        'header' of our chain, for another wallet. Returns whether it did.
+        """
+        tx_info = self.network.verified_tx_cache.get(tx_hash)
+        if tx_info is None or tx_info.height != tx_height:
+            return False
+        # the block might have been reorged out since
+        if tx_info.header_hash != hash_header(header):
+            return False
+        self.merkle_roots[tx_hash] = header.get('merkle_root')
+        self.logger.info(f"verified {tx_hash} (shared)")
         self.wallet.add_verified_tx(tx_hash, tx_info)
+        return True
 
     @classmethod
     def hash_merkle_root(cls, merkle_branch: Sequence[str], tx_hash: str, leaf_pos_in_tree: int):
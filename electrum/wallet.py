@@ -38,6 +38,7 @@ import operator
 import math
 from functools import partial
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from numbers import Number
 from decimal import Decimal
 from typing import TYPE_CHECKING, List, Optional, Tuple, Union, NamedTuple, Sequence, Dict, Any, Set
@@ -62,7 +63,7 @@ from .bitcoin import is_address, address_to_script, is_minikey, relayfee, dust_t
 from .crypto import sha256d
 from . import keystore
 from .keystore import (load_keystore, Hardware_KeyStore, KeyStore, KeyStoreWithMPK,
-                       AddressIndexGeneric, CannotDerivePubkey)
+                       AddressIndexGeneric, CannotDerivePubkey, Software_KeyStore)
 from .util import multisig_type
 from .storage import StorageEncryptionVersion, WalletStorage
 from .wallet_db import WalletDB
@@ -88,6 +89,9 @@ if TYPE_CHECKING:
 
 _logger = get_logger(__name__)
 
+# with fewer inputs, starting the signing threads costs more than it saves
+MIN_INPUTS_TO_SIGN_IN_EXECUTOR = 20
+
 
 
 async def _append_utxos_to_inputs(*, inputs: List[PartialTxInput], network: 'Network',
@@ -292,15 +296,15 @@ class Abstract_Wallet(AddressSynchronizer, ABC):
         # a wallet may have channel backups, regardless of lnworker activation
         self.lnbackups = LNBackups(self)
 
-    def save_db(self):
+    def save_db(self, *, consolidate: bool = False):
         if self.storage:
-            self.db.write(self.storage)
+            self.db.write(self.storage, consolidate=consolidate)
 
     def save_backup(self):
         backup_dir = get_backup_dir(self.config)
         if backup_dir is None:
             return
-        new_db = WalletDB(self.db.dump(), manual_upgrades=False)
+        new_db = WalletDB(self.db.dump_as_json_wallet(), manual_upgrades=False)
 
         if self.lnworker:
             channel_backups = new_db.get_dict('channel_backups')
@@ -347,7 +351,9 @@ class Abstract_Wallet(AddressSynchronizer, ABC):
                 self.lnworker = None
             self.lnbackups.stop()
             self.lnbackups = None
-        self.save_db()
+        # fold the journal into the snapshot, so that the file is plain json again
+        self.save_db(consolidate=True)
+        self.db.close()
 
     def set_up_to_date(self, b):
         super().set_up_to_date(b)
@@ -462,7 +468,7 @@ class Abstract_Wallet(AddressSynchronizer, ABC):
         write_json_file(path, self.get_all_labels())
 
     def set_fiat_value(self, txid, ccy, text, fx, value_sat):
-        if not self.db.get_transaction(txid):
+        if not self.db.has_transaction(txid):
             return
         # since fx is inserting the thousands separator,
         # and not util, also have fx remove it
@@ -1727,11 +1733,19 @@ class Abstract_Wallet(AddressSynchronizer, ABC):
         # and full derivation paths as hw keystores might want them
         tmp_tx = copy.deepcopy(tx)
         tmp_tx.add_info_from_wallet(self, include_xpubs=True)
+        # opt-in: software keystores create the signatures of large txs in a thread pool
+        num_workers = self.config.get('sign_num_workers', 0)
+        use_executor = num_workers > 1 and len(tmp_tx.inputs()) >= MIN_INPUTS_TO_SIGN_IN_EXECUTOR
         # sign. start with ready keystores.
         for k in sorted(self.get_keystores(), key=lambda ks: ks.ready_to_sign(), reverse=True):
             try:
                 if k.can_sign(tmp_tx):
-                    k.sign_transaction(tmp_tx, password)
+                    if use_executor and isinstance(k, Software_KeyStore):
+                        with ThreadPoolExecutor(max_workers=num_workers,
+                                                thread_name_prefix='sign_tx_thread') as executor:
+                            k.sign_transaction(tmp_tx, password, executor=executor)
+                    else:
+                        k.sign_transaction(tmp_tx, password)
             except UserCancelled:
                 continue
         # remove sensitive info; then copy back details from temporary tx
@@ -2094,6 +2108,10 @@ class Abstract_Wallet(AddressSynchronizer, ABC):
                 enc_version = self.get_available_storage_encryption_version()
             else:
                 enc_version = StorageEncryptionVersion.PLAINTEXT
+            if (new_pw and enc_version != StorageEncryptionVersion.PLAINTEXT
+                    and not self.db.supports_storage_encryption()):
+                raise WalletFileException(_("This wallet keeps its history in an sqlite database, "
+                                            "which cannot be encrypted."))
             self.storage.set_password(new_pw, enc_version)
         # make sure next storage.write() saves changes
         self.db.set_modified(True)
@@ -2397,6 +2415,8 @@ class Imported_Wallet(Simple_Wallet):
                         transactions_new.add(tx_hash)
             transactions_to_remove -= transactions_new
             self.db.remove_addr_history(address)
+            # txs shared with other addresses lose this address' delta
+            self._history_cache.invalidate()
             for tx_hash in transactions_to_remove:
                 self.remove_transaction(tx_hash)
         self.set_label(address, None)
@@ -2588,6 +2608,14 @@ class Deterministic_Wallet(Abstract_Wallet):
         pubkeys = self.derive_pubkeys(for_change, n)
         return self.pubkeys_to_address(pubkeys)
 
+    def derive_addresses(self, for_change: int, start: int, stop: int) -> List[str]:
+        """Returns the addresses at (for_change, n), for n in range(start, stop)."""
+        for_change = int(for_change)
+        pubkeys_per_keystore = [k.derive_pubkeys(for_change, start, stop)
+                                for k in self.get_keystores()]
+        return [self.pubkeys_to_address([pk.hex() for pk in pubkeys])
+                for pubkeys in zip(*pubkeys_per_keystore)]
+
     def export_private_key_for_path(self, path: Union[Sequence[int], str], password: Optional[str]) -> str:
         if isinstance(path, str):
             path = convert_bip32_path_to_list_of_uint32(path)
@@ -2616,30 +2644,41 @@ class Deterministic_Wallet(Abstract_Wallet):
             txinout.bip32_paths[pubkey] = (fp_bytes, der_full)
 
     def create_new_address(self, for_change: bool = False):
+        assert type(for_change) is bool
+        return self.create_new_addresses(for_change, 1)[0]
+
+    def create_new_addresses(self, for_change: bool, count: int) -> List[str]:
         assert type(for_change) is bool
         with self.lock:
             n = self.db.num_change_addresses() if for_change else self.db.num_receiving_addresses()
-            address = self.derive_address(int(for_change), n)
-            self.db.add_change_address(address) if for_change else self.db.add_receiving_address(address)
-            self.add_address(address)
+            addresses = self.derive_addresses(int(for_change), n, n + count)
+            for address in addresses:
+                self.db.add_change_address(address) if for_change else self.db.add_receiving_address(address)
+                self.add_address(address)
             if for_change:
                 # note: if it's actually "old", it will get filtered later
-                self._not_old_change_addresses.append(address)
-            return address
+                self._not_old_change_addresses.extend(addresses)
+            return addresses
 
     def synchronize_sequence(self, for_change):
         limit = self.gap_limit_for_change if for_change else self.gap_limit
         while True:
             num_addr = self.db.num_change_addresses() if for_change else self.db.num_receiving_addresses()
             if num_addr < limit:
-                self.create_new_address(for_change)
+                self.create_new_addresses(for_change, limit - num_addr)
                 continue
             if for_change:
                 last_few_addresses = self.get_change_addresses(slice_start=-limit)
             else:
                 last_few_addresses = self.get_receiving_addresses(slice_start=-limit)
-            if any(map(self.address_is_old, last_few_addresses)):
-                self.create_new_address(for_change)
+            # new addresses are not old: create enough of them to push
+            # the last old address out of the window
+            num_new = 0
+            for i, address in enumerate(last_few_addresses):
+                if self.address_is_old(address):
+                    num_new = i + 1
+            if num_new:
+                self.create_new_addresses(for_change, num_new)
             else:
                 break
 
@@ -24,6 +24,7 @@
 # SOFTWARE.
 import os
 import ast
+import sys
 import json
 import copy
 import threading
@@ -32,14 +33,14 @@ from typing import Dict, Optional, List, Tuple, Set, Iterable, NamedTuple, Seque
 import binascii
 
 from . import util, bitcoin
-from .util import profiler, WalletFileException, multisig_type, TxMinedInfo, bfh
+from .util import profiler, WalletFileException, multisig_type, TxMinedInfo, bfh, LRUCache
 from .invoices import PR_TYPE_ONCHAIN, Invoice
 from .keystore import bip44_derivation
 from .transaction import Transaction, TxOutpoint, tx_from_any, PartialTransaction, PartialTxOutput
 from .logging import Logger
 from .lnutil import LOCAL, REMOTE, FeeUpdate, UpdateAddHtlc, LocalConfig, RemoteConfig, Keypair, OnlyPubkeyKeypair, RevocationStore, ChannelBackupStorage
 from .lnutil import ChannelConstraints, Outpoint, ShachainElement
-from .json_db import StoredDict, JsonDB, locked, modifier
+from .json_db import StoredDict, JsonDB, locked, modifier, split_journal, apply_journal_record
 from .plugin import run_hook, plugin_loaders
 from .paymentrequest import PaymentRequest
 from .submarine_swaps import SwapData
@@ -55,6 +56,14 @@ NEW_SEED_VERSION = 11       # electrum versions >= 2.0
 FINAL_SEED_VERSION = 33     # electrum >= 2.7 will set this to prevent
                             # old versions from overwriting new format
 
+# number of parsed Transaction objects kept in memory
+TX_CACHE_SIZE = 1000
+
+
+def is_partial_raw_tx(raw: str) -> bool:
+    # partial txs are stored as base64 PSBT (or hex, by older versions)
+    return raw[:6] == 'cHNidP' or raw[:10] == '70736274ff'
+
 
 class TxFeesValue(NamedTuple):
     fee: Optional[int] = None
@@ -68,6 +77,10 @@ class WalletDB(JsonDB):
         JsonDB.__init__(self, {})
         self._manual_upgrades = manual_upgrades
         self._called_after_upgrade_tasks = False
+        # set when the data was changed in ways the journal does not track
+        self._requires_snapshot = False
+        # txid -> Transaction, for txs that were parsed or added recently
+        self._parsed_txs = LRUCache(maxsize=TX_CACHE_SIZE)  # type: Dict[str, Transaction]
         if raw:  # loading existing db
             self.load_data(raw)
             self.load_plugins()
@@ -76,8 +89,11 @@ class WalletDB(JsonDB):
             self._after_upgrade_tasks()
 
     def load_data(self, s):
+        s, journal = split_journal(s)
         try:
             self.data = json.loads(s)
+            for record in journal:
+                apply_journal_record(self.data, record)
         except:
             try:
                 d = ast.literal_eval(s)
@@ -85,6 +101,7 @@ class WalletDB(JsonDB):
             except Exception as e:
                 raise WalletFileException("Cannot read wallet file. (parsing failed)")
             self.data = {}
+            self._requires_snapshot = True
             for key, value in d.items():
                 try:
                     json.dumps(key)
@@ -154,6 +171,7 @@ class WalletDB(JsonDB):
     @profiler
     def upgrade(self):
         self.logger.info('upgrading wallet format')
+        self._requires_snapshot = True
         if self._called_after_upgrade_tasks:
             # we need strict ordering between upgrade() and after_upgrade_tasks()
             raise Exception("'after_upgrade_tasks' must NOT be called before 'upgrade'")
@@ -905,6 +923,7 @@ class WalletDB(JsonDB):
         if scripthash not in self._prevouts_by_scripthash:
             self._prevouts_by_scripthash[scripthash] = set()
         self._prevouts_by_scripthash[scripthash].add((prevout.to_str(), value))
+        self.record_change(['prevouts_by_scripthash', scripthash])
 
     @modifier
     def remove_prevout_by_scripthash(self, scripthash: str, *, prevout: TxOutpoint, value: int) -> None:
@@ -912,6 +931,7 @@ class WalletDB(JsonDB):
         assert isinstance(prevout, TxOutpoint)
         assert isinstance(value, int)
         self._prevouts_by_scripthash[scripthash].discard((prevout.to_str(), value))
+        self.record_change(['prevouts_by_scripthash', scripthash])
         if not self._prevouts_by_scripthash[scripthash]:
             self._prevouts_by_scripthash.pop(scripthash)
 
@@ -931,21 +951,40 @@ class WalletDB(JsonDB):
         if tx_hash != tx.txid():
             raise Exception(f"trying to add tx to db with inconsistent txid: {tx_hash} != {tx.txid()}")
         # don't allow overwriting complete tx with partial tx
-        tx_we_already_have = self.transactions.get(tx_hash, None)
-        if tx_we_already_have is None or isinstance(tx_we_already_have, PartialTransaction):
-            self.transactions[tx_hash] = tx
+        raw_we_already_have = self.transactions.get(tx_hash, None)
+        if raw_we_already_have is None or is_partial_raw_tx(raw_we_already_have):
+            # interned, so that wallets with a tx in common share its raw string
+            self.transactions[tx_hash] = sys.intern(tx.serialize())
+            self._parsed_txs[tx_hash] = tx
 
     @modifier
     def remove_transaction(self, tx_hash: str) -> Optional[Transaction]:
         assert isinstance(tx_hash, str)
-        return self.transactions.pop(tx_hash, None)
+        tx = self._parsed_txs.pop(tx_hash, None)
+        raw = self.transactions.pop(tx_hash, None)
+        if raw is None:
+            return None
+        return tx or tx_from_any(raw, deserialize=False)
 
     @locked
     def get_transaction(self, tx_hash: Optional[str]) -> Optional[Transaction]:
         if tx_hash is None:
             return None
         assert isinstance(tx_hash, str)
-        return self.transactions.get(tx_hash)
+        tx = self._parsed_txs.get(tx_hash)
+        if tx is None:
+            raw = self.transactions.get(tx_hash)
+            if raw is None:
+                return None
+            # note: for performance, "deserialize=False" so that we will deserialize on-demand
+            tx = tx_from_any(raw, deserialize=False)
+            self._parsed_txs[tx_hash] = tx
+        return tx
+
+    @locked
+    def has_transaction(self, tx_hash: str) -> bool:
+        assert isinstance(tx_hash, str)
+        return tx_hash in self.transactions
 
     @locked
     def list_transactions(self) -> Sequence[str]:
@@ -1096,12 +1135,14 @@ class WalletDB(JsonDB):
         assert isinstance(addr, str)
         self._addr_to_addr_index[addr] = (1, len(self.change_addresses))
         self.change_addresses.append(addr)
+        self.record_change(['addresses', 'change'])
 
     @modifier
     def add_receiving_address(self, addr: str) -> None:
         assert isinstance(addr, str)
         self._addr_to_addr_index[addr] = (0, len(self.receiving_addresses))
         self.receiving_addresses.append(addr)
+        self.record_change(['addresses', 'receiving'])
 
     @locked
     def get_address_index(self, address: str) -> Optional[Sequence[int]]:
@@ -1158,7 +1199,7 @@ class WalletDB(JsonDB):
         self.txi = self.get_dict('txi')                          # type: Dict[str, Dict[str, Dict[str, int]]]
         # txid -> address -> output_index -> (value, is_coinbase)
         self.txo = self.get_dict('txo')                          # type: Dict[str, Dict[str, Dict[str, Tuple[int, bool]]]]
-        self.transactions = self.get_dict('transactions')        # type: Dict[str, Transaction]
+        self.transactions = self.get_dict('transactions')        # type: Dict[str, str]
         self.spent_outpoints = self.get_dict('spent_outpoints')  # txid -> output_index -> next_txid
         self.history = self.get_dict('addr_history')             # address -> list of (txid, height)
         self.verified_tx = self.get_dict('verified_tx3')         # txid -> (height, timestamp, txpos, header_hash)
@@ -1184,16 +1225,17 @@ class WalletDB(JsonDB):
         self.txo.clear()
         self.spent_outpoints.clear()
         self.transactions.clear()
+        self._parsed_txs.clear()
         self.history.clear()
         self.verified_tx.clear()
         self.tx_fees.clear()
         self._prevouts_by_scripthash.clear()
 
     def _convert_dict(self, path, key, v):
+        # note: 'transactions' are kept as raw strings, and parsed in get_transaction
         if key == 'transactions':
-            # note: for performance, "deserialize=False" so that we will deserialize these on-demand
-            v = dict((k, tx_from_any(x, deserialize=False)) for k, x in v.items())
-        if key == 'invoices':
+            v = dict((k, sys.intern(x)) for k, x in v.items())
+        elif key == 'invoices':
             v = dict((k, Invoice.from_json(x)) for k, x in v.items())
         if key == 'payment_requests':
             v = dict((k, Invoice.from_json(x)) for k, x in v.items())
@@ -1234,21 +1276,53 @@ class WalletDB(JsonDB):
             return False
         return True
 
-    def write(self, storage: 'WalletStorage'):
+    def write(self, storage: 'WalletStorage', *, consolidate: bool = False):
+        """Saves changes. Normally only the changed paths are appended to the
+        file as a journal record; a full snapshot is written if 'consolidate'
+        is set, or once the journal has grown larger than the snapshot.
+        """
         with self.lock:
-            self._write(storage)
+            self._write(storage, consolidate=consolidate)
 
     @profiler
-    def _write(self, storage: 'WalletStorage'):
+    def _write(self, storage: 'WalletStorage', *, consolidate: bool = False):
         if threading.currentThread().isDaemon():
             self.logger.warning('daemon thread cannot write db')
             return
+        if consolidate and storage.journal_size():
+            self.set_modified(True)
         if not self.modified():
             return
-        json_str = self.dump(human_readable=not storage.is_encrypted())
-        storage.write(json_str)
+        if (not consolidate
+                and self._called_after_upgrade_tasks
+                and not self._requires_snapshot
+                and storage.can_append()
+                and storage.journal_size() < storage.snapshot_size()):
+            record = self.dump_pending_changes()
+            if record is not None:
+                storage.append(record)
+        else:
+            json_str = self.dump(human_readable=not storage.is_encrypted())
+            storage.write(json_str)
+            self._requires_snapshot = False
+        self.clear_pending_changes()
         self.set_modified(False)
 
+    def dump_as_json_wallet(self) -> str:
+        """Serializes the db as a json wallet file. Unlike dump, this includes
+        data kept outside of the json, see SqliteWalletDB.
+        """
+        return self.dump()
+
+    def supports_storage_encryption(self) -> bool:
+        return True
+
+    def close(self) -> None:
+        """Releases resources held outside of the json, see SqliteWalletDB.
+        Called when the wallet is stopped, after the db was written.
+        """
+        pass
+
     def is_ready_to_be_used_by_wallet(self):
         return not self.requires_upgrade() and self._called_after_upgrade_tasks
 
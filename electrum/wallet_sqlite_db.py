@@ -0,0 +1,579 @@
+#!/usr/bin/env python
+#
+# Electrum - lightweight Bitcoin client
+# Copyright (C) 2020 The Electrum Developers
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import json
+import sqlite3
+from collections import defaultdict
+from typing import Dict, Optional, List, Tuple, Iterable, Sequence, Set, Union, TYPE_CHECKING
+
+from .json_db import StoredDict, locked, modifier
+from .logging import get_logger
+from .transaction import Transaction, TxOutpoint, tx_from_any
+from .util import TxMinedInfo, profiler, test_read_write_permissions, WalletFileException
+from .wallet_db import WalletDB, TxFeesValue, is_partial_raw_tx
+
+if TYPE_CHECKING:
+    from .storage import WalletStorage
+    from .simple_config import SimpleConfig
+
+
+# keys of the json db that SqliteWalletDB keeps in sqlite instead
+SQLITE_TABLE_KEYS = (
+    'transactions', 'txi', 'txo', 'addr_history', 'spent_outpoints',
+    'prevouts_by_scripthash', 'verified_tx3', 'tx_fees',
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS transactions (txid TEXT PRIMARY KEY, raw TEXT NOT NULL, is_partial INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS txi (txid TEXT, addr TEXT, prevout TEXT, value INTEGER, PRIMARY KEY (txid, addr, prevout));
+CREATE TABLE IF NOT EXISTS txo (txid TEXT, addr TEXT, n INTEGER, value INTEGER, is_coinbase INTEGER, PRIMARY KEY (txid, addr, n));
+CREATE TABLE IF NOT EXISTS addr_history (addr TEXT PRIMARY KEY, hist TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS spent_outpoints (prevout_hash TEXT, prevout_n TEXT, spending_txid TEXT, PRIMARY KEY (prevout_hash, prevout_n));
+CREATE INDEX IF NOT EXISTS spent_outpoints_by_spender ON spent_outpoints (spending_txid);
+CREATE TABLE IF NOT EXISTS prevouts_by_scripthash (scripthash TEXT, prevout TEXT, value INTEGER, PRIMARY KEY (scripthash, prevout, value));
+CREATE TABLE IF NOT EXISTS verified_tx (txid TEXT PRIMARY KEY, height INTEGER, timestamp INTEGER, txpos INTEGER, header_hash TEXT);
+CREATE TABLE IF NOT EXISTS tx_fees (txid TEXT PRIMARY KEY, fee INTEGER, is_calculated_by_us INTEGER, num_inputs INTEGER);
+"""
+
+
+# random id, stored in the wallet file and in the sqlite db,
+# so that we only use an sqlite db created for this wallet file
+SQLITE_DB_ID_KEY = 'sqlite_db_id'
+
+_logger = get_logger(__name__)
+
+
+class SqliteDBMismatch(WalletFileException):
+    """The sqlite db next to the wallet file was created for another wallet file."""
+
+
+def get_sqlite_path(wallet_path: str) -> str:
+    return wallet_path + '.sqlite'
+
+
+def move_sqlite_db_aside(sqlite_path: str) -> str:
+    """Renames an sqlite db that does not belong to its wallet file.
+    Returns the new path.
+    """
+    new_path = sqlite_path + '.orphaned'
+    i = 1
+    while os.path.exists(new_path):
+        new_path = f'{sqlite_path}.orphaned{i}'
+        i += 1
+    os.rename(sqlite_path, new_path)
+    return new_path
+
+
+def open_wallet_db(storage: 'WalletStorage', *, manual_upgrades: bool,
+                   config: 'SimpleConfig') -> WalletDB:
+    """Returns a SqliteWalletDB if the wallet already has an sqlite database,
+    or if the config asks for one (this migrates the wallet), else a WalletDB.
+    Encrypted wallets are not migrated, as sqlite files are not encrypted.
+    """
+    sqlite_path = get_sqlite_path(storage.path)
+    if os.path.exists(sqlite_path):
+        try:
+            return SqliteWalletDB(storage.read(), manual_upgrades=manual_upgrades, path=sqlite_path)
+        except SqliteDBMismatch:
+            # e.g. left behind by a deleted wallet, or the wallet file was restored from a backup
+            new_path = move_sqlite_db_aside(sqlite_path)
+            _logger.warning(f"{sqlite_path} belongs to another wallet file, moved it to {new_path}")
+    if config.get('wallet_db_backend') == 'sqlite':
+        if not storage.is_encrypted():
+            return SqliteWalletDB(storage.read(), manual_upgrades=manual_upgrades, path=sqlite_path)
+        _logger.warning(f"not using sqlite for {storage.path}: the wallet file is encrypted")
+    return WalletDB(storage.read(), manual_upgrades=manual_upgrades)
+
+
+class SqliteWalletDB(WalletDB):
+    """WalletDB that keeps transactions and the tables derived from them in an
+    sqlite database next to the wallet file, and only loads rows on demand.
+    Everything else (keystores, addresses, labels, channels...) stays in json.
+
+    Changes to the sqlite tables are committed when the db is written.
+    Sqlite files are not encrypted, so this is not used for encrypted wallets.
+    """
+
+    def __init__(self, raw, *, manual_upgrades: bool, path: str):
+        self.sqlite_path = path
+        self.conn = None  # type: Optional[sqlite3.Connection]
+        WalletDB.__init__(self, raw, manual_upgrades=manual_upgrades)
+
+    def _open_sqlite(self):
+        if not os.path.exists(self.sqlite_path):
+            open(self.sqlite_path, 'a').close()
+        test_read_write_permissions(self.sqlite_path)
+        # all access is serialized by self.lock
+        self.conn = sqlite3.connect(self.sqlite_path, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+    @profiler
+    def _load_transactions(self):
+        # split off the tables before they would be converted to StoredDicts
+        tables = {key: self.data.pop(key) for key in SQLITE_TABLE_KEYS if key in self.data}
+        self.data = StoredDict(self.data, self, [])
+        self._open_sqlite()
+        db_id = self._get_meta(SQLITE_DB_ID_KEY)
+        if self.conn.execute("SELECT COUNT(*) FROM meta").fetchone()[0] == 0:
+            # nothing was committed yet
+            self._migrate_from_json(tables)
+        elif db_id is None or db_id != self.data.get(SQLITE_DB_ID_KEY):
+            self.conn.close()
+            self.conn = None
+            raise SqliteDBMismatch(f"{self.sqlite_path} belongs to another wallet file")
+        elif tables:
+            # a crash between committing sqlite and writing json
+            self.logger.info("sqlite db is authoritative, dropping tables from json")
+        if tables:
+            self._requires_snapshot = True
+            self.set_modified(True)
+        self._history_addrs = {addr for (addr,) in self.conn.execute("SELECT addr FROM addr_history")}
+        # remove unreferenced tx
+        cur = self.conn.execute(
+            "DELETE FROM transactions WHERE txid NOT IN (SELECT txid FROM txi) "
+            "AND txid NOT IN (SELECT txid FROM txo)")
+        if cur.rowcount:
+            self.logger.info(f"removed {cur.rowcount} unreferenced txs")
+        # remove unreferenced outpoints
+        cur = self.conn.execute(
+            "DELETE FROM spent_outpoints WHERE spending_txid NOT IN (SELECT txid FROM transactions)")
+        if cur.rowcount:
+            self.logger.info(f"removed {cur.rowcount} unreferenced spent outpoints")
+
+    def _get_meta(self, key: str) -> Optional[str]:
+        row = self.conn.execute("SELECT value FROM meta WHERE key=?", (key,)).fetchone()
+        return row[0] if row else None
+
+    @profiler
+    def _migrate_from_json(self, tables: Dict[str, dict]) -> None:
+        """Moves the tables of a json wallet into sqlite, in one sqlite transaction."""
+        c = self.conn
+        c.executemany("INSERT OR REPLACE INTO transactions VALUES (?,?,?)", (
+            (txid, raw, int(is_partial_raw_tx(raw)))
+            for txid, raw in tables.get('transactions', {}).items()))
+        c.executemany("INSERT OR REPLACE INTO txi VALUES (?,?,?,?)", (
+            (txid, addr, ser, v)
+            for txid, d in tables.get('txi', {}).items()
+            for addr, d2 in d.items()
+            for ser, v in d2.items()))
+        c.executemany("INSERT OR REPLACE INTO txo VALUES (?,?,?,?,?)", (
+            (txid, addr, int(n), v, int(cb))
+            for txid, d in tables.get('txo', {}).items()
+            for addr, d2 in d.items()
+            for n, (v, cb) in d2.items()))
+        c.executemany("INSERT OR REPLACE INTO addr_history VALUES (?,?)", (
+            (addr, json.dumps(hist))
+            for addr, hist in tables.get('addr_history', {}).items()))
+        c.executemany("INSERT OR REPLACE INTO spent_outpoints VALUES (?,?,?)", (
+            (prevout_hash, prevout_n, spending_txid)
+            for prevout_hash, d in tables.get('spent_outpoints', {}).items()
+            for prevout_n, spending_txid in d.items()))
+        c.executemany("INSERT OR REPLACE INTO prevouts_by_scripthash VALUES (?,?,?)", (
+            (scripthash, prevout, value)
+            for scripthash, l in tables.get('prevouts_by_scripthash', {}).items()
+            for prevout, value in l))
+        c.executemany("INSERT OR REPLACE INTO verified_tx VALUES (?,?,?,?,?)", (
+            (txid, height, timestamp, txpos, header_hash)
+            for txid, (height, timestamp, txpos, header_hash) in tables.get('verified_tx3', {}).items()))
+        c.executemany("INSERT OR REPLACE INTO tx_fees VALUES (?,?,?,?)", (
+            (txid, *TxFeesValue(*x))
+            for txid, x in tables.get('tx_fees', {}).items()))
+        db_id = os.urandom(16).hex()
+        c.execute("INSERT OR REPLACE INTO meta VALUES (?,?)", (SQLITE_DB_ID_KEY, db_id))
+        # written to the wallet file after sqlite is committed. If we crash
+        # in between, the sqlite db is not used, and the json tables are migrated again.
+        self.data[SQLITE_DB_ID_KEY] = db_id
+        num_txs = len(tables.get('transactions', {}))
+        self.logger.info(f"migrated {num_txs} transactions from json to sqlite")
+
+    def _write(self, storage: 'WalletStorage', *, consolidate: bool = False):
+        # commit sqlite first: if we crash in between, the json leftovers
+        # from a migration are dropped on the next load
+        if self.conn and self.conn.in_transaction:
+            self.conn.commit()
+        WalletDB._write(self, storage, consolidate=consolidate)
+
+    def supports_storage_encryption(self) -> bool:
+        # the sqlite file would keep the history in plaintext
+        return False
+
+    @locked
+    def dump_as_json_wallet(self) -> str:
+        data = json.loads(self.dump(human_readable=False))
+        data.pop(SQLITE_DB_ID_KEY, None)
+        data.update(self._dump_tables())
+        return json.dumps(data, indent=4, sort_keys=True)
+
+    def _dump_tables(self) -> dict:
+        """Returns the sqlite tables in the format of the json db."""
+        c = self.conn
+        txi = defaultdict(lambda: defaultdict(dict))
+        for txid, addr, ser, v in c.execute("SELECT txid, addr, prevout, value FROM txi"):
+            txi[txid][addr][ser] = v
+        txo = defaultdict(lambda: defaultdict(dict))
+        for txid, addr, n, v, cb in c.execute("SELECT txid, addr, n, value, is_coinbase FROM txo"):
+            txo[txid][addr][str(n)] = (v, bool(cb))
+        spent_outpoints = defaultdict(dict)
+        for prevout_hash, prevout_n, spending_txid in c.execute("SELECT * FROM spent_outpoints"):
+            spent_outpoints[prevout_hash][prevout_n] = spending_txid
+        prevouts_by_scripthash = defaultdict(list)
+        for scripthash, prevout, value in c.execute("SELECT * FROM prevouts_by_scripthash"):
+            prevouts_by_scripthash[scripthash].append((prevout, value))
+        return {
+            'transactions': dict(c.execute("SELECT txid, raw FROM transactions")),
+            'txi': txi,
+            'txo': txo,
+            'addr_history': {addr: json.loads(hist) for addr, hist in c.execute("SELECT * FROM addr_history")},
+            'spent_outpoints': spent_outpoints,
+            'prevouts_by_scripthash': prevouts_by_scripthash,
+            'verified_tx3': {txid: (height, timestamp, txpos, header_hash)
+                             for txid, height, timestamp, txpos, header_hash in c.execute("SELECT * FROM verified_tx")},
+            'tx_fees': {txid: (fee, bool(is_calculated_by_us), num_inputs)
+                        for txid, fee, is_calculated_by_us, num_inputs in c.execute("SELECT * FROM tx_fees")},
+        }
+
+    @locked
+    def close(self) -> None:
+        if self.conn:
+            self.conn.commit()
+            self.conn.close()
+            self.conn = None
+
+    # txi / txo
+
+    @locked
+    def get_txi_addresses(self, tx_hash: str) -> List[str]:
+        assert isinstance(tx_hash, str)
+        return [addr for (addr,) in self.conn.execute(
+            "SELECT DISTINCT addr FROM txi WHERE txid=?", (tx_hash,))]
+
+    @locked
+    def get_txo_addresses(self, tx_hash: str) -> List[str]:
+        assert isinstance(tx_hash, str)
+        return [addr for (addr,) in self.conn.execute(
+            "SELECT DISTINCT addr FROM txo WHERE txid=?", (tx_hash,))]
+
+    @locked
+    def get_txi_addr(self, tx_hash: str, address: str) -> Iterable[Tuple[str, int]]:
+        assert isinstance(tx_hash, str)
+        assert isinstance(address, str)
+        return self.conn.execute(
+            "SELECT prevout, value FROM txi WHERE txid=? AND addr=?", (tx_hash, address)).fetchall()
+
+    @locked
+    def get_txo_addr(self, tx_hash: str, address: str) -> Dict[int, Tuple[int, bool]]:
+        assert isinstance(tx_hash, str)
+        assert isinstance(address, str)
+        return {n: (v, bool(cb)) for n, v, cb in self.conn.execute(
+            "SELECT n, value, is_coinbase FROM txo WHERE txid=? AND addr=?", (tx_hash, address))}
+
+    @modifier
+    def add_txi_addr(self, tx_hash: str, addr: str, ser: str, v: int) -> None:
+        assert isinstance(tx_hash, str)
+        assert isinstance(addr, str)
+        assert isinstance(ser, str)
+        assert isinstance(v, int)
+        self.conn.execute("INSERT OR REPLACE INTO txi VALUES (?,?,?,?)", (tx_hash, addr, ser, v))
+
+    @modifier
+    def add_txo_addr(self, tx_hash: str, addr: str, n: Union[int, str], v: int, is_coinbase: bool) -> None:
+        n = int(n)
+        assert isinstance(tx_hash, str)
+        assert isinstance(addr, str)
+        assert isinstance(v, int)
+        assert isinstance(is_coinbase, bool)
+        self.conn.execute("INSERT OR REPLACE INTO txo VALUES (?,?,?,?,?)", (tx_hash, addr, n, v, int(is_coinbase)))
+
+    @locked
+    def list_txi(self) -> Sequence[str]:
+        return [txid for (txid,) in self.conn.execute("SELECT DISTINCT txid FROM txi")]
+
+    @locked
+    def list_txo(self) -> Sequence[str]:
+        return [txid for (txid,) in self.conn.execute("SELECT DISTINCT txid FROM txo")]
+
+    @modifier
+    def remove_txi(self, tx_hash: str) -> None:
+        assert isinstance(tx_hash, str)
+        self.conn.execute("DELETE FROM txi WHERE txid=?", (tx_hash,))
+
+    @modifier
+    def remove_txo(self, tx_hash: str) -> None:
+        assert isinstance(tx_hash, str)
+        self.conn.execute("DELETE FROM txo WHERE txid=?", (tx_hash,))
+
+    # spent outpoints
+
+    @locked
+    def list_spent_outpoints(self) -> Sequence[Tuple[str, str]]:
+        return self.conn.execute("SELECT prevout_hash, prevout_n FROM spent_outpoints").fetchall()
+
+    @locked
+    def get_spent_outpoints(self, prevout_hash: str) -> Sequence[str]:
+        assert isinstance(prevout_hash, str)
+        return [n for (n,) in self.conn.execute(
+            "SELECT prevout_n FROM spent_outpoints WHERE prevout_hash=?", (prevout_hash,))]
+
+    @locked
+    def get_spent_outpoint(self, prevout_hash: str, prevout_n: Union[int, str]) -> Optional[str]:
+        assert isinstance(prevout_hash, str)
+        row = self.conn.execute(
+            "SELECT spending_txid FROM spent_outpoints WHERE prevout_hash=? AND prevout_n=?",
+            (prevout_hash, str(prevout_n))).fetchone()
+        return row[0] if row else None
+
+    @modifier
+    def remove_spent_outpoint(self, prevout_hash: str, prevout_n: Union[int, str]) -> None:
+        assert isinstance(prevout_hash, str)
+        self.conn.execute("DELETE FROM spent_outpoints WHERE prevout_hash=? AND prevout_n=?",
+                          (prevout_hash, str(prevout_n)))
+
+    @modifier
+    def set_spent_outpoint(self, prevout_hash: str, prevout_n: Union[int, str], tx_hash: str) -> None:
+        assert isinstance(prevout_hash, str)
+        assert isinstance(tx_hash, str)
+        self.conn.execute("INSERT OR REPLACE INTO spent_outpoints VALUES (?,?,?)",
+                          (prevout_hash, str(prevout_n), tx_hash))
+
+    # prevouts by scripthash
+
+    @modifier
+    def add_prevout_by_scripthash(self, scripthash: str, *, prevout: TxOutpoint, value: int) -> None:
+        assert isinstance(scripthash, str)
+        assert isinstance(prevout, TxOutpoint)
+        assert isinstance(value, int)
+        self.conn.execute("INSERT OR IGNORE INTO prevouts_by_scripthash VALUES (?,?,?)",
+                          (scripthash, prevout.to_str(), value))
+
+    @modifier
+    def remove_prevout_by_scripthash(self, scripthash: str, *, prevout: TxOutpoint, value: int) -> None:
+        assert isinstance(scripthash, str)
+        assert isinstance(prevout, TxOutpoint)
+        assert isinstance(value, int)
+        self.conn.execute("DELETE FROM prevouts_by_scripthash WHERE scripthash=? AND prevout=? AND value=?",
+                          (scripthash, prevout.to_str(), value))
+
+    @locked
+    def get_prevouts_by_scripthash(self, scripthash: str) -> Set[Tuple[TxOutpoint, int]]:
+        assert isinstance(scripthash, str)
+        return {(TxOutpoint.from_str(prevout), value) for prevout, value in self.conn.execute(
+            "SELECT prevout, value FROM prevouts_by_scripthash WHERE scripthash=?", (scripthash,))}
+
+    # transactions
+
+    @modifier
+    def add_transaction(self, tx_hash: str, tx: Transaction) -> None:
+        assert isinstance(tx_hash, str)
+        assert isinstance(tx, Transaction), tx
+        # note that tx might be a PartialTransaction
+        if not tx_hash:
+            raise Exception("trying to add tx to db without txid")
+        if tx_hash != tx.txid():
+            raise Exception(f"trying to add tx to db with inconsistent txid: {tx_hash} != {tx.txid()}")
+        # don't allow overwriting complete tx with partial tx
+        row = self.conn.execute("SELECT is_partial FROM transactions WHERE txid=?", (tx_hash,)).fetchone()
+        if row is None or row[0]:
+            raw = tx.serialize()
+            self.conn.execute("INSERT OR REPLACE INTO transactions VALUES (?,?,?)",
+                              (tx_hash, raw, int(is_partial_raw_tx(raw))))
+            self._parsed_txs[tx_hash] = tx
+
+    @modifier
+    def remove_transaction(self, tx_hash: str) -> Optional[Transaction]:
+        assert isinstance(tx_hash, str)
+        tx = self.get_transaction(tx_hash)
+        if tx is not None:
+            self.conn.execute("DELETE FROM transactions WHERE txid=?", (tx_hash,))
+            self._parsed_txs.pop(tx_hash, None)
+        return tx
+
+    @locked
+    def get_transaction(self, tx_hash: Optional[str]) -> Optional[Transaction]:
+        if tx_hash is None:
+            return None
+        assert isinstance(tx_hash, str)
+        tx = self._parsed_txs.get(tx_hash)
+        if tx is None:
+            row = self.conn.execute("SELECT raw FROM transactions WHERE txid=?", (tx_hash,)).fetchone()
+            if row is None:
+                return None
+            tx = tx_from_any(row[0], deserialize=False)
+            self._parsed_txs[tx_hash] = tx
+        return tx
+
+    @locked
+    def has_transaction(self, tx_hash: str) -> bool:
+        assert isinstance(tx_hash, str)
+        return self.conn.execute("SELECT 1 FROM transactions WHERE txid=?", (tx_hash,)).fetchone() is not None
+
+    @locked
+    def list_transactions(self) -> Sequence[str]:
+        return [txid for (txid,) in self.conn.execute("SELECT txid FROM transactions")]
+
+    # address history
+
+    @locked
+    def get_history(self) -> Sequence[str]:
+        return list(self._history_addrs)
+
+    def is_addr_in_history(self, addr: str) -> bool:
+        # does not mean history is non-empty!
+        assert isinstance(addr, str)
+        return addr in self._history_addrs
+
+    @locked
+    def get_addr_history(self, addr: str) -> Sequence[Tuple[str, int]]:
+        assert isinstance(addr, str)
+        row = self.conn.execute("SELECT hist FROM addr_history WHERE addr=?", (addr,)).fetchone()
+        if row is None:
+            return []
+        return [tuple(item) for item in json.loads(row[0])]
+
+    @modifier
+    def set_addr_history(self, addr: str, hist) -> None:
+        assert isinstance(addr, str)
+        self.conn.execute("INSERT OR REPLACE INTO addr_history VALUES (?,?)", (addr, json.dumps(hist)))
+        self._history_addrs.add(addr)
+
+    @modifier
+    def remove_addr_history(self, addr: str) -> None:
+        assert isinstance(addr, str)
+        self.conn.execute("DELETE FROM addr_history WHERE addr=?", (addr,))
+        self._history_addrs.discard(addr)
+
+    # verified txs
+
+    @locked
+    def list_verified_tx(self) -> Sequence[str]:
+        return [txid for (txid,) in self.conn.execute("SELECT txid FROM verified_tx")]
+
+    @locked
+    def get_verified_tx(self, txid: str) -> Optional[TxMinedInfo]:
+        assert isinstance(txid, str)
+        row = self.conn.execute(
+            "SELECT height, timestamp, txpos, header_hash FROM verified_tx WHERE txid=?", (txid,)).fetchone()
+        if row is None:
+            return None
+        height, timestamp, txpos, header_hash = row
+        return TxMinedInfo(height=height,
+                           conf=None,
+                           timestamp=timestamp,
+                           txpos=txpos,
+                           header_hash=header_hash)
+
+    @modifier
+    def add_verified_tx(self, txid: str, info: TxMinedInfo):
+        assert isinstance(txid, str)
+        assert isinstance(info, TxMinedInfo)
+        self.conn.execute("INSERT OR REPLACE INTO verified_tx VALUES (?,?,?,?,?)",
+                          (txid, info.height, info.timestamp, info.txpos, info.header_hash))
+
+    @modifier
+    def remove_verified_tx(self, txid: str):
+        assert isinstance(txid, str)
+        self.conn.execute("DELETE FROM verified_tx WHERE txid=?", (txid,))
+
+    @locked
+    def is_in_verified_tx(self, txid: str) -> bool:
+        assert isinstance(txid, str)
+        return self.conn.execute("SELECT 1 FROM verified_tx WHERE txid=?", (txid,)).fetchone() is not None
+
+    # tx fees
+
+    def _get_tx_fees_value(self, txid: str) -> Optional[TxFeesValue]:
+        row = self.conn.execute(
+            "SELECT fee, is_calculated_by_us, num_inputs FROM tx_fees WHERE txid=?", (txid,)).fetchone()
+        if row is None:
+            return None
+        fee, is_calculated_by_us, num_inputs = row
+        return TxFeesValue(fee=fee, is_calculated_by_us=bool(is_calculated_by_us), num_inputs=num_inputs)
+
+    def _set_tx_fees_value(self, txid: str, value: TxFeesValue) -> None:
+        self.conn.execute("INSERT OR REPLACE INTO tx_fees VALUES (?,?,?,?)",
+                          (txid, value.fee, int(value.is_calculated_by_us), value.num_inputs))
+
+    @modifier
+    def add_tx_fee_from_server(self, txid: str, fee_sat: Optional[int]) -> None:
+        assert isinstance(txid, str)
+        # note: when called with (fee_sat is None), rm currently saved value
+        tx_fees_value = self._get_tx_fees_value(txid) or TxFeesValue()
+        if tx_fees_value.is_calculated_by_us:
+            return
+        self._set_tx_fees_value(txid, tx_fees_value._replace(fee=fee_sat, is_calculated_by_us=False))
+
+    @modifier
+    def add_tx_fee_we_calculated(self, txid: str, fee_sat: Optional[int]) -> None:
+        assert isinstance(txid, str)
+        if fee_sat is None:
+            return
+        assert isinstance(fee_sat, int)
+        tx_fees_value = self._get_tx_fees_value(txid) or TxFeesValue()
+        self._set_tx_fees_value(txid, tx_fees_value._replace(fee=fee_sat, is_calculated_by_us=True))
+
+    @locked
+    def get_tx_fee(self, txid: str, *, trust_server: bool = False) -> Optional[int]:
+        assert isinstance(txid, str)
+        tx_fees_value = self._get_tx_fees_value(txid)
+        if tx_fees_value is None:
+            return None
+        if not trust_server and not tx_fees_value.is_calculated_by_us:
+            return None
+        return tx_fees_value.fee
+
+    @modifier
+    def add_num_inputs_to_tx(self, txid: str, num_inputs: int) -> None:
+        assert isinstance(txid, str)
+        assert isinstance(num_inputs, int)
+        tx_fees_value = self._get_tx_fees_value(txid) or TxFeesValue()
+        self._set_tx_fees_value(txid, tx_fees_value._replace(num_inputs=num_inputs))
+
+    @locked
+    def get_num_all_inputs_of_tx(self, txid: str) -> Optional[int]:
+        assert isinstance(txid, str)
+        tx_fees_value = self._get_tx_fees_value(txid)
+        if tx_fees_value is None:
+            return None
+        return tx_fees_value.num_inputs
+
+    @locked
+    def get_num_ismine_inputs_of_tx(self, txid: str) -> int:
+        assert isinstance(txid, str)
+        return self.conn.execute("SELECT COUNT(*) FROM txi WHERE txid=?", (txid,)).fetchone()[0]
+
+    @modifier
+    def remove_tx_fee(self, txid: str) -> None:
+        assert isinstance(txid, str)
+        self.conn.execute("DELETE FROM tx_fees WHERE txid=?", (txid,))
+
+    @modifier
+    def clear_history(self):
+        for table in ('txi', 'txo', 'spent_outpoints', 'transactions', 'addr_history',
+                      'verified_tx', 'tx_fees', 'prevouts_by_scripthash'):
+            self.conn.execute(f"DELETE FROM {table}")
+        self._history_addrs.clear()
+        self._parsed_txs.clear()